@@ -0,0 +1,153 @@
+"""
+WSGI vs ASGI throughput for create-payment-intent.
+
+Starts a fake Stripe server that takes ``--latency`` seconds per call, then
+runs the app twice against a scratch SQLite database:
+
+* ``wsgi`` - ``gunicorn payflow.wsgi`` with one worker and ``--threads``
+             threads, posting to ``/api/v1/create-payment-intent/``
+* ``asgi`` - ``uvicorn payflow.asgi`` with one worker, posting to
+             ``/api/v1/async/create-payment-intent/``
+
+Each run keeps ``--concurrency`` requests in flight. With a slow gateway the
+sync worker can only have ``--threads`` payments waiting on Stripe at once,
+while the async worker is limited by the event loop.
+
+    python -m benchmarks.asgi_load --requests 2000 --concurrency 200 --latency 0.5
+"""
+import argparse
+import asyncio
+import os
+import socket
+import subprocess
+import sys
+import tempfile
+import time
+
+from benchmarks.common import summarize, print_table
+from benchmarks.fake_stripe import spawn_server
+
+USERS = 100
+
+
+def free_port():
+    with socket.socket() as sock:
+        sock.bind(('127.0.0.1', 0))
+        return sock.getsockname()[1]
+
+
+def prepare_database(env):
+    os.environ.update(env)
+    import django
+    django.setup()
+    from django.core.management import call_command
+    from payment_gateway.models import User, Merchant, PaymentMethod
+
+    call_command('migrate', verbosity=0)
+    Merchant.objects.create(name='Bench Merchant', email='bench-merchant@example.com', password='x')
+    users = User.objects.bulk_create(
+        User(username=f'user{i}', email=f'user{i}@example.com', password='x') for i in range(USERS)
+    )
+    PaymentMethod.objects.bulk_create(
+        PaymentMethod(user=user, method_type='credit_card', gateway_payment_method_token='pm_bench') for user in users
+    )
+    return [user.pk for user in users]
+
+
+def wait_for_port(port, process, timeout=30):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        if process.poll() is not None:
+            raise RuntimeError(f"Server exited with status {process.returncode}")
+        try:
+            socket.create_connection(('127.0.0.1', port), timeout=0.2).close()
+            return
+        except OSError:
+            time.sleep(0.1)
+    raise RuntimeError(f"Server did not start on port {port}")
+
+
+async def load(url, user_ids, total, concurrency):
+    import httpx
+
+    latencies, errors = [], 0
+    queue = asyncio.Queue()
+    for i in range(total):
+        queue.put_nowait(user_ids[i % len(user_ids)])
+
+    async def worker(client):
+        nonlocal errors
+        while not queue.empty():
+            user_id = queue.get_nowait()
+            begin = time.perf_counter()
+            try:
+                response = await client.post(url, json={'amount': '10.00', 'payment_method_id': 'pm_bench',
+                                                        'user_id': user_id})
+            except httpx.HTTPError:
+                errors += 1
+                continue
+            latencies.append(time.perf_counter() - begin)
+            if response.status_code != 200:
+                errors += 1
+
+    limits = httpx.Limits(max_connections=concurrency)
+    async with httpx.AsyncClient(limits=limits, timeout=120) as client:
+        started = time.perf_counter()
+        await asyncio.gather(*(worker(client) for _ in range(concurrency)))
+        elapsed = time.perf_counter() - started
+    return summarize(latencies, elapsed), errors
+
+
+def run_server(command, port, env, url, user_ids, args):
+    process = subprocess.Popen(command, env=env, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    try:
+        wait_for_port(port, process)
+        return asyncio.run(load(url.format(port=port), user_ids, args.requests, args.concurrency))
+    finally:
+        process.terminate()
+        process.wait()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--requests', type=int, default=1000)
+    parser.add_argument('--concurrency', type=int, default=100)
+    parser.add_argument('--latency', type=float, default=0.5, help="Fake Stripe latency per call, in seconds.")
+    parser.add_argument('--threads', type=int, default=8, help="gunicorn threads for the WSGI run.")
+    args = parser.parse_args()
+
+    stripe_server, stripe_url = spawn_server(latency=args.latency)
+    env = {
+        **os.environ,
+        'DJANGO_SETTINGS_MODULE': 'benchmarks.loadtest_settings',
+        'PAYFLOW_BENCH_DB': os.path.join(tempfile.mkdtemp(), 'bench.sqlite3'),
+        'PAYFLOW_STRIPE_POOL_MAXSIZE': str(max(args.concurrency, args.threads)),
+        'STRIPE_API_BASE': stripe_url,
+        'STRIPE_SECRET_KEY': 'sk_test_benchmark',
+    }
+    user_ids = prepare_database(env)
+
+    port = free_port()
+    servers = (
+        (f'wsgi (gunicorn, {args.threads} threads)',
+         [sys.executable, '-m', 'gunicorn', 'payflow.wsgi', '--workers', '1', '--threads', str(args.threads),
+          '--bind', f'127.0.0.1:{port}'],
+         'http://127.0.0.1:{port}/api/v1/create-payment-intent/'),
+        ('asgi (uvicorn)',
+         [sys.executable, '-m', 'uvicorn', 'payflow.asgi:application', '--workers', '1', '--port', str(port),
+          '--log-level', 'warning'],
+         'http://127.0.0.1:{port}/api/v1/async/create-payment-intent/'),
+    )
+    rows = []
+    for name, command, url in servers:
+        result, errors = run_server(command, port, env, url, user_ids, args)
+        if errors:
+            name = f'{name} [{errors} errors]'
+        rows.append((name, result))
+    stripe_server.terminate()
+
+    print_table(f'{args.requests} payments, {args.concurrency} in flight, gateway latency {args.latency}s', rows)
+
+
+if __name__ == '__main__':
+    main()
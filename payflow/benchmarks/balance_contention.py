@@ -0,0 +1,101 @@
+"""
+Concurrent balance credits to a single user.
+
+Starts N threads that all credit the same account and compares:
+
+* ``legacy``  - the previous ``user.balance = F('balance') + x; user.save()``
+* ``ledger``  - ``ledger.credit`` with a single-column UPDATE
+* ``sharded`` - ``ledger.credit`` with the user listed as a hot account
+
+Each credit runs in its own database transaction, as it does in the payment
+flow. The final balance is checked against the expected total. Point
+``DATABASES`` at PostgreSQL to measure row-lock contention.
+
+    python -m benchmarks.balance_contention --threads 16 --credits 200
+"""
+import argparse
+import os
+import tempfile
+import threading
+import time
+from decimal import Decimal
+
+from benchmarks.common import setup_django, summarize, print_table
+
+AMOUNT = Decimal('1.00')
+
+
+def legacy_credit(user_id):
+    from django.db.models import F
+    from payment_gateway.models import User
+    user = User.objects.get(pk=user_id)
+    user.balance = F('balance') + AMOUNT
+    user.save()
+
+
+def ledger_credit(user_id):
+    from payment_gateway import ledger
+    ledger.credit(user_id, AMOUNT)
+
+
+def run(credit, user_id, threads, credits):
+    from django.db import connection, transaction
+
+    latencies = []
+    lock = threading.Lock()
+
+    def worker():
+        local = []
+        try:
+            for _ in range(credits):
+                begin = time.perf_counter()
+                with transaction.atomic():
+                    credit(user_id)
+                local.append(time.perf_counter() - begin)
+        finally:
+            connection.close()
+        with lock:
+            latencies.extend(local)
+
+    pool = [threading.Thread(target=worker) for _ in range(threads)]
+    started = time.perf_counter()
+    for thread in pool:
+        thread.start()
+    for thread in pool:
+        thread.join()
+    return summarize(latencies, time.perf_counter() - started)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--threads', type=int, default=8)
+    parser.add_argument('--credits', type=int, default=100, help="Credits per thread.")
+    args = parser.parse_args()
+
+    sqlite_file = os.path.join(tempfile.mkdtemp(), 'bench.sqlite3')
+    setup_django(sqlite_file=sqlite_file)
+    from django.test import override_settings
+    from payment_gateway import ledger
+    from payment_gateway.models import User
+
+    expected = AMOUNT * args.threads * args.credits
+    rows = []
+    for name, credit, hot in (('legacy', legacy_credit, False), ('ledger', ledger_credit, False),
+                              ('sharded', ledger_credit, True)):
+        user = User.objects.create(username=name, email=f'{name}@example.com', password='x')
+        hot_accounts = {user.pk} if hot else set()
+        with override_settings(PAYFLOW_HOT_ACCOUNTS=hot_accounts):
+            result = run(credit, user.pk, args.threads, args.credits)
+        ledger.rollup([user.pk])
+        balance = User.objects.get(pk=user.pk).balance
+        assert balance == expected, f"{name}: balance {balance} != {expected}"
+        rows.append((name, result))
+
+    from django.db import connection
+    print_table(f'{args.threads} threads x {args.credits} credits to one user ({connection.vendor})', rows)
+    if connection.vendor == 'sqlite':
+        print("\nSQLite serializes every write transaction, so row-level contention only shows on PostgreSQL.")
+
+
+if __name__ == '__main__':
+    main()
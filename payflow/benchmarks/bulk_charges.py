@@ -0,0 +1,102 @@
+"""
+Batch charge throughput: one request per charge vs the bulk endpoint.
+
+Creates ``--charges`` payment intents against a fake Stripe server running in
+a separate process (``--latency`` seconds per call):
+
+* ``single`` - ``POST /api/v1/create-payment-intent/`` once per charge, in
+               sequence, the way the batch jobs call it today. Measured on
+               the first ``--single-sample`` charges to keep the run short.
+* ``bulk``   - ``POST /api/v1/create-payment-intents/`` in batches of
+               ``--batch-size``, with ``PAYFLOW_BULK_CONCURRENCY`` gateway
+               calls in flight.
+
+Latencies are per charge for ``single`` and per batch for ``bulk``;
+compare ops/sec, which is charges per second in both rows.
+
+    python -m benchmarks.bulk_charges --charges 10000 --batch-size 500
+"""
+import argparse
+import os
+import tempfile
+import time
+
+from benchmarks.common import setup_django, summarize, print_table
+from benchmarks.fake_stripe import spawn_server
+
+
+def seed(count):
+    from payment_gateway.models import User, Merchant, PaymentMethod
+
+    Merchant.objects.create(name='Bench Merchant', email='bench-merchant@example.com', password='x')
+    users = User.objects.bulk_create(
+        User(username=f'user{i}', email=f'user{i}@example.com', password='x') for i in range(count)
+    )
+    PaymentMethod.objects.bulk_create(
+        PaymentMethod(user=user, method_type='credit_card', gateway_payment_method_token='pm_bench') for user in users
+    )
+    return [user.pk for user in users]
+
+
+def charges(user_ids, count):
+    return [{'amount': '10.00', 'payment_method_id': 'pm_bench', 'user_id': user_ids[i % len(user_ids)]}
+            for i in range(count)]
+
+
+def run_single(client, items):
+    latencies = []
+    started = time.perf_counter()
+    for item in items:
+        begin = time.perf_counter()
+        response = client.post('/api/v1/create-payment-intent/', item, content_type='application/json')
+        assert response.status_code == 200, response.content
+        latencies.append(time.perf_counter() - begin)
+    return summarize(latencies, time.perf_counter() - started)
+
+
+def run_bulk(client, items, batch_size):
+    latencies = []
+    started = time.perf_counter()
+    for offset in range(0, len(items), batch_size):
+        begin = time.perf_counter()
+        response = client.post('/api/v1/create-payment-intents/', {'charges': items[offset:offset + batch_size]},
+                               content_type='application/json')
+        assert response.status_code == 200, response.content
+        latencies.append(time.perf_counter() - begin)
+    result = summarize(latencies, time.perf_counter() - started)
+    result['ops_per_sec'] = round(len(items) / (time.perf_counter() - started), 1)
+    result['count'] = len(items)
+    return result
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--charges', type=int, default=10000)
+    parser.add_argument('--batch-size', type=int, default=500)
+    parser.add_argument('--single-sample', type=int, default=500)
+    parser.add_argument('--users', type=int, default=1000)
+    parser.add_argument('--latency', type=float, default=0.05, help="Fake Stripe latency per call, in seconds.")
+    args = parser.parse_args()
+
+    stripe_server, stripe_url = spawn_server(latency=args.latency)
+    os.environ['STRIPE_SECRET_KEY'] = 'sk_test_benchmark'
+    setup_django(sqlite_file=os.path.join(tempfile.mkdtemp(), 'bench.sqlite3'))
+    import stripe
+    from django.test import Client, override_settings
+    stripe.api_base = stripe_url
+    stripe.api_key = 'sk_test_benchmark'
+
+    user_ids = seed(args.users)
+    client = Client()
+    rows = []
+    rows.append(('single', run_single(client, charges(user_ids, min(args.single_sample, args.charges)))))
+    with override_settings(PAYFLOW_BULK_MAX_CHARGES=args.batch_size):
+        rows.append((f'bulk ({args.batch_size}/request)', run_bulk(client, charges(user_ids, args.charges),
+                                                                     args.batch_size)))
+    stripe_server.terminate()
+
+    print_table(f'{args.charges} charges, gateway latency {args.latency}s', rows)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,75 @@
+"""
+Shared helpers for the benchmark scripts.
+
+Benchmarks run against a throwaway test database so they never touch
+``db.sqlite3``. Run them from the ``payflow`` directory, e.g.::
+
+    python -m benchmarks.webhook_inbox
+"""
+import hashlib
+import hmac
+import os
+import statistics
+import time
+
+
+def setup_django(sqlite_file=None, keepdb=False):
+    """
+    Configure Django and create a throwaway test database.
+
+    SQLite test databases live in memory by default; pass ``sqlite_file`` for
+    benchmarks that write from several threads, so each thread gets its own
+    connection to a shared file with IMMEDIATE write transactions. With
+    ``keepdb`` an existing test database (e.g. a generated dataset) is reused.
+    """
+    os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'payflow.settings')
+    import django
+    django.setup()
+
+    from django.conf import settings
+    from django.db import connection, connections
+    database = settings.DATABASES['default']
+    if sqlite_file and database['ENGINE'] == 'django.db.backends.sqlite3':
+        database.setdefault('TEST', {})['NAME'] = sqlite_file
+        database.setdefault('OPTIONS', {}).update({'timeout': 60, 'transaction_mode': 'IMMEDIATE'})
+    from django.test.utils import setup_test_environment
+    setup_test_environment()
+    connection.creation.create_test_db(verbosity=0, serialize=False, keepdb=keepdb)
+    # Read replicas read the test database too
+    for alias in settings.DATABASES:
+        if settings.DATABASES[alias].get('TEST', {}).get('MIRROR'):
+            connections[alias].creation.set_as_test_mirror(connection.settings_dict)
+
+
+def sign_payload(payload: str, secret: str, timestamp=None) -> str:
+    """Build a ``Stripe-Signature`` header for ``payload``."""
+    timestamp = int(timestamp or time.time())
+    signed = f"{timestamp}.{payload}".encode('utf-8')
+    signature = hmac.new(secret.encode('utf-8'), signed, hashlib.sha256).hexdigest()
+    return f"t={timestamp},v1={signature}"
+
+
+def percentile(samples, pct):
+    if not samples:
+        return 0.0
+    ordered = sorted(samples)
+    index = min(len(ordered) - 1, int(round(pct / 100.0 * (len(ordered) - 1))))
+    return ordered[index]
+
+
+def summarize(samples, elapsed):
+    """Summarize per-call latencies (seconds) and total elapsed time."""
+    return {
+        'count': len(samples),
+        'ops_per_sec': round(len(samples) / elapsed, 1) if elapsed else 0.0,
+        'mean_ms': round(statistics.fmean(samples) * 1000, 3) if samples else 0.0,
+        'p50_ms': round(percentile(samples, 50) * 1000, 3),
+        'p99_ms': round(percentile(samples, 99) * 1000, 3),
+    }
+
+
+def print_table(title, rows):
+    print(f"\n{title}")
+    print(f"{'case':<28}{'count':>8}{'ops/sec':>12}{'p50 ms':>10}{'p99 ms':>10}")
+    for name, result in rows:
+        print(f"{name:<28}{result['count']:>8}{result['ops_per_sec']:>12}{result['p50_ms']:>10}{result['p99_ms']:>10}")
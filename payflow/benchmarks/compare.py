@@ -0,0 +1,54 @@
+"""
+Compare two ``benchmarks.suite`` result files.
+
+Prints throughput and p50/p99 latency per scenario side by side with the
+relative change; a positive change in ops/sec and a negative change in
+latency are improvements.
+
+    python -m benchmarks.compare benchmarks/results/1a8889e.json benchmarks/results/5ee2132.json
+"""
+import argparse
+import json
+
+METRICS = (('ops_per_sec', 'ops/sec'), ('p50_ms', 'p50 ms'), ('p99_ms', 'p99 ms'))
+
+
+def change(old, new):
+    if not old:
+        return 'n/a'
+    return f"{(new - old) / old * 100:+.1f}%"
+
+
+def compare(base, head):
+    rows = []
+    for name in sorted(set(base['scenarios']) | set(head['scenarios'])):
+        old, new = base['scenarios'].get(name), head['scenarios'].get(name)
+        if old is None or new is None:
+            rows.append((name, 'only in ' + ('head' if old is None else 'base'), '', '', ''))
+            continue
+        for key, label in METRICS:
+            rows.append((name, label, old[key], new[key], change(old[key], new[key])))
+    return rows
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('base')
+    parser.add_argument('head')
+    args = parser.parse_args()
+
+    with open(args.base) as f:
+        base = json.load(f)
+    with open(args.head) as f:
+        head = json.load(f)
+
+    print(f"{base['meta']['commit']} -> {head['meta']['commit']}")
+    if base['dataset'] != head['dataset']:
+        print(f"warning: datasets differ ({base['dataset']} vs {head['dataset']})")
+    print(f"{'scenario':<18}{'metric':<10}{'base':>12}{'head':>12}{'change':>10}")
+    for name, label, old, new, delta in compare(base, head):
+        print(f"{name:<18}{label:<10}{old:>12}{new:>12}{delta:>10}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,137 @@
+"""
+Seeded dataset generator for the benchmarks.
+
+Creates merchants, users with one payment method each, and transactions
+spread over the last ``--days`` days with a realistic mix of statuses, plus
+one log row per transaction, then rebuilds the transaction rollups. The same
+``--seed`` always produces the same rows. Rows are written with
+``bulk_create`` in batches, so millions of transactions take minutes, not
+hours.
+
+Generate a dataset once into a file and reuse it with the scenario suite::
+
+    python -m benchmarks.dataset --transactions 2000000 --db /tmp/payflow-bench.sqlite3
+    python -m benchmarks.suite --db /tmp/payflow-bench.sqlite3 --keepdb
+"""
+import argparse
+import random
+import time
+from contextlib import contextmanager
+from datetime import timedelta
+from decimal import Decimal
+
+from benchmarks.common import setup_django
+
+STATUS_WEIGHTS = (('completed', 90), ('failed', 7), ('pending', 3))
+LOG_TYPES = {'completed': 'captured', 'failed': 'failed', 'pending': 'authorized'}
+
+
+@contextmanager
+def explicit_timestamps(*models):
+    """Let ``bulk_create`` keep the ``created_at`` values we set instead of now()."""
+    fields = [model._meta.get_field('created_at') for model in models]
+    for field in fields:
+        field.auto_now_add = False
+    try:
+        yield
+    finally:
+        for field in fields:
+            field.auto_now_add = True
+
+
+def generate(users=1000, merchants=10, transactions=100000, days=90, seed=0, batch_size=5000, logs=True):
+    """Write a dataset and return the number of rows created per model."""
+    from django.db import transaction as db_transaction
+    from django.utils import timezone
+    from payment_gateway import rollups
+    from payment_gateway.models import User, Merchant, PaymentMethod, Transaction, TransactionLog
+
+    rng = random.Random(seed)
+    now = timezone.now()
+    statuses = [status for status, _ in STATUS_WEIGHTS]
+    weights = [weight for _, weight in STATUS_WEIGHTS]
+
+    with db_transaction.atomic():
+        merchant_rows = Merchant.objects.bulk_create(
+            Merchant(name=f'Merchant {i}', email=f'merchant{i}@example.com', password='x') for i in range(merchants)
+        )
+        user_rows = User.objects.bulk_create(
+            (User(username=f'user{i}', email=f'user{i}@example.com', password='x') for i in range(users)),
+            batch_size=batch_size,
+        )
+        method_rows = PaymentMethod.objects.bulk_create(
+            (PaymentMethod(user=user, method_type='credit_card', gateway_payment_method_token=f'pm_bench_{user.pk}',
+                           last_four_digits=f'{rng.randrange(10000):04d}') for user in user_rows),
+            batch_size=batch_size,
+        )
+
+    created = 0
+    log_count = 0
+    with explicit_timestamps(Transaction, TransactionLog):
+        while created < transactions:
+            size = min(batch_size, transactions - created)
+            batch = []
+            for i in range(created, created + size):
+                method = method_rows[rng.randrange(len(method_rows))]
+                batch.append(Transaction(
+                    user_id=method.user_id,
+                    merchant=merchant_rows[rng.randrange(len(merchant_rows))],
+                    payment_method=method,
+                    amount=Decimal(rng.randrange(100, 50000)) / 100,
+                    description=f'Order {i}',
+                    status=rng.choices(statuses, weights)[0],
+                    gateway_payment_intent_id=f'pi_bench_{seed}_{i}',
+                    created_at=now - timedelta(seconds=rng.randrange(days * 86400)),
+                ))
+            with db_transaction.atomic():
+                Transaction.objects.bulk_create(batch)
+                if logs:
+                    TransactionLog.objects.bulk_create(
+                        TransactionLog(transaction=record, log_message=f"Transaction {record.status}",
+                                       log_type=LOG_TYPES[record.status], user_id=record.user_id,
+                                       merchant=record.merchant, payment_method=record.payment_method,
+                                       created_at=record.created_at)
+                        for record in batch
+                    )
+            created += size
+            log_count += size if logs else 0
+    # bulk_create skips the live rollup updates
+    rollups.rebuild()
+
+    return {'merchants': len(merchant_rows), 'users': len(user_rows), 'payment_methods': len(method_rows),
+            'transactions': created, 'transaction_logs': log_count}
+
+
+def counts():
+    """Rows currently in the benchmark database, per model."""
+    from payment_gateway.models import User, Merchant, PaymentMethod, Transaction, TransactionLog
+    return {'merchants': Merchant.objects.count(), 'users': User.objects.count(),
+            'payment_methods': PaymentMethod.objects.count(), 'transactions': Transaction.objects.count(),
+            'transaction_logs': TransactionLog.objects.count()}
+
+
+def add_arguments(parser):
+    parser.add_argument('--users', type=int, default=1000)
+    parser.add_argument('--merchants', type=int, default=10)
+    parser.add_argument('--transactions', type=int, default=100000)
+    parser.add_argument('--days', type=int, default=90, help="Spread transactions over this many days.")
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--batch-size', type=int, default=5000)
+    parser.add_argument('--no-logs', action='store_true', help="Skip the transaction log rows.")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    add_arguments(parser)
+    parser.add_argument('--db', required=True, help="SQLite file to write the dataset to.")
+    args = parser.parse_args()
+
+    setup_django(sqlite_file=args.db)
+    started = time.perf_counter()
+    rows = generate(users=args.users, merchants=args.merchants, transactions=args.transactions, days=args.days,
+                    seed=args.seed, batch_size=args.batch_size, logs=not args.no_logs)
+    print(f"Generated {rows} in {time.perf_counter() - started:.1f}s into {args.db}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,199 @@
+"""
+A local stand-in for the Stripe API.
+
+Answers the create calls the payment views make with canned objects over
+HTTP/1.1 keep-alive, optionally over TLS with a throwaway self-signed
+certificate (needs the ``openssl`` binary). Counts accepted connections so
+benchmarks can show how many handshakes a run paid for.
+
+Each call waits ``latency`` seconds, plus up to ``jitter`` more. A
+``failure_rate`` share of calls is declined (402 ``card_error``) and an
+``error_rate`` share fails with a 500 ``api_error``; draws come from a
+generator seeded with ``seed`` so runs are repeatable.
+
+Run it standalone to keep its CPU use out of the process being measured::
+
+    python -m benchmarks.fake_stripe --port 12111 --latency 0.2 --failure-rate 0.05
+"""
+import argparse
+import itertools
+import json
+import os
+import random
+import shutil
+import socket
+import ssl
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+OBJECTS = {
+    '/v1/payment_intents': ('payment_intent', 'pi', {'status': 'succeeded'}),
+    '/v1/payment_links': ('payment_link', 'plink', {'url': 'https://buy.stripe.com/test'}),
+    '/v1/checkout/sessions': ('checkout.session', 'cs', {'url': 'https://checkout.stripe.com/test'}),
+}
+
+
+class FakeStripeHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+    disable_nagle_algorithm = True
+
+    def setup(self):
+        if self.server.ssl_context:
+            # Handshake on the handler thread, not the accept loop.
+            self.request.do_handshake()
+        super().setup()
+
+    def log_message(self, format, *args):
+        pass
+
+    def do_POST(self):
+        self.rfile.read(int(self.headers.get('Content-Length') or 0))
+        delay, outcome = self.server.draw()
+        if delay:
+            time.sleep(delay)
+        path = self.path.split('?', 1)[0]
+        if path not in OBJECTS:
+            return self.respond(404, {'error': {'type': 'invalid_request_error', 'message': 'Unknown path'}})
+        if outcome == 'declined':
+            return self.respond(402, {'error': {'type': 'card_error', 'code': 'card_declined',
+                                                'message': 'Your card was declined.'}})
+        if outcome == 'error':
+            return self.respond(500, {'error': {'type': 'api_error', 'message': 'Fake server error.'}})
+        object_name, prefix, fields = OBJECTS[path]
+        self.respond(200, {'id': f'{prefix}_{next(self.server.ids)}', 'object': object_name, **fields})
+
+    def respond(self, status, body):
+        data = json.dumps(body).encode('utf-8')
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(data)))
+        self.send_header('Request-Id', 'req_fake')
+        self.end_headers()
+        self.wfile.write(data)
+
+
+class FakeStripeServer(ThreadingHTTPServer):
+    daemon_threads = True
+    request_queue_size = 1024
+
+    def __init__(self, latency=0.0, ssl_context=None, port=0, jitter=0.0, failure_rate=0.0, error_rate=0.0,
+                 seed=None):
+        super().__init__(('127.0.0.1', port), FakeStripeHandler)
+        self.latency = latency
+        self.jitter = jitter
+        self.failure_rate = failure_rate
+        self.error_rate = error_rate
+        self.ssl_context = ssl_context
+        self.ids = itertools.count(1)
+        self.connections = 0
+        self._random = random.Random(seed)
+        self._lock = threading.Lock()
+
+    def draw(self):
+        """Pick the delay and outcome (``ok``, ``declined`` or ``error``) of one call."""
+        with self._lock:
+            delay = self.latency + (self._random.uniform(0, self.jitter) if self.jitter else 0.0)
+            roll = self._random.random()
+        if roll < self.failure_rate:
+            return delay, 'declined'
+        if roll < self.failure_rate + self.error_rate:
+            return delay, 'error'
+        return delay, 'ok'
+
+    def get_request(self):
+        sock, address = super().get_request()
+        with self._lock:
+            self.connections += 1
+        if self.ssl_context:
+            sock = self.ssl_context.wrap_socket(sock, server_side=True, do_handshake_on_connect=False)
+        return sock, address
+
+    def handle_error(self, request, client_address):
+        # Clients that time out hang up before the response is written.
+        pass
+
+    @property
+    def scheme(self):
+        return 'https' if self.ssl_context else 'http'
+
+    @property
+    def url(self):
+        return f'{self.scheme}://127.0.0.1:{self.server_address[1]}'
+
+
+def make_certificate(directory):
+    """Create a self-signed certificate for 127.0.0.1. Returns ``(cert, key)`` paths."""
+    cert, key = os.path.join(directory, 'cert.pem'), os.path.join(directory, 'key.pem')
+    subprocess.run(
+        ['openssl', 'req', '-x509', '-newkey', 'rsa:2048', '-nodes', '-days', '1', '-subj', '/CN=127.0.0.1',
+         '-addext', 'subjectAltName=IP:127.0.0.1', '-keyout', key, '-out', cert],
+        check=True, capture_output=True,
+    )
+    return cert, key
+
+
+def start_server(latency=0.0, tls=False, port=0, **behaviour):
+    """
+    Start a fake Stripe server on a background thread.
+
+    ``behaviour`` takes the ``jitter``, ``failure_rate``, ``error_rate`` and
+    ``seed`` options of ``FakeStripeServer``. Returns ``(server, ca_bundle)``;
+    ``ca_bundle`` is the certificate to trust when ``tls`` is set, otherwise
+    None. Call ``server.shutdown()`` when done.
+    """
+    ssl_context, ca_bundle = None, None
+    if tls:
+        if not shutil.which('openssl'):
+            raise RuntimeError("TLS mode needs the openssl binary")
+        ca_bundle, key = make_certificate(tempfile.mkdtemp())
+        ssl_context = ssl.SSLContext(ssl.PROTOCOL_TLS_SERVER)
+        ssl_context.load_cert_chain(ca_bundle, key)
+    server = FakeStripeServer(latency=latency, ssl_context=ssl_context, port=port, **behaviour)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server, ca_bundle
+
+
+def spawn_server(latency=0.0, jitter=0.0, failure_rate=0.0, error_rate=0.0, seed=None):
+    """
+    Run a fake Stripe server in a child process.
+
+    Keeps the server's CPU use out of the process being measured. Returns
+    ``(process, url)``; call ``process.terminate()`` when done.
+    """
+    with socket.socket() as sock:
+        sock.bind(('127.0.0.1', 0))
+        port = sock.getsockname()[1]
+    command = [sys.executable, '-m', 'benchmarks.fake_stripe', '--port', str(port), '--latency', str(latency),
+               '--jitter', str(jitter), '--failure-rate', str(failure_rate), '--error-rate', str(error_rate)]
+    if seed is not None:
+        command += ['--seed', str(seed)]
+    process = subprocess.Popen(command, stdout=subprocess.PIPE, text=True)
+    return process, process.stdout.readline().split()[0]
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Run a fake Stripe API server.")
+    parser.add_argument('--port', type=int, default=12111)
+    parser.add_argument('--latency', type=float, default=0.0, help="Delay per call, in seconds.")
+    parser.add_argument('--jitter', type=float, default=0.0, help="Extra random delay per call, up to this many seconds.")
+    parser.add_argument('--failure-rate', type=float, default=0.0, help="Share of calls declined with a card error.")
+    parser.add_argument('--error-rate', type=float, default=0.0, help="Share of calls failing with a 500.")
+    parser.add_argument('--seed', type=int, default=None)
+    parser.add_argument('--tls', action='store_true')
+    args = parser.parse_args()
+
+    server, ca_bundle = start_server(latency=args.latency, tls=args.tls, port=args.port, jitter=args.jitter,
+                                     failure_rate=args.failure_rate, error_rate=args.error_rate, seed=args.seed)
+    print(server.url, ca_bundle or '', flush=True)
+    try:
+        threading.Event().wait()
+    except KeyboardInterrupt:
+        server.shutdown()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,16 @@
+"""Settings for benchmarks that start real app servers against a scratch database."""
+import os
+
+from payflow.settings import *  # noqa: F401,F403
+
+DATABASES = {
+    'default': {
+        'ENGINE': 'django.db.backends.sqlite3',
+        'NAME': os.environ['PAYFLOW_BENCH_DB'],
+        'OPTIONS': {
+            'timeout': 60,
+            'transaction_mode': 'IMMEDIATE',
+            'init_command': 'PRAGMA journal_mode=WAL; PRAGMA synchronous=NORMAL;',
+        },
+    }
+}
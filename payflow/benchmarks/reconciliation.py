@@ -0,0 +1,86 @@
+"""
+Reconciliation throughput and memory against a generated Stripe export.
+
+Generates ``--transactions`` transactions, writes a balance transaction
+export for them with a share of amount and status discrepancies, unknown
+payment intents and omitted rows, then runs the reconciliation with
+``--chunk-size`` rows per chunk. Reports export rows per second and, from a
+second pass, the peak Python heap (tracemalloc), which should stay flat as
+the export grows.
+
+    python -m benchmarks.reconciliation --transactions 1000000 --chunk-size 20000
+"""
+import argparse
+import os
+import random
+import tempfile
+import time
+import tracemalloc
+
+from benchmarks import dataset
+from benchmarks.common import setup_django
+
+
+def write_export(path, rng, discrepancy_rate):
+    from payment_gateway.models import Transaction
+
+    written = 0
+    with open(path, 'w') as f:
+        f.write('balance_transaction_id,created_utc,currency,gross,fee,net,reporting_category,payment_intent_id\n')
+        rows = (Transaction.objects.exclude(gateway_payment_intent_id='').order_by('id')
+                .values_list('gateway_payment_intent_id', 'amount', 'status', 'created_at'))
+        for intent, amount, status, created_at in rows.iterator(chunk_size=10000):
+            if status == 'pending':
+                continue
+            roll = rng.random()
+            if roll < discrepancy_rate / 4:
+                continue  # missing from the export
+            if roll < discrepancy_rate / 2:
+                amount += 1
+            elif roll < discrepancy_rate * 3 / 4:
+                status = 'failed' if status == 'completed' else 'completed'
+            elif roll < discrepancy_rate:
+                intent = f'pi_unknown_{written}'
+            category = 'charge' if status == 'completed' else 'charge_failure'
+            f.write(f'txn_{written},{created_at:%Y-%m-%d %H:%M:%S},usd,{amount},0.30,,{category},{intent}\n')
+            written += 1
+    return written
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--transactions', type=int, default=200000)
+    parser.add_argument('--chunk-size', type=int, default=10000)
+    parser.add_argument('--discrepancy-rate', type=float, default=0.02)
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args()
+
+    setup_django()
+    from payment_gateway.reconciliation import reconcile
+
+    dataset.generate(users=1000, merchants=10, transactions=args.transactions, seed=args.seed, logs=False)
+    path = os.path.join(tempfile.mkdtemp(), 'export.csv')
+    rows = write_export(path, random.Random(args.seed), args.discrepancy_rate)
+
+    def run():
+        with open(path, newline='') as f:
+            return reconcile(f, chunk_size=args.chunk_size, dry_run=True)
+
+    started = time.perf_counter()
+    result = run()
+    elapsed = time.perf_counter() - started
+    # A second pass for memory, since tracemalloc slows everything down
+    tracemalloc.start()
+    run()
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    os.remove(path)
+
+    print(f"{rows} export rows, chunk size {args.chunk_size}")
+    for name, count in result.as_dict().items():
+        print(f"  {name:<18}{count:>12}")
+    print(f"{elapsed:.2f}s, {rows / elapsed:,.0f} rows/sec, peak heap {peak / 2 ** 20:.1f} MiB")
+
+
+if __name__ == '__main__':
+    main()
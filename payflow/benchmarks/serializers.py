@@ -0,0 +1,83 @@
+"""
+Transaction list serialization: ModelSerializer vs the values() fast path.
+
+Serializes ``--rows`` transactions (and their logs) ``--repeat`` times each
+way, including the query and JSON encoding, and checks both produce the same
+bytes:
+
+* ``model``  - model instances through ``TransactionSerializer`` and DRF's
+               ``JSONRenderer``, as the list endpoints did before.
+* ``values`` - ``values()`` rows through ``TransactionValuesSerializer`` and
+               ``FastJSONRenderer``.
+
+Latencies are per pass over all rows; ops/sec is rows per second.
+
+    python -m benchmarks.serializers --rows 50000 --repeat 5
+"""
+import argparse
+import time
+
+from benchmarks import dataset
+from benchmarks.common import setup_django, summarize, print_table
+
+
+def measure(render, rows, repeat):
+    latencies = []
+    output = None
+    started = time.perf_counter()
+    for _ in range(repeat):
+        begin = time.perf_counter()
+        output = render()
+        latencies.append(time.perf_counter() - begin)
+    elapsed = time.perf_counter() - started
+    result = summarize(latencies, elapsed)
+    result['ops_per_sec'] = round(rows * repeat / elapsed, 1)
+    return result, output
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--rows', type=int, default=50000)
+    parser.add_argument('--repeat', type=int, default=5)
+    args = parser.parse_args()
+
+    setup_django()
+    from rest_framework.renderers import JSONRenderer
+    from payment_gateway.fast_serializers import (
+        FastJSONRenderer, TransactionValuesSerializer, TransactionLogValuesSerializer, get_values_serializer
+    )
+    from payment_gateway.models import Transaction, TransactionLog
+    from payment_gateway.serializers import TransactionSerializer, TransactionLogSerializer
+
+    dataset.generate(users=1000, merchants=10, transactions=args.rows)
+
+    class PlainResponse:
+        plain_json = True
+
+    def model_path(model, serializer_class):
+        def render():
+            data = serializer_class(list(model.objects.order_by('-created_at', '-id')), many=True).data
+            return JSONRenderer().render(data)
+        return render
+
+    def values_path(model, values_serializer_class):
+        def render():
+            fast = get_values_serializer(values_serializer_class)
+            data = fast.to_representation_many(fast.values(model.objects.order_by('-created_at', '-id')))
+            return FastJSONRenderer().render(data, renderer_context={'response': PlainResponse()})
+        return render
+
+    rows = []
+    for label, model, serializer_class, values_serializer_class in (
+            ('transactions', Transaction, TransactionSerializer, TransactionValuesSerializer),
+            ('logs', TransactionLog, TransactionLogSerializer, TransactionLogValuesSerializer)):
+        model_result, model_bytes = measure(model_path(model, serializer_class), args.rows, args.repeat)
+        values_result, values_bytes = measure(values_path(model, values_serializer_class), args.rows, args.repeat)
+        assert model_bytes == values_bytes, f"{label}: fast path output differs"
+        rows += [(f'{label}: model', model_result), (f'{label}: values', values_result)]
+
+    print_table(f'{args.rows} rows x {args.repeat} passes (ops/sec = rows/sec, output byte-identical)', rows)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,88 @@
+"""
+Stripe call latency with and without connection reuse.
+
+Runs ``stripe.PaymentIntent.create`` against a local fake Stripe server (see
+``benchmarks.fake_stripe``) over TLS and compares:
+
+* ``fresh``       - a new HTTP client per call, so every call pays for a TCP
+                    connect and TLS handshake
+* ``sdk-default`` - the SDK's own ``RequestsClient``, which keeps one session
+                    per thread
+* ``pooled``      - ``gateway_client.build_http_client()``, one pooled
+                    keep-alive session shared by all threads
+
+The number of connections the server accepted is reported for each case.
+
+    python -m benchmarks.stripe_pooling --threads 8 --calls 200
+"""
+import argparse
+import threading
+import time
+
+from benchmarks.common import setup_django, summarize, print_table
+from benchmarks.fake_stripe import start_server
+
+
+def run(make_client, api_base, threads, calls):
+    import stripe
+
+    shared = make_client()
+    latencies = []
+    lock = threading.Lock()
+
+    def worker():
+        local = []
+        for _ in range(calls):
+            client = shared or make_client(fresh=True)
+            begin = time.perf_counter()
+            stripe_client = stripe.StripeClient('sk_test_benchmark', http_client=client,
+                                                base_addresses={'api': api_base})
+            stripe_client.payment_intents.create(params={'amount': 1000, 'currency': 'usd'})
+            local.append(time.perf_counter() - begin)
+            if client is not shared:
+                client.close()
+        with lock:
+            latencies.extend(local)
+
+    pool = [threading.Thread(target=worker) for _ in range(threads)]
+    started = time.perf_counter()
+    for thread in pool:
+        thread.start()
+    for thread in pool:
+        thread.join()
+    return summarize(latencies, time.perf_counter() - started)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--threads', type=int, default=8)
+    parser.add_argument('--calls', type=int, default=100, help="Calls per thread.")
+    parser.add_argument('--latency', type=float, default=0.0, help="Server-side delay per call, in seconds.")
+    parser.add_argument('--no-tls', action='store_true', help="Use plain HTTP (no openssl needed).")
+    args = parser.parse_args()
+
+    setup_django()
+    import stripe
+    from payment_gateway import gateway_client
+
+    server, ca_bundle = start_server(latency=args.latency, tls=not args.no_tls)
+    if ca_bundle:
+        stripe.ca_bundle_path = ca_bundle
+
+    cases = (
+        ('fresh', lambda fresh=False: stripe.RequestsClient() if fresh else None),
+        ('sdk-default', lambda fresh=False: stripe.RequestsClient()),
+        ('pooled', lambda fresh=False: gateway_client.build_http_client(POOL_MAXSIZE=args.threads)),
+    )
+    rows = []
+    for name, make_client in cases:
+        before = server.connections
+        result = run(make_client, server.url, args.threads, args.calls)
+        rows.append((f'{name} ({server.connections - before} conns)', result))
+    server.shutdown()
+
+    print_table(f'{args.threads} threads x {args.calls} PaymentIntent.create over {server.scheme}', rows)
+
+
+if __name__ == '__main__':
+    main()
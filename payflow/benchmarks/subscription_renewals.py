@@ -0,0 +1,90 @@
+"""
+Subscription renewal throughput.
+
+Seeds ``--subscriptions`` due subscriptions spread over ``--users`` users
+and renews them with the ``renew_subscriptions`` command against a fake
+Stripe server (``--latency`` seconds per call, ``--failure-rate`` of charges
+declined). ``--workers`` worker processes each claim ``--batch-size``
+subscriptions at a time and keep ``--concurrency`` Stripe calls in flight.
+Reports subscriptions per second and checks that every subscription was
+charged exactly once. The fake Stripe server is a single Python process and
+tops out at a couple of hundred requests per second, which caps the rate
+however many workers run; point ``stripe.api_base`` at stripe-mock or a
+sandbox to measure beyond that.
+
+    python -m benchmarks.subscription_renewals --subscriptions 1000000 --workers 4 --concurrency 32
+"""
+import argparse
+import os
+import tempfile
+import time
+from datetime import timedelta
+from io import StringIO
+
+from benchmarks.common import setup_django
+from benchmarks.fake_stripe import spawn_server
+
+SEED_CHUNK = 10000
+
+
+def seed(subscriptions, users):
+    from django.utils import timezone
+    from payment_gateway.models import User, PaymentMethod, Subscriptions
+
+    created = User.objects.bulk_create(
+        User(username=f'user{i}', email=f'user{i}@example.com', password='x') for i in range(users)
+    )
+    PaymentMethod.objects.bulk_create(
+        PaymentMethod(user=user, method_type='credit_card', gateway_payment_method_token='pm_bench') for user in created
+    )
+    now = timezone.now()
+    for start in range(0, subscriptions, SEED_CHUNK):
+        Subscriptions.objects.bulk_create(
+            Subscriptions(user=created[i % users], plan_name='pro', amount='9.99',
+                          end_date=now - timedelta(minutes=i % 1440))
+            for i in range(start, min(start + SEED_CHUNK, subscriptions))
+        )
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--subscriptions', type=int, default=1000000)
+    parser.add_argument('--users', type=int, default=10000)
+    parser.add_argument('--workers', type=int, default=1)
+    parser.add_argument('--batch-size', type=int, default=500)
+    parser.add_argument('--concurrency', type=int, default=16)
+    parser.add_argument('--latency', type=float, default=0.05, help="Fake Stripe latency per call, in seconds.")
+    parser.add_argument('--failure-rate', type=float, default=0.0)
+    args = parser.parse_args()
+
+    stripe_server, stripe_url = spawn_server(latency=args.latency, failure_rate=args.failure_rate, seed=0)
+    os.environ['STRIPE_SECRET_KEY'] = 'sk_test_benchmark'
+    setup_django(sqlite_file=os.path.join(tempfile.mkdtemp(), 'bench.sqlite3'))
+    import stripe
+    from django.core.management import call_command
+    from django.db.models import Count
+    from payment_gateway.models import Subscriptions, Transaction
+    stripe.api_base = stripe_url
+    stripe.api_key = 'sk_test_benchmark'
+
+    seed(args.subscriptions, args.users)
+    started = time.perf_counter()
+    call_command('renew_subscriptions', '--once', '--workers', str(args.workers), '--batch-size',
+                 str(args.batch_size), '--concurrency', str(args.concurrency), stdout=StringIO())
+    elapsed = time.perf_counter() - started
+    stripe_server.terminate()
+
+    renewed = Subscriptions.objects.filter(renewal_attempts=0, claimed_until__isnull=True).count()
+    retrying = Subscriptions.objects.filter(renewal_attempts__gt=0).count()
+    charged = Transaction.objects.count()
+    duplicates = (Transaction.objects.exclude(gateway_payment_intent_id='').values('gateway_payment_intent_id')
+                  .annotate(n=Count('id')).filter(n__gt=1).count())
+    print(f"{args.subscriptions} subscriptions, {args.workers} workers x {args.concurrency} calls in flight, "
+          f"gateway latency {args.latency}s")
+    print(f"  renewed {renewed}, awaiting retry {retrying}, transactions {charged}, duplicate intents {duplicates}")
+    print(f"{elapsed:.2f}s, {args.subscriptions / elapsed:,.0f} subscriptions/sec")
+    assert renewed + retrying == args.subscriptions and charged >= renewed and not duplicates
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,309 @@
+"""
+Benchmark scenarios against a seeded dataset and a fake Stripe server.
+
+Generates a dataset (or reuses one with ``--keepdb``), starts the fake Stripe
+server in a separate process and runs each scenario through the Django test
+client with ``--concurrency`` threads:
+
+* ``payment_intents`` - ``POST /api/v1/create-payment-intent/`` for random
+                        users; the fake server's ``--failure-rate`` and
+                        ``--error-rate`` exercise the failure paths.
+* ``webhook_storm``   - signed ``payment_intent.succeeded`` events, each
+                        delivered ``--webhook-copies`` times in shuffled
+                        order, the way Stripe retries under load.
+* ``list_endpoints``  - transaction list pages, for all transactions and per
+                        user, following ``next`` cursors ``--pages`` deep.
+* ``exports``         - full NDJSON transaction exports, read to the end.
+* ``rate_limiter``    - the rate limit throttles alone, ``--rate-checks``
+                        times over parsed requests for random merchants,
+                        users and API keys; ``within_budget`` says whether
+                        they add under 100µs per request on average.
+
+Every scenario reports throughput, p50/p99 latency and response status
+counts. Results are also written as JSON (``--output``, by default
+``benchmarks/results/<commit>.json``); compare two runs with
+``python -m benchmarks.compare old.json new.json``.
+
+    python -m benchmarks.suite --transactions 200000 --concurrency 8
+    python -m benchmarks.suite --scenarios payment_intents,webhook_storm --latency 0.1
+"""
+import argparse
+import json
+import os
+import platform
+import random
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from collections import Counter
+from datetime import datetime, timezone
+
+from benchmarks import dataset
+from benchmarks.common import setup_django, sign_payload, summarize, print_table
+from benchmarks.fake_stripe import spawn_server
+
+WEBHOOK_SECRET = 'whsec_benchmark'
+RESULTS_DIR = os.path.join(os.path.dirname(__file__), 'results')
+
+
+def run_concurrently(work, items, concurrency):
+    """
+    Run ``work(client, item)`` for every item over ``concurrency`` threads.
+
+    ``work`` returns a list of ``(latency, status)`` samples, one per request
+    it made. Each thread has its own test client and database connection.
+    """
+    from django.db import connections
+    from django.test import Client
+
+    pending = list(reversed(items))
+    samples = []
+    lock = threading.Lock()
+
+    def worker():
+        client = Client()
+        try:
+            while True:
+                with lock:
+                    if not pending:
+                        return
+                    item = pending.pop()
+                result = work(client, item)
+                with lock:
+                    samples.extend(result)
+        finally:
+            connections.close_all()
+
+    started = time.perf_counter()
+    threads = [threading.Thread(target=worker) for _ in range(max(1, concurrency))]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return summarize_samples(samples, time.perf_counter() - started)
+
+
+def summarize_samples(samples, elapsed):
+    result = summarize([latency for latency, _ in samples], elapsed)
+    statuses = Counter(status for _, status in samples)
+    result['statuses'] = {str(code): count for code, count in sorted(statuses.items())}
+    result['server_errors'] = sum(count for code, count in statuses.items() if code >= 500)
+    return result
+
+
+def timed_request(send):
+    begin = time.perf_counter()
+    response = send()
+    return time.perf_counter() - begin, response
+
+
+def payment_intents(args, rng):
+    from payment_gateway.models import User
+
+    user_ids = list(User.objects.values_list('pk', flat=True)[:10000])
+    items = [{'amount': str(rng.randrange(100, 50000) / 100), 'payment_method_id': 'pm_bench',
+              'user_id': rng.choice(user_ids)} for _ in range(args.payments)]
+
+    def work(client, item):
+        latency, response = timed_request(lambda: client.post('/api/v1/create-payment-intent/', item,
+                                                              content_type='application/json'))
+        return [(latency, response.status_code)]
+    return run_concurrently(work, items, args.concurrency)
+
+
+def webhook_storm(args, rng):
+    from payment_gateway.models import Transaction
+
+    intent_ids = list(Transaction.objects.exclude(status='completed')
+                      .values_list('gateway_payment_intent_id', flat=True)[:args.webhooks])
+    events = []
+    for i, intent_id in enumerate(intent_ids):
+        payload = json.dumps({
+            'id': f'evt_storm_{time.time_ns()}_{i}',
+            'object': 'event',
+            'type': 'payment_intent.succeeded',
+            'data': {'object': {'id': intent_id, 'object': 'payment_intent', 'metadata': {}}},
+        })
+        events.extend([(payload, sign_payload(payload, WEBHOOK_SECRET))] * args.webhook_copies)
+    rng.shuffle(events)
+
+    def work(client, event):
+        payload, signature = event
+        latency, response = timed_request(lambda: client.post('/api/v1/webhook/', data=payload,
+                                                              content_type='application/json',
+                                                              HTTP_STRIPE_SIGNATURE=signature))
+        return [(latency, response.status_code)]
+    return run_concurrently(work, events, args.concurrency)
+
+
+def list_endpoints(args, rng):
+    from payment_gateway.models import User
+
+    user_ids = list(User.objects.values_list('pk', flat=True)[:10000])
+    starts = ['/api/v1/resources/transactions/?page_size=50']
+    starts += [f'/api/v1/resources/transactions/?page_size=50&user_id={rng.choice(user_ids)}'
+               for _ in range(args.list_walks - 1)]
+
+    def work(client, url):
+        samples = []
+        for _ in range(args.pages):
+            latency, response = timed_request(lambda: client.get(url))
+            samples.append((latency, response.status_code))
+            url = response.status_code == 200 and response.json().get('next')
+            if not url:
+                break
+        return samples
+    return run_concurrently(work, starts, args.concurrency)
+
+
+def exports(args, rng):
+    from django.test import Client
+
+    client = Client()
+    samples = []
+    rows = 0
+    started = time.perf_counter()
+    for _ in range(args.exports):
+        begin = time.perf_counter()
+        response = client.get('/api/v1/resources/transactions/export/?output=ndjson')
+        rows += sum(chunk.count(b'\n') for chunk in response.streaming_content)
+        samples.append((time.perf_counter() - begin, response.status_code))
+    elapsed = time.perf_counter() - started
+    result = summarize_samples(samples, elapsed)
+    result['rows_per_sec'] = round(rows / elapsed, 1) if elapsed else 0.0
+    return result
+
+
+def rate_limiter(args, rng):
+    from rest_framework.parsers import JSONParser
+    from rest_framework.request import Request
+    from rest_framework.test import APIRequestFactory
+    from payment_gateway.throttling import RATE_THROTTLES, get_limiter
+
+    factory = APIRequestFactory()
+    requests = []
+    for _ in range(1000):
+        data = {'user_id': rng.randrange(10000), 'merchant_id': rng.randrange(100)}
+        request = Request(factory.post('/api/v1/create-payment-intent/', data, format='json',
+                                       HTTP_X_API_KEY=f'key_{rng.randrange(1000)}'), parsers=[JSONParser()])
+        request.data  # parsed up front, as the view has done by the time throttles run
+        requests.append(request)
+
+    get_limiter()
+    samples = []
+    started = time.perf_counter()
+    for i in range(args.rate_checks):
+        request = requests[i % len(requests)]
+        begin = time.perf_counter()
+        for throttle in RATE_THROTTLES:
+            throttle().allow_request(request, None)
+        samples.append(time.perf_counter() - begin)
+    result = summarize(samples, time.perf_counter() - started)
+    result['backend'] = type(get_limiter().store).__name__
+    result['within_budget'] = result['mean_ms'] < 0.1
+    return result
+
+
+SCENARIOS = {
+    'payment_intents': payment_intents,
+    'webhook_storm': webhook_storm,
+    'list_endpoints': list_endpoints,
+    'exports': exports,
+    'rate_limiter': rate_limiter,
+}
+
+
+def git_revision():
+    def git(*command):
+        try:
+            return subprocess.run(['git', *command], capture_output=True, text=True, check=True).stdout.strip()
+        except (OSError, subprocess.CalledProcessError):
+            return ''
+    return git('rev-parse', '--short', 'HEAD') or 'unknown', bool(git('status', '--porcelain', '--untracked-files=no'))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    dataset.add_arguments(parser)
+    parser.add_argument('--db', help="SQLite file for the dataset (default: a temporary file).")
+    parser.add_argument('--keepdb', action='store_true', help="Reuse the dataset already in --db.")
+    parser.add_argument('--scenarios', default=','.join(SCENARIOS), help="Comma-separated scenarios to run.")
+    parser.add_argument('--concurrency', type=int, default=4)
+    parser.add_argument('--payments', type=int, default=1000)
+    parser.add_argument('--webhooks', type=int, default=1000)
+    parser.add_argument('--webhook-copies', type=int, default=3)
+    parser.add_argument('--list-walks', type=int, default=50)
+    parser.add_argument('--pages', type=int, default=20)
+    parser.add_argument('--exports', type=int, default=3)
+    parser.add_argument('--rate-checks', type=int, default=100000)
+    parser.add_argument('--latency', type=float, default=0.05, help="Fake Stripe latency per call, in seconds.")
+    parser.add_argument('--jitter', type=float, default=0.0)
+    parser.add_argument('--failure-rate', type=float, default=0.0)
+    parser.add_argument('--error-rate', type=float, default=0.0)
+    parser.add_argument('--output', help="Where to write the JSON results ('-' for stdout).")
+    args = parser.parse_args()
+
+    names = [name.strip() for name in args.scenarios.split(',') if name.strip()]
+    unknown = set(names) - set(SCENARIOS)
+    if unknown:
+        parser.error(f"unknown scenarios: {', '.join(sorted(unknown))}")
+
+    stripe_server, stripe_url = spawn_server(latency=args.latency, jitter=args.jitter,
+                                             failure_rate=args.failure_rate, error_rate=args.error_rate,
+                                             seed=args.seed)
+    try:
+        setup_django(sqlite_file=args.db or os.path.join(tempfile.mkdtemp(), 'bench.sqlite3'), keepdb=args.keepdb)
+        import django
+        import stripe
+        stripe.api_base = stripe_url
+        # The webhook view verifies signatures with the API key
+        stripe.api_key = WEBHOOK_SECRET
+
+        started = time.perf_counter()
+        rows = dataset.counts()
+        if not (args.keepdb and rows['transactions']):
+            rows = dataset.generate(users=args.users, merchants=args.merchants, transactions=args.transactions,
+                                    days=args.days, seed=args.seed, batch_size=args.batch_size,
+                                    logs=not args.no_logs)
+        setup_seconds = time.perf_counter() - started
+
+        rng = random.Random(args.seed)
+        results = {}
+        for name in names:
+            results[name] = SCENARIOS[name](args, rng)
+    finally:
+        stripe_server.terminate()
+
+    commit, dirty = git_revision()
+    report = {
+        'meta': {
+            'commit': commit,
+            'dirty': dirty,
+            'started_at': datetime.now(timezone.utc).isoformat(timespec='seconds'),
+            'python': platform.python_version(),
+            'django': django.get_version(),
+            'platform': platform.platform(),
+            'setup_seconds': round(setup_seconds, 1),
+            'options': vars(args),
+        },
+        'dataset': rows,
+        'scenarios': results,
+    }
+
+    print_table(f'Scenarios at {commit}{" (dirty)" if dirty else ""}, concurrency {args.concurrency}, '
+                f'gateway latency {args.latency}s', list(results.items()))
+    output = args.output or os.path.join(RESULTS_DIR, f'{commit}{"-dirty" if dirty else ""}.json')
+    if output == '-':
+        json.dump(report, sys.stdout, indent=2)
+        print()
+    else:
+        os.makedirs(os.path.dirname(os.path.abspath(output)), exist_ok=True)
+        with open(output, 'w') as f:
+            json.dump(report, f, indent=2)
+        print(f"\nResults written to {output}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,100 @@
+"""
+Webhook latency and throughput with and without the inbox.
+
+Posts signed ``payment_intent.succeeded`` events to the webhook endpoint,
+first processing them inline and then with ``PAYFLOW_WEBHOOK_INBOX`` enabled,
+and reports request p50/p99 latency and events/sec for both modes. In inbox
+mode the time to drain the inbox is reported separately.
+
+    python -m benchmarks.webhook_inbox --events 2000
+"""
+import argparse
+import json
+import time
+
+from benchmarks.common import setup_django, sign_payload, summarize, print_table
+
+WEBHOOK_SECRET = 'whsec_benchmark'
+
+
+def seed(count):
+    from payment_gateway.models import User, Merchant, PaymentMethod, Transaction
+
+    merchant = Merchant.objects.create(name='Bench Merchant', email='bench-merchant@example.com', password='x')
+    users = User.objects.bulk_create(
+        User(username=f'user{i}', email=f'user{i}@example.com', password='x') for i in range(count)
+    )
+    methods = PaymentMethod.objects.bulk_create(
+        PaymentMethod(user=user, method_type='credit_card', gateway_payment_method_token=f'pm_bench_{user.pk}')
+        for user in users
+    )
+    transactions = Transaction.objects.bulk_create(
+        Transaction(user=method.user, merchant=merchant, payment_method=method, amount='10.00', status='pending',
+                    gateway_payment_intent_id=f'pi_bench_{method.pk}')
+        for method in methods
+    )
+    return [transaction.gateway_payment_intent_id for transaction in transactions]
+
+
+def build_events(intent_ids, prefix):
+    events = []
+    for i, intent_id in enumerate(intent_ids):
+        payload = json.dumps({
+            'id': f'evt_{prefix}_{i}',
+            'object': 'event',
+            'type': 'payment_intent.succeeded',
+            'data': {'object': {
+                'id': intent_id,
+                'object': 'payment_intent',
+                'metadata': {},
+            }},
+        })
+        events.append((payload, sign_payload(payload, WEBHOOK_SECRET)))
+    return events
+
+
+def post_events(client, events):
+    latencies = []
+    started = time.perf_counter()
+    for payload, signature in events:
+        begin = time.perf_counter()
+        response = client.post('/api/v1/webhook/', data=payload, content_type='application/json',
+                               HTTP_STRIPE_SIGNATURE=signature)
+        latencies.append(time.perf_counter() - begin)
+        assert response.status_code == 200, response.content
+    return summarize(latencies, time.perf_counter() - started)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--events', type=int, default=1000)
+    parser.add_argument('--batch-size', type=int, default=100)
+    args = parser.parse_args()
+
+    setup_django()
+    import stripe
+    from django.test import Client, override_settings
+    from payment_gateway import webhooks
+    from payment_gateway.views import StripeWebhookView
+
+    stripe.api_key = WEBHOOK_SECRET
+    intent_ids = seed(args.events)
+    client = Client()
+
+    with override_settings(PAYFLOW_WEBHOOK_INBOX=False):
+        inline = post_events(client, build_events(intent_ids, 'inline'))
+
+    with override_settings(PAYFLOW_WEBHOOK_INBOX=True):
+        inbox = post_events(client, build_events(intent_ids, 'inbox'))
+
+    started = time.perf_counter()
+    drained = webhooks.run_worker(StripeWebhookView().handle_event, batch_size=args.batch_size, once=True)
+    drain_elapsed = time.perf_counter() - started
+
+    print_table('Webhook request latency', [('inline', inline), ('inbox', inbox)])
+    print(f"\nInbox drain: {drained} events in {drain_elapsed:.2f}s "
+          f"({drained / drain_elapsed if drain_elapsed else 0:.1f} events/sec, batch size {args.batch_size})")
+
+
+if __name__ == '__main__':
+    main()
@@ -49,6 +49,7 @@ INSTALLED_APPS = [
 ]
 
 MIDDLEWARE = [
+    'payment_gateway.timing.TimingMiddleware',
     'django.middleware.security.SecurityMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
@@ -56,6 +57,7 @@ MIDDLEWARE = [
     'django.contrib.auth.middleware.AuthenticationMiddleware',
     'django.contrib.messages.middleware.MessageMiddleware',
     'django.middleware.clickjacking.XFrameOptionsMiddleware',
+    'payment_gateway.db_routing.PrimaryPinningMiddleware',
 ]
 
 ROOT_URLCONF = 'payflow.urls'
@@ -88,6 +90,46 @@ DATABASES = {
     }
 }
 
+# PostgreSQL when POSTGRES_DB is set. Connections persist for CONN_MAX_AGE
+# seconds and are health-checked before reuse; POSTGRES_POOL_SIZE switches to
+# a psycopg connection pool instead. Each of POSTGRES_REPLICA_HOSTS
+# (host[:port],...) becomes a read replica alias, replica_0, replica_1...
+if os.environ.get('POSTGRES_DB'):
+    DATABASES['default'] = {
+        'ENGINE': 'django.db.backends.postgresql',
+        'NAME': os.environ['POSTGRES_DB'],
+        'USER': os.environ.get('POSTGRES_USER', ''),
+        'PASSWORD': os.environ.get('POSTGRES_PASSWORD', ''),
+        'HOST': os.environ.get('POSTGRES_HOST', 'localhost'),
+        'PORT': os.environ.get('POSTGRES_PORT', '5432'),
+        'CONN_MAX_AGE': int(os.environ.get('POSTGRES_CONN_MAX_AGE', 60)),
+        'CONN_HEALTH_CHECKS': True,
+        'OPTIONS': {
+            'application_name': 'payflow',
+            'connect_timeout': int(os.environ.get('POSTGRES_CONNECT_TIMEOUT', 5)),
+        },
+    }
+    if os.environ.get('POSTGRES_POOL_SIZE'):
+        # Pooled connections cannot also be persistent
+        DATABASES['default']['CONN_MAX_AGE'] = 0
+        DATABASES['default']['OPTIONS']['pool'] = {
+            'min_size': 2,
+            'max_size': int(os.environ['POSTGRES_POOL_SIZE']),
+            'timeout': 10,
+        }
+    replica_hosts = [host.strip() for host in os.environ.get('POSTGRES_REPLICA_HOSTS', '').split(',') if host.strip()]
+    for index, replica in enumerate(replica_hosts):
+        host, _, port = replica.partition(':')
+        DATABASES[f'replica_{index}'] = {
+            **DATABASES['default'],
+            'HOST': host,
+            'PORT': port or DATABASES['default']['PORT'],
+            'OPTIONS': {**DATABASES['default']['OPTIONS']},
+            'TEST': {'MIRROR': 'default'},
+        }
+
+DATABASE_ROUTERS = ['payment_gateway.db_routing.PrimaryReplicaRouter']
+
 
 # Password validation
 # https://docs.djangoproject.com/en/5.2/ref/settings/#auth-password-validators
@@ -140,4 +182,195 @@ REST_FRAMEWORK = {
     'DEFAULT_VERSION': 'v1',
     'ALLOWED_VERSIONS': ['v1', 'v2'],
     'VERSION_PARAM': 'version',
+    # Timed variants of the defaults, so sampled requests report parse and render time
+    'DEFAULT_PARSER_CLASSES': [
+        'payment_gateway.timing.JSONParser',
+        'payment_gateway.timing.FormParser',
+        'payment_gateway.timing.MultiPartParser',
+    ],
+    'DEFAULT_RENDERER_CLASSES': [
+        'payment_gateway.timing.JSONRenderer',
+        'rest_framework.renderers.BrowsableAPIRenderer',
+    ],
+    # Proxies in front of the app that append to X-Forwarded-For; the rate
+    # limits key anonymous clients on the address the outermost one saw.
+    # 0 trusts no header and uses REMOTE_ADDR.
+    'NUM_PROXIES': int(os.environ.get('PAYFLOW_NUM_PROXIES', 0)),
+}
+
+# Webhook inbox settings
+# When enabled, the webhook view only verifies and stores events; run
+# `python manage.py process_webhooks` to process them.
+PAYFLOW_WEBHOOK_INBOX = os.environ.get('PAYFLOW_WEBHOOK_INBOX', 'False') == 'True'
+PAYFLOW_WEBHOOK_WORKERS = int(os.environ.get('PAYFLOW_WEBHOOK_WORKERS', 2))
+PAYFLOW_WEBHOOK_BATCH_SIZE = 100
+PAYFLOW_WEBHOOK_MAX_ATTEMPTS = 5
+
+# Webhook deduplication settings
+# Processed event ids are kept for 30 days; Stripe retries for up to 3 days.
+PAYFLOW_PROCESSED_EVENT_TTL = 30 * 24 * 60 * 60
+PAYFLOW_PROCESSED_EVENT_CACHE_SIZE = 10000
+
+# Keyset pagination for the transaction and transaction log endpoints
+PAYFLOW_PAGINATION = {
+    'PAGE_SIZE': 50,
+    'MAX_PAGE_SIZE': 500,
+}
+
+# Rows fetched per database round trip by the streaming export endpoints
+PAYFLOW_EXPORT_CHUNK_SIZE = 2000
+
+# Balance ledger settings
+# Credits to these user ids are spread over PAYFLOW_BALANCE_SHARDS rows and
+# folded into User.balance by `python manage.py rollup_balances`.
+PAYFLOW_HOT_ACCOUNTS = set()
+PAYFLOW_BALANCE_SHARDS = 8
+
+# Shared Stripe HTTP client (see payment_gateway/gateway_client.py)
+PAYFLOW_STRIPE_HTTP = {
+    'POOL_CONNECTIONS': 4,
+    'POOL_MAXSIZE': int(os.environ.get('PAYFLOW_STRIPE_POOL_MAXSIZE', 32)),
+    'CONNECT_TIMEOUT': 5,
+    'READ_TIMEOUT': 30,
+    'MAX_NETWORK_RETRIES': 0,
+    'API_BASE': os.environ.get('STRIPE_API_BASE'),
+}
+
+# Bulk payment intent endpoint (POST /api/v1/create-payment-intents/)
+# Keep PAYFLOW_BULK_CONCURRENCY at or below PAYFLOW_STRIPE_HTTP['POOL_MAXSIZE'].
+PAYFLOW_BULK_MAX_CHARGES = 500
+PAYFLOW_BULK_CONCURRENCY = 16
+
+# Signal side effects (log rows, ledger credits, notifications) are batched
+# and flushed once per payment; set to True to apply each one immediately.
+PAYFLOW_SYNC_SIDE_EFFECTS = os.environ.get('PAYFLOW_SYNC_SIDE_EFFECTS', 'False') == 'True'
+
+# Idempotency-Key responses are kept in this cache. Local memory is per
+# process; set PAYFLOW_REDIS_URL to share them across workers.
+CACHES = {
+    'default': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+    },
+    'idempotency': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+        'LOCATION': 'payflow-idempotency',
+        'OPTIONS': {'MAX_ENTRIES': 100000},
+    },
+}
+if os.environ.get('PAYFLOW_REDIS_URL'):
+    CACHES['idempotency'] = {
+        'BACKEND': 'django.core.cache.backends.redis.RedisCache',
+        'LOCATION': os.environ['PAYFLOW_REDIS_URL'],
+    }
+
+PAYFLOW_IDEMPOTENCY = {
+    'CACHE': 'idempotency',
+    'TTL': 24 * 60 * 60,
+    'LOCK_TTL': 60,
+}
+
+# Process-local caches for merchants, payment gateway configuration and
+# default payment methods. With Redis configured, invalidations are published
+# through it so every worker drops stale entries within VERSION_CHECK_INTERVAL.
+# Each cache keeps at most MAX_ENTRIES, dropping the least recently used.
+PAYFLOW_CONFIG_CACHE = {
+    'TTL': 300,
+    'MAX_ENTRIES': 10000,
+    'SHARED_CACHE': 'idempotency' if os.environ.get('PAYFLOW_REDIS_URL') else None,
+    'VERSION_CHECK_INTERVAL': 1.0,
+}
+
+# Per-stage request timing (payment_gateway/timing.py). A sampled request is
+# observed into the histograms served at /metrics and, with SERVER_TIMING,
+# gets a Server-Timing header. Set SAMPLE_RATE to 0 to turn timing off.
+PAYFLOW_TIMING = {
+    'SAMPLE_RATE': float(os.environ.get('PAYFLOW_TIMING_SAMPLE_RATE', 0.1)),
+    'SERVER_TIMING': True,
+}
+
+# /metrics (payment_gateway/metrics.py) answers staff users and scrapers that
+# send "Authorization: Bearer <TOKEN>"; leave TOKEN empty for staff only.
+PAYFLOW_METRICS = {
+    'TOKEN': os.environ.get('PAYFLOW_METRICS_TOKEN', ''),
+}
+
+# TransactionLog retention (payment_gateway/archive.py). The
+# archive_transaction_logs command moves logs older than MAX_AGE_DAYS into
+# one gzip file per month under DIR; restore_transaction_logs brings them back.
+PAYFLOW_LOG_ARCHIVE = {
+    'DIR': os.environ.get('PAYFLOW_LOG_ARCHIVE_DIR', BASE_DIR / 'log_archive'),
+    'MAX_AGE_DAYS': 180,
+    'BATCH_SIZE': 5000,
+}
+
+# Hourly and daily transaction rollups (payment_gateway/rollups.py). With LIVE
+# set they are updated with every payment; rebuild_rollups recomputes the last
+# REBUILD_DAYS days, or everything with --full.
+PAYFLOW_ROLLUPS = {
+    'LIVE': True,
+    'REBUILD_DAYS': 2,
+}
+
+# Export rows reconciled per chunk by reconcile_stripe_export (needs numpy)
+PAYFLOW_RECONCILIATION_CHUNK_SIZE = 10000
+
+# Subscription renewals (payment_gateway/renewals.py), run by
+# renew_subscriptions. Due subscriptions are claimed BATCH_SIZE at a time and
+# charged with CONCURRENCY Stripe calls in flight; a failed charge is retried
+# after RETRY_DELAY seconds, up to MAX_ATTEMPTS times.
+PAYFLOW_RENEWALS = {
+    'BATCH_SIZE': 500,
+    'CONCURRENCY': 16,
+    'MAX_ATTEMPTS': 4,
+    'RETRY_DELAY': 24 * 60 * 60,
+    'VISIBILITY_TIMEOUT': 10 * 60,
+}
+
+# Payment gateway providers and routing (payment_gateway/gateways.py). Each
+# payment goes to the provider with the lowest latency and error rate
+# averages; one that fails FAILURE_THRESHOLD times in a row gets no payments
+# for RESET_TIMEOUT seconds. Calls time out per operation (TIMEOUTS), keyed
+# calls are retried RETRIES times, and BULKHEAD_SIZE caps the calls in flight
+# per worker so payments cannot take every thread; rejected calls get a 503.
+PAYFLOW_GATEWAYS = {
+    'PROVIDERS': {
+        'stripe': 'payment_gateway.gateways.StripeProvider',
+    },
+    'EWMA_ALPHA': 0.2,
+    'ERROR_PENALTY': 10.0,
+    'EXPLORE_RATE': 0.02,
+    'FAILURE_THRESHOLD': 5,
+    'RESET_TIMEOUT': 30.0,
+    'TIMEOUTS': {
+        'create_payment_intent': (2, 15),
+        'create_payment_link': (2, 10),
+        'create_checkout_session': (2, 10),
+    },
+    'RETRIES': 2,
+    'RETRY_BASE_DELAY': 0.25,
+    'RETRY_MAX_DELAY': 2.0,
+    'BULKHEAD_SIZE': int(os.environ.get('PAYFLOW_GATEWAY_BULKHEAD_SIZE', 32)),
+    'BULKHEAD_MAX_WAIT': 1.0,
+}
+
+# Token-bucket rate limits on the payment and resource APIs
+# (payment_gateway/throttling.py), per caller (authenticated user or client
+# address) and, within the caller, per merchant_id and user_id.
+# The local backend limits each worker on its own; with Redis configured the
+# buckets are shared through the cache.
+PAYFLOW_RATE_LIMITS = {
+    'BACKEND': 'cache' if os.environ.get('PAYFLOW_REDIS_URL') else 'local',
+    'CACHE': 'idempotency',
+    'RATES': {
+        'merchant': {'RATE': '100/s', 'BURST': 200},
+        'user': {'RATE': '20/s', 'BURST': 50},
+        'principal': {'RATE': '50/s', 'BURST': 100},
+    },
+}
+
+# Read replicas: read-only API actions, exports and admin changelists use
+# them; a client's reads stay on the primary for PIN_SECONDS after it writes.
+PAYFLOW_DATABASE_ROUTING = {
+    'REPLICAS': [alias for alias in DATABASES if alias != 'default'],
+    'PIN_SECONDS': int(os.environ.get('PAYFLOW_REPLICA_PIN_SECONDS', 5)),
 }
@@ -21,6 +21,7 @@ from rest_framework.decorators import api_view
 from drf_yasg.views import get_schema_view
 from drf_yasg import openapi
 from rest_framework import permissions
+from payment_gateway.metrics import metrics_view
 
 schema_view = get_schema_view(
    openapi.Info(
@@ -45,6 +46,7 @@ urlpatterns = [
     path('admin/', admin.site.urls),
     path('', api_root),
     path('api/', include('payment_gateway.urls')),
+    path('metrics', metrics_view, name='metrics'),
     path('swagger/', schema_view.with_ui('swagger', cache_timeout=0), name='schema-swagger-ui'),
     path('redoc/', schema_view.with_ui('redoc', cache_timeout=0), name='schema-redoc'),
 ]
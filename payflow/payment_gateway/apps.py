@@ -5,4 +5,9 @@ class PaymentGatewayConfig(AppConfig):
     name = 'payment_gateway'
     
     def ready(self):
-        import payment_gateway.signals
\ No newline at end of file
+        import payment_gateway.signals
+        from .gateway_client import configure
+        configure()
+        from django.db.backends.signals import connection_created
+        from .timing import install_query_timer
+        connection_created.connect(install_query_timer, dispatch_uid='payflow-query-timer')
@@ -0,0 +1,209 @@
+"""
+Retention and archival of TransactionLog rows.
+
+Logs older than ``PAYFLOW_LOG_ARCHIVE['MAX_AGE_DAYS']`` are moved out of the
+hot table, oldest first and ``BATCH_SIZE`` rows at a time, into one
+gzip-compressed NDJSON file per calendar month (UTC) under
+``PAYFLOW_LOG_ARCHIVE['DIR']``. Every batch is appended to its month's file
+as a separate gzip member, and the same database transaction records an
+``ArchivedLog`` index row per log (log id, transaction id and the member's
+byte offset) and deletes the hot rows. A run can therefore stop at any point
+and be started again: bytes written by a batch that did not commit lie past
+``LogArchive.size`` and are truncated before the next append.
+
+Looking up the archived logs of a transaction reads only the members the
+index points at; ``restore_transaction`` and ``restore_month`` put rows back
+into the hot table.
+"""
+import gzip
+import json
+import os
+import zlib
+from collections import defaultdict
+from datetime import date, datetime, timedelta, timezone as dt_timezone
+
+from django.conf import settings
+from django.db import transaction
+from django.db.models import Case, DateTimeField, F, Value, When
+from django.utils import timezone
+
+from .models import ArchivedLog, LogArchive, Merchant, PaymentMethod, Transaction, TransactionLog, User
+
+DEFAULTS = {
+    'DIR': None,
+    'MAX_AGE_DAYS': 180,
+    'BATCH_SIZE': 5000,
+}
+
+READ_CHUNK_SIZE = 64 * 1024
+RESTORE_UPDATE_SIZE = 500
+
+
+def archive_settings():
+    options = {**DEFAULTS, **getattr(settings, 'PAYFLOW_LOG_ARCHIVE', {})}
+    if options['DIR'] is None:
+        options['DIR'] = os.path.join(settings.BASE_DIR, 'log_archive')
+    return options
+
+
+def columns():
+    return [field.attname for field in TransactionLog._meta.concrete_fields]
+
+
+def archive_path(archive):
+    return os.path.join(archive_settings()['DIR'], archive.path)
+
+
+def month_of(moment):
+    moment = moment.astimezone(dt_timezone.utc)
+    return date(moment.year, moment.month, 1)
+
+
+def encode(row):
+    return json.dumps({**row, 'created_at': row['created_at'].isoformat()}, separators=(',', ':')).encode() + b'\n'
+
+
+def decode(line):
+    row = json.loads(line)
+    row['created_at'] = datetime.fromisoformat(row['created_at'])
+    return row
+
+
+def _append(path, offset, data):
+    """Write ``data`` at ``offset``, dropping whatever an interrupted run left after it."""
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path, 'r+b' if os.path.exists(path) else 'w+b') as f:
+        f.truncate(offset)
+        f.seek(offset)
+        f.write(data)
+        f.flush()
+        os.fsync(f.fileno())
+
+
+def read_member(archive, offset):
+    """Rows of the gzip member starting at ``offset`` in ``archive``."""
+    decompressor = zlib.decompressobj(zlib.MAX_WBITS | 16)
+    chunks = []
+    with open(archive_path(archive), 'rb') as f:
+        f.seek(offset)
+        while not decompressor.eof:
+            chunk = f.read(READ_CHUNK_SIZE)
+            if not chunk:
+                raise EOFError(f"{archive.path} is truncated at offset {offset}")
+            chunks.append(decompressor.decompress(chunk))
+    return [decode(line) for line in b''.join(chunks).splitlines()]
+
+
+def _archive_month(month, rows):
+    name = f'transaction-logs-{month:%Y-%m}.ndjson.gz'
+    with transaction.atomic():
+        archive, _ = LogArchive.objects.select_for_update().get_or_create(month=month, defaults={'path': name})
+        offset = archive.size
+        data = gzip.compress(b''.join(encode(row) for row in rows))
+        _append(archive_path(archive), offset, data)
+        ArchivedLog.objects.bulk_create(
+            ArchivedLog(log_id=row['id'], transaction_id=row['transaction_id'], created_at=row['created_at'],
+                        archive=archive, offset=offset)
+            for row in rows
+        )
+        TransactionLog.objects.filter(pk__in=[row['id'] for row in rows]).delete()
+        LogArchive.objects.filter(pk=archive.pk).update(
+            size=offset + len(data), row_count=F('row_count') + len(rows), updated_at=timezone.now())
+
+
+def archive_batch(before, batch_size=None):
+    """Archive up to ``batch_size`` of the oldest logs created before ``before``; return how many."""
+    batch_size = batch_size or archive_settings()['BATCH_SIZE']
+    rows = list(TransactionLog.objects.filter(created_at__lt=before)
+                .order_by('created_at', 'id').values(*columns())[:batch_size])
+    by_month = defaultdict(list)
+    for row in rows:
+        by_month[month_of(row['created_at'])].append(row)
+    for month, month_rows in by_month.items():
+        _archive_month(month, month_rows)
+    return len(rows)
+
+
+def archive_old_logs(max_age_days=None, batch_size=None, limit=None):
+    """Archive logs older than ``max_age_days`` in batches; return how many were archived."""
+    options = archive_settings()
+    max_age_days = options['MAX_AGE_DAYS'] if max_age_days is None else max_age_days
+    before = timezone.now() - timedelta(days=max_age_days)
+    batch_size = batch_size or options['BATCH_SIZE']
+    archived = 0
+    while limit is None or archived < limit:
+        count = archive_batch(before, batch_size if limit is None else min(batch_size, limit - archived))
+        if not count:
+            break
+        archived += count
+    return archived
+
+
+def _members(entries):
+    """Group index rows by the archive member that holds them."""
+    members = defaultdict(set)
+    archives = {}
+    for entry in entries.select_related('archive'):
+        archives[entry.archive_id] = entry.archive
+        members[entry.archive_id, entry.offset].add(entry.log_id)
+    return [(archives[archive_id], offset, log_ids) for (archive_id, offset), log_ids in sorted(members.items())]
+
+
+def archived_logs(transaction_id):
+    """Archived log rows of one transaction, as ``values()`` rows in creation order."""
+    rows = []
+    for archive, offset, log_ids in _members(ArchivedLog.objects.filter(transaction_id=transaction_id)):
+        rows.extend(row for row in read_member(archive, offset) if row['id'] in log_ids)
+    rows.sort(key=lambda row: (row['created_at'], row['id']))
+    return rows
+
+
+def _existing(model, ids):
+    return set(model.objects.filter(pk__in={pk for pk in ids if pk is not None}).values_list('pk', flat=True))
+
+
+def _restore_rows(archive, rows):
+    transactions = _existing(Transaction, [row['transaction_id'] for row in rows])
+    # Logs of deleted transactions stay in the archive
+    rows = [row for row in rows if row['transaction_id'] in transactions]
+    if not rows:
+        return 0
+    related = {
+        'user_id': _existing(User, [row['user_id'] for row in rows]),
+        'merchant_id': _existing(Merchant, [row['merchant_id'] for row in rows]),
+        'payment_method_id': _existing(PaymentMethod, [row['payment_method_id'] for row in rows]),
+    }
+    for row in rows:
+        for column, existing in related.items():
+            if row[column] not in existing:
+                row[column] = None
+
+    ids = [row['id'] for row in rows]
+    with transaction.atomic():
+        TransactionLog.objects.bulk_create(TransactionLog(**row) for row in rows)
+        # bulk_create stamps created_at with now()
+        for start in range(0, len(rows), RESTORE_UPDATE_SIZE):
+            chunk = rows[start:start + RESTORE_UPDATE_SIZE]
+            TransactionLog.objects.filter(pk__in=[row['id'] for row in chunk]).update(created_at=Case(
+                *[When(pk=row['id'], then=Value(row['created_at'])) for row in chunk], output_field=DateTimeField()
+            ))
+        ArchivedLog.objects.filter(log_id__in=ids).delete()
+        LogArchive.objects.filter(pk=archive.pk).update(row_count=F('row_count') - len(rows), updated_at=timezone.now())
+    return len(rows)
+
+
+def _restore(entries):
+    restored = 0
+    for archive, offset, log_ids in _members(entries):
+        restored += _restore_rows(archive, [row for row in read_member(archive, offset) if row['id'] in log_ids])
+    return restored
+
+
+def restore_transaction(transaction_id):
+    """Move the archived logs of one transaction back into the hot table; return how many."""
+    return _restore(ArchivedLog.objects.filter(transaction_id=transaction_id))
+
+
+def restore_month(month):
+    """Move every archived log of the month starting ``month`` back into the hot table."""
+    return _restore(ArchivedLog.objects.filter(archive__month=month))
@@ -0,0 +1,136 @@
+"""
+Bulk payment intent creation.
+
+A batch of already validated charges is handled in three steps: the payment
+contexts for every user are loaded in two queries, the Stripe calls are fanned
+out over a bounded thread pool (``PAYFLOW_BULK_CONCURRENCY``), and every
+resulting ``Transaction`` is written with ``bulk_create`` in one effect batch,
+so the signal receivers' log rows and ledger credits are flushed in bulk too.
+A failed charge does not fail the batch; each item reports its own outcome.
+A charge refused before reaching a gateway (``GatewayRejected``: open circuit
+or full bulkhead) is reported as ``rejected`` and not recorded at all, since
+nothing was charged or declined.
+"""
+import contextvars
+import logging
+from concurrent.futures import ThreadPoolExecutor
+
+import stripe
+from django.conf import settings
+
+from . import config_cache, effects, gateways
+from .models import PaymentMethod, Transaction
+from .signals import payment_processed, payment_failed, invalidate_config, log_captured
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_CONCURRENCY = 16
+
+
+def missing_users(charges, contexts):
+    """Per-item errors for charges whose user does not exist."""
+    return {
+        index: {'user_id': [f"User {charge['user_id']} does not exist."]}
+        for index, charge in enumerate(charges)
+        if charge['user_id'] not in contexts
+    }
+
+
+def call_gateway(charges, create_intent, concurrency=None):
+    """
+    Call ``create_intent(index, charge)`` for every charge concurrently.
+
+    Each call runs in a copy of the caller's context, so per-request state
+    such as the idempotency key and call timeout carries over to the workers.
+    Returns the intents, or the StripeErrors raised, in charge order.
+    """
+    concurrency = concurrency or getattr(settings, 'PAYFLOW_BULK_CONCURRENCY', DEFAULT_CONCURRENCY)
+
+    def attempt(index, charge):
+        try:
+            return create_intent(index, charge)
+        except stripe.error.StripeError as e:
+            return e
+
+    with ThreadPoolExecutor(max_workers=max(1, min(concurrency, len(charges)))) as executor:
+        futures = [
+            executor.submit(contextvars.copy_context().run, attempt, index, charge)
+            for index, charge in enumerate(charges)
+        ]
+        return [future.result() for future in futures]
+
+
+def record_results(charges, contexts, outcomes, sender=None):
+    """
+    Write the transactions, logs and ledger credits for a batch of outcomes.
+
+    Mirrors the single-charge endpoint: succeeded charges are recorded as
+    completed (creating a default payment method for users without one) and
+    credited; failed charges are recorded only for users with a payment method.
+    Rejected charges are not recorded, and an intent that already has a
+    transaction (Stripe replaying it for a retried batch) is not recorded
+    twice.
+    """
+    results = []
+    rows = []
+    with effects.batch():
+        recorded = dict(Transaction.objects.filter(gateway_payment_intent_id__in=[
+            outcome.id for outcome in outcomes if not isinstance(outcome, Exception)
+        ]).values_list('gateway_payment_intent_id', 'pk'))
+        needs_method = {
+            charge['user_id']: charge['payment_method_id']
+            for charge, outcome in zip(charges, outcomes)
+            if not isinstance(outcome, Exception) and outcome.status == 'succeeded'
+            and contexts[charge['user_id']].payment_method is None
+        }
+        if needs_method:
+            created = PaymentMethod.objects.bulk_create(
+                PaymentMethod(user_id=user_id, method_type='credit_card', gateway_payment_method_token=token,
+                              last_four_digits='1234')
+                for user_id, token in needs_method.items()
+            )
+            for payment_method in created:
+                contexts[payment_method.user_id].payment_method = payment_method
+                # bulk_create sends no post_save
+                invalidate_config(config_cache.default_payment_methods, str(payment_method.user_id))
+
+        for index, (charge, outcome) in enumerate(zip(charges, outcomes)):
+            context = contexts[charge['user_id']]
+            result = {'index': index}
+            if isinstance(outcome, gateways.GatewayRejected):
+                result.update(status='rejected', error=str(outcome), retry_after=outcome.retry_after)
+                row_status = None
+            elif isinstance(outcome, Exception):
+                result.update(status='failed', error=str(outcome))
+                row_status = 'failed' if context.payment_method else None
+            else:
+                result.update(status=outcome.status, payment_intent_id=outcome.id)
+                row_status = 'completed' if outcome.status == 'succeeded' else None
+                if outcome.id in recorded:
+                    result['transaction_id'] = recorded[outcome.id]
+                    row_status = None
+            results.append(result)
+            if row_status:
+                rows.append((result, Transaction(
+                    user=context.user,
+                    merchant=context.merchant,
+                    payment_method=context.payment_method,
+                    amount=charge['amount'],
+                    description=charge.get('description', ''),
+                    status=row_status,
+                    gateway_payment_intent_id=result.get('payment_intent_id', ''),
+                )))
+
+        created = Transaction.objects.bulk_create(record for _, record in rows)
+        for (result, _), record in zip(rows, created):
+            result['transaction_id'] = record.pk
+            # bulk_create sends no post_save
+            effects.add_rollup(record, created=True)
+            if record.status == 'failed':
+                payment_failed.send(sender=sender, transaction=record, error_message=result['error'])
+            else:
+                log_captured(record)
+                payment_processed.send(sender=sender, transaction=record)
+
+    logger.info("Bulk charge batch: %s items, %s recorded", len(charges), len(created))
+    return results
@@ -0,0 +1,292 @@
+"""
+Versioned, process-local read-through caches for rarely changing rows.
+
+Merchants, payment gateway configuration and users' default payment methods
+are read on nearly every payment but change rarely. Each ``ConfigCache`` keeps
+loaded values in process memory for ``PAYFLOW_CONFIG_CACHE['TTL']`` seconds.
+
+Entries are stamped with the cache's version, and the key's version, at the
+time the load started. Invalidating a key or the whole cache bumps the
+version, so a load that raced with an invalidation is never served. A key's
+version only exists while a load of it is running, and each cache holds at
+most ``MAX_ENTRIES`` entries, so memory stays bounded whatever keys clients
+send. The
+signal receivers in ``signals.py`` invalidate on ``post_save`` and
+``post_delete``, and again once the change commits.
+
+When ``PAYFLOW_CONFIG_CACHE['SHARED_CACHE']`` names a Django cache (Redis in
+production), every invalidation also bumps a shared version number there.
+Other workers check it at most every ``VERSION_CHECK_INTERVAL`` seconds and
+drop their entries when it moves, so a change made by one worker is seen by
+the rest within that interval rather than after the TTL.
+
+``stats()`` reports hits, misses and invalidations per cache.
+"""
+import logging
+import threading
+import time
+
+from django.conf import settings
+from django.core.cache import caches
+from django.http import Http404
+
+from .models import Merchant, PaymentGateway, PaymentMethod
+
+logger = logging.getLogger(__name__)
+
+DEFAULTS = {
+    'TTL': 300,
+    'MAX_ENTRIES': 10000,
+    'SHARED_CACHE': None,
+    'VERSION_CHECK_INTERVAL': 1.0,
+}
+
+_registry = {}
+
+
+def config_cache_settings():
+    return {**DEFAULTS, **getattr(settings, 'PAYFLOW_CONFIG_CACHE', {})}
+
+
+class ConfigCache:
+    """
+    A read-through cache in front of ``loader(key)``.
+
+    ``aloader`` is the async counterpart used by ``aget``. Loaders may return
+    None, which is cached like any other value unless ``cache_none`` is False;
+    caches keyed by ids that clients send set it, so unknown ids do not fill
+    the cache. Exceptions are not cached. Beyond ``MAX_ENTRIES`` the least
+    recently used entry is dropped.
+    """
+
+    def __init__(self, name, loader, aloader=None, cache_none=True):
+        self.name = name
+        self.loader = loader
+        self.aloader = aloader
+        self.cache_none = cache_none
+        self._entries = {}
+        self._version = 0
+        # Per-key versions and loads in flight, kept only while a load of the key is running
+        self._key_versions = {}
+        self._loading = {}
+        self._shared_version = None
+        self._checked_at = 0.0
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.invalidations = 0
+        _registry[name] = self
+
+    @property
+    def shared_key(self):
+        return f"payflow:config:{self.name}:version"
+
+    def get(self, key=None):
+        found, value, version = self._lookup(key)
+        if found:
+            return value
+        try:
+            value = self.loader(key)
+        except BaseException:
+            self._store(key, None, version, keep=False)
+            raise
+        self._store(key, value, version)
+        return value
+
+    async def aget(self, key=None):
+        found, value, version = self._lookup(key)
+        if found:
+            return value
+        try:
+            value = await self.aloader(key)
+        except BaseException:
+            self._store(key, None, version, keep=False)
+            raise
+        self._store(key, value, version)
+        return value
+
+    def invalidate(self, key=None, everything=False):
+        """Drop ``key``, or every entry with ``everything=True``, here and in other workers."""
+        with self._lock:
+            self.invalidations += 1
+            if everything:
+                self._version += 1
+                self._entries.clear()
+                self._key_versions.clear()
+            else:
+                self._entries.pop(key, None)
+                # Only a load already running could store a stale value
+                if key in self._loading:
+                    self._key_versions[key] = self._key_versions.get(key, 0) + 1
+        self._bump_shared_version()
+
+    def clear(self):
+        """Forget every entry and reset the counters, in this process only."""
+        with self._lock:
+            self._version += 1
+            self._entries.clear()
+            self._key_versions.clear()
+            self._shared_version = None
+            self._checked_at = 0.0
+            self.hits = self.misses = self.invalidations = 0
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                'hits': self.hits,
+                'misses': self.misses,
+                'invalidations': self.invalidations,
+                'size': len(self._entries),
+            }
+
+    def _lookup(self, key):
+        self._sync_shared_version()
+        now = time.monotonic()
+        with self._lock:
+            entry = self._entries.pop(key, None)
+            if entry is not None and entry[0] > now and entry[1] == self._version:
+                # Re-inserted so the dict stays in least recently used order
+                self._entries[key] = entry
+                self.hits += 1
+                return True, entry[2], None
+            self.misses += 1
+            self._loading[key] = self._loading.get(key, 0) + 1
+            return False, None, (self._version, self._key_versions.get(key, 0))
+
+    def _store(self, key, value, version, keep=True):
+        """End a load started by ``_lookup``, keeping ``value`` unless it may be stale."""
+        options = config_cache_settings()
+        expires = time.monotonic() + options['TTL']
+        with self._lock:
+            # An invalidation since the load started means the value may be stale
+            if keep and version == (self._version, self._key_versions.get(key, 0)) and (
+                    value is not None or self.cache_none):
+                self._entries[key] = (expires, version[0], value)
+                if len(self._entries) > options['MAX_ENTRIES']:
+                    del self._entries[next(iter(self._entries))]
+            self._loading[key] -= 1
+            if not self._loading[key]:
+                del self._loading[key]
+                self._key_versions.pop(key, None)
+
+    def _shared_cache(self):
+        alias = config_cache_settings()['SHARED_CACHE']
+        return caches[alias] if alias else None
+
+    def _sync_shared_version(self):
+        shared = self._shared_cache()
+        if shared is None:
+            return
+        now = time.monotonic()
+        if now - self._checked_at < config_cache_settings()['VERSION_CHECK_INTERVAL']:
+            return
+        self._checked_at = now
+        try:
+            current = shared.get(self.shared_key, 0)
+        except Exception:
+            logger.warning("Could not read the shared version of the %s cache", self.name, exc_info=True)
+            return
+        with self._lock:
+            if self._shared_version is not None and current != self._shared_version:
+                self._version += 1
+                self._entries.clear()
+                self._key_versions.clear()
+            self._shared_version = current
+
+    def _bump_shared_version(self):
+        shared = self._shared_cache()
+        if shared is None:
+            return
+        try:
+            try:
+                shared.incr(self.shared_key)
+            except ValueError:
+                if not shared.add(self.shared_key, 1, timeout=None):
+                    shared.incr(self.shared_key)
+        except Exception:
+            logger.warning("Could not publish an invalidation of the %s cache", self.name, exc_info=True)
+
+
+def stats() -> dict:
+    """Hit, miss and invalidation counters for every cache, keyed by name."""
+    return {name: cache.stats() for name, cache in _registry.items()}
+
+
+def clear_all():
+    for cache in _registry.values():
+        cache.clear()
+
+
+def _load_merchant(merchant_id):
+    if merchant_id is None:
+        return Merchant.objects.first()
+    return Merchant.objects.filter(pk=merchant_id).first()
+
+
+async def _aload_merchant(merchant_id):
+    if merchant_id is None:
+        return await Merchant.objects.afirst()
+    return await Merchant.objects.filter(pk=merchant_id).afirst()
+
+
+def _load_gateway(name):
+    return PaymentGateway.objects.filter(name=name).order_by('pk').first()
+
+
+async def _aload_gateway(name):
+    return await PaymentGateway.objects.filter(name=name).order_by('pk').afirst()
+
+
+def _default_payment_method_query(user_id):
+    return PaymentMethod.objects.select_related('user').filter(user_id=user_id).order_by('pk')
+
+
+def _load_default_payment_method(user_id):
+    return _default_payment_method_query(user_id).first()
+
+
+async def _aload_default_payment_method(user_id):
+    return await _default_payment_method_query(user_id).afirst()
+
+
+merchants = ConfigCache('merchants', _load_merchant, _aload_merchant, cache_none=False)
+gateways = ConfigCache('payment_gateways', _load_gateway, _aload_gateway)
+default_payment_methods = ConfigCache('default_payment_methods', _load_default_payment_method,
+                                      _aload_default_payment_method, cache_none=False)
+
+
+def _merchant_key(merchant_id):
+    return str(merchant_id) if merchant_id else None
+
+
+def get_merchant(merchant_id=None):
+    """Return the merchant with ``merchant_id``, or the default (first) merchant; 404 for an unknown id."""
+    merchant = merchants.get(_merchant_key(merchant_id))
+    if merchant is None and merchant_id:
+        raise Http404("No Merchant matches the given query.")
+    return merchant
+
+
+async def aget_merchant(merchant_id=None):
+    merchant = await merchants.aget(_merchant_key(merchant_id))
+    if merchant is None and merchant_id:
+        raise Http404("No Merchant matches the given query.")
+    return merchant
+
+
+def get_payment_gateway(name):
+    """Return the ``PaymentGateway`` configured under ``name``, or None."""
+    return gateways.get(name)
+
+
+async def aget_payment_gateway(name):
+    return await gateways.aget(name)
+
+
+def get_default_payment_method(user_id):
+    """Return the user's first payment method, with ``user`` joined, or None."""
+    return default_payment_methods.get(str(user_id))
+
+
+async def aget_default_payment_method(user_id):
+    return await default_payment_methods.aget(str(user_id))
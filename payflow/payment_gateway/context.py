@@ -0,0 +1,87 @@
+"""
+Per-request payment context.
+
+The payment endpoints all need the paying user, their default payment method
+and a merchant. ``load_payment_context`` fetches the user and payment method
+in a single joined query. Both it and the merchant are served from the
+process-local caches in ``config_cache``, since they rarely change.
+"""
+from dataclasses import dataclass
+from typing import Optional
+
+from django.http import Http404
+from django.shortcuts import get_object_or_404
+
+from .config_cache import aget_default_payment_method, aget_merchant, get_default_payment_method, get_merchant
+from .models import Merchant, PaymentMethod, User
+
+
+@dataclass
+class PaymentContext:
+    user: User
+    payment_method: Optional[PaymentMethod]
+    merchant: Optional[Merchant]
+
+    def ensure_payment_method(self, token) -> PaymentMethod:
+        """Return the user's default payment method, creating one if none exists."""
+        if self.payment_method is None:
+            self.payment_method = PaymentMethod.objects.create(
+                user=self.user,
+                method_type='credit_card',
+                gateway_payment_method_token=token,
+                last_four_digits='1234'  # Default value
+            )
+        return self.payment_method
+
+    async def aensure_payment_method(self, token) -> PaymentMethod:
+        if self.payment_method is None:
+            self.payment_method = await PaymentMethod.objects.acreate(
+                user=self.user,
+                method_type='credit_card',
+                gateway_payment_method_token=token,
+                last_four_digits='1234'  # Default value
+            )
+        return self.payment_method
+
+
+def load_payment_context(user_id, merchant_id=None) -> PaymentContext:
+    """
+    Load everything a payment needs for ``user_id``.
+
+    The user and their default payment method come back from one cached
+    query; the user is only fetched separately when they have no payment
+    method yet. The user is a cached snapshot, so read balances from the
+    database rather than from ``context.user``.
+    """
+    payment_method = get_default_payment_method(user_id)
+    user = payment_method.user if payment_method else get_object_or_404(User, pk=user_id)
+    return PaymentContext(user=user, payment_method=payment_method, merchant=get_merchant(merchant_id))
+
+
+def load_payment_contexts(user_ids, merchant_id=None) -> dict:
+    """
+    Load payment contexts for many users at once, keyed by user id.
+
+    Takes two queries however many users there are. Unknown ids are left out.
+    """
+    merchant = get_merchant(merchant_id)
+    contexts = {
+        user.pk: PaymentContext(user=user, payment_method=None, merchant=merchant)
+        for user in User.objects.filter(pk__in=set(user_ids))
+    }
+    for payment_method in PaymentMethod.objects.filter(user_id__in=contexts).order_by('-pk'):
+        # Descending, so the last one assigned is each user's first method
+        contexts[payment_method.user_id].payment_method = payment_method
+    return contexts
+
+
+async def aload_payment_context(user_id, merchant_id=None) -> PaymentContext:
+    payment_method = await aget_default_payment_method(user_id)
+    if payment_method:
+        user = payment_method.user
+    else:
+        try:
+            user = await User.objects.aget(pk=user_id)
+        except User.DoesNotExist:
+            raise Http404("No User matches the given query.")
+    return PaymentContext(user=user, payment_method=payment_method, merchant=await aget_merchant(merchant_id))
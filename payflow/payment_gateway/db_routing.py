@@ -0,0 +1,114 @@
+"""
+Primary/replica database routing.
+
+Writes, and every read that is not explicitly sent elsewhere, go to the
+primary (``default``). Read-only traffic that can tolerate replication lag
+opts in to a replica with ``read_alias(request)``: the resource API's list
+and retrieve actions, exports and admin changelists. ``read_alias`` picks one
+of ``PAYFLOW_DATABASE_ROUTING['REPLICAS']`` at random, or the primary when:
+
+* no replicas are configured;
+* the request is not a safe method, so it may go on to write;
+* a transaction is open on the primary, so a replica could miss its writes;
+* the client wrote recently: ``PrimaryPinningMiddleware`` answers every
+  unsafe request with a cookie that pins the client's reads to the primary
+  for ``PIN_SECONDS``, so it reads its own writes.
+
+Querysets are sent to the replica with ``.using()`` rather than by the router
+so that streamed responses, evaluated after the view has returned, still
+read from it. ``PrimaryReplicaRouter`` keeps every write on the primary,
+including saves of objects loaded from a replica, and only migrates the
+primary; replicas are configured as ``TEST['MIRROR']`` of it.
+"""
+import random
+
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction
+from django.conf import settings
+from django.db import DEFAULT_DB_ALIAS, connections
+
+DEFAULTS = {
+    'REPLICAS': [],
+    'PIN_SECONDS': 5,
+    'PIN_COOKIE': 'payflow_primary',
+}
+
+SAFE_METHODS = ('GET', 'HEAD', 'OPTIONS')
+
+
+def routing_settings():
+    return {**DEFAULTS, **getattr(settings, 'PAYFLOW_DATABASE_ROUTING', {})}
+
+
+def read_alias(request=None):
+    """The database for a read-only query made on behalf of ``request``."""
+    options = routing_settings()
+    replicas = options['REPLICAS']
+    if not replicas or connections[DEFAULT_DB_ALIAS].in_atomic_block:
+        return DEFAULT_DB_ALIAS
+    if request is not None and (request.method not in SAFE_METHODS or options['PIN_COOKIE'] in request.COOKIES):
+        return DEFAULT_DB_ALIAS
+    return random.choice(replicas)
+
+
+class PrimaryReplicaRouter:
+    def db_for_write(self, model, **hints):
+        return DEFAULT_DB_ALIAS
+
+    def allow_relation(self, obj1, obj2, **hints):
+        databases = {DEFAULT_DB_ALIAS, *routing_settings()['REPLICAS']}
+        return obj1._state.db in databases and obj2._state.db in databases
+
+    def allow_migrate(self, db, app_label, model_name=None, **hints):
+        return db == DEFAULT_DB_ALIAS
+
+
+class PrimaryPinningMiddleware:
+    """Pin a client's reads to the primary for a few seconds after each unsafe request."""
+
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        if iscoroutinefunction(get_response):
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if iscoroutinefunction(self):
+            return self.__acall__(request)
+        return self.pin(request, self.get_response(request))
+
+    async def __acall__(self, request):
+        return self.pin(request, await self.get_response(request))
+
+    def pin(self, request, response):
+        options = routing_settings()
+        if options['REPLICAS'] and request.method not in SAFE_METHODS:
+            response.set_cookie(options['PIN_COOKIE'], '1', max_age=options['PIN_SECONDS'],
+                                httponly=True, samesite='Lax')
+        return response
+
+
+class ReplicaReadMixin:
+    """Viewset mixin: read-only actions query a replica unless ``read_alias`` says otherwise."""
+
+    replica_actions = ('list', 'retrieve')
+
+    def filter_queryset(self, queryset):
+        queryset = super().filter_queryset(queryset)
+        if self.action in self.replica_actions:
+            queryset = queryset.using(read_alias(self.request))
+        return queryset
+
+
+class ReplicaChangelistMixin:
+    """ModelAdmin mixin: changelist pages query a replica; add and change forms stay on the primary."""
+
+    def changelist_view(self, request, extra_context=None):
+        request.read_alias = read_alias(request)
+        return super().changelist_view(request, extra_context)
+
+    def get_queryset(self, request):
+        queryset = super().get_queryset(request)
+        alias = getattr(request, 'read_alias', None)
+        return queryset.using(alias) if alias else queryset
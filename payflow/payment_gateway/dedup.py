@@ -0,0 +1,87 @@
+"""
+Deduplication of redelivered gateway events.
+
+Stripe delivers webhooks at least once, so the same event id can arrive many
+times. ``ProcessedEventStore`` records every handled event id in the
+``ProcessedEvent`` table (unique index on ``event_id``) and keeps the most
+recent ids in an in-process LRU so that hot duplicates are rejected without a
+database round trip.
+"""
+import logging
+import threading
+from collections import OrderedDict
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import IntegrityError, transaction
+from django.utils import timezone
+
+from .models import ProcessedEvent
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_CACHE_SIZE = 10000
+DEFAULT_TTL = 30 * 24 * 60 * 60
+
+
+class ProcessedEventStore:
+    def __init__(self, max_size=None):
+        self.max_size = max_size or getattr(settings, 'PAYFLOW_PROCESSED_EVENT_CACHE_SIZE', DEFAULT_CACHE_SIZE)
+        self._recent = OrderedDict()
+        self._lock = threading.Lock()
+
+    def _remember(self, event_id):
+        with self._lock:
+            self._recent[event_id] = True
+            self._recent.move_to_end(event_id)
+            while len(self._recent) > self.max_size:
+                self._recent.popitem(last=False)
+
+    def _recently_seen(self, event_id):
+        with self._lock:
+            if event_id in self._recent:
+                self._recent.move_to_end(event_id)
+                return True
+        return False
+
+    def seen(self, event_id) -> bool:
+        """Return True if ``event_id`` has already been processed."""
+        if self._recently_seen(event_id):
+            return True
+        if ProcessedEvent.objects.filter(event_id=event_id).exists():
+            self._remember(event_id)
+            return True
+        return False
+
+    def claim(self, event_id, event_type='') -> bool:
+        """
+        Record ``event_id`` as processed. Returns False if it was already claimed.
+
+        Call this inside the same atomic block as the event's side effects: if
+        processing fails the claim is rolled back and the redelivery is handled.
+        """
+        if self._recently_seen(event_id):
+            return False
+        try:
+            with transaction.atomic():
+                ProcessedEvent.objects.create(event_id=event_id, event_type=event_type)
+        except IntegrityError:
+            self._remember(event_id)
+            return False
+        # Only cache the id once the claim is durable.
+        transaction.on_commit(lambda: self._remember(event_id))
+        return True
+
+    def prune(self, ttl=None) -> int:
+        """Delete processed-event records older than ``ttl`` seconds."""
+        ttl = ttl if ttl is not None else getattr(settings, 'PAYFLOW_PROCESSED_EVENT_TTL', DEFAULT_TTL)
+        cutoff = timezone.now() - timedelta(seconds=ttl)
+        deleted, _ = ProcessedEvent.objects.filter(processed_at__lt=cutoff).delete()
+        return deleted
+
+    def clear_cache(self):
+        with self._lock:
+            self._recent.clear()
+
+
+processed_events = ProcessedEventStore()
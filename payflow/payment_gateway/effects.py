@@ -0,0 +1,139 @@
+"""
+Batched side effects for payment signals.
+
+Signal receivers hand their side effects to this module instead of writing
+them one by one. Inside ``batch()`` the effects are collected and flushed once
+when the batch exits:
+
+* ``TransactionLog`` rows are written with a single ``bulk_create``;
+* balance credits go through ``ledger.credit_many``, so deltas for the same
+  user are coalesced into one balance update;
+* transaction rollup deltas are summed per rollup row and applied once;
+* everything passed to ``defer`` (log lines, notifications) runs once the
+  database transaction commits.
+
+Log rows and credits are flushed before the batch's transaction commits, so
+a payment and its ledger entries still commit or roll back together. Outside
+a batch, or with ``PAYFLOW_SYNC_SIDE_EFFECTS`` set, every effect is applied
+immediately.
+"""
+import contextvars
+import logging
+from contextlib import contextmanager
+
+from django.conf import settings
+from django.db import transaction
+
+from . import ledger, rollups, timing
+from .models import TransactionLog
+
+logger = logging.getLogger(__name__)
+
+_current = contextvars.ContextVar('payflow_effect_batch', default=None)
+
+
+def sync_mode() -> bool:
+    return getattr(settings, 'PAYFLOW_SYNC_SIDE_EFFECTS', False)
+
+
+class EffectBatch:
+    def __init__(self):
+        self.logs = []
+        self.credits = []
+        self.rollups = []
+        self.callbacks = []
+
+    def merge(self, other):
+        self.logs.extend(other.logs)
+        self.credits.extend(other.credits)
+        self.rollups.extend(other.rollups)
+        self.callbacks.extend(other.callbacks)
+
+    @timing.timed('signals')
+    def flush(self):
+        if self.logs:
+            TransactionLog.objects.bulk_create(self.logs)
+        if self.credits:
+            ledger.credit_many(self.credits)
+        if self.rollups:
+            rollups.apply(self.rollups)
+        if self.callbacks:
+            callbacks = self.callbacks
+            transaction.on_commit(lambda: run_callbacks(callbacks))
+
+
+@timing.timed('signals')
+def run_callbacks(callbacks):
+    for callback in callbacks:
+        try:
+            callback()
+        except Exception:
+            logger.exception("Deferred side effect %r failed", callback)
+
+
+@contextmanager
+def batch():
+    """
+    Collect side effects for the duration of the block, in a database transaction.
+
+    Nested batches join the outer one when they exit cleanly; effects from a
+    nested batch that raises are discarded with its savepoint.
+    """
+    if sync_mode():
+        with transaction.atomic():
+            yield None
+        return
+
+    parent = _current.get()
+    current = EffectBatch()
+    token = _current.set(current)
+    try:
+        with transaction.atomic():
+            yield current
+            if parent is None:
+                _current.set(None)
+                current.flush()
+    finally:
+        _current.reset(token)
+    if parent is not None:
+        parent.merge(current)
+
+
+def add_log(log: TransactionLog):
+    current = _current.get()
+    if current is None:
+        log.save()
+    else:
+        current.logs.append(log)
+
+
+def add_credit(user_id, amount, transaction_record=None):
+    current = _current.get()
+    if current is None:
+        ledger.credit(user_id, amount, transaction_record)
+    else:
+        current.credits.append((user_id, amount, transaction_record))
+
+
+def add_rollup(transaction_record, created=False, deleted=False):
+    """Roll up what changed on ``transaction_record`` since it was loaded."""
+    if not rollups.is_live():
+        return
+    deltas = rollups.changes(transaction_record, created=created, deleted=deleted)
+    current = _current.get()
+    if current is None:
+        if deltas:
+            rollups.apply(deltas)
+    else:
+        current.rollups.extend(deltas)
+
+
+def defer(callback):
+    """Run ``callback`` after the current database transaction commits."""
+    current = _current.get()
+    if current is not None:
+        current.callbacks.append(callback)
+    elif sync_mode():
+        callback()
+    else:
+        transaction.on_commit(callback, robust=True)
@@ -0,0 +1,230 @@
+"""
+Read-only fast path for serializing large lists of rows.
+
+``ValuesSerializer`` reads rows with ``QuerySet.values()`` instead of building
+model instances, and produces exactly what a DRF ``ModelSerializer`` would for
+the same rows. The column list and a converter per field are worked out once
+from the serializer's own fields: foreign keys become their ``<name>_id``
+column, ``get_<field>_display`` sources are looked up in precomputed choice
+label dicts, and decimals and datetimes are formatted the way DRF formats
+them, falling back to the DRF field for anything unusual.
+
+``FastJSONRenderer`` encodes responses built from such rows with ``orjson``,
+when it is installed, post-processed to match DRF's ``JSONRenderer`` byte for
+byte. Responses whose data may hold floats, and anything orjson refuses, go
+through the stdlib encoder as before.
+"""
+import decimal
+import re
+from functools import lru_cache
+
+from django.core.exceptions import FieldDoesNotExist, ImproperlyConfigured
+from django.db import models
+from rest_framework import serializers
+from rest_framework.response import Response
+from rest_framework.settings import ISO_8601, api_settings
+
+from . import timing
+from .serializers import TransactionSerializer, TransactionLogSerializer
+
+try:
+    import orjson
+except ImportError:  # pragma: no cover
+    orjson = None
+
+DISPLAY_SOURCE = re.compile(r'^get_(\w+)_display$')
+
+
+def _label_converter(model_field):
+    labels = {value: str(label) for value, label in model_field.flatchoices}
+
+    def convert(value):
+        label = labels.get(value)
+        return label if label is not None else str(value)
+    return convert
+
+
+def _decimal_converter(field):
+    if field.decimal_places is None or field.localize or not getattr(
+            field, 'coerce_to_string', api_settings.COERCE_DECIMAL_TO_STRING):
+        return field.to_representation
+    exponent = -field.decimal_places
+
+    def convert(value):
+        if isinstance(value, decimal.Decimal) and value.as_tuple().exponent == exponent:
+            return f'{value:f}'
+        return field.to_representation(value)
+    return convert
+
+
+def _datetime_converter(field):
+    if getattr(field, 'format', api_settings.DATETIME_FORMAT) != ISO_8601:
+        return field.to_representation
+    zone = field.timezone if hasattr(field, 'timezone') else field.default_timezone()
+    if zone is None:
+        return field.to_representation
+
+    def convert(value):
+        if value.tzinfo is None:
+            return field.to_representation(value)
+        text = value.astimezone(zone).isoformat()
+        return text[:-6] + 'Z' if text.endswith('+00:00') else text
+    return convert
+
+
+class ValuesSerializer:
+    """
+    Serialize ``.values()`` rows the way ``serializer_class`` serializes instances.
+
+    Only plain model-backed fields are supported; building one for a
+    serializer with custom ``to_representation`` or computed fields raises
+    ImproperlyConfigured.
+    """
+
+    serializer_class = None
+
+    def __init__(self, serializer_class=None):
+        self.serializer_class = serializer_class or self.serializer_class
+        serializer = self.serializer_class()
+        if type(serializer).to_representation is not serializers.Serializer.to_representation:
+            raise ImproperlyConfigured(f"{self.serializer_class.__name__} customizes to_representation")
+        self.model = serializer.Meta.model
+        self.may_hold_floats = False
+        self.columns = []
+        self.fields = []
+        self.datetime_fields = {}
+        for name, field in serializer.fields.items():
+            if field.write_only:
+                continue
+            column, convert = self.plan_field(field)
+            if column not in self.columns:
+                self.columns.append(column)
+            if isinstance(field, serializers.DateTimeField):
+                self.datetime_fields[name] = field
+            self.fields.append((name, column, convert))
+
+    def plan_field(self, field):
+        """Return the ``values()`` column and converter (None for identity) for one serializer field."""
+        display = DISPLAY_SOURCE.match(field.source)
+        if display and isinstance(field, serializers.CharField):
+            return display.group(1), _label_converter(self.model._meta.get_field(display.group(1)))
+        try:
+            model_field = self.model._meta.get_field(field.source)
+        except FieldDoesNotExist:
+            raise ImproperlyConfigured(f"{self.serializer_class.__name__}.{field.field_name} is not a model field")
+
+        if isinstance(field, serializers.PrimaryKeyRelatedField):
+            if field.pk_field is not None:
+                raise ImproperlyConfigured(f"{field.field_name} uses pk_field")
+            return model_field.attname, None
+        if isinstance(field, serializers.DecimalField):
+            return model_field.attname, _decimal_converter(field)
+        if isinstance(field, serializers.DateTimeField):
+            # Converted per call, since the current timezone may change
+            return model_field.attname, None
+        if isinstance(field, serializers.JSONField):
+            self.may_hold_floats = True
+            return model_field.attname, None if not field.binary else field.to_representation
+        if isinstance(field, serializers.ChoiceField):
+            # Values of string choices come back unchanged
+            plain = all(isinstance(key, str) for key in field.choices)
+            return model_field.attname, None if plain else field.to_representation
+        if isinstance(field, serializers.IntegerField) and isinstance(model_field, models.AutoField):
+            return model_field.attname, None
+        if isinstance(field, serializers.CharField) and isinstance(model_field, (models.CharField, models.TextField)):
+            return model_field.attname, None
+        raise ImproperlyConfigured(f"{self.serializer_class.__name__}.{field.field_name} "
+                                   f"({type(field).__name__}) has no fast path")
+
+    def values(self, queryset):
+        return queryset.values(*self.columns)
+
+    def converters(self):
+        """The per-field plan, with datetime converters bound to the current timezone."""
+        return [
+            (key, column, _datetime_converter(self.datetime_fields[key]) if key in self.datetime_fields else convert)
+            for key, column, convert in self.fields
+        ]
+
+    def iter_representations(self, rows):
+        plan = self.converters()
+        for row in rows:
+            item = {}
+            for key, column, convert in plan:
+                value = row[column]
+                item[key] = value if convert is None or value is None else convert(value)
+            yield item
+
+    def to_representation_many(self, rows):
+        return list(self.iter_representations(rows))
+
+
+class TransactionValuesSerializer(ValuesSerializer):
+    serializer_class = TransactionSerializer
+
+
+class TransactionLogValuesSerializer(ValuesSerializer):
+    serializer_class = TransactionLogSerializer
+
+
+@lru_cache(maxsize=None)
+def get_values_serializer(values_serializer_class):
+    """Shared instance of a ``ValuesSerializer`` subclass; they hold no per-request state."""
+    return values_serializer_class()
+
+
+def _has_float(value):
+    if isinstance(value, float):
+        return True
+    if isinstance(value, dict):
+        return any(_has_float(item) for item in value.values())
+    if isinstance(value, (list, tuple)):
+        return any(_has_float(item) for item in value)
+    return False
+
+
+class FastListMixin:
+    """
+    ``list()`` through ``fast_serializer_class`` for JSON responses.
+
+    Other formats, such as the browsable API, keep the regular serializer.
+    """
+
+    fast_serializer_class = None
+
+    def list(self, request, *args, **kwargs):
+        if self.fast_serializer_class is None or request.accepted_renderer.format != 'json':
+            return super().list(request, *args, **kwargs)
+
+        fast = get_values_serializer(self.fast_serializer_class)
+        rows = fast.values(self.filter_queryset(self.get_queryset()))
+        page = self.paginate_queryset(rows)
+        with timing.stage('serialize'):
+            data = fast.to_representation_many(page if page is not None else rows)
+        response = self.get_paginated_response(data) if page is not None else Response(data)
+        response.plain_json = not (fast.may_hold_floats and _has_float(data))
+        return response
+
+
+class FastJSONRenderer(timing.JSONRenderer):
+    """
+    ``JSONRenderer`` that uses orjson for responses marked ``plain_json``.
+
+    The output is byte-identical to ``JSONRenderer``: compact, unescaped
+    unicode, with U+2028 and U+2029 escaped. Floats are left to the stdlib
+    encoder because orjson formats some of them differently.
+    """
+
+    def render(self, data, accepted_media_type=None, renderer_context=None):
+        response = (renderer_context or {}).get('response')
+        if (orjson is None or data is None or not getattr(response, 'plain_json', False)
+                or self.get_indent(accepted_media_type, renderer_context or {}) is not None
+                or self.ensure_ascii or not self.compact):
+            return super().render(data, accepted_media_type, renderer_context)
+        try:
+            with timing.stage('serialize'):
+                encoded = orjson.dumps(data)
+                return encoded.replace(b'\xe2\x80\xa8', b'\\u2028').replace(b'\xe2\x80\xa9', b'\\u2029')
+        except TypeError:
+            # Integers beyond 64 bits, lone surrogates, unknown types
+            return super().render(data, accepted_media_type, renderer_context)
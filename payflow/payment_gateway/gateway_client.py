@@ -0,0 +1,171 @@
+"""
+Shared Stripe client configuration.
+
+All Stripe calls go through one ``stripe.default_http_client``: a requests
+session with a sized connection pool, kept alive between calls so each payment
+does not pay for a fresh TCP and TLS handshake. The pool is rebuilt after a
+fork, so workers started from a preloaded master never share sockets.
+
+The ``*_async`` SDK methods used by the ASGI views go through the same
+client's async fallback: an httpx ``AsyncClient`` per event loop with the same
+pool limits. httpx is optional; without it only the sync views work.
+
+Settings (``PAYFLOW_STRIPE_HTTP``)::
+
+    POOL_CONNECTIONS     hosts to keep pools for
+    POOL_MAXSIZE         keep-alive connections per host
+    CONNECT_TIMEOUT      seconds
+    READ_TIMEOUT         seconds
+    MAX_NETWORK_RETRIES  passed to ``stripe.max_network_retries``
+    API_BASE             override ``stripe.api_base`` (e.g. a local stub)
+"""
+import asyncio
+import contextvars
+import os
+import ssl
+import threading
+import weakref
+from contextlib import contextmanager
+
+import requests
+import stripe
+from django.conf import settings
+from requests.adapters import HTTPAdapter
+
+from . import timing
+
+try:
+    import httpx
+except ImportError:  # pragma: no cover
+    httpx = None
+
+DEFAULTS = {
+    'POOL_CONNECTIONS': 4,
+    'POOL_MAXSIZE': 32,
+    'CONNECT_TIMEOUT': 5,
+    'READ_TIMEOUT': 30,
+    'MAX_NETWORK_RETRIES': 0,
+    'API_BASE': None,
+}
+
+_call_timeout = contextvars.ContextVar('payflow_stripe_call_timeout', default=None)
+
+
+def http_settings():
+    return {**DEFAULTS, **getattr(settings, 'PAYFLOW_STRIPE_HTTP', {})}
+
+
+@contextmanager
+def call_timeout(seconds):
+    """Use ``seconds`` (or a ``(connect, read)`` tuple) for Stripe calls made inside the block."""
+    token = _call_timeout.set(seconds)
+    try:
+        yield
+    finally:
+        _call_timeout.reset(token)
+
+
+class PooledSession(requests.Session):
+    """Session that honours the timeout set with ``call_timeout``."""
+
+    def request(self, method, url, *args, timeout=None, **kwargs):
+        return super().request(method, url, *args, timeout=_call_timeout.get() or timeout, **kwargs)
+
+
+def build_session(pool_connections, pool_maxsize) -> PooledSession:
+    session = PooledSession()
+    adapter = HTTPAdapter(pool_connections=pool_connections, pool_maxsize=pool_maxsize, pool_block=False)
+    session.mount('https://', adapter)
+    session.mount('http://', adapter)
+    return session
+
+
+class PooledRequestsClient(stripe.RequestsClient):
+    """``RequestsClient`` sharing one pooled session across threads, rebuilt per process."""
+
+    name = 'payflow-pooled-requests'
+
+    def __init__(self, pool_connections, pool_maxsize, **kwargs):
+        self._pool_connections = pool_connections
+        self._pool_maxsize = pool_maxsize
+        self._pid = os.getpid()
+        super().__init__(session=build_session(pool_connections, pool_maxsize), **kwargs)
+
+    def _request_internal(self, *args, **kwargs):
+        if self._pid != os.getpid():
+            self._pid = os.getpid()
+            self._session = build_session(self._pool_connections, self._pool_maxsize)
+            self._thread_local = threading.local()
+        with timing.stage('stripe'):
+            return super()._request_internal(*args, **kwargs)
+
+
+class PooledHTTPXClient(stripe.HTTPXClient):
+    """Async Stripe client keeping one pooled ``httpx.AsyncClient`` per event loop."""
+
+    name = 'payflow-pooled-httpx'
+
+    def __init__(self, max_connections, timeout, **kwargs):
+        super().__init__(timeout=_httpx_timeout(timeout), **kwargs)
+        self._limits = httpx.Limits(max_connections=max_connections, max_keepalive_connections=max_connections)
+        self._clients = weakref.WeakKeyDictionary()
+
+    def _async_client(self):
+        loop = asyncio.get_running_loop()
+        client = self._clients.get(loop)
+        if client is None:
+            verify = ssl.create_default_context(cafile=stripe.ca_bundle_path) if self._verify_ssl_certs else False
+            client = self._clients[loop] = httpx.AsyncClient(verify=verify, limits=self._limits)
+        return client
+
+    def _get_request_args_kwargs(self, method, url, headers, post_data):
+        args, kwargs = super()._get_request_args_kwargs(method, url, headers, post_data)
+        if _call_timeout.get():
+            kwargs['timeout'] = _httpx_timeout(_call_timeout.get())
+        return args, kwargs
+
+    async def request_async(self, method, url, headers, post_data=None):
+        args, kwargs = self._get_request_args_kwargs(method, url, headers, post_data)
+        try:
+            with timing.stage('stripe'):
+                response = await self._async_client().request(*args, **kwargs)
+        except Exception as e:
+            self._handle_request_error(e)
+        return response.content, response.status_code, response.headers
+
+    async def close_async(self):
+        client = self._clients.pop(asyncio.get_running_loop(), None)
+        if client is not None:
+            await client.aclose()
+
+
+def _httpx_timeout(timeout):
+    if isinstance(timeout, tuple):
+        connect, read = timeout
+        return httpx.Timeout(read, connect=connect)
+    return timeout
+
+
+def build_http_client(**overrides) -> PooledRequestsClient:
+    config = {**http_settings(), **overrides}
+    timeout = (config['CONNECT_TIMEOUT'], config['READ_TIMEOUT'])
+    async_client = None
+    if httpx is not None:
+        async_client = PooledHTTPXClient(max_connections=config['POOL_MAXSIZE'], timeout=timeout)
+    return PooledRequestsClient(
+        pool_connections=config['POOL_CONNECTIONS'],
+        pool_maxsize=config['POOL_MAXSIZE'],
+        timeout=timeout,
+        async_fallback_client=async_client,
+    )
+
+
+def configure():
+    """Set the Stripe key, endpoint and shared HTTP client. Called once from ``AppConfig.ready``."""
+    config = http_settings()
+    stripe.api_key = settings.STRIPE_SECRET_KEY
+    if config['API_BASE']:
+        stripe.api_base = config['API_BASE']
+    stripe.max_network_retries = config['MAX_NETWORK_RETRIES']
+    stripe.default_http_client = build_http_client()
+    return stripe.default_http_client
@@ -0,0 +1,372 @@
+"""
+Payment gateway providers and latency-aware routing between them.
+
+A provider wraps one payment service behind the operations the payment
+views need (``create_payment_intent``, ``create_payment_link``,
+``create_checkout_session`` and their ``a*`` async versions). Results are
+Stripe-shaped objects (mappings with ``id`` and ``status``), and failures are
+raised as ``stripe.error`` exceptions, which the views and bulk charges
+already handle; a provider for another service maps its responses and
+errors onto those. ``StripeProvider`` is the default provider.
+
+The configured providers (``PAYFLOW_GATEWAYS['PROVIDERS']``) are chosen per
+call by a ``Router``. It keeps an exponentially weighted moving average of
+each provider's latency and error rate and sends the call to the provider
+with the lowest score, ``latency * (1 + ERROR_PENALTY * error_rate)``. A
+share of calls (``EXPLORE_RATE``) goes to a random provider, so one that has
+recovered is noticed. Each provider also has a ``CircuitBreaker``, so after
+``FAILURE_THRESHOLD`` consecutive failures it gets no calls for
+``RESET_TIMEOUT`` seconds. Declines and invalid requests count as healthy
+calls; connection errors, 5xx responses, rate limits and unexpected
+exceptions count as failures.
+
+Every call is bounded: ``TIMEOUTS`` sets per-operation (connect, read)
+timeouts, and at most ``BULKHEAD_SIZE`` calls are in flight per process. A
+call that finds the bulkhead full for ``BULKHEAD_MAX_WAIT`` seconds, or no
+provider with a closed circuit, fails fast with a ``GatewayRejected`` error,
+which the views answer with 503. Gateway failures of calls made with an
+idempotency key are retried on the same provider up to ``RETRIES`` times,
+with jittered exponential backoff; calls without a key could charge twice
+and are not retried. A call is never retried on another provider, because
+the first one may have charged the card before it failed. The statistics
+are per worker process.
+"""
+import asyncio
+import itertools
+import logging
+import math
+import random
+import threading
+import time
+
+import stripe
+from django.conf import settings
+from django.core.signals import setting_changed
+from django.dispatch import receiver
+from django.utils.module_loading import import_string
+
+from .config_cache import get_payment_gateway
+from .gateway_client import call_timeout
+from .resilience import Bulkhead, CircuitBreaker, backoff_delay
+
+logger = logging.getLogger(__name__)
+
+DEFAULTS = {
+    'PROVIDERS': {'stripe': 'payment_gateway.gateways.StripeProvider'},
+    'EWMA_ALPHA': 0.2,
+    'ERROR_PENALTY': 10.0,
+    'EXPLORE_RATE': 0.02,
+    'FAILURE_THRESHOLD': 5,
+    'RESET_TIMEOUT': 30.0,
+    # (connect, read) seconds per operation; the async versions use the same
+    'TIMEOUTS': {
+        'create_payment_intent': (2, 15),
+        'create_payment_link': (2, 10),
+        'create_checkout_session': (2, 10),
+    },
+    'RETRIES': 2,
+    'RETRY_BASE_DELAY': 0.25,
+    'RETRY_MAX_DELAY': 2.0,
+    'BULKHEAD_SIZE': 32,
+    'BULKHEAD_MAX_WAIT': 1.0,
+}
+
+# Errors that say the gateway, rather than the payment, is in trouble
+GATEWAY_ERRORS = (stripe.error.APIConnectionError, stripe.error.APIError, stripe.error.RateLimitError)
+
+
+class GatewayRejected(stripe.error.APIConnectionError):
+    """The call was refused before reaching a gateway; ``retry_after`` says when to try again."""
+
+    def __init__(self, message, retry_after=None):
+        super().__init__(message)
+        self.retry_after = retry_after
+
+
+class NoGatewayAvailable(GatewayRejected):
+    """Every provider that supports the operation has an open circuit."""
+
+
+class GatewayBusy(GatewayRejected):
+    """The process already has ``BULKHEAD_SIZE`` gateway calls in flight."""
+
+
+def retry_after_headers(error) -> dict:
+    """``Retry-After`` for the 503 answering a ``GatewayRejected`` error."""
+    return {'Retry-After': str(math.ceil(error.retry_after))} if error.retry_after else {}
+
+
+def gateway_settings():
+    return {**DEFAULTS, **getattr(settings, 'PAYFLOW_GATEWAYS', {})}
+
+
+def is_gateway_failure(error) -> bool:
+    return isinstance(error, GATEWAY_ERRORS) or not isinstance(error, stripe.error.StripeError)
+
+
+class Provider:
+    """Base class for payment providers; subclasses implement the operations they support."""
+
+    def __init__(self, name):
+        self.name = name
+
+    def credentials(self):
+        """The ``PaymentGateway`` row configured under this provider's name, or None."""
+        return get_payment_gateway(self.name)
+
+    def supports(self, operation) -> bool:
+        return callable(getattr(self, operation, None))
+
+
+class StripeProvider(Provider):
+    def create_payment_intent(self, params, **options):
+        return stripe.PaymentIntent.create(**params, **options)
+
+    async def acreate_payment_intent(self, params, **options):
+        return await stripe.PaymentIntent.create_async(**params, **options)
+
+    def create_payment_link(self, params, **options):
+        return stripe.PaymentLink.create(**params, **options)
+
+    async def acreate_payment_link(self, params, **options):
+        return await stripe.PaymentLink.create_async(**params, **options)
+
+    def create_checkout_session(self, params, **options):
+        return stripe.checkout.Session.create(**params, **options)
+
+    async def acreate_checkout_session(self, params, **options):
+        return await stripe.checkout.Session.create_async(**params, **options)
+
+
+class GatewayStats:
+    def __init__(self):
+        self.latency = None
+        self.error_rate = 0.0
+        self.calls = 0
+        self.failures = 0
+        self.retries = 0
+
+    def observe(self, elapsed, failed, alpha):
+        self.calls += 1
+        self.failures += failed
+        self.latency = elapsed if self.latency is None else alpha * elapsed + (1 - alpha) * self.latency
+        self.error_rate = alpha * failed + (1 - alpha) * self.error_rate
+
+
+def base_operation(operation):
+    """``acreate_payment_intent`` -> ``create_payment_intent``, for per-operation settings."""
+    return operation[1:] if operation.startswith('acreate_') else operation
+
+
+class Router:
+    def __init__(self, providers, alpha=0.2, error_penalty=10.0, explore_rate=0.02, failure_threshold=5,
+                 reset_timeout=30.0, timeouts=None, retries=0, retry_base_delay=0.25, retry_max_delay=2.0,
+                 bulkhead_size=32, bulkhead_max_wait=0.0, clock=time.monotonic, rng=None):
+        self.providers = list(providers)
+        self.alpha = alpha
+        self.error_penalty = error_penalty
+        self.explore_rate = explore_rate
+        self.timeouts = timeouts or {}
+        self.retries = retries
+        self.retry_base_delay = retry_base_delay
+        self.retry_max_delay = retry_max_delay
+        self.clock = clock
+        self.rng = rng or random.Random()
+        self.breakers = {provider.name: CircuitBreaker(failure_threshold, reset_timeout, clock)
+                         for provider in self.providers}
+        self.stats = {provider.name: GatewayStats() for provider in self.providers}
+        self.bulkhead = Bulkhead(bulkhead_size, bulkhead_max_wait)
+        self.rejections = {'circuit_open': 0, 'bulkhead_full': 0}
+        self._lock = threading.Lock()
+
+    @classmethod
+    def from_settings(cls):
+        options = gateway_settings()
+        providers = [
+            (import_string(provider) if isinstance(provider, str) else provider)(name)
+            for name, provider in options['PROVIDERS'].items()
+        ]
+        return cls(providers, alpha=options['EWMA_ALPHA'], error_penalty=options['ERROR_PENALTY'],
+                   explore_rate=options['EXPLORE_RATE'], failure_threshold=options['FAILURE_THRESHOLD'],
+                   reset_timeout=options['RESET_TIMEOUT'], timeouts=options['TIMEOUTS'],
+                   retries=options['RETRIES'], retry_base_delay=options['RETRY_BASE_DELAY'],
+                   retry_max_delay=options['RETRY_MAX_DELAY'], bulkhead_size=options['BULKHEAD_SIZE'],
+                   bulkhead_max_wait=options['BULKHEAD_MAX_WAIT'])
+
+    def score(self, provider):
+        stats = self.stats[provider.name]
+        # An untried provider scores 0 so that it gets measured
+        return (stats.latency or 0.0) * (1 + self.error_penalty * stats.error_rate)
+
+    def reject(self, reason, error):
+        with self._lock:
+            self.rejections[reason] += 1
+        raise error
+
+    def choose(self, operation) -> Provider:
+        """The provider for the next ``operation`` call; raises ``NoGatewayAvailable``."""
+        supported = [provider for provider in self.providers if provider.supports(operation)]
+        candidates = [provider for provider in supported if self.breakers[provider.name].available()]
+        with self._lock:
+            if len(candidates) > 1 and self.rng.random() < self.explore_rate:
+                self.rng.shuffle(candidates)
+            else:
+                # Stable, so ties go to the provider configured first
+                candidates.sort(key=self.score)
+        for provider in candidates:
+            if self.breakers[provider.name].allow():
+                return provider
+        retry_after = min((self.breakers[provider.name].retry_after() for provider in supported), default=None)
+        self.reject('circuit_open', NoGatewayAvailable(
+            f"No payment gateway is available for {operation}.", retry_after=retry_after))
+
+    def observe(self, provider, elapsed, error=None):
+        failed = error is not None and is_gateway_failure(error)
+        with self._lock:
+            self.stats[provider.name].observe(elapsed, failed, self.alpha)
+        breaker = self.breakers[provider.name]
+        if failed:
+            breaker.record_failure()
+            logger.warning("Gateway %s failed (%s): %s", provider.name, breaker.state, error)
+        else:
+            breaker.record_success()
+
+    def retry_delay(self, provider, attempt, error, options):
+        """
+        Seconds to wait before retrying a failed call, or None if it must not be retried.
+
+        Only calls carrying an idempotency key are retried, and only on the same
+        provider, which then returns the original result if the first attempt
+        went through. Declines and other payment errors are never retried.
+        """
+        if (attempt >= self.retries or not options.get('idempotency_key')
+                or not isinstance(error, GATEWAY_ERRORS) or isinstance(error, GatewayRejected)
+                or not self.breakers[provider.name].available()):
+            return None
+        with self._lock:
+            self.stats[provider.name].retries += 1
+            return backoff_delay(attempt, self.retry_base_delay, self.retry_max_delay, self.rng)
+
+    def provider_for(self, operation, provider):
+        if provider is None:
+            return self.choose(operation)
+        if not self.breakers[provider.name].allow():
+            self.reject('circuit_open', NoGatewayAvailable(
+                f"Payment gateway {provider.name} is unavailable.",
+                retry_after=self.breakers[provider.name].retry_after()))
+        return provider
+
+    def busy(self):
+        self.reject('bulkhead_full', GatewayBusy(
+            f"Too many payment gateway calls in flight ({self.bulkhead.size}).", retry_after=1))
+
+    def call(self, operation, *args, **kwargs):
+        provider = None
+        for attempt in itertools.count():
+            if not self.bulkhead.acquire():
+                self.busy()
+            try:
+                provider = self.provider_for(operation, provider)
+                started = self.clock()
+                try:
+                    with call_timeout(self.timeouts.get(base_operation(operation))):
+                        result = getattr(provider, operation)(*args, **kwargs)
+                except Exception as e:
+                    self.observe(provider, self.clock() - started, e)
+                    delay = self.retry_delay(provider, attempt, e, kwargs)
+                    if delay is None:
+                        raise
+                else:
+                    self.observe(provider, self.clock() - started)
+                    return result
+            finally:
+                self.bulkhead.release()
+            time.sleep(delay)
+
+    async def acall(self, operation, *args, **kwargs):
+        provider = None
+        for attempt in itertools.count():
+            if not await self.bulkhead.aacquire():
+                self.busy()
+            try:
+                provider = self.provider_for(operation, provider)
+                started = self.clock()
+                try:
+                    with call_timeout(self.timeouts.get(base_operation(operation))):
+                        result = await getattr(provider, operation)(*args, **kwargs)
+                except Exception as e:
+                    self.observe(provider, self.clock() - started, e)
+                    delay = self.retry_delay(provider, attempt, e, kwargs)
+                    if delay is None:
+                        raise
+                else:
+                    self.observe(provider, self.clock() - started)
+                    return result
+            finally:
+                self.bulkhead.release()
+            await asyncio.sleep(delay)
+
+    def snapshot(self):
+        with self._lock:
+            return {
+                provider.name: {
+                    'score': self.score(provider),
+                    'latency_ms': None if self.stats[provider.name].latency is None
+                    else round(self.stats[provider.name].latency * 1000, 3),
+                    'error_rate': round(self.stats[provider.name].error_rate, 4),
+                    'calls': self.stats[provider.name].calls,
+                    'failures': self.stats[provider.name].failures,
+                    'retries': self.stats[provider.name].retries,
+                    **self.breakers[provider.name].stats(),
+                }
+                for provider in self.providers
+            }
+
+    def counters(self):
+        with self._lock:
+            return {'rejections': dict(self.rejections), 'bulkhead_in_use': self.bulkhead.in_use,
+                    'bulkhead_size': self.bulkhead.size}
+
+
+_router = None
+_router_lock = threading.Lock()
+
+
+def get_router() -> Router:
+    global _router
+    if _router is None:
+        with _router_lock:
+            if _router is None:
+                _router = Router.from_settings()
+    return _router
+
+
+@receiver(setting_changed)
+def reset_router(setting, **kwargs):
+    global _router
+    if setting == 'PAYFLOW_GATEWAYS':
+        _router = None
+
+
+def create_payment_intent(params, **options):
+    return get_router().call('create_payment_intent', params, **options)
+
+
+async def acreate_payment_intent(params, **options):
+    return await get_router().acall('acreate_payment_intent', params, **options)
+
+
+def create_payment_link(params, **options):
+    return get_router().call('create_payment_link', params, **options)
+
+
+async def acreate_payment_link(params, **options):
+    return await get_router().acall('acreate_payment_link', params, **options)
+
+
+def create_checkout_session(params, **options):
+    return get_router().call('create_checkout_session', params, **options)
+
+
+async def acreate_checkout_session(params, **options):
+    return await get_router().acall('acreate_checkout_session', params, **options)
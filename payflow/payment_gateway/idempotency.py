@@ -0,0 +1,220 @@
+"""
+``Idempotency-Key`` support for the payment endpoints.
+
+The first request with a given key runs normally, and its response is stored
+under the key, with a fingerprint of the request, for ``TTL`` seconds. A retry
+with the same key and body gets the stored response back without reaching
+Stripe or the database. Reusing a key for a different request is rejected
+with 422. A retry that arrives while the first request is still running gets
+409. Server errors are not stored, so those requests can be retried.
+
+The in-progress lock expires after ``LOCK_TTL`` seconds, so that a worker that
+dies mid-request does not block the key for good, but it is refreshed every
+third of that while the request runs: a slow request (a large batch waiting
+on gateway timeouts, retries and the bulkhead) keeps its lock until its
+response has replaced it.
+
+Keys are scoped to the caller (its API key or authenticated user) and the
+``merchant_id`` of the request, so two clients that happen to send the same
+key never see each other's responses.
+
+The (scoped) key is also forwarded to Stripe as ``idempotency_key``, so a retry after a
+response was lost never creates a second Stripe object.
+
+``idempotent`` wraps the ``StripePaymentView`` actions and ``aidempotent``
+the async payment views; both store and replay the same way.
+
+Responses live in the Django cache named by ``PAYFLOW_IDEMPOTENCY['CACHE']``:
+local memory by default, or Redis when ``PAYFLOW_REDIS_URL`` is set.
+"""
+import contextvars
+import hashlib
+import json
+import threading
+from contextlib import contextmanager
+from functools import wraps
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.core.cache import caches
+from django.http import JsonResponse
+from rest_framework import status
+from rest_framework.response import Response
+from rest_framework.utils.encoders import JSONEncoder
+
+from .principals import digest, request_principal
+
+HEADER = 'Idempotency-Key'
+REPLAYED_HEADER = 'Idempotent-Replayed'
+IN_PROGRESS = 'in_progress'
+MAX_KEY_LENGTH = 255
+
+DEFAULTS = {
+    'CACHE': 'default',
+    'TTL': 24 * 60 * 60,
+    'LOCK_TTL': 60,
+}
+
+_current_key = contextvars.ContextVar('payflow_idempotency_key', default=None)
+
+
+def idempotency_settings():
+    return {**DEFAULTS, **getattr(settings, 'PAYFLOW_IDEMPOTENCY', {})}
+
+
+def get_cache():
+    return caches[idempotency_settings()['CACHE']]
+
+
+def fingerprint(method, path, data) -> str:
+    body = json.dumps(data, sort_keys=True, cls=JSONEncoder)
+    return hashlib.sha256(f"{method}:{path}:{body}".encode('utf-8')).hexdigest()
+
+
+def scope(request, data, user=None) -> str:
+    """The namespace of a caller's keys: its principal and the request's merchant."""
+    merchant_id = data.get('merchant_id') if isinstance(data, dict) else None
+    return digest(f"{request_principal(request, user) or 'anonymous'}:{merchant_id or ''}")
+
+
+def stripe_options(suffix=None) -> dict:
+    """Keyword arguments forwarding the current request's key to a Stripe create call."""
+    key = _current_key.get()
+    if key is None:
+        return {}
+    return {'idempotency_key': key if suffix is None else f"{key}:{suffix}"}
+
+
+class LockRefresher(threading.Thread):
+    """Keep an in-progress lock from expiring until ``stop`` is called."""
+
+    def __init__(self, cache, cache_key, ttl):
+        super().__init__(name='payflow-idempotency-lock', daemon=True)
+        self.cache = cache
+        self.cache_key = cache_key
+        self.ttl = ttl
+        self._stopped = threading.Event()
+
+    def run(self):
+        while not self._stopped.wait(self.ttl / 3):
+            self.cache.touch(self.cache_key, self.ttl)
+
+    def stop(self):
+        """Stop refreshing; once this returns no refresh can overwrite what is stored next."""
+        self._stopped.set()
+        self.join()
+
+
+class IdempotentRequest:
+    """A request's use of its key: claim the key, or answer from what is stored under it."""
+
+    def __init__(self, request, key, data, user=None):
+        self.config = idempotency_settings()
+        self.cache = get_cache()
+        self.cache_key = f"payflow:idempotency:{scope(request, data, user)}:{request.path}:{key}"
+        self.fingerprint = fingerprint(request.method, request.path, data)
+
+    def claim(self):
+        """None once the key is claimed for this request, else the ``(status, data, headers)`` to answer with."""
+        if self.cache.add(self.cache_key, {'state': IN_PROGRESS, 'fingerprint': self.fingerprint},
+                          self.config['LOCK_TTL']):
+            return None
+        stored = self.cache.get(self.cache_key)
+        if stored is None:
+            return status.HTTP_409_CONFLICT, "A request with this key just expired; retry.", {}
+        if stored['fingerprint'] != self.fingerprint:
+            return status.HTTP_422_UNPROCESSABLE_ENTITY, f"{HEADER} was already used for a different request.", {}
+        if stored['state'] == IN_PROGRESS:
+            return status.HTTP_409_CONFLICT, "A request with this key is still being processed.", {}
+        return stored['status'], stored['data'], {REPLAYED_HEADER: 'true'}
+
+    @contextmanager
+    def running(self):
+        """Hold the claimed key while the view runs; release it if the view raises."""
+        # Stripe dedups keys account-wide, so the forwarded key is scoped too
+        token = _current_key.set(digest(self.cache_key))
+        refresher = LockRefresher(self.cache, self.cache_key, self.config['LOCK_TTL'])
+        refresher.start()
+        try:
+            yield
+        except BaseException:
+            refresher.stop()
+            self.cache.delete(self.cache_key)
+            raise
+        finally:
+            _current_key.reset(token)
+        refresher.stop()
+
+    def finish(self, status_code, data):
+        """Store the response in place of the lock; server errors are dropped so they can be retried."""
+        if status_code >= 500:
+            self.cache.delete(self.cache_key)
+        else:
+            self.cache.set(self.cache_key, {
+                'state': 'done',
+                'fingerprint': self.fingerprint,
+                'status': status_code,
+                # Store plain JSON types so any cache backend can hold it
+                'data': json.loads(json.dumps(data, cls=JSONEncoder)),
+            }, self.config['TTL'])
+
+
+def too_long(key):
+    return len(key) > MAX_KEY_LENGTH
+
+
+def idempotent(view_method):
+    """Make a ViewSet action honour the ``Idempotency-Key`` header."""
+    @wraps(view_method)
+    def wrapper(self, request, *args, **kwargs):
+        key = request.headers.get(HEADER)
+        if not key:
+            return view_method(self, request, *args, **kwargs)
+        if too_long(key):
+            return Response(status=status.HTTP_400_BAD_REQUEST,
+                            data=f"{HEADER} must be at most {MAX_KEY_LENGTH} characters.")
+
+        idempotent_request = IdempotentRequest(request, key, request.data, request.user)
+        answer = idempotent_request.claim()
+        if answer is not None:
+            status_code, data, headers = answer
+            return Response(status=status_code, data=data, headers=headers)
+        with idempotent_request.running():
+            response = view_method(self, request, *args, **kwargs)
+        idempotent_request.finish(response.status_code, response.data)
+        return response
+    return wrapper
+
+
+def request_data(request):
+    """The JSON or form body of a plain Django request."""
+    if request.content_type == 'application/json':
+        try:
+            return json.loads(request.body or b'{}')
+        except ValueError:
+            return {}
+    return request.POST
+
+
+def aidempotent(view):
+    """``idempotent`` for the async function views, which return ``JsonResponse``."""
+    @wraps(view)
+    async def wrapper(request, *args, **kwargs):
+        key = request.headers.get(HEADER)
+        if not key:
+            return await view(request, *args, **kwargs)
+        if too_long(key):
+            return JsonResponse(f"{HEADER} must be at most {MAX_KEY_LENGTH} characters.",
+                                status=status.HTTP_400_BAD_REQUEST, safe=False)
+
+        user = await request.auser() if hasattr(request, 'auser') else None
+        idempotent_request = IdempotentRequest(request, key, request_data(request), user)
+        answer = await sync_to_async(idempotent_request.claim)()
+        if answer is not None:
+            status_code, data, headers = answer
+            return JsonResponse(data, status=status_code, safe=False, headers=headers)
+        with idempotent_request.running():
+            response = await view(request, *args, **kwargs)
+        await sync_to_async(idempotent_request.finish)(response.status_code, json.loads(response.content))
+        return response
+    return wrapper
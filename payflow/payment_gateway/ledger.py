@@ -0,0 +1,119 @@
+"""
+Balance ledger.
+
+Every balance change is appended to ``BalanceEntry`` and applied to the
+materialized balance in the same database transaction. Ordinary accounts are
+updated with a single-column ``UPDATE ... SET balance = balance + x``. Accounts
+listed in ``PAYFLOW_HOT_ACCOUNTS`` take so many concurrent credits that even
+that row lock serializes them, so their credits go to one of
+``PAYFLOW_BALANCE_SHARDS`` sub-rows and are rolled up periodically.
+"""
+import logging
+import random
+from collections import defaultdict
+from decimal import Decimal
+
+from django.conf import settings
+from django.db import IntegrityError, transaction
+from django.db.models import F, Sum
+from django.utils import timezone
+
+from .models import BalanceEntry, BalanceShard, User
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_SHARDS = 8
+
+
+def shard_count() -> int:
+    return getattr(settings, 'PAYFLOW_BALANCE_SHARDS', DEFAULT_SHARDS)
+
+
+def is_hot_account(user_id) -> bool:
+    return user_id in getattr(settings, 'PAYFLOW_HOT_ACCOUNTS', ())
+
+
+def _credit_shard(user_id, amount):
+    shard = random.randrange(shard_count())
+    shards = BalanceShard.objects.filter(user_id=user_id, shard=shard)
+    if shards.update(amount=F('amount') + amount):
+        return
+    try:
+        with transaction.atomic():
+            BalanceShard.objects.create(user_id=user_id, shard=shard, amount=amount)
+    except IntegrityError:
+        # Another writer created the shard row first.
+        shards.update(amount=F('amount') + amount)
+
+
+def credit(user_id, amount, transaction_record=None) -> BalanceEntry:
+    """
+    Record ``amount`` against ``user_id`` and apply it to the balance.
+
+    Runs in (or joins) a database transaction, so when called while a payment
+    is being recorded the ledger write commits or rolls back with it.
+    """
+    amount = Decimal(amount)
+    with transaction.atomic():
+        entry = BalanceEntry.objects.create(user_id=user_id, transaction=transaction_record, amount=amount)
+        if is_hot_account(user_id):
+            _credit_shard(user_id, amount)
+        else:
+            User.objects.filter(pk=user_id).update(balance=F('balance') + amount, updated_at=timezone.now())
+    return entry
+
+
+def credit_many(credits) -> list:
+    """
+    Apply many ``(user_id, amount, transaction_record)`` credits at once.
+
+    Entries are bulk inserted and each account's balance is updated once with
+    the sum of its credits, in user id order so concurrent batches lock rows
+    in the same order.
+    """
+    entries = [
+        BalanceEntry(user_id=user_id, transaction=transaction_record, amount=Decimal(amount))
+        for user_id, amount, transaction_record in credits
+    ]
+    totals = defaultdict(Decimal)
+    for entry in entries:
+        totals[entry.user_id] += entry.amount
+    with transaction.atomic():
+        BalanceEntry.objects.bulk_create(entries)
+        now = timezone.now()
+        for user_id in sorted(totals):
+            if is_hot_account(user_id):
+                _credit_shard(user_id, totals[user_id])
+            else:
+                User.objects.filter(pk=user_id).update(balance=F('balance') + totals[user_id], updated_at=now)
+    return entries
+
+
+def get_balance(user_id) -> Decimal:
+    """Current balance including credits not yet rolled up from shards."""
+    balance = User.objects.filter(pk=user_id).values_list('balance', flat=True).first() or Decimal('0')
+    pending = BalanceShard.objects.filter(user_id=user_id).aggregate(total=Sum('amount'))['total']
+    return balance + (pending or Decimal('0'))
+
+
+def rollup(user_ids=None) -> int:
+    """Fold shard balances into ``User.balance``. Returns the number of accounts updated."""
+    shards = BalanceShard.objects.exclude(amount=0)
+    if user_ids is not None:
+        shards = shards.filter(user_id__in=user_ids)
+    updated = 0
+    for user_id in shards.values_list('user_id', flat=True).distinct():
+        with transaction.atomic():
+            locked = list(BalanceShard.objects.select_for_update().filter(user_id=user_id).exclude(amount=0))
+            total = sum((shard.amount for shard in locked), Decimal('0'))
+            if not total:
+                continue
+            # Subtract what was read rather than zeroing, in case a credit
+            # landed on a shard on a backend without row locks.
+            for shard in locked:
+                BalanceShard.objects.filter(pk=shard.pk).update(amount=F('amount') - shard.amount)
+            User.objects.filter(pk=user_id).update(balance=F('balance') + total, updated_at=timezone.now())
+            updated += 1
+    if updated:
+        logger.info("Rolled up balance shards for %s accounts", updated)
+    return updated
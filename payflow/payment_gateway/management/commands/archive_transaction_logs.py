@@ -0,0 +1,20 @@
+from django.core.management.base import BaseCommand
+
+from payment_gateway import archive
+
+
+class Command(BaseCommand):
+    help = ("Move transaction logs older than the retention window into monthly archive files. "
+            "Safe to interrupt and run again.")
+
+    def add_arguments(self, parser):
+        parser.add_argument('--older-than-days', type=int, default=None,
+                            help="Retention in days (defaults to PAYFLOW_LOG_ARCHIVE['MAX_AGE_DAYS']).")
+        parser.add_argument('--batch-size', type=int, default=None,
+                            help="Rows per batch (defaults to PAYFLOW_LOG_ARCHIVE['BATCH_SIZE']).")
+        parser.add_argument('--limit', type=int, default=None, help="Stop after archiving this many rows.")
+
+    def handle(self, *args, **options):
+        archived = archive.archive_old_logs(max_age_days=options['older_than_days'],
+                                            batch_size=options['batch_size'], limit=options['limit'])
+        self.stdout.write(self.style.SUCCESS(f"Archived {archived} transaction logs"))
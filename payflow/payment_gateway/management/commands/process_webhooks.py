@@ -0,0 +1,59 @@
+import multiprocessing
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from django.db import connections
+
+from payment_gateway import webhooks
+from payment_gateway.views import StripeWebhookView
+
+
+def _worker(batch_size, poll_interval, visibility_timeout, once):
+    # Each worker process opens its own database connections after the fork.
+    connections.close_all()
+    webhooks.run_worker(
+        StripeWebhookView().handle_event,
+        batch_size=batch_size,
+        poll_interval=poll_interval,
+        visibility_timeout=visibility_timeout,
+        once=once,
+    )
+
+
+class Command(BaseCommand):
+    help = "Drain the webhook inbox with a pool of worker processes."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--workers', type=int, default=getattr(settings, 'PAYFLOW_WEBHOOK_WORKERS', 1))
+        parser.add_argument('--batch-size', type=int, default=getattr(settings, 'PAYFLOW_WEBHOOK_BATCH_SIZE', webhooks.DEFAULT_BATCH_SIZE))
+        parser.add_argument('--poll-interval', type=float, default=1.0, help="Seconds to sleep when the inbox is empty.")
+        parser.add_argument('--visibility-timeout', type=int, default=webhooks.DEFAULT_VISIBILITY_TIMEOUT,
+                            help="Seconds after which an unfinished claim is handed to another worker.")
+        parser.add_argument('--once', action='store_true', help="Exit once the inbox is empty.")
+
+    def handle(self, *args, **options):
+        worker_args = (options['batch_size'], options['poll_interval'], options['visibility_timeout'], options['once'])
+        if options['workers'] <= 1:
+            processed = webhooks.run_worker(
+                StripeWebhookView().handle_event,
+                batch_size=options['batch_size'],
+                poll_interval=options['poll_interval'],
+                visibility_timeout=options['visibility_timeout'],
+                once=options['once'],
+            )
+            self.stdout.write(self.style.SUCCESS(f"Processed {processed} webhook events"))
+            return
+
+        # Connections must not be shared across forked processes.
+        connections.close_all()
+        context = multiprocessing.get_context('fork')
+        processes = [context.Process(target=_worker, args=worker_args) for _ in range(options['workers'])]
+        for process in processes:
+            process.start()
+        try:
+            for process in processes:
+                process.join()
+        except KeyboardInterrupt:
+            for process in processes:
+                process.terminate()
+        self.stdout.write(self.style.SUCCESS(f"{len(processes)} webhook workers exited"))
@@ -0,0 +1,15 @@
+from django.core.management.base import BaseCommand
+
+from payment_gateway.dedup import processed_events
+
+
+class Command(BaseCommand):
+    help = "Delete processed webhook event ids older than the retention window."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--ttl', type=int, default=None,
+                            help="Retention in seconds (defaults to PAYFLOW_PROCESSED_EVENT_TTL).")
+
+    def handle(self, *args, **options):
+        deleted = processed_events.prune(options['ttl'])
+        self.stdout.write(self.style.SUCCESS(f"Pruned {deleted} processed events"))
@@ -0,0 +1,29 @@
+from django.core.management.base import BaseCommand, CommandError
+from rest_framework.exceptions import ValidationError
+
+from payment_gateway import rollups
+from payment_gateway.exports import parse_boundary
+
+
+class Command(BaseCommand):
+    help = "Recompute transaction rollups from the transactions table."
+
+    def add_arguments(self, parser):
+        group = parser.add_mutually_exclusive_group()
+        group.add_argument('--since', help="Rebuild buckets from this date on "
+                                           "(defaults to PAYFLOW_ROLLUPS['REBUILD_DAYS'] days ago).")
+        group.add_argument('--full', action='store_true', help="Rebuild every bucket.")
+
+    def handle(self, *args, **options):
+        if options['full']:
+            since = None
+        elif options['since']:
+            try:
+                since = parse_boundary(options['since'])
+            except ValidationError:
+                raise CommandError("--since must be an ISO date or datetime")
+        else:
+            since = rollups.default_watermark()
+        written = rollups.rebuild(since)
+        start = 'the beginning' if since is None else f"{since:%Y-%m-%d}"
+        self.stdout.write(self.style.SUCCESS(f"Rebuilt {written} rollup rows from {start}"))
@@ -0,0 +1,59 @@
+import gzip
+import sys
+
+from django.core.management.base import BaseCommand, CommandError
+from rest_framework.exceptions import ValidationError
+
+from payment_gateway import reconciliation
+from payment_gateway.exports import parse_boundary
+
+
+class Command(BaseCommand):
+    help = ("Reconcile transactions against a Stripe balance transaction CSV export, "
+            "logging every discrepancy as a reconciliation transaction log.")
+
+    def add_arguments(self, parser):
+        parser.add_argument('export', help="CSV export, optionally gzipped; '-' reads stdin.")
+        parser.add_argument('--chunk-size', type=int, default=None,
+                            help="Export rows per chunk (defaults to PAYFLOW_RECONCILIATION_CHUNK_SIZE).")
+        parser.add_argument('--amount-unit', choices=['major', 'cents'], default='major',
+                            help="Whether export amounts are in major units (10.00) or cents (1000).")
+        for name, column in reconciliation.DEFAULT_COLUMNS.items():
+            parser.add_argument(f'--{name}-column', default=column, help=f"Export column for the {name}.")
+        parser.add_argument('--start', help="Window for missing-in-export checks (defaults to the export's).")
+        parser.add_argument('--end')
+        parser.add_argument('--report', help="Write every discrepancy to this CSV file.")
+        parser.add_argument('--dry-run', action='store_true', help="Report without writing transaction logs.")
+
+    def handle(self, *args, **options):
+        try:
+            start = parse_boundary(options['start']) if options['start'] else None
+            end = parse_boundary(options['end'], end=True) if options['end'] else None
+        except ValidationError:
+            raise CommandError("--start and --end must be ISO dates or datetimes")
+        columns = {name: options[f'{name}_column'] for name in reconciliation.DEFAULT_COLUMNS}
+
+        report = open(options['report'], 'w', newline='') if options['report'] else None
+        path = options['export']
+        if path == '-':
+            export = sys.stdin
+        elif path.endswith('.gz'):
+            export = gzip.open(path, 'rt', newline='')
+        else:
+            export = open(path, newline='')
+        try:
+            result = reconciliation.reconcile(export, columns=columns, amount_unit=options['amount_unit'],
+                                              chunk_size=options['chunk_size'], start=start, end=end,
+                                              dry_run=options['dry_run'], report=report)
+        except ValueError as e:
+            raise CommandError(str(e))
+        finally:
+            if export is not sys.stdin:
+                export.close()
+            if report is not None:
+                report.close()
+
+        for name, count in result.as_dict().items():
+            self.stdout.write(f"{name:<18}{count:>12}")
+        verb = "Would write" if options['dry_run'] else "Wrote"
+        self.stdout.write(self.style.SUCCESS(f"{verb} {result.corrections} reconciliation logs"))
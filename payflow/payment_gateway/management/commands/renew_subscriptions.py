@@ -0,0 +1,48 @@
+import multiprocessing
+
+from django.core.management.base import BaseCommand
+from django.db import connections
+
+from payment_gateway import renewals
+
+
+def _worker(batch_size, concurrency, poll_interval, once):
+    # Each worker process opens its own database connections after the fork.
+    connections.close_all()
+    renewals.run_worker(batch_size=batch_size, concurrency=concurrency, poll_interval=poll_interval, once=once)
+
+
+class Command(BaseCommand):
+    help = "Renew due subscriptions in batches with a pool of worker processes."
+
+    def add_arguments(self, parser):
+        options = renewals.renewal_settings()
+        parser.add_argument('--workers', type=int, default=1)
+        parser.add_argument('--batch-size', type=int, default=options['BATCH_SIZE'])
+        parser.add_argument('--concurrency', type=int, default=options['CONCURRENCY'],
+                            help="Stripe calls in flight per worker.")
+        parser.add_argument('--poll-interval', type=float, default=60.0,
+                            help="Seconds to sleep when nothing is due.")
+        parser.add_argument('--once', action='store_true', help="Exit once nothing is due.")
+
+    def handle(self, *args, **options):
+        worker_args = (options['batch_size'], options['concurrency'], options['poll_interval'], options['once'])
+        if options['workers'] <= 1:
+            totals = renewals.run_worker(*worker_args)
+            self.stdout.write(self.style.SUCCESS(
+                f"Renewed {totals['renewed']} subscriptions, {totals['failed']} failed, {totals['expired']} expired"))
+            return
+
+        # Connections must not be shared across forked processes.
+        connections.close_all()
+        context = multiprocessing.get_context('fork')
+        processes = [context.Process(target=_worker, args=worker_args) for _ in range(options['workers'])]
+        for process in processes:
+            process.start()
+        try:
+            for process in processes:
+                process.join()
+        except KeyboardInterrupt:
+            for process in processes:
+                process.terminate()
+        self.stdout.write(self.style.SUCCESS(f"{len(processes)} renewal workers exited"))
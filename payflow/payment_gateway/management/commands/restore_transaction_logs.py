@@ -0,0 +1,25 @@
+from datetime import datetime
+
+from django.core.management.base import BaseCommand, CommandError
+
+from payment_gateway import archive
+
+
+class Command(BaseCommand):
+    help = "Move archived transaction logs back into the transaction log table."
+
+    def add_arguments(self, parser):
+        group = parser.add_mutually_exclusive_group(required=True)
+        group.add_argument('--transaction', type=int, help="Restore the logs of this transaction id.")
+        group.add_argument('--month', help="Restore every log archived for this month (YYYY-MM).")
+
+    def handle(self, *args, **options):
+        if options['transaction'] is not None:
+            restored = archive.restore_transaction(options['transaction'])
+        else:
+            try:
+                month = datetime.strptime(options['month'], '%Y-%m').date()
+            except ValueError:
+                raise CommandError("--month must look like YYYY-MM")
+            restored = archive.restore_month(month)
+        self.stdout.write(self.style.SUCCESS(f"Restored {restored} transaction logs"))
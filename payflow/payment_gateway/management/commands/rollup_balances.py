@@ -0,0 +1,21 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from payment_gateway import ledger
+
+
+class Command(BaseCommand):
+    help = "Fold sharded hot-account balance credits into User.balance."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--interval', type=float, default=None,
+                            help="Keep running, rolling up every INTERVAL seconds.")
+
+    def handle(self, *args, **options):
+        while True:
+            updated = ledger.rollup()
+            self.stdout.write(f"Rolled up {updated} accounts")
+            if options['interval'] is None:
+                return
+            time.sleep(options['interval'])
@@ -0,0 +1,171 @@
+"""
+Prometheus metrics in the text exposition format, served at ``/metrics``.
+
+Histograms live in process memory, so each worker reports its own requests;
+scrape every worker, or aggregate them with a sidecar, under a multi-process
+server.
+
+The endpoint is for the scraper and for staff: a request must carry
+``Authorization: Bearer <PAYFLOW_METRICS['TOKEN']>`` or come from a logged-in
+staff user. With no token configured only staff can read it.
+"""
+import bisect
+import hmac
+import threading
+
+from django.conf import settings
+from django.http import HttpResponse, HttpResponseForbidden
+
+from . import config_cache, gateways
+
+METRICS_PATH = '/metrics'
+CONTENT_TYPE = 'text/plain; version=0.0.4; charset=utf-8'
+
+DEFAULTS = {
+    'TOKEN': '',
+}
+
+LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+QUERY_BUCKETS = (0, 1, 2, 3, 5, 8, 13, 21, 34, 55, 89)
+
+
+def _format_labels(labels):
+    return ','.join(f'{name}="{_escape(value)}"' for name, value in labels)
+
+
+def _escape(value):
+    return str(value).replace('\\', r'\\').replace('\n', r'\n').replace('"', r'\"')
+
+
+def _format_value(value):
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class Histogram:
+    def __init__(self, name, documentation, labelnames, buckets):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self.buckets = tuple(buckets)
+        self._series = {}
+        self._lock = threading.Lock()
+
+    def observe(self, value, *labelvalues):
+        index = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            series = self._series.get(labelvalues)
+            if series is None:
+                series = self._series[labelvalues] = [[0] * len(self.buckets), 0.0, 0]
+            if index < len(self.buckets):
+                series[0][index] += 1
+            series[1] += value
+            series[2] += 1
+
+    def clear(self):
+        with self._lock:
+            self._series.clear()
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} histogram"]
+        with self._lock:
+            series = sorted((labels, (list(counts), total, count))
+                            for labels, (counts, total, count) in self._series.items())
+        for labelvalues, (counts, total, count) in series:
+            labels = list(zip(self.labelnames, labelvalues))
+            cumulative = 0
+            for bound, bucket_count in zip(self.buckets, counts):
+                cumulative += bucket_count
+                bucket_labels = _format_labels(labels + [('le', _format_value(float(bound)))])
+                lines.append(f"{self.name}_bucket{{{bucket_labels}}} {cumulative}")
+            lines.append(f"{self.name}_bucket{{{_format_labels(labels + [('le', '+Inf')])}}} {count}")
+            lines.append(f"{self.name}_sum{{{_format_labels(labels)}}} {_format_value(total)}")
+            lines.append(f"{self.name}_count{{{_format_labels(labels)}}} {count}")
+        return lines
+
+
+request_duration = Histogram(
+    'payflow_request_duration_seconds', 'Time to produce a response, for sampled requests.',
+    ('view', 'method'), LATENCY_BUCKETS)
+stage_duration = Histogram(
+    'payflow_request_stage_seconds', 'Time spent in each stage of a sampled request.',
+    ('view', 'stage'), LATENCY_BUCKETS)
+request_queries = Histogram(
+    'payflow_request_db_queries', 'Database queries made by a sampled request.',
+    ('view',), QUERY_BUCKETS)
+
+HISTOGRAMS = (request_duration, stage_duration, request_queries)
+
+
+def observe_request(view, method, total, durations, db_queries):
+    request_duration.observe(total, view, method)
+    for name, seconds in durations.items():
+        stage_duration.observe(seconds, view, name)
+    request_queries.observe(db_queries, view)
+
+
+def clear():
+    for histogram in HISTOGRAMS:
+        histogram.clear()
+
+
+def render_config_cache():
+    lines = []
+    stats = config_cache.stats()
+    for field in ('hits', 'misses', 'invalidations'):
+        name = f"payflow_config_cache_{field}_total"
+        lines += [f"# HELP {name} Config cache {field} in this worker.", f"# TYPE {name} counter"]
+        lines += [f'{name}{{cache="{cache}"}} {counters[field]}' for cache, counters in sorted(stats.items())]
+    return lines
+
+
+CIRCUIT_STATES = {'closed': 0, 'half_open': 1, 'open': 2}
+
+
+def render_gateways():
+    router = gateways.get_router()
+    providers = sorted(router.snapshot().items())
+    counters = router.counters()
+    lines = ["# HELP payflow_gateway_circuit_state Circuit breaker state: 0 closed, 1 half-open, 2 open.",
+             "# TYPE payflow_gateway_circuit_state gauge"]
+    lines += [f'payflow_gateway_circuit_state{{gateway="{_escape(name)}"}} {CIRCUIT_STATES[stats["state"]]}'
+              for name, stats in providers]
+    for field in ('calls', 'failures', 'retries'):
+        name = f"payflow_gateway_{field}_total"
+        lines += [f"# HELP {name} Gateway {field} in this worker.", f"# TYPE {name} counter"]
+        lines += [f'{name}{{gateway="{_escape(gateway)}"}} {stats[field]}' for gateway, stats in providers]
+    lines += ["# HELP payflow_gateway_rejections_total Gateway calls refused without being sent.",
+              "# TYPE payflow_gateway_rejections_total counter"]
+    lines += [f'payflow_gateway_rejections_total{{reason="{reason}"}} {count}'
+              for reason, count in sorted(counters['rejections'].items())]
+    lines += ["# HELP payflow_gateway_bulkhead_in_use Gateway calls in flight in this worker.",
+              "# TYPE payflow_gateway_bulkhead_in_use gauge",
+              f"payflow_gateway_bulkhead_in_use {counters['bulkhead_in_use']}"]
+    return lines
+
+
+def render() -> str:
+    lines = []
+    for histogram in HISTOGRAMS:
+        lines += histogram.render()
+    lines += render_config_cache()
+    lines += render_gateways()
+    return '\n'.join(lines) + '\n'
+
+
+def metrics_settings():
+    return {**DEFAULTS, **getattr(settings, 'PAYFLOW_METRICS', {})}
+
+
+def allowed(request) -> bool:
+    token = metrics_settings()['TOKEN']
+    scheme, _, credentials = request.headers.get('Authorization', '').partition(' ')
+    if token and scheme.lower() == 'bearer' and hmac.compare_digest(credentials.encode(), token.encode()):
+        return True
+    user = getattr(request, 'user', None)
+    return bool(user and user.is_active and user.is_staff)
+
+
+def metrics_view(request):
+    if not allowed(request):
+        return HttpResponseForbidden()
+    return HttpResponse(render(), content_type=CONTENT_TYPE)
@@ -0,0 +1,28 @@
+# Generated by Django 5.2.1 on 2026-10-18 12:48
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('payment_gateway', '0003_processedevent'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='transaction',
+            name='gateway_checkout_session_id',
+            field=models.CharField(blank=True, db_index=True, max_length=255),
+        ),
+        migrations.AddField(
+            model_name='transaction',
+            name='gateway_payment_intent_id',
+            field=models.CharField(blank=True, db_index=True, max_length=255),
+        ),
+        migrations.AddField(
+            model_name='transaction',
+            name='gateway_payment_link_id',
+            field=models.CharField(blank=True, db_index=True, max_length=255),
+        ),
+    ]
@@ -0,0 +1,93 @@
+from collections import defaultdict
+
+from django.db import migrations
+from django.db.models import Count, Min, OuterRef, Subquery
+
+# Keys that may carry gateway ids in TransactionLog.additional_info, per column.
+REFERENCE_KEYS = {
+    'gateway_payment_intent_id': ('payment_intent_id', 'payment_intent'),
+    'gateway_checkout_session_id': ('checkout_session_id', 'session_id'),
+    'gateway_payment_link_id': ('payment_link_id', 'payment_link'),
+}
+TOKEN_PREFIXES = {
+    'pi_': 'gateway_payment_intent_id',
+    'cs_': 'gateway_checkout_session_id',
+    'plink_': 'gateway_payment_link_id',
+}
+
+
+BATCH_SIZE = 1000
+
+
+def log_references(info):
+    references = {}
+    if isinstance(info, dict):
+        for field, keys in REFERENCE_KEYS.items():
+            for key in keys:
+                value = info.get(key)
+                if isinstance(value, str) and value:
+                    references[field] = value
+                    break
+    return references
+
+
+def write_references(Transaction, references):
+    """Write ``{transaction_id: {field: value}}``, one bulk UPDATE per set of fields."""
+    by_fields = defaultdict(list)
+    for transaction_id, fields in references.items():
+        by_fields[tuple(sorted(fields))].append(Transaction(pk=transaction_id, **fields))
+    for fields, transactions in by_fields.items():
+        Transaction.objects.bulk_update(transactions, fields, batch_size=BATCH_SIZE)
+
+
+def backfill_gateway_references(apps, schema_editor):
+    Transaction = apps.get_model('payment_gateway', 'Transaction')
+    TransactionLog = apps.get_model('payment_gateway', 'TransactionLog')
+    PaymentMethod = apps.get_model('payment_gateway', 'PaymentMethod')
+
+    # Logs are read in transaction order, so a transaction's references are
+    # complete once the next one starts and are written a batch at a time.
+    references = {}
+    logs = (
+        TransactionLog.objects
+        .exclude(additional_info=None)
+        .order_by('transaction_id', 'id')
+        .values_list('transaction_id', 'additional_info')
+    )
+    for transaction_id, info in logs.iterator(chunk_size=2000):
+        if transaction_id not in references and len(references) >= BATCH_SIZE:
+            write_references(Transaction, references)
+            references = {}
+        found = log_references(info)
+        if found:
+            fields = references.setdefault(transaction_id, {})
+            for field, value in found.items():
+                fields.setdefault(field, value)
+    write_references(Transaction, references)
+
+    # Older code matched transactions through the payment method token, which
+    # was sometimes a session or intent id. Only trust it when the payment
+    # method belongs to a single transaction, and where the logs gave nothing.
+    token = Subquery(PaymentMethod.objects.filter(pk=OuterRef('payment_method_id'))
+                     .values('gateway_payment_method_token')[:1])
+    for prefix, field in TOKEN_PREFIXES.items():
+        single_use = (
+            Transaction.objects
+            .filter(payment_method__gateway_payment_method_token__startswith=prefix)
+            .values('payment_method_id')
+            .annotate(transactions=Count('id'), transaction_id=Min('id'))
+            .filter(transactions=1)
+            .values('transaction_id')
+        )
+        Transaction.objects.filter(pk__in=single_use, **{field: ''}).update(**{field: token})
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('payment_gateway', '0004_transaction_gateway_references'),
+    ]
+
+    operations = [
+        migrations.RunPython(backfill_gateway_references, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,53 @@
+# Generated by Django 5.2.1 on 2026-10-18 12:50
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('payment_gateway', '0006_access_pattern_indexes'),
+    ]
+
+    operations = [
+        migrations.RemoveIndex(
+            model_name='transaction',
+            name='transaction_user_idx',
+        ),
+        migrations.RemoveIndex(
+            model_name='transaction',
+            name='transaction_merchant_idx',
+        ),
+        migrations.RemoveIndex(
+            model_name='transaction',
+            name='transaction_created_idx',
+        ),
+        migrations.RemoveIndex(
+            model_name='transactionlog',
+            name='txnlog_transaction_idx',
+        ),
+        migrations.RemoveIndex(
+            model_name='transactionlog',
+            name='txnlog_created_idx',
+        ),
+        migrations.AddIndex(
+            model_name='transaction',
+            index=models.Index(fields=['user', '-created_at', '-id'], name='transaction_user_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='transaction',
+            index=models.Index(fields=['merchant', '-created_at', '-id'], name='transaction_merchant_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='transaction',
+            index=models.Index(fields=['-created_at', '-id'], name='transaction_created_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='transactionlog',
+            index=models.Index(fields=['transaction', 'created_at', 'id'], name='txnlog_transaction_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='transactionlog',
+            index=models.Index(fields=['-created_at', '-id'], name='txnlog_created_idx'),
+        ),
+    ]
@@ -0,0 +1,39 @@
+# Generated by Django 5.2.1 on 2026-10-18 13:35
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('payment_gateway', '0008_balance_ledger'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='LogArchive',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('month', models.DateField(unique=True)),
+                ('path', models.CharField(max_length=255)),
+                ('size', models.BigIntegerField(default=0)),
+                ('row_count', models.PositiveIntegerField(default=0)),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+            ],
+        ),
+        migrations.CreateModel(
+            name='ArchivedLog',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('log_id', models.BigIntegerField(unique=True)),
+                ('transaction_id', models.BigIntegerField()),
+                ('created_at', models.DateTimeField()),
+                ('offset', models.BigIntegerField()),
+                ('archive', models.ForeignKey(on_delete=django.db.models.deletion.PROTECT, related_name='entries', to='payment_gateway.logarchive')),
+            ],
+            options={
+                'indexes': [models.Index(fields=['transaction_id', 'created_at'], name='archivedlog_transaction_idx')],
+            },
+        ),
+    ]
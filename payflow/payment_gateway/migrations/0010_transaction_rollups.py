@@ -0,0 +1,29 @@
+# Generated by Django 5.2.1 on 2026-10-18 13:38
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('payment_gateway', '0009_log_archive'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='TransactionRollup',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('grain', models.CharField(choices=[('hour', 'Hour'), ('day', 'Day')], max_length=4)),
+                ('scope', models.CharField(choices=[('merchant', 'Merchant'), ('user', 'User')], max_length=8)),
+                ('scope_id', models.BigIntegerField()),
+                ('bucket', models.DateTimeField()),
+                ('status', models.CharField(max_length=10)),
+                ('transaction_count', models.BigIntegerField(default=0)),
+                ('amount', models.DecimalField(decimal_places=2, default=0, max_digits=16)),
+            ],
+            options={
+                'constraints': [models.UniqueConstraint(fields=('grain', 'scope', 'scope_id', 'bucket', 'status'), name='transactionrollup_key_uniq')],
+            },
+        ),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 5.2.1 on 2026-10-18 13:43
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('payment_gateway', '0010_transaction_rollups'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='transactionlog',
+            name='log_type',
+            field=models.CharField(choices=[('initiated', 'Initiated'), ('authorized', 'Authorized'), ('captured', 'Captured'), ('refunded', 'Refunded'), ('failed', 'Failed'), ('voided', 'Voided'), ('partially_refunded', 'Partially Refunded'), ('partially_voided', 'Partially Voided'), ('chargeback', 'Chargeback'), ('reversed', 'Reversed'), ('settled', 'Settled'), ('disputed', 'Disputed'), ('reconciliation', 'Reconciliation')], max_length=20),
+        ),
+    ]
@@ -0,0 +1,49 @@
+# Generated by Django 5.2.1 on 2026-10-18 13:58
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('payment_gateway', '0011_reconciliation_log_type'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='subscriptions',
+            name='amount',
+            field=models.DecimalField(decimal_places=2, default=0, max_digits=10),
+        ),
+        # Subscriptions from before renewals have no amount to charge, so they
+        # do not renew; only new ones default to renewing automatically.
+        migrations.AddField(
+            model_name='subscriptions',
+            name='auto_renew',
+            field=models.BooleanField(default=False),
+        ),
+        migrations.AlterField(
+            model_name='subscriptions',
+            name='auto_renew',
+            field=models.BooleanField(default=True),
+        ),
+        migrations.AddField(
+            model_name='subscriptions',
+            name='claimed_until',
+            field=models.DateTimeField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='subscriptions',
+            name='period_days',
+            field=models.PositiveIntegerField(default=30),
+        ),
+        migrations.AddField(
+            model_name='subscriptions',
+            name='renewal_attempts',
+            field=models.PositiveSmallIntegerField(default=0),
+        ),
+        migrations.AddIndex(
+            model_name='subscriptions',
+            index=models.Index(fields=['status', 'end_date'], name='subscription_due_idx'),
+        ),
+    ]
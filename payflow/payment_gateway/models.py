@@ -51,6 +51,13 @@ class PaymentMethod(models.Model):
     expiry_date = models.CharField(max_length=5, blank=True)
     card_brand = models.CharField(max_length=20, choices=CARD_BRANDS, blank=True)
     created_at = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['user', '-created_at'], name='paymentmethod_user_idx'),
+            models.Index(fields=['method_type', '-created_at'], name='paymentmethod_type_idx'),
+            models.Index(fields=['-created_at'], name='paymentmethod_created_idx'),
+        ]
     
     def __str__(self):
         return f"{self.get_method_type_display()} - {self.last_four_digits}"
@@ -67,8 +74,27 @@ class Transaction(models.Model):
     amount = models.DecimalField(max_digits=10, decimal_places=2)
     description = models.TextField(blank=True)
     status = models.CharField(max_length=10, choices=STATUS_CHOICES)
+    # Gateway object references, indexed for webhook and redirect lookups
+    gateway_payment_intent_id = models.CharField(max_length=255, blank=True, db_index=True)
+    gateway_checkout_session_id = models.CharField(max_length=255, blank=True, db_index=True)
+    gateway_payment_link_id = models.CharField(max_length=255, blank=True, db_index=True)
     created_at = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['user', '-created_at', '-id'], name='transaction_user_idx'),
+            models.Index(fields=['merchant', '-created_at', '-id'], name='transaction_merchant_idx'),
+            models.Index(fields=['status', 'created_at'], name='transaction_status_idx'),
+            models.Index(fields=['-created_at', '-id'], name='transaction_created_idx'),
+        ]
     
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        instance = super().from_db(db, field_names, values)
+        # Lets rollups see what a later save() changed
+        instance._loaded_values = dict(zip(field_names, values))
+        return instance
+
     def __str__(self):
         return f"Transaction {self.id} - {self.amount}"
 
@@ -86,6 +112,7 @@ class TransactionLog(models.Model):
         ('reversed', 'Reversed'),
         ('settled', 'Settled'),
         ('disputed', 'Disputed'),
+        ('reconciliation', 'Reconciliation'),
     ]
     
     transaction = models.ForeignKey(Transaction, on_delete=models.CASCADE, related_name='logs')
@@ -96,6 +123,13 @@ class TransactionLog(models.Model):
     payment_method = models.ForeignKey(PaymentMethod, on_delete=models.CASCADE, null=True, blank=True, related_name='transaction_logs')
     additional_info = models.JSONField(null=True, blank=True)
     created_at = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['transaction', 'created_at', 'id'], name='txnlog_transaction_idx'),
+            models.Index(fields=['log_type', 'created_at'], name='txnlog_type_idx'),
+            models.Index(fields=['-created_at', '-id'], name='txnlog_created_idx'),
+        ]
     
     def __str__(self):
         return f"Log for Transaction {self.transaction.id}"
@@ -128,6 +162,163 @@ class Subscriptions(models.Model):
         choices=STATUS_CHOICES, 
         default='active'
     )
+    # Renewal terms and state, see payment_gateway/renewals.py
+    amount = models.DecimalField(max_digits=10, decimal_places=2, default=0)
+    period_days = models.PositiveIntegerField(default=30)
+    auto_renew = models.BooleanField(default=True)
+    renewal_attempts = models.PositiveSmallIntegerField(default=0)
+    claimed_until = models.DateTimeField(null=True, blank=True)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['user', 'status'], name='subscription_user_idx'),
+            models.Index(fields=['status', '-start_date'], name='subscription_status_idx'),
+            models.Index(fields=['-start_date'], name='subscription_start_idx'),
+            models.Index(fields=['status', 'end_date'], name='subscription_due_idx'),
+        ]
     
     def __str__(self) -> str:
-        return f"{self.plan_name} - {self.user.username}"
\ No newline at end of file
+        return f"{self.plan_name} - {self.user.username}"
+
+class WebhookEvent(models.Model):
+    """Durable inbox for verified gateway webhook events awaiting processing."""
+    STATUS_CHOICES = [
+        ('pending', 'Pending'),
+        ('processing', 'Processing'),
+        ('processed', 'Processed'),
+        ('failed', 'Failed'),
+    ]
+
+    event_id = models.CharField(max_length=255, db_index=True)
+    event_type = models.CharField(max_length=100)
+    payload = models.JSONField()
+    status = models.CharField(max_length=20, choices=STATUS_CHOICES, default='pending')
+    attempts = models.PositiveIntegerField(default=0)
+    last_error = models.TextField(blank=True)
+    received_at = models.DateTimeField(auto_now_add=True)
+    claimed_at = models.DateTimeField(null=True, blank=True)
+    processed_at = models.DateTimeField(null=True, blank=True)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['status', 'received_at']),
+        ]
+
+    def __str__(self) -> str:
+        return f"{self.event_type} - {self.event_id}"
+
+
+class ProcessedEvent(models.Model):
+    """Gateway event ids that have already been handled, used to drop redeliveries."""
+    event_id = models.CharField(max_length=255, unique=True)
+    event_type = models.CharField(max_length=100, blank=True)
+    processed_at = models.DateTimeField(auto_now_add=True, db_index=True)
+
+    def __str__(self) -> str:
+        return self.event_id
+
+
+class BalanceEntry(models.Model):
+    """Append-only ledger of every change to a user's balance."""
+    user = models.ForeignKey(User, on_delete=models.CASCADE, related_name='balance_entries')
+    transaction = models.ForeignKey(Transaction, on_delete=models.SET_NULL, null=True, blank=True, related_name='balance_entries')
+    amount = models.DecimalField(max_digits=12, decimal_places=2)
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['user', 'created_at'], name='balanceentry_user_idx'),
+        ]
+
+    def __str__(self) -> str:
+        return f"{self.user_id}: {self.amount}"
+
+
+class BalanceShard(models.Model):
+    """
+    Un-rolled-up balance deltas for hot accounts.
+
+    Credits to a hot account are spread over several shard rows so concurrent
+    payments do not all wait on the same row lock; ``rollup_balances`` folds
+    the shards back into ``User.balance``.
+    """
+    user = models.ForeignKey(User, on_delete=models.CASCADE, related_name='balance_shards')
+    shard = models.PositiveSmallIntegerField()
+    amount = models.DecimalField(max_digits=12, decimal_places=2, default=0)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['user', 'shard'], name='balanceshard_user_shard_uniq'),
+        ]
+
+    def __str__(self) -> str:
+        return f"{self.user_id}[{self.shard}]: {self.amount}"
+
+
+class LogArchive(models.Model):
+    """
+    A gzip file of archived TransactionLog rows for one calendar month.
+
+    The file is a series of gzip members, one per archiving batch. ``size``
+    is the length of the file that has been committed; anything past it was
+    left by an interrupted run and is truncated before the next append.
+    """
+    month = models.DateField(unique=True)
+    path = models.CharField(max_length=255)
+    size = models.BigIntegerField(default=0)
+    row_count = models.PositiveIntegerField(default=0)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    def __str__(self) -> str:
+        return self.path
+
+
+class ArchivedLog(models.Model):
+    """Index of archived TransactionLog rows: which archive member holds each one."""
+    log_id = models.BigIntegerField(unique=True)
+    transaction_id = models.BigIntegerField()
+    created_at = models.DateTimeField()
+    archive = models.ForeignKey(LogArchive, on_delete=models.PROTECT, related_name='entries')
+    offset = models.BigIntegerField()
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['transaction_id', 'created_at'], name='archivedlog_transaction_idx'),
+        ]
+
+    def __str__(self) -> str:
+        return f"Archived log {self.log_id}"
+
+
+class TransactionRollup(models.Model):
+    """
+    Count and amount of transactions per hour or day, merchant or user, and status.
+
+    Maintained incrementally by ``payment_gateway.rollups``; ``scope_id`` is 0
+    for transactions without a merchant.
+    """
+    GRAINS = [
+        ('hour', 'Hour'),
+        ('day', 'Day'),
+    ]
+    SCOPES = [
+        ('merchant', 'Merchant'),
+        ('user', 'User'),
+    ]
+
+    grain = models.CharField(max_length=4, choices=GRAINS)
+    scope = models.CharField(max_length=8, choices=SCOPES)
+    scope_id = models.BigIntegerField()
+    bucket = models.DateTimeField()
+    status = models.CharField(max_length=10)
+    transaction_count = models.BigIntegerField(default=0)
+    amount = models.DecimalField(max_digits=16, decimal_places=2, default=0)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['grain', 'scope', 'scope_id', 'bucket', 'status'],
+                                    name='transactionrollup_key_uniq'),
+        ]
+
+    def __str__(self) -> str:
+        return f"{self.scope} {self.scope_id} {self.grain} {self.bucket:%Y-%m-%d %H:00} {self.status}"
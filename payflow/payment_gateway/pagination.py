@@ -0,0 +1,131 @@
+"""
+Keyset (cursor) pagination on ``(created_at, id)``.
+
+Pages are selected with a range condition on the ordering key rather than an
+OFFSET, so fetching page 1000 costs the same index seek as fetching page 1.
+Cursors are opaque base64 tokens; clients follow the ``next`` and
+``previous`` links.
+"""
+import base64
+import json
+from collections import OrderedDict
+from datetime import datetime
+
+from django.conf import settings
+from django.db.models import Q
+from rest_framework.exceptions import NotFound
+from rest_framework.pagination import BasePagination
+from rest_framework.response import Response
+from rest_framework.utils.urls import remove_query_param, replace_query_param
+
+DEFAULT_PAGE_SIZE = 50
+DEFAULT_MAX_PAGE_SIZE = 500
+
+
+def _pagination_setting(name, default):
+    return getattr(settings, 'PAYFLOW_PAGINATION', {}).get(name, default)
+
+
+class KeysetPagination(BasePagination):
+    """Newest-first pagination over ``created_at`` with ``id`` as tie-breaker."""
+    cursor_query_param = 'cursor'
+    page_size_query_param = 'page_size'
+    invalid_cursor_message = 'Invalid cursor'
+
+    def get_page_size(self, request):
+        page_size = _pagination_setting('PAGE_SIZE', DEFAULT_PAGE_SIZE)
+        max_page_size = _pagination_setting('MAX_PAGE_SIZE', DEFAULT_MAX_PAGE_SIZE)
+        try:
+            requested = int(request.query_params[self.page_size_query_param])
+            if requested > 0:
+                page_size = requested
+        except (KeyError, ValueError):
+            pass
+        return min(page_size, max_page_size)
+
+    def encode_cursor(self, position, reverse):
+        created_at, pk = position
+        payload = json.dumps({'c': created_at.isoformat(), 'i': pk, 'r': int(reverse)}, separators=(',', ':'))
+        token = base64.urlsafe_b64encode(payload.encode('ascii')).decode('ascii')
+        return replace_query_param(self.base_url, self.cursor_query_param, token)
+
+    def decode_cursor(self, request):
+        token = request.query_params.get(self.cursor_query_param)
+        if not token:
+            return None
+        try:
+            payload = json.loads(base64.urlsafe_b64decode(token.encode('ascii')).decode('ascii'))
+            position = (datetime.fromisoformat(payload['c']), int(payload['i']))
+            return position, bool(payload.get('r'))
+        except (TypeError, ValueError, KeyError, UnicodeError):
+            raise NotFound(self.invalid_cursor_message)
+
+    @staticmethod
+    def get_position(item):
+        if isinstance(item, dict):
+            return item['created_at'], item['id']
+        return item.created_at, item.pk
+
+    def get_page_queryset(self, queryset, position, reverse, page_size):
+        """Return the query for the page after (or, if ``reverse``, before) ``position``."""
+        if position:
+            created_at, pk = position
+            # The leading range predicate lets the database seek straight to
+            # the cursor position in the (created_at, id) index.
+            if reverse:
+                queryset = queryset.filter(created_at__gte=created_at).filter(
+                    Q(created_at__gt=created_at) | Q(id__gt=pk))
+            else:
+                queryset = queryset.filter(created_at__lte=created_at).filter(
+                    Q(created_at__lt=created_at) | Q(id__lt=pk))
+        ordering = ('created_at', 'id') if reverse else ('-created_at', '-id')
+        # One extra row tells us whether another page follows.
+        return queryset.order_by(*ordering)[:page_size + 1]
+
+    def paginate_queryset(self, queryset, request, view=None):
+        self.request = request
+        self.base_url = remove_query_param(request.build_absolute_uri(), self.cursor_query_param)
+        self.page_size = self.get_page_size(request)
+        cursor = self.decode_cursor(request)
+        position, reverse = cursor if cursor else (None, False)
+
+        results = list(self.get_page_queryset(queryset, position, reverse, self.page_size))
+        has_more = len(results) > self.page_size
+        results = results[:self.page_size]
+
+        if reverse:
+            results.reverse()
+            self.has_next, self.has_previous = True, has_more
+        else:
+            self.has_next, self.has_previous = has_more, cursor is not None
+
+        self.page = results
+        return results
+
+    def get_next_link(self):
+        if not self.has_next or not self.page:
+            return None
+        return self.encode_cursor(self.get_position(self.page[-1]), reverse=False)
+
+    def get_previous_link(self):
+        if not self.has_previous or not self.page:
+            return None
+        return self.encode_cursor(self.get_position(self.page[0]), reverse=True)
+
+    def get_paginated_response(self, data):
+        return Response(OrderedDict([
+            ('next', self.get_next_link()),
+            ('previous', self.get_previous_link()),
+            ('results', data),
+        ]))
+
+    def get_paginated_response_schema(self, schema):
+        return {
+            'type': 'object',
+            'required': ['results'],
+            'properties': {
+                'next': {'type': 'string', 'nullable': True, 'format': 'uri'},
+                'previous': {'type': 'string', 'nullable': True, 'format': 'uri'},
+                'results': schema,
+            },
+        }
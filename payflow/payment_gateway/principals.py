@@ -0,0 +1,36 @@
+"""
+Who a request acts for.
+
+``request_principal`` names the caller by its API key (``X-Api-Key`` or
+``Authorization`` header), else by the authenticated user. Nothing checks
+the key, so a client can claim any key it likes: that is fine for keeping
+one caller's idempotency keys apart from another's, but anything a client
+must not be able to escape, such as a rate limit, uses
+``authenticated_principal`` instead. API keys are only ever used hashed, so
+they are not written to a shared cache in the clear.
+"""
+import hashlib
+
+
+def digest(value) -> str:
+    return hashlib.blake2b(str(value).encode(), digest_size=16).hexdigest()
+
+
+def api_key_digest(request):
+    api_key = request.headers.get('X-Api-Key') or request.headers.get('Authorization')
+    return digest(api_key) if api_key else None
+
+
+def authenticated_principal(user):
+    """``user:<pk>`` for an authenticated user, else None."""
+    if user is not None and user.is_authenticated:
+        return f"user:{user.pk}"
+    return None
+
+
+def request_principal(request, user=None):
+    """``key:<digest>`` or ``user:<pk>`` for the caller, or None for an anonymous one."""
+    api_key = api_key_digest(request)
+    if api_key:
+        return f"key:{api_key}"
+    return authenticated_principal(user)
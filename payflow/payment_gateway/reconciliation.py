@@ -0,0 +1,336 @@
+"""
+Reconciliation of transactions against Stripe balance transaction exports.
+
+The export (an itemized balance or payout reconciliation report as CSV) is
+read ``chunk_size`` rows at a time into NumPy column arrays. Each chunk is
+joined with the transactions that carry the same payment intent ids: both
+sides are sorted by reference and matched with ``searchsorted``, amounts are
+compared in cents and the report category is compared with the recorded
+status. Once the export is read, completed transactions created inside its
+time window whose ids were never matched are reported as missing from the
+export. Memory is bounded by the chunk size plus one integer per matched
+transaction.
+
+Every discrepancy against a recorded transaction is written as a
+``reconciliation`` ``TransactionLog`` row with ``bulk_create``; rows of the
+export that match no transaction can only be reported. A discrepancy that
+already has a correction log (the same balance transaction, or the same
+transaction missing from an export) is not logged again, so an export can be
+reconciled more than once. Rows too short to hold every column read are
+skipped, counted as ``malformed`` and logged with their line number.
+"""
+import csv
+import logging
+from dataclasses import asdict, dataclass
+from datetime import timezone as dt_timezone
+from decimal import ROUND_HALF_EVEN, Decimal
+
+from django.conf import settings
+
+from .models import Transaction, TransactionLog
+
+logger = logging.getLogger(__name__)
+
+try:
+    import numpy as np
+except ImportError:  # pragma: no cover
+    np = None
+
+DEFAULT_CHUNK_SIZE = 10000
+
+# Export column for each value read, as in Stripe's itemized reports
+DEFAULT_COLUMNS = {
+    'id': 'balance_transaction_id',
+    'reference': 'payment_intent_id',
+    'amount': 'gross',
+    'category': 'reporting_category',
+    'created': 'created_utc',
+}
+
+# Report categories that describe a payment, and the status they imply
+CATEGORY_STATUS = {
+    'charge': 'completed',
+    'charge_failure': 'failed',
+}
+
+STATUS_CODES = {status: code for code, (status, _) in enumerate(Transaction.STATUS_CHOICES)}
+STATUS_NAMES = {code: status for status, code in STATUS_CODES.items()}
+UNKNOWN_STATUS = -1
+# Below this many cents a float64 parse of an amount rounds to the exact cent
+EXACT_FLOAT_CENTS = 2 ** 50
+
+REPORT_FIELDS = ['issue', 'balance_transaction_id', 'reference', 'transaction_id',
+                 'stripe_amount_cents', 'recorded_amount_cents', 'stripe_status', 'recorded_status']
+
+
+@dataclass
+class ReconciliationResult:
+    rows: int = 0
+    skipped: int = 0
+    malformed: int = 0
+    matched: int = 0
+    missing_in_db: int = 0
+    missing_in_export: int = 0
+    amount_mismatch: int = 0
+    status_mismatch: int = 0
+    corrections: int = 0
+
+    def as_dict(self):
+        return asdict(self)
+
+
+def to_cents(values, unit='major'):
+    """
+    Amount strings to int64 cents; ``unit='cents'`` for exports already in minor units.
+
+    Parsing through float64 is exact for amounts with at most two decimals
+    well inside float precision, which is nearly every row. The rest (larger
+    amounts, more decimals) are parsed as ``Decimal`` so they stay exact too.
+    """
+    amounts = np.asarray(values, dtype=str)
+    scale = 1 if unit == 'cents' else 100
+    cents = amounts.astype(np.float64) * scale
+    fraction = np.strings.partition(amounts, '.')[2] if len(amounts) else amounts
+    inexact = (np.abs(cents) >= EXACT_FLOAT_CENTS) | (np.strings.str_len(fraction) > (2 if scale == 100 else 0))
+    cents = np.rint(cents).astype(np.int64)
+    for index in np.flatnonzero(inexact).tolist():
+        cents[index] = int((Decimal(str(amounts[index])) * scale).to_integral_value(ROUND_HALF_EVEN))
+    return cents
+
+
+def status_codes(statuses):
+    """Map an array of status names to their codes, unknown ones to ``UNKNOWN_STATUS``."""
+    names, inverse = np.unique(np.asarray(statuses, dtype=str), return_inverse=True)
+    lookup = np.array([STATUS_CODES.get(name, UNKNOWN_STATUS) for name in names.tolist()], dtype=np.int8)
+    return lookup[inverse.reshape(-1)] if len(names) else np.empty(0, dtype=np.int8)
+
+
+def read_chunks(lines, columns, chunk_size, on_malformed=None):
+    """
+    Yield dicts of column lists, ``chunk_size`` export rows at a time.
+
+    A row too short for every column is passed to ``on_malformed(line_number,
+    row)`` and left out; without a callback it raises ``ValueError``.
+    """
+    reader = csv.reader(lines)
+    header = next(reader, None) or []
+    missing = [column for column in columns.values() if column not in header]
+    if missing:
+        raise ValueError(f"Export is missing columns: {', '.join(missing)}")
+    positions = {name: header.index(column) for name, column in columns.items()}
+    width = max(positions.values()) + 1
+    chunk = {name: [] for name in columns}
+    for row in reader:
+        if not row:
+            continue
+        if len(row) < width:
+            if on_malformed is None:
+                raise ValueError(f"Export line {reader.line_num} has {len(row)} columns, expected {width}")
+            on_malformed(reader.line_num, row)
+            continue
+        for name, position in positions.items():
+            chunk[name].append(row[position])
+        if len(chunk['reference']) >= chunk_size:
+            yield chunk
+            chunk = {name: [] for name in columns}
+    if chunk['reference']:
+        yield chunk
+
+
+def correction_key(transaction_id, info):
+    """What a correction is about: its balance transaction, or the transaction missing from the export."""
+    info = info if isinstance(info, dict) else {}
+    return transaction_id, info.get('balance_transaction_id') or ','.join(info.get('issues', []))
+
+
+class Reconciler:
+    def __init__(self, columns=None, amount_unit='major', chunk_size=None, start=None, end=None,
+                 dry_run=False, report=None):
+        if np is None:
+            raise RuntimeError("Reconciliation needs numpy; install it with pip install numpy")
+        self.columns = {**DEFAULT_COLUMNS, **(columns or {})}
+        self.amount_unit = amount_unit
+        self.chunk_size = chunk_size or getattr(settings, 'PAYFLOW_RECONCILIATION_CHUNK_SIZE', DEFAULT_CHUNK_SIZE)
+        self.start, self.end = start, end
+        self.dry_run = dry_run
+        self.report = csv.writer(report) if report is not None else None
+        if self.report:
+            self.report.writerow(REPORT_FIELDS)
+        self.result = ReconciliationResult()
+        self.seen = []
+        self.first_created = self.last_created = None
+
+    def run(self, lines) -> ReconciliationResult:
+        for chunk in read_chunks(lines, self.columns, self.chunk_size, self.malformed_row):
+            self.reconcile_chunk(chunk)
+        self.find_missing_in_export()
+        return self.result
+
+    def malformed_row(self, line_number, row):
+        self.result.malformed += 1
+        logger.warning("Skipped export line %s: %s columns, too few for the columns read", line_number, len(row))
+
+    def recorded(self, references):
+        """The transactions for ``references`` as arrays sorted by reference, one per reference."""
+        rows = list(Transaction.objects.filter(gateway_payment_intent_id__in=set(references.tolist()) - {''})
+                    .order_by('gateway_payment_intent_id', 'id')
+                    .values_list('gateway_payment_intent_id', 'id', 'amount', 'status',
+                                 'user_id', 'merchant_id', 'payment_method_id'))
+        if not rows:
+            return None
+        columns = list(zip(*rows))
+        # The oldest transaction stands for the payment intent
+        keys, first = np.unique(np.array(columns[0], dtype=str), return_index=True)
+        return {
+            'reference': keys,
+            'id': np.array(columns[1], dtype=np.int64)[first],
+            'cents': to_cents([str(amount) for amount in columns[2]])[first],
+            'status': status_codes(columns[3])[first],
+            'related': columns[4:],
+            'first': first,
+        }
+
+    def reconcile_chunk(self, chunk):
+        categories = np.array(chunk['category'], dtype=str)
+        payments = np.isin(categories, list(CATEGORY_STATUS))
+        self.result.rows += len(categories)
+        self.result.skipped += int(np.count_nonzero(~payments))
+        if not payments.any():
+            return
+
+        ids = np.array(chunk['id'], dtype=str)[payments]
+        references = np.array(chunk['reference'], dtype=str)[payments]
+        cents = to_cents(np.array(chunk['amount'], dtype=str)[payments], self.amount_unit)
+        expected = status_codes([CATEGORY_STATUS[category] for category in categories[payments].tolist()])
+        created = np.array(chunk['created'], dtype='datetime64[s]')[payments]
+        self.track_window(created)
+
+        recorded = self.recorded(references)
+        if recorded is None:
+            found = np.zeros(len(references), dtype=bool)
+            position = np.zeros(len(references), dtype=np.intp)
+        else:
+            position = np.searchsorted(recorded['reference'], references)
+            position = np.minimum(position, len(recorded['reference']) - 1)
+            found = (recorded['reference'][position] == references) & (references != '')
+
+        missing = ~found
+        self.result.missing_in_db += int(np.count_nonzero(missing))
+        for index in np.flatnonzero(missing).tolist():
+            self.write_report('missing_in_db', ids[index], references[index], None,
+                              int(cents[index]), None, STATUS_NAMES[int(expected[index])], None)
+        if recorded is None:
+            return
+
+        matched_position = position[found]
+        self.seen.append(recorded['id'][matched_position])
+        amount_differs = found & (recorded['cents'][position] != cents)
+        status_differs = found & (recorded['status'][position] != expected)
+        self.result.amount_mismatch += int(np.count_nonzero(amount_differs))
+        self.result.status_mismatch += int(np.count_nonzero(status_differs))
+        self.result.matched += int(np.count_nonzero(found & ~amount_differs & ~status_differs))
+
+        logs = []
+        for index in np.flatnonzero(amount_differs | status_differs).tolist():
+            at = int(position[index])
+            issues = [name for name, differs in (('amount_mismatch', amount_differs[index]),
+                                                 ('status_mismatch', status_differs[index])) if differs]
+            stripe_cents, recorded_cents = int(cents[index]), int(recorded['cents'][at])
+            stripe_status = STATUS_NAMES[int(expected[index])]
+            recorded_status = STATUS_NAMES.get(int(recorded['status'][at]), 'unknown')
+            for issue in issues:
+                self.write_report(issue, ids[index], references[index], int(recorded['id'][at]),
+                                  stripe_cents, recorded_cents, stripe_status, recorded_status)
+            source = int(recorded['first'][at])
+            logs.append(self.correction(
+                int(recorded['id'][at]), [related[source] for related in recorded['related']],
+                f"Reconciliation: Stripe reports {stripe_cents} cents, {stripe_status}; "
+                f"recorded {recorded_cents} cents, {recorded_status}",
+                {'issues': issues, 'balance_transaction_id': str(ids[index]),
+                 'stripe_amount_cents': stripe_cents, 'recorded_amount_cents': recorded_cents,
+                 'stripe_status': stripe_status, 'recorded_status': recorded_status},
+            ))
+        self.save(logs)
+
+    def track_window(self, created):
+        valid = created[~np.isnat(created)]
+        if not len(valid):
+            return
+        first, last = valid.min(), valid.max()
+        self.first_created = first if self.first_created is None else min(self.first_created, first)
+        self.last_created = last if self.last_created is None else max(self.last_created, last)
+
+    def window(self):
+        def aware(moment):
+            return moment.astype('datetime64[us]').item().replace(tzinfo=dt_timezone.utc)
+        start = self.start or (aware(self.first_created) if self.first_created is not None else None)
+        end = self.end or (aware(self.last_created) if self.last_created is not None else None)
+        return start, end
+
+    def find_missing_in_export(self):
+        """Completed transactions inside the export's time window that it never mentioned."""
+        start, end = self.window()
+        if start is None or end is None:
+            return
+        seen = np.unique(np.concatenate(self.seen)) if self.seen else np.empty(0, dtype=np.int64)
+        self.seen = []
+        queryset = (Transaction.objects.filter(status='completed', created_at__gte=start, created_at__lte=end)
+                    .exclude(gateway_payment_intent_id='').order_by('id')
+                    .values_list('id', 'gateway_payment_intent_id', 'amount', 'user_id', 'merchant_id',
+                                 'payment_method_id'))
+        batch = []
+        for row in queryset.iterator(chunk_size=self.chunk_size):
+            batch.append(row)
+            if len(batch) >= self.chunk_size:
+                self.report_missing_in_export(batch, seen)
+                batch = []
+        if batch:
+            self.report_missing_in_export(batch, seen)
+
+    def report_missing_in_export(self, rows, seen):
+        ids = np.fromiter((row[0] for row in rows), dtype=np.int64, count=len(rows))
+        unseen = np.flatnonzero(~np.isin(ids, seen, assume_unique=True)).tolist()
+        self.result.missing_in_export += len(unseen)
+        logs = []
+        for index in unseen:
+            transaction_id, reference, amount, *related = rows[index]
+            recorded_cents = int(to_cents([str(amount)])[0])
+            self.write_report('missing_in_export', None, reference, transaction_id,
+                              None, recorded_cents, None, 'completed')
+            logs.append(self.correction(
+                transaction_id, related,
+                "Reconciliation: completed transaction not found in the Stripe export",
+                {'issues': ['missing_in_export'], 'recorded_amount_cents': recorded_cents},
+            ))
+        self.save(logs)
+
+    def correction(self, transaction_id, related, message, info):
+        user_id, merchant_id, payment_method_id = related
+        return TransactionLog(transaction_id=transaction_id, log_message=message, log_type='reconciliation',
+                              user_id=user_id, merchant_id=merchant_id, payment_method_id=payment_method_id,
+                              additional_info=info)
+
+    def save(self, logs):
+        logs = self.unlogged(logs)
+        if logs and not self.dry_run:
+            TransactionLog.objects.bulk_create(logs)
+        self.result.corrections += len(logs)
+
+    def unlogged(self, logs):
+        """The corrections among ``logs`` that an earlier reconciliation has not logged yet."""
+        if not logs:
+            return logs
+        existing = TransactionLog.objects.filter(
+            log_type='reconciliation', transaction_id__in={log.transaction_id for log in logs},
+        ).values_list('transaction_id', 'additional_info')
+        logged = {correction_key(transaction_id, info) for transaction_id, info in existing}
+        return [log for log in logs if correction_key(log.transaction_id, log.additional_info) not in logged]
+
+    def write_report(self, *values):
+        if self.report:
+            self.report.writerow(['' if value is None else value for value in values])
+
+
+def reconcile(lines, **options) -> ReconciliationResult:
+    """Reconcile the CSV export read from ``lines``; see ``Reconciler`` for the options."""
+    return Reconciler(**options).run(lines)
@@ -0,0 +1,205 @@
+"""
+Subscription renewals.
+
+Due subscriptions (active, ``end_date`` passed) are renewed in batches of
+``PAYFLOW_RENEWALS['BATCH_SIZE']``. A batch is claimed through the
+``(status, end_date)`` index with ``SELECT ... FOR UPDATE SKIP LOCKED``, and
+``claimed_until`` is set so that other workers pass over it; a worker that
+dies mid-batch leaves its claim to expire after ``VISIBILITY_TIMEOUT``
+seconds. The batch is charged with ``bulk.call_gateway`` (``CONCURRENCY``
+calls in flight, one idempotency key per subscription period and attempt,
+so a retried claim never charges twice), and the transactions and the
+subscriptions' new end dates are written in bulk in one database
+transaction.
+
+A failed charge is retried after ``RETRY_DELAY`` seconds; after
+``MAX_ATTEMPTS`` failures the subscription becomes inactive. A charge the
+gateway router refused without sending it (``GatewayRejected``) is not an
+attempt: the subscription is simply claimed again once the gateway's
+``retry_after`` has passed. Subscriptions
+without ``auto_renew`` simply expire; those created before renewals existed
+have it off.
+"""
+import logging
+import math
+import time
+from collections import defaultdict
+from datetime import timedelta
+
+import stripe
+from django.conf import settings
+from django.db import transaction
+from django.db.models import F, Q
+from django.utils import timezone
+
+from . import bulk, effects, gateways
+from .context import load_payment_contexts
+from .models import Subscriptions
+from .views import payment_intent_params
+
+logger = logging.getLogger(__name__)
+
+DEFAULTS = {
+    'BATCH_SIZE': 500,
+    'CONCURRENCY': 16,
+    'MAX_ATTEMPTS': 4,
+    'RETRY_DELAY': 24 * 60 * 60,
+    'VISIBILITY_TIMEOUT': 10 * 60,
+}
+
+
+def renewal_settings():
+    return {**DEFAULTS, **getattr(settings, 'PAYFLOW_RENEWALS', {})}
+
+
+def due(now):
+    return Q(status='active', end_date__lte=now) & (Q(claimed_until__isnull=True) | Q(claimed_until__lt=now))
+
+
+def expire_due(now=None, batch_size=None):
+    """Deactivate due subscriptions that do not renew automatically; return how many."""
+    now = now or timezone.now()
+    batch_size = batch_size or renewal_settings()['BATCH_SIZE']
+    expired = 0
+    while True:
+        ids = list(Subscriptions.objects.filter(due(now), auto_renew=False)
+                   .order_by('end_date', 'id').values_list('id', flat=True)[:batch_size])
+        if not ids:
+            return expired
+        expired += Subscriptions.objects.filter(due(now), pk__in=ids).update(status='inactive')
+
+
+def claim_batch(batch_size=None, now=None):
+    """Claim up to ``batch_size`` due, automatically renewing subscriptions for the calling worker."""
+    options = renewal_settings()
+    batch_size = batch_size or options['BATCH_SIZE']
+    now = now or timezone.now()
+    # Nothing to charge for a zero amount; such subscriptions stay as they are
+    claimable = due(now) & Q(auto_renew=True, amount__gt=0)
+    claimed_until = now + timedelta(seconds=options['VISIBILITY_TIMEOUT'])
+    with transaction.atomic():
+        ids = list(
+            Subscriptions.objects
+            .select_for_update(skip_locked=True)
+            .filter(claimable)
+            .order_by('end_date', 'id')
+            .values_list('id', flat=True)[:batch_size]
+        )
+        if not ids:
+            return []
+        # Re-check the claim condition in the UPDATE so that backends without
+        # row locks (SQLite) never hand the same subscription to two workers.
+        Subscriptions.objects.filter(claimable, pk__in=ids).update(claimed_until=claimed_until)
+    return list(Subscriptions.objects.filter(pk__in=ids, claimed_until=claimed_until).order_by('end_date', 'id'))
+
+
+def renewal_charge(subscription, context):
+    payment_method = context.payment_method
+    return {
+        'user_id': subscription.user_id,
+        'amount': subscription.amount,
+        'payment_method_id': payment_method.gateway_payment_method_token if payment_method else '',
+        'description': f"Renewal of {subscription.plan_name}",
+    }
+
+
+def create_renewal_intent(subscription, charge):
+    """
+    Charge one renewal. The key makes a retried claim of the same attempt a
+    no-op at Stripe, while a retry after a decline is a new charge rather
+    than a replay of the stored decline.
+    """
+    params = payment_intent_params(charge)
+    params['metadata']['subscription_id'] = subscription.pk
+    key = f"renewal:{subscription.pk}:{subscription.end_date:%Y%m%dT%H%M%S}:{subscription.renewal_attempts}"
+    return gateways.create_payment_intent(params, idempotency_key=key)
+
+
+def record_renewals(subscriptions, outcomes, now, options):
+    """
+    Move renewed subscriptions to their next period and schedule retries.
+
+    Rows are grouped by what happens to them so that a batch takes a handful
+    of UPDATEs; ``bulk_update`` would need one CASE per row and field.
+    """
+    extend, restart, retry, give_up, deferred = defaultdict(list), defaultdict(list), [], [], []
+    for subscription, outcome in zip(subscriptions, outcomes):
+        if isinstance(outcome, gateways.GatewayRejected):
+            deferred.append((subscription.pk, outcome.retry_after or 0))
+        elif not isinstance(outcome, Exception) and outcome.status == 'succeeded':
+            lapsed = subscription.end_date + timedelta(days=subscription.period_days) <= now
+            (restart if lapsed else extend)[subscription.period_days].append(subscription.pk)
+        elif subscription.renewal_attempts + 1 >= options['MAX_ATTEMPTS']:
+            give_up.append(subscription.pk)
+        else:
+            retry.append(subscription.pk)
+
+    renewed = 0
+    for period_days, ids in extend.items():
+        renewed += Subscriptions.objects.filter(pk__in=ids).update(
+            end_date=F('end_date') + timedelta(days=period_days), renewal_attempts=0, claimed_until=None)
+    for period_days, ids in restart.items():
+        # A long-lapsed subscription starts a fresh period instead of catching up
+        renewed += Subscriptions.objects.filter(pk__in=ids).update(
+            end_date=now + timedelta(days=period_days), renewal_attempts=0, claimed_until=None)
+    Subscriptions.objects.filter(pk__in=retry).update(
+        renewal_attempts=F('renewal_attempts') + 1, claimed_until=now + timedelta(seconds=options['RETRY_DELAY']))
+    Subscriptions.objects.filter(pk__in=give_up).update(
+        renewal_attempts=F('renewal_attempts') + 1, claimed_until=None, status='inactive')
+    if deferred:
+        delay = max(1, math.ceil(max(retry_after for _, retry_after in deferred)))
+        Subscriptions.objects.filter(pk__in=[pk for pk, _ in deferred]).update(
+            claimed_until=now + timedelta(seconds=delay))
+        logger.warning("Renewal batch: %s charges refused by the gateway router, retrying in %ss",
+                       len(deferred), delay)
+    return renewed, len(retry) + len(give_up)
+
+
+def renew_batch(subscriptions, now=None, create_intent=create_renewal_intent, concurrency=None):
+    """Charge a claimed batch and record the outcomes; returns ``(renewed, failed)``."""
+    options = renewal_settings()
+    now = now or timezone.now()
+    contexts = load_payment_contexts({subscription.user_id for subscription in subscriptions})
+    subscriptions = [subscription for subscription in subscriptions if subscription.user_id in contexts]
+    charges = [renewal_charge(subscription, contexts[subscription.user_id]) for subscription in subscriptions]
+
+    def charge(index, item):
+        if not item['payment_method_id']:
+            raise stripe.error.InvalidRequestError("No payment method on file.", 'payment_method')
+        return create_intent(subscriptions[index], item)
+
+    outcomes = bulk.call_gateway(charges, charge, concurrency=concurrency or options['CONCURRENCY'])
+
+    with effects.batch():
+        # A claim that expired while charging now belongs to another worker,
+        # which gets the same intent back from Stripe and records it instead.
+        held = set(Subscriptions.objects.select_for_update().filter(
+            pk__in=[subscription.pk for subscription in subscriptions],
+            claimed_until__in={subscription.claimed_until for subscription in subscriptions},
+        ).values_list('pk', 'claimed_until'))
+        kept = [index for index, subscription in enumerate(subscriptions)
+                if (subscription.pk, subscription.claimed_until) in held]
+        if len(kept) < len(subscriptions):
+            logger.warning("Renewal batch lost %s expired claims", len(subscriptions) - len(kept))
+        subscriptions = [subscriptions[index] for index in kept]
+        outcomes = [outcomes[index] for index in kept]
+        bulk.record_results([charges[index] for index in kept], contexts, outcomes, sender=Subscriptions)
+        renewed, failed = record_renewals(subscriptions, outcomes, now, options)
+    logger.info("Renewal batch: %s renewed, %s failed", renewed, failed)
+    return renewed, failed
+
+
+def run_worker(batch_size=None, concurrency=None, poll_interval=60.0, once=False):
+    """Expire and renew due subscriptions until none are left (``once``) or forever."""
+    totals = {'expired': 0, 'renewed': 0, 'failed': 0}
+    while True:
+        totals['expired'] += expire_due(batch_size=batch_size)
+        batch = claim_batch(batch_size)
+        if batch:
+            renewed, failed = renew_batch(batch, concurrency=concurrency)
+            totals['renewed'] += renewed
+            totals['failed'] += failed
+            continue
+        if once:
+            return totals
+        time.sleep(poll_interval)
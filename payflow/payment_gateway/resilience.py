@@ -0,0 +1,127 @@
+"""
+Failure isolation for calls to payment gateways.
+
+``CircuitBreaker`` stops sending calls to a gateway after
+``failure_threshold`` consecutive failures. Once ``reset_timeout`` seconds
+have passed it lets a single probe call through (half-open): a success
+closes the circuit again, a failure keeps it open for another timeout.
+
+``Bulkhead`` caps the gateway calls in flight in a process, so that a slow
+gateway ties up at most that many worker threads and the rest keep serving
+other endpoints. ``backoff_delay`` gives the jittered wait before a retry.
+"""
+import asyncio
+import threading
+import time
+
+
+class CircuitBreaker:
+    CLOSED = 'closed'
+    OPEN = 'open'
+    HALF_OPEN = 'half_open'
+
+    def __init__(self, failure_threshold=5, reset_timeout=30.0, clock=time.monotonic):
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.clock = clock
+        self._lock = threading.Lock()
+        self._state = self.CLOSED
+        self._failures = 0
+        self._opened_at = None
+        self._probing = False
+
+    @property
+    def state(self):
+        with self._lock:
+            return self._current_state()
+
+    def _current_state(self):
+        if self._state == self.OPEN and self.clock() - self._opened_at >= self.reset_timeout:
+            return self.HALF_OPEN
+        return self._state
+
+    def available(self) -> bool:
+        """Whether a call would be let through, without claiming the half-open probe."""
+        with self._lock:
+            state = self._current_state()
+            return state == self.CLOSED or (state == self.HALF_OPEN and not self._probing)
+
+    def allow(self) -> bool:
+        """Claim permission for one call; in the half-open state only one caller gets it."""
+        with self._lock:
+            state = self._current_state()
+            if state == self.CLOSED:
+                return True
+            if state == self.HALF_OPEN and not self._probing:
+                self._state = self.HALF_OPEN
+                self._probing = True
+                return True
+            return False
+
+    def record_success(self):
+        with self._lock:
+            self._state = self.CLOSED
+            self._failures = 0
+            self._probing = False
+
+    def record_failure(self):
+        with self._lock:
+            self._failures += 1
+            if self._state == self.HALF_OPEN or self._failures >= self.failure_threshold:
+                self._state = self.OPEN
+                self._opened_at = self.clock()
+            self._probing = False
+
+    def retry_after(self):
+        """Seconds until an open circuit lets a probe through; 0 otherwise."""
+        with self._lock:
+            if self._state != self.OPEN:
+                return 0
+            return max(0.0, self.reset_timeout - (self.clock() - self._opened_at))
+
+    def stats(self):
+        with self._lock:
+            return {'state': self._current_state(), 'consecutive_failures': self._failures}
+
+
+class Bulkhead:
+    def __init__(self, size, max_wait=0.0):
+        self.size = size
+        self.max_wait = max_wait
+        self._slots = threading.BoundedSemaphore(size)
+        self._lock = threading.Lock()
+        self._in_use = 0
+
+    @property
+    def in_use(self):
+        return self._in_use
+
+    def _taken(self, acquired):
+        if acquired:
+            with self._lock:
+                self._in_use += 1
+        return acquired
+
+    def acquire(self) -> bool:
+        """Take a slot, waiting up to ``max_wait`` seconds for one; False if none freed up."""
+        return self._taken(self._slots.acquire(timeout=self.max_wait) if self.max_wait else
+                           self._slots.acquire(blocking=False))
+
+    async def aacquire(self) -> bool:
+        """``acquire`` for coroutines: polls instead of blocking the event loop."""
+        deadline = time.monotonic() + self.max_wait
+        while not self._slots.acquire(blocking=False):
+            if time.monotonic() >= deadline:
+                return False
+            await asyncio.sleep(0.005)
+        return self._taken(True)
+
+    def release(self):
+        with self._lock:
+            self._in_use -= 1
+        self._slots.release()
+
+
+def backoff_delay(attempt, base, cap, rng):
+    """Full jitter: a random wait of up to ``base * 2 ** attempt``, capped at ``cap`` seconds."""
+    return rng.uniform(0, min(cap, base * 2 ** attempt))
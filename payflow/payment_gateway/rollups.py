@@ -0,0 +1,195 @@
+"""
+Pre-aggregated transaction totals for reporting.
+
+``TransactionRollup`` holds a transaction count and amount per hour and per
+day (UTC), per merchant and per user, and per status, so a dashboard reads
+one row per bucket instead of summing ``Transaction.amount`` over the whole
+table.
+
+Rollups are kept current from the payment flow: a saved transaction is
+compared with the values it was loaded with, and the difference (a new row,
+a status transition, a deleted row) becomes deltas that go through
+``effects`` and are applied in the payment's database transaction. Code that
+changes transactions without ``save()``, such as ``QuerySet.update()`` or
+``bulk_create()``, calls ``effects.add_rollup()`` itself.
+
+``rebuild()`` recomputes the rollups from the transactions table for every
+bucket from a watermark on; with ``PAYFLOW_ROLLUPS['LIVE']`` off that batch
+job is the only writer. Live deltas for the buckets being rebuilt that commit
+while a rebuild runs can be lost, so rebuild recent buckets at a quiet time
+or again afterwards.
+"""
+from collections import defaultdict
+from datetime import datetime, timedelta, timezone as dt_timezone
+from decimal import Decimal
+
+from django.conf import settings
+from django.db import IntegrityError, connection, transaction
+from django.db.models import Count, F, Sum, Value
+from django.db.models.functions import Coalesce, TruncDay, TruncHour
+
+from .models import Transaction, TransactionRollup
+
+DEFAULTS = {
+    'LIVE': True,
+    'REBUILD_DAYS': 2,
+}
+
+CENT = Decimal('0.01')
+GRAINS = {'hour': TruncHour, 'day': TruncDay}
+SCOPES = {'merchant': 'merchant_id', 'user': 'user_id'}
+TRACKED = ('status', 'amount', 'created_at', 'merchant_id', 'user_id')
+UPSERT_VENDORS = ('sqlite', 'postgresql')
+# Rows per upsert statement: 7 parameters each keeps a statement under
+# SQLite's oldest variable limit (999) and of bounded size on PostgreSQL.
+UPSERT_BATCH_SIZE = 140
+
+
+def rollup_settings():
+    return {**DEFAULTS, **getattr(settings, 'PAYFLOW_ROLLUPS', {})}
+
+
+def is_live() -> bool:
+    return rollup_settings()['LIVE']
+
+
+def bucket_start(moment, grain):
+    moment = moment.astimezone(dt_timezone.utc)
+    if grain == 'day':
+        return moment.replace(hour=0, minute=0, second=0, microsecond=0)
+    return moment.replace(minute=0, second=0, microsecond=0)
+
+
+def _deltas(state, sign):
+    amount = Decimal(state['amount']).quantize(CENT) * sign
+    for grain in GRAINS:
+        bucket = bucket_start(state['created_at'], grain)
+        for scope, column in SCOPES.items():
+            yield (grain, scope, state[column] or 0, bucket, state['status']), sign, amount
+
+
+def _state(instance):
+    return {name: getattr(instance, name) for name in TRACKED}
+
+
+def changes(instance, created=False, deleted=False):
+    """
+    Rollup deltas for what happened to ``instance`` since it was loaded or last rolled up.
+
+    Returns ``(key, count, amount)`` tuples for ``apply()``. Transactions
+    neither created here nor loaded with all tracked fields produce none.
+    """
+    previous = None
+    if not created:
+        loaded = getattr(instance, '_loaded_values', None)
+        if loaded is None or any(name not in loaded for name in TRACKED):
+            return []
+        previous = {name: loaded[name] for name in TRACKED}
+    current = None if deleted else _state(instance)
+    if previous == current:
+        return []
+    if current is not None:
+        instance._loaded_values = {**getattr(instance, '_loaded_values', {}), **current}
+    deltas = []
+    if previous is not None:
+        deltas.extend(_deltas(previous, -1))
+    if current is not None:
+        deltas.extend(_deltas(current, 1))
+    return deltas
+
+
+def _upsert(rows):
+    """Add to many rollup rows with ``INSERT ... ON CONFLICT DO UPDATE``, ``UPSERT_BATCH_SIZE`` rows at a time."""
+    meta = TransactionRollup._meta
+    quote = connection.ops.quote_name
+    table = quote(meta.db_table)
+    names = ('grain', 'scope', 'scope_id', 'bucket', 'status', 'transaction_count', 'amount')
+    fields = [meta.get_field(name) for name in names]
+    sums = ', '.join(f'{quote(name)} = {table}.{quote(name)} + EXCLUDED.{quote(name)}'
+                     for name in ('transaction_count', 'amount'))
+    row_placeholder = '(' + ', '.join(['%s'] * len(names)) + ')'
+    with connection.cursor() as cursor:
+        for start in range(0, len(rows), UPSERT_BATCH_SIZE):
+            batch = rows[start:start + UPSERT_BATCH_SIZE]
+            params = []
+            for row in batch:
+                params.extend(field.get_db_prep_value(value, connection) for field, value in zip(fields, row))
+            cursor.execute(
+                f"INSERT INTO {table} ({', '.join(quote(name) for name in names)}) "
+                f"VALUES {', '.join([row_placeholder] * len(batch))} "
+                f"ON CONFLICT ({', '.join(quote(name) for name in names[:5])}) DO UPDATE SET {sums}",
+                params,
+            )
+
+
+def _update_or_create(rows):
+    with transaction.atomic():
+        for grain, scope, scope_id, bucket, status, count, amount in rows:
+            matching = TransactionRollup.objects.filter(grain=grain, scope=scope, scope_id=scope_id, bucket=bucket,
+                                                        status=status)
+            if matching.update(transaction_count=F('transaction_count') + count, amount=F('amount') + amount):
+                continue
+            try:
+                with transaction.atomic():
+                    TransactionRollup.objects.create(grain=grain, scope=scope, scope_id=scope_id, bucket=bucket,
+                                                     status=status, transaction_count=count, amount=amount)
+            except IntegrityError:
+                # Another payment created the row first
+                matching.update(transaction_count=F('transaction_count') + count, amount=F('amount') + amount)
+
+
+def apply(deltas):
+    """
+    Add ``(key, count, amount)`` deltas to the rollup rows.
+
+    Deltas for the same row are summed first, and rows are written in key
+    order so concurrent payments lock them in the same order. On SQLite and
+    PostgreSQL rows are written with a few multi-row upserts.
+    """
+    totals = defaultdict(lambda: [0, Decimal('0')])
+    for key, count, amount in deltas:
+        totals[key][0] += count
+        totals[key][1] += amount
+    rows = [(*key, *totals[key]) for key in sorted(totals) if any(totals[key])]
+    if not rows:
+        return
+    if connection.vendor in UPSERT_VENDORS:
+        _upsert(rows)
+    else:
+        _update_or_create(rows)
+
+
+def default_watermark():
+    today = bucket_start(datetime.now(dt_timezone.utc), 'day')
+    return today - timedelta(days=rollup_settings()['REBUILD_DAYS'])
+
+
+def rebuild(since=None):
+    """
+    Recompute every rollup bucket starting at or after ``since`` (all of them when None).
+
+    ``since`` is rounded down to the start of its UTC day. Returns the
+    number of rollup rows written.
+    """
+    transactions = Transaction.objects.all()
+    existing = TransactionRollup.objects.all()
+    if since is not None:
+        since = bucket_start(since, 'day')
+        transactions = transactions.filter(created_at__gte=since)
+        existing = existing.filter(bucket__gte=since)
+
+    rows = []
+    for grain, trunc in GRAINS.items():
+        for scope, column in SCOPES.items():
+            totals = (transactions.order_by()
+                      .values(bucket=trunc('created_at', tzinfo=dt_timezone.utc),
+                              key=Coalesce(column, Value(0)), state=F('status'))
+                      .annotate(transaction_count=Count('id'), total=Sum('amount')))
+            rows.extend(TransactionRollup(grain=grain, scope=scope, scope_id=row['key'], bucket=row['bucket'],
+                                          status=row['state'], transaction_count=row['transaction_count'],
+                                          amount=row['total'])
+                        for row in totals)
+    with transaction.atomic():
+        existing.delete()
+        TransactionRollup.objects.bulk_create(rows, batch_size=1000)
+    return len(rows)
@@ -1,7 +1,35 @@
+from decimal import Decimal
+from django.conf import settings
 from rest_framework import serializers
-from .models import User, Transaction, Merchant, PaymentMethod, TransactionLog, PaymentGateway, Subscriptions
+from .models import (
+    User, Transaction, Merchant, PaymentMethod, TransactionLog, PaymentGateway, Subscriptions, TransactionRollup
+)
+from . import timing
 
-class UserSerializer(serializers.ModelSerializer):
+
+class TimedListSerializer(serializers.ListSerializer):
+    @property
+    def data(self):
+        with timing.stage('serialize'):
+            return super().data
+
+
+class TimedSerializerMixin:
+    """Time ``.data`` as the ``serialize`` stage, for one object or, with ``many=True``, a list."""
+
+    def __init_subclass__(cls, **kwargs):
+        super().__init_subclass__(**kwargs)
+        meta = getattr(cls, 'Meta', None)
+        if meta is not None and not hasattr(meta, 'list_serializer_class'):
+            meta.list_serializer_class = TimedListSerializer
+
+    @property
+    def data(self):
+        with timing.stage('serialize'):
+            return super().data
+
+
+class UserSerializer(TimedSerializerMixin, serializers.ModelSerializer):
     phone = serializers.CharField(required=False, allow_blank=True)
     
     class Meta:
@@ -20,13 +48,13 @@ class UserSerializer(serializers.ModelSerializer):
             representation.pop('phone')
         return representation
 
-class MerchantSerializer(serializers.ModelSerializer):
+class MerchantSerializer(TimedSerializerMixin, serializers.ModelSerializer):
     class Meta:
         model = Merchant
         fields = ['id', 'name', 'email', 'phone', 'created_at', 'updated_at']
         extra_kwargs = {'password': {'write_only': True}}
 
-class PaymentMethodSerializer(serializers.ModelSerializer):
+class PaymentMethodSerializer(TimedSerializerMixin, serializers.ModelSerializer):
     method_type_display = serializers.CharField(source='get_method_type_display', read_only=True)
     card_brand_display = serializers.CharField(source='get_card_brand_display', read_only=True)
     
@@ -36,7 +64,7 @@ class PaymentMethodSerializer(serializers.ModelSerializer):
                  'gateway_payment_method_token', 'last_four_digits', 'expiry_date', 
                  'card_brand', 'card_brand_display', 'created_at']
 
-class TransactionSerializer(serializers.ModelSerializer):
+class TransactionSerializer(TimedSerializerMixin, serializers.ModelSerializer):
     status_display = serializers.CharField(source='get_status_display', read_only=True)
     
     class Meta:
@@ -44,7 +72,7 @@ class TransactionSerializer(serializers.ModelSerializer):
         fields = ['id', 'user', 'merchant', 'payment_method', 'amount', 
                  'description', 'status', 'status_display', 'created_at']
 
-class TransactionLogSerializer(serializers.ModelSerializer):
+class TransactionLogSerializer(TimedSerializerMixin, serializers.ModelSerializer):
     log_type_display = serializers.CharField(source='get_log_type_display', read_only=True)
     
     class Meta:
@@ -52,15 +80,44 @@ class TransactionLogSerializer(serializers.ModelSerializer):
         fields = ['id', 'transaction', 'log_message', 'log_type', 'log_type_display',
                  'user', 'merchant', 'payment_method', 'additional_info', 'created_at']
 
-class PaymentGatewaySerializer(serializers.ModelSerializer):
+class PaymentGatewaySerializer(TimedSerializerMixin, serializers.ModelSerializer):
     class Meta:
         model = PaymentGateway
         fields = ['id', 'name', 'api_key', 'created_at', 'updated_at']
         extra_kwargs = {'api_secret': {'write_only': True}}
 
-class SubscriptionSerializer(serializers.ModelSerializer):
+class SubscriptionSerializer(TimedSerializerMixin, serializers.ModelSerializer):
     status_display = serializers.CharField(source='get_status_display', read_only=True)
     
     class Meta:
         model = Subscriptions
-        fields = ['id', 'user', 'plan_name', 'start_date', 'end_date', 'status', 'status_display']
\ No newline at end of file
+        fields = ['id', 'user', 'plan_name', 'start_date', 'end_date', 'status', 'status_display',
+                  'amount', 'period_days', 'auto_renew']
+
+class TransactionRollupSerializer(TimedSerializerMixin, serializers.ModelSerializer):
+    class Meta:
+        model = TransactionRollup
+        fields = ['grain', 'scope', 'scope_id', 'bucket', 'status', 'transaction_count', 'amount']
+
+class RollupTotalsSerializer(serializers.Serializer):
+    bucket = serializers.DateTimeField()
+    transaction_count = serializers.IntegerField(source='total_count')
+    amount = serializers.DecimalField(max_digits=18, decimal_places=2, source='total_amount')
+    failed_count = serializers.IntegerField()
+    failed_amount = serializers.DecimalField(max_digits=18, decimal_places=2)
+
+class ChargeSerializer(serializers.Serializer):
+    amount = serializers.DecimalField(max_digits=10, decimal_places=2, min_value=Decimal('0.01'))
+    payment_method_id = serializers.CharField()
+    user_id = serializers.IntegerField()
+    description = serializers.CharField(required=False, allow_blank=True, default='')
+
+class BulkChargeSerializer(serializers.Serializer):
+    charges = ChargeSerializer(many=True, allow_empty=False)
+    merchant_id = serializers.IntegerField(required=False)
+
+    def validate_charges(self, charges):
+        limit = getattr(settings, 'PAYFLOW_BULK_MAX_CHARGES', 500)
+        if len(charges) > limit:
+            raise serializers.ValidationError(f"At most {limit} charges per request.")
+        return charges
@@ -4,57 +4,108 @@ import logging
 from django.db.models import F
 from django.db.models.signals import post_save
 from django.dispatch import Signal, receiver
-from .models import Transaction, TransactionLog
+from django.db.models.signals import post_delete
+from django.db import transaction as db_transaction
+from .models import Transaction, TransactionLog, Merchant, PaymentGateway, PaymentMethod, User
+from . import effects
+from . import config_cache
+from .timing import TimedSignal
+from functools import partial
 import logging
 
 logger = logging.getLogger('payflow.payment_gateway.signals')
 
 # Custom signals
-payment_processed = Signal()  # Provides transaction instance
-payment_failed = Signal()  # Provides transaction instance and error message
+payment_processed = TimedSignal()  # Provides transaction instance
+payment_failed = TimedSignal()  # Provides transaction instance and error message
 user_balance_updated = Signal()  # Provides user instance and amount
 
 logger = logging.getLogger(__name__)
 
 @receiver(post_save, sender=Transaction)
 def transaction_post_save(sender, instance: Transaction, created: bool, **kwargs) -> None:
-    """Log transaction creation and updates."""
+    """Log transaction creation and updates once the change commits."""
     if created:
-        logger.info(f"New transaction created: {instance.id} for amount {instance.amount}")
+        effects.defer(partial(logger.info, "New transaction created: %s for amount %s", instance.id, instance.amount))
     else:
         status_dict = dict(Transaction.STATUS_CHOICES)
         if instance.status in status_dict:
-            logger.info(f"Transaction updated: {instance.id}, status: {instance.status}")
+            effects.defer(partial(logger.info, "Transaction updated: %s, status: %s", instance.id, instance.status))
         else:
-            logger.warning(f"Transaction updated: {instance.id} with invalid status: {instance.status}")
+            effects.defer(partial(logger.warning, "Transaction updated: %s with invalid status: %s",
+                                  instance.id, instance.status))
+
+@receiver(post_save, sender=Transaction)
+def roll_up_saved_transaction(sender, instance: Transaction, created: bool, raw=False, **kwargs) -> None:
+    if not raw:
+        effects.add_rollup(instance, created=created)
+
+@receiver(post_delete, sender=Transaction)
+def roll_up_deleted_transaction(sender, instance: Transaction, **kwargs) -> None:
+    effects.add_rollup(instance, deleted=True)
+
+def invalidate_config(cache, key=None, everything=False):
+    """Invalidate now and again on commit, so a read racing the write is not kept."""
+    cache.invalidate(key, everything=everything)
+    db_transaction.on_commit(partial(cache.invalidate, key, everything=everything))
+
+@receiver([post_save, post_delete], sender=Merchant)
+def invalidate_merchant_cache(sender, **kwargs):
+    """Drop cached merchants so payments never use a stale or deleted row."""
+    invalidate_config(config_cache.merchants, everything=True)
+
+@receiver([post_save, post_delete], sender=PaymentGateway)
+def invalidate_gateway_cache(sender, instance, **kwargs):
+    invalidate_config(config_cache.gateways, everything=True)
+
+@receiver([post_save, post_delete], sender=PaymentMethod)
+def invalidate_default_payment_method(sender, instance, **kwargs):
+    invalidate_config(config_cache.default_payment_methods, str(instance.user_id))
+
+@receiver([post_save, post_delete], sender=User)
+def invalidate_cached_user(sender, instance, **kwargs):
+    """Cached payment methods carry the user row with them."""
+    invalidate_config(config_cache.default_payment_methods, str(instance.pk))
+
+def log_captured(transaction):
+    """Audit a completed charge; shared by the single and bulk charge paths."""
+    effects.add_log(TransactionLog(
+        transaction=transaction,
+        log_message=f"Transaction captured for amount {transaction.amount}",
+        log_type='captured',
+        user_id=transaction.user_id,
+        merchant_id=transaction.merchant_id,
+        payment_method_id=transaction.payment_method_id
+    ))
 
 @receiver(payment_processed)
 def update_user_balance(sender, transaction, **kwargs):
-    """Update user balance when payment is processed successfully"""
+    """Credit the user's balance through the ledger when payment is processed successfully"""
     if transaction.status == 'completed':
-        user = transaction.user
-        user.balance = F('balance') + transaction.amount
         try:
-            user.save()
-            user_balance_updated.send(
-                sender=Transaction,
-                user=user,
-                amount=transaction.amount
-            )
-            logger.info(f"User {user.id} balance updated: +{transaction.amount}")
+            effects.add_credit(transaction.user_id, transaction.amount, transaction)
         except Exception as e:
-            logger.error(f"Failed to update user {user.id} balance: {str(e)}")
+            # Re-raise so the payment's database transaction rolls back with it
+            logger.error(f"Failed to update user {transaction.user_id} balance: {str(e)}")
+            raise
+        effects.defer(partial(
+            user_balance_updated.send,
+            sender=Transaction,
+            user=transaction.user,
+            amount=transaction.amount
+        ))
+        effects.defer(partial(logger.info, "User %s balance updated: +%s", transaction.user_id, transaction.amount))
 
 @receiver(payment_failed)
 def handle_payment_failure(sender, transaction, error_message, **kwargs):
     """Handle payment failure"""
-    logger.error(f"Payment failed for transaction {transaction.id}: {error_message}")
+    effects.defer(partial(logger.error, "Payment failed for transaction %s: %s", transaction.id, error_message))
     # Create a transaction log for the failure
-    TransactionLog.objects.create(
+    effects.add_log(TransactionLog(
         transaction=transaction,
         log_message=f"Payment failed: {error_message}",
         log_type='failed',
-        user=transaction.user,
-        merchant=transaction.merchant,
-        payment_method=transaction.payment_method
-    )
\ No newline at end of file
+        user_id=transaction.user_id,
+        merchant_id=transaction.merchant_id,
+        payment_method_id=transaction.payment_method_id
+    ))
\ No newline at end of file
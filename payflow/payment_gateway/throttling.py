@@ -0,0 +1,268 @@
+"""
+Token-bucket rate limits for the payment and resource APIs.
+
+Every request is limited per caller, and within that per merchant and per
+user, each with its own rate and burst (``PAYFLOW_RATE_LIMITS['RATES']``).
+The caller is only ever something the client cannot choose: the
+authenticated user, else the client address. The address is ``REMOTE_ADDR``,
+or, behind ``REST_FRAMEWORK['NUM_PROXIES']`` trusted proxies, the entry the
+outermost of them added to ``X-Forwarded-For``; unchecked headers such as
+``X-Api-Key`` play no part. The merchant and user buckets are the caller's
+buckets for the ``merchant_id`` and ``user_id`` of the request body or query
+string, so changing those ids only moves a client between its own buckets
+and never past the caller limit; a request without the id is not limited by
+them.
+Exceeding any limit gets a 429 with ``Retry-After``. The DRF views list
+``RATE_THROTTLES``; the async function views apply the same throttles with
+``athrottled``.
+
+Two bucket stores are available (``BACKEND``):
+
+* ``local`` - an exact token bucket per key in process memory. Each worker
+              enforces the full rate, so the effective limit grows with the
+              number of workers.
+* ``cache`` - shared by every worker through the Django cache named by
+              ``CACHE`` (Redis when ``PAYFLOW_REDIS_URL`` is set). It is built
+              on the cache's atomic ``incr`` rather than read-modify-write, so
+              concurrent workers never lose updates: tokens taken are counted
+              per refill window, and the previous window's count is weighted
+              by how much of it still overlaps (a sliding-window
+              approximation of the bucket).
+"""
+import math
+import threading
+import time
+from collections.abc import Mapping
+from dataclasses import dataclass
+from functools import wraps
+
+from asgiref.sync import sync_to_async
+
+from django.conf import settings
+from django.core.cache import caches
+from django.core.signals import setting_changed
+from django.dispatch import receiver
+from django.http import JsonResponse
+from rest_framework.exceptions import Throttled
+from rest_framework.throttling import BaseThrottle
+
+from .idempotency import request_data
+from .principals import authenticated_principal
+
+DEFAULTS = {
+    'BACKEND': 'local',
+    'CACHE': 'default',
+    'MAX_KEYS': 100000,
+    'RATES': {
+        'merchant': {'RATE': '100/s', 'BURST': 200},
+        'user': {'RATE': '20/s', 'BURST': 50},
+        'principal': {'RATE': '50/s', 'BURST': 100},
+    },
+}
+
+PERIODS = {'s': 1, 'm': 60, 'h': 3600, 'd': 86400}
+
+
+@dataclass(frozen=True)
+class Limit:
+    rate: float  # tokens per second
+    burst: int
+
+
+def parse_rate(rate) -> float:
+    """``'100/s'``, ``'6000/min'`` or ``'10/hour'`` to tokens per second."""
+    count, period = rate.split('/')
+    return int(count) / PERIODS[period.strip()[0]]
+
+
+def rate_limit_settings():
+    return {**DEFAULTS, **getattr(settings, 'PAYFLOW_RATE_LIMITS', {})}
+
+
+class LocalBucketStore:
+    """Token buckets in process memory, least recently used dropped beyond ``max_keys``."""
+
+    def __init__(self, max_keys=DEFAULTS['MAX_KEYS'], clock=time.monotonic):
+        self.max_keys = max_keys
+        self.clock = clock
+        self._buckets = {}
+        self._lock = threading.Lock()
+
+    def consume(self, key, limit):
+        """Take a token from ``key``'s bucket; returns ``(allowed, seconds until a token is free)``."""
+        now = self.clock()
+        with self._lock:
+            bucket = self._buckets.pop(key, None)
+            tokens = limit.burst if bucket is None else min(limit.burst, bucket[0] + (now - bucket[1]) * limit.rate)
+            allowed = tokens >= 1
+            if allowed:
+                tokens -= 1
+            # Re-inserted so the dict stays in least recently used order
+            self._buckets[key] = (tokens, now)
+            if len(self._buckets) > self.max_keys:
+                del self._buckets[next(iter(self._buckets))]
+        return allowed, 0.0 if allowed else (1 - tokens) / limit.rate
+
+    def clear(self):
+        with self._lock:
+            self._buckets.clear()
+
+
+class CacheBucketStore:
+    """Buckets shared through a Django cache, using only atomic ``add``/``incr``/``decr``."""
+
+    prefix = 'payflow:ratelimit'
+
+    def __init__(self, cache, clock=time.time):
+        self.cache = cache
+        self.clock = clock
+
+    def consume(self, key, limit):
+        now = self.clock()
+        window = limit.burst / limit.rate  # time to refill an empty bucket
+        slot = int(now // window)
+        current = f"{self.prefix}:{key}:{slot}"
+        try:
+            taken = self.cache.incr(current)
+        except ValueError:
+            # First request of the window; a concurrent add may have won the race
+            if self.cache.add(current, 1, timeout=math.ceil(2 * window) + 1):
+                taken = 1
+            else:
+                taken = self.cache.incr(current)
+        previous = self.cache.get(f"{self.prefix}:{key}:{slot - 1}", 0)
+        overlap = 1 - (now - slot * window) / window
+        used = taken + previous * overlap
+        if used <= limit.burst:
+            return True, 0.0
+        # A refused request takes no token
+        self.cache.decr(current)
+        return False, (used - limit.burst) / limit.rate
+
+
+class RateLimiter:
+    def __init__(self, store, limits):
+        self.store = store
+        self.limits = limits
+
+    @classmethod
+    def from_settings(cls):
+        options = rate_limit_settings()
+        if options['BACKEND'] == 'cache':
+            store = CacheBucketStore(caches[options['CACHE']])
+        else:
+            store = LocalBucketStore(options['MAX_KEYS'])
+        limits = {scope: Limit(parse_rate(limit['RATE']), limit['BURST'])
+                  for scope, limit in options['RATES'].items() if limit}
+        return cls(store, limits)
+
+
+_limiter = None
+_limiter_lock = threading.Lock()
+
+
+def get_limiter() -> RateLimiter:
+    global _limiter
+    if _limiter is None:
+        with _limiter_lock:
+            if _limiter is None:
+                _limiter = RateLimiter.from_settings()
+    return _limiter
+
+
+@receiver(setting_changed)
+def reset_limiter(setting, **kwargs):
+    global _limiter
+    if setting == 'PAYFLOW_RATE_LIMITS':
+        _limiter = None
+
+
+def request_value(request, name):
+    data = request.data
+    value = data.get(name) if isinstance(data, Mapping) else None
+    if value in (None, ''):
+        value = request.query_params.get(name)
+    return None if value in (None, '') else str(value)
+
+
+class TokenBucketThrottle(BaseThrottle):
+    """Base for the token-bucket throttles; subclasses set ``scope`` and ``get_key``."""
+
+    scope = None
+
+    def get_key(self, request):
+        raise NotImplementedError
+
+    def get_caller(self, request):
+        return authenticated_principal(request.user) or f"addr:{self.get_ident(request)}"
+
+    def allow_request(self, request, view):
+        limiter = get_limiter()
+        limit = limiter.limits.get(self.scope)
+        key = limit and self.get_key(request)
+        if not key:
+            return True
+        allowed, self._wait = limiter.store.consume(f"{self.scope}:{key}", limit)
+        return allowed
+
+    def wait(self):
+        return self._wait
+
+
+class PrincipalRateThrottle(TokenBucketThrottle):
+    scope = 'principal'
+
+    def get_key(self, request):
+        return self.get_caller(request)
+
+
+class MerchantRateThrottle(TokenBucketThrottle):
+    scope = 'merchant'
+
+    def get_key(self, request):
+        merchant_id = request_value(request, 'merchant_id')
+        return merchant_id and f"{self.get_caller(request)}:{merchant_id}"
+
+
+class UserRateThrottle(TokenBucketThrottle):
+    scope = 'user'
+
+    def get_key(self, request):
+        user_id = request_value(request, 'user_id')
+        return user_id and f"{self.get_caller(request)}:{user_id}"
+
+
+RATE_THROTTLES = [PrincipalRateThrottle, MerchantRateThrottle, UserRateThrottle]
+
+
+class ThrottledRequest:
+    """What the throttles read from a request, for views without a DRF ``Request``."""
+
+    def __init__(self, request, data, user):
+        self.META = request.META
+        self.headers = request.headers
+        self.query_params = request.GET
+        self.data = data
+        self.user = user
+
+
+def throttle_wait(request):
+    """Seconds until ``request`` is within every limit, or None if it is now."""
+    # Like DRF, every throttle is checked even once one has refused
+    waits = [throttle.wait() for throttle in [cls() for cls in RATE_THROTTLES]
+             if not throttle.allow_request(request, None)]
+    return max(waits) if waits else None
+
+
+def athrottled(view):
+    """``RATE_THROTTLES`` for the async function views: a 429 with ``Retry-After`` over any limit."""
+    @wraps(view)
+    async def wrapper(request, *args, **kwargs):
+        throttled = ThrottledRequest(request, request_data(request), await request.auser())
+        wait = await sync_to_async(throttle_wait)(throttled)
+        if wait is not None:
+            error = Throttled(wait)
+            return JsonResponse({'detail': str(error.detail)}, status=error.status_code,
+                                headers={'Retry-After': str(error.wait)})
+        return await view(request, *args, **kwargs)
+    return wrapper
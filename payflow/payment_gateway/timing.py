@@ -0,0 +1,235 @@
+"""
+Per-request stage timers.
+
+``TimingMiddleware`` samples a fraction of requests (``PAYFLOW_TIMING
+['SAMPLE_RATE']``). For a sampled request it collects the time spent in each
+stage:
+
+* ``parse``: request body parsing (DRF parsers, webhook payloads);
+* ``db``: database queries, with their count, through an execute wrapper
+  installed on every connection;
+* ``stripe``: Stripe API calls, in the shared HTTP clients;
+* ``serialize``: serializer output and JSON rendering;
+* ``signals``: payment signal receivers and the side effects they batch.
+
+Stages can overlap (signal receivers run queries), and concurrent Stripe calls
+in the bulk endpoint add up. Durations are observed into the histograms in
+``metrics`` and, with ``SERVER_TIMING`` on, returned in a ``Server-Timing``
+header. An unsampled request pays for one random number and a context
+variable lookup per timer.
+"""
+import contextvars
+import random
+import threading
+import time
+from functools import wraps
+
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction
+from django.conf import settings
+from django.dispatch import Signal
+from rest_framework import parsers, renderers
+
+from . import metrics
+
+STAGES = ('parse', 'db', 'stripe', 'serialize', 'signals')
+
+DEFAULTS = {
+    'SAMPLE_RATE': 0.1,
+    'SERVER_TIMING': True,
+}
+
+_current = contextvars.ContextVar('payflow_request_timings', default=None)
+
+
+def timing_settings():
+    return {**DEFAULTS, **getattr(settings, 'PAYFLOW_TIMING', {})}
+
+
+class RequestTimings:
+    def __init__(self):
+        self.durations = dict.fromkeys(STAGES, 0.0)
+        self.db_queries = 0
+        self._lock = threading.Lock()
+
+    def add(self, name, seconds):
+        with self._lock:
+            self.durations[name] = self.durations.get(name, 0.0) + seconds
+
+    def count_query(self, seconds):
+        with self._lock:
+            self.durations['db'] += seconds
+            self.db_queries += 1
+
+
+class _Timer:
+    __slots__ = ('timings', 'name', 'start')
+
+    def __init__(self, timings, name):
+        self.timings = timings
+        self.name = name
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+
+    def __exit__(self, *exc_info):
+        self.timings.add(self.name, time.perf_counter() - self.start)
+
+
+class _NoopTimer:
+    __slots__ = ()
+
+    def __enter__(self):
+        pass
+
+    def __exit__(self, *exc_info):
+        pass
+
+
+_NOOP = _NoopTimer()
+
+
+def current():
+    """The timings being collected for this request, or None when it is not sampled."""
+    return _current.get()
+
+
+def stage(name):
+    """Context manager adding the block's duration to stage ``name``."""
+    timings = _current.get()
+    if timings is None:
+        return _NOOP
+    return _Timer(timings, name)
+
+
+def timed(name):
+    """Decorator timing every call of a function, sync or async, as stage ``name``."""
+    def decorator(func):
+        if iscoroutinefunction(func):
+            @wraps(func)
+            async def async_wrapper(*args, **kwargs):
+                with stage(name):
+                    return await func(*args, **kwargs)
+            return async_wrapper
+
+        @wraps(func)
+        def wrapper(*args, **kwargs):
+            with stage(name):
+                return func(*args, **kwargs)
+        return wrapper
+    return decorator
+
+
+def record_query(execute, sql, params, many, context):
+    timings = _current.get()
+    if timings is None:
+        return execute(sql, params, many, context)
+    start = time.perf_counter()
+    try:
+        return execute(sql, params, many, context)
+    finally:
+        timings.count_query(time.perf_counter() - start)
+
+
+def install_query_timer(sender, connection, **kwargs):
+    """``connection_created`` receiver adding ``record_query`` to each new connection once."""
+    if record_query not in connection.execute_wrappers:
+        connection.execute_wrappers.append(record_query)
+
+
+class TimedSignal(Signal):
+    """A ``Signal`` whose receivers are timed as the ``signals`` stage."""
+
+    def send(self, sender, **named):
+        with stage('signals'):
+            return super().send(sender, **named)
+
+
+class TimedParserMixin:
+    def parse(self, stream, media_type=None, parser_context=None):
+        with stage('parse'):
+            return super().parse(stream, media_type, parser_context)
+
+
+class JSONParser(TimedParserMixin, parsers.JSONParser):
+    pass
+
+
+class FormParser(TimedParserMixin, parsers.FormParser):
+    pass
+
+
+class MultiPartParser(TimedParserMixin, parsers.MultiPartParser):
+    pass
+
+
+class JSONRenderer(renderers.JSONRenderer):
+    def render(self, data, accepted_media_type=None, renderer_context=None):
+        with stage('serialize'):
+            return super().render(data, accepted_media_type, renderer_context)
+
+
+def server_timing(timings, total):
+    entries = [
+        f"{name};dur={seconds * 1000:.2f}" + (f';desc="{timings.db_queries} queries"' if name == 'db' else '')
+        for name, seconds in timings.durations.items()
+        if seconds or name == 'db' and timings.db_queries
+    ]
+    entries.append(f"total;dur={total * 1000:.2f}")
+    return ', '.join(entries)
+
+
+class TimingMiddleware:
+    """Time sampled requests stage by stage; see the module docstring."""
+
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        if iscoroutinefunction(get_response):
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if iscoroutinefunction(self):
+            return self.__acall__(request)
+        config = self.sample(request)
+        if config is None:
+            return self.get_response(request)
+        timings = RequestTimings()
+        token = _current.set(timings)
+        start = time.perf_counter()
+        try:
+            response = self.get_response(request)
+        finally:
+            _current.reset(token)
+        return self.finish(request, response, timings, time.perf_counter() - start, config)
+
+    async def __acall__(self, request):
+        config = self.sample(request)
+        if config is None:
+            return await self.get_response(request)
+        timings = RequestTimings()
+        token = _current.set(timings)
+        start = time.perf_counter()
+        try:
+            response = await self.get_response(request)
+        finally:
+            _current.reset(token)
+        return self.finish(request, response, timings, time.perf_counter() - start, config)
+
+    def sample(self, request):
+        config = timing_settings()
+        rate = config['SAMPLE_RATE']
+        if rate <= 0 or (rate < 1 and random.random() >= rate):
+            return None
+        if request.path == metrics.METRICS_PATH:
+            return None
+        return config
+
+    def finish(self, request, response, timings, total, config):
+        match = request.resolver_match
+        view = match.view_name if match else 'unmatched'
+        metrics.observe_request(view, request.method, total, timings.durations, timings.db_queries)
+        if config['SERVER_TIMING']:
+            response['Server-Timing'] = server_timing(timings, total)
+        return response
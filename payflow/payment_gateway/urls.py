@@ -3,7 +3,8 @@ from rest_framework.routers import DefaultRouter
 from .views_api import (
     UserViewSet, MerchantViewSet, PaymentMethodViewSet, 
     TransactionViewSet, TransactionLogViewSet, 
-    PaymentGatewayViewSet, SubscriptionViewSet
+    PaymentGatewayViewSet, SubscriptionViewSet, TransactionRollupViewSet,
+    TransactionExportView, TransactionLogExportView, ConfigCacheStatsView, GatewayStatsView
 )
 
 # Create a router for the API viewsets
@@ -15,10 +16,19 @@ router.register(r'transactions', TransactionViewSet)
 router.register(r'transaction-logs', TransactionLogViewSet)
 router.register(r'payment-gateways', PaymentGatewayViewSet)
 router.register(r'subscriptions', SubscriptionViewSet)
+router.register(r'rollups', TransactionRollupViewSet)
 
 urlpatterns = [
     # Include the payment gateway URLs for version 1 to allow for versioning of the API
     path('v1/', include('payment_gateway.urls_v1')),
+    # Async versions of the payment endpoints, for ASGI deployments
+    path('v1/async/', include('payment_gateway.urls_async')),
+    # Streaming exports; listed before the router so 'export' is not taken as a pk
+    path('v1/resources/transactions/export/', TransactionExportView.as_view(), name='transaction-export'),
+    path('v1/resources/transaction-logs/export/', TransactionLogExportView.as_view(), name='transaction-log-export'),
+    # Per-worker cache counters, for staff
+    path('v1/internal/config-cache/', ConfigCacheStatsView.as_view(), name='config-cache-stats'),
+    path('v1/internal/gateways/', GatewayStatsView.as_view(), name='gateway-stats'),
     # Include the REST API endpoints for model resources
     path('v1/resources/', include(router.urls)),
 ] + router.urls
\ No newline at end of file
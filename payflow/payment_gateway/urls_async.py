@@ -0,0 +1,9 @@
+from django.urls import path
+from . import views_async
+
+urlpatterns = [
+    path('create-payment-intent/', views_async.create_payment_intent, name='async-create-payment-intent'),
+    path('create-payment-link/', views_async.create_payment_link, name='async-create-payment-link'),
+    path('checkout-session/', views_async.checkout_session, name='async-checkout-session'),
+    path('webhook/', views_async.webhook, name='async-webhook'),
+]
@@ -3,6 +3,7 @@ from .views import StripePaymentView, StripeWebhookView
 
 urlpatterns = [
     path('create-payment-intent/', StripePaymentView.as_view({'post': 'create_payment_intent'}), name='create-payment-intent'),
+    path('create-payment-intents/', StripePaymentView.as_view({'post': 'create_payment_intents'}), name='create-payment-intents'),
     path('create-payment-link/', StripePaymentView.as_view({'post': 'create_payment_link'}), name='create-payment-link'),
     path('checkout-session/', StripePaymentView.as_view({'post': 'checkout_session'}), name='checkout-session'),
     path('success/', StripePaymentView.as_view({'get': 'payment_success'}), name='success'),
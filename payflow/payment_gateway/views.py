@@ -1,20 +1,142 @@
-import os
 from django.shortcuts import get_object_or_404
 from decimal import Decimal
 from django.urls import reverse
 import logging
-from django.conf import settings
 from rest_framework.views import APIView
 from rest_framework.viewsets import ViewSet
 from rest_framework.response import Response
 from rest_framework import status
 from .models import Transaction, TransactionLog, Merchant, PaymentMethod, User
-from .signals import payment_processed, payment_failed, user_balance_updated
+from .signals import payment_processed, payment_failed, user_balance_updated, log_captured
+from . import webhooks
+from . import effects, timing
+from .idempotency import idempotent, stripe_options
+from .dedup import processed_events
+from .context import load_payment_context, load_payment_contexts
+from .serializers import BulkChargeSerializer
+from .throttling import RATE_THROTTLES
+from . import bulk, gateways
 import stripe
 
 logger = logging.getLogger(__name__)
 
-stripe.api_key = settings.STRIPE_SECRET_KEY
+
+def payment_intent_params(data):
+    return {
+        'amount': int(Decimal(data.get('amount', 0)) * 100),
+        'currency': 'usd',
+        'payment_method': data.get('payment_method_id', ''),
+        'confirmation_method': 'manual',
+        'confirm': True,
+        'metadata': {
+            'user_id': data.get('user_id'),
+            'description': data.get('description', '')
+        }
+    }
+
+
+def payment_link_params(request, data):
+    return {
+        'line_items': [{
+            'price_data': {
+                'currency': 'usd',
+                'product_data': {
+                    'name': data.get('product_name', 'Product'),
+                    'description': data.get('description', ''),
+                },
+                'unit_amount': int(Decimal(data.get('amount', 0)) * 100),
+            },
+            'quantity': 1,
+        }],
+        'after_completion': {
+            'type': 'redirect',
+            'redirect': {
+                'url': request.build_absolute_uri(reverse('success')),
+            },
+        },
+        'metadata': {
+            'user_id': data.get('user_id'),
+            'description': data.get('description', '')
+        }
+    }
+
+
+def checkout_session_params(request, data, user):
+    return {
+        'payment_method_types': ['card'],
+        'line_items': [
+            {
+                'price_data': {
+                    'currency': 'usd',
+                    'product_data': {
+                        'name': data.get('product_name', 'Product'),
+                    },
+                    'unit_amount': int(Decimal(data.get('amount', 0)) * 100),
+                },
+                'quantity': 1,
+            },
+        ],
+        'mode': 'payment',
+        'customer': user.stripe_customer_id if hasattr(user, 'stripe_customer_id') else None,
+        'success_url': request.build_absolute_uri(reverse('success')) + '?session_id={CHECKOUT_SESSION_ID}',
+        'cancel_url': request.build_absolute_uri(reverse('cancel')) + '?cancel=true',
+        'metadata': {
+            'user_id': data.get('user_id'),
+            'description': data.get('description', '')
+        }
+    }
+
+
+def record_payment(sender, context, data, intent):
+    """Record a succeeded payment intent and credit the ledger atomically."""
+    # Create a default payment method if none exists
+    payment_method = context.ensure_payment_method(data.get('payment_method_id', ''))
+    
+    with effects.batch():
+        transaction = Transaction.objects.create(
+            user=context.user,
+            merchant=context.merchant,
+            payment_method=payment_method,
+            amount=Decimal(data.get('amount', 0)),
+            description=data.get('description', ''),
+            status='completed',
+            gateway_payment_intent_id=intent.id
+        )
+        log_captured(transaction)
+        
+        # Send signal that payment was processed
+        payment_processed.send(
+            sender=sender,
+            transaction=transaction
+        )
+    return transaction
+
+
+def record_failed_payment(sender, context, data, error):
+    with effects.batch():
+        transaction = Transaction.objects.create(
+            user=context.user,
+            merchant=context.merchant,
+            payment_method=context.payment_method,
+            amount=Decimal(data.get('amount', 0)),
+            description=data.get('description', ''),
+            status='failed'
+        )
+        
+        payment_failed.send(
+            sender=sender,
+            transaction=transaction,
+            error_message=str(error)
+        )
+    return transaction
+
+
+def gateway_unavailable(error):
+    """503 for a payment call refused before reaching a gateway (open circuit or full bulkhead)."""
+    return Response(status=status.HTTP_503_SERVICE_UNAVAILABLE, data=str(error),
+                    headers=gateways.retry_after_headers(error))
+
+
 # Create your views here.
 class StripePaymentView(ViewSet):
     """
@@ -22,8 +144,9 @@ class StripePaymentView(ViewSet):
     
     Version: v1
     """
-    stripe.api_key = os.getenv('STRIPE_SECRET_KEY')
+    throttle_classes = RATE_THROTTLES
 
+    @idempotent
     def create_payment_intent(self, request):
         try:
             amount = request.data.get('amount', 0)
@@ -33,147 +156,94 @@ class StripePaymentView(ViewSet):
             if amount is None or payment_method_id is None or user_id is None or float(amount) <= 0:
                 return Response(status=status.HTTP_400_BAD_REQUEST, data="Amount must be a positive number, and payment method ID, and user ID are required.")
             
-            user = get_object_or_404(User, pk=user_id)
+            context = load_payment_context(user_id, request.data.get('merchant_id'))
             
-            intent = stripe.PaymentIntent.create(
-                amount=int(Decimal(amount) * 100),
-                currency='usd',
-                payment_method=payment_method_id,
-                confirmation_method='manual',
-                confirm=True,
-                metadata={
-                    'user_id': user_id,
-                    'description': request.data.get('description', '')
-                }
-            )
+            intent = gateways.create_payment_intent(payment_intent_params(request.data), **stripe_options())
 
             if intent.status == 'succeeded':
-                # Get merchant - either from request or default to first merchant
-                merchant_id = request.data.get('merchant_id')
-                if merchant_id:
-                    merchant = get_object_or_404(Merchant, pk=merchant_id)
-                else:
-                    merchant = Merchant.objects.first()
-                
-                # Get payment method - either from request or default to first for user
-                payment_method = PaymentMethod.objects.filter(user=user).first()
-                if not payment_method:
-                    # Create a default payment method if none exists
-                    payment_method = PaymentMethod.objects.create(
-                        user=user,
-                        method_type='credit_card',
-                        gateway_payment_method_token=payment_method_id,
-                        last_four_digits='1234'  # Default value
-                    )
-                
-                transaction = Transaction.objects.create(
-                    user=user,
-                    merchant=merchant,
-                    payment_method=payment_method,
-                    amount=Decimal(amount),
-                    description=request.data.get('description', ''),
-                    status='completed'
-                )
-                
-                # Send signal that payment was processed
-                payment_processed.send(
-                    sender=self.__class__,
-                    transaction=transaction
-                )
+                record_payment(self.__class__, context, request.data, intent)
             
             return Response(status=status.HTTP_200_OK, data=intent)
             
+        except gateways.GatewayRejected as e:
+            return gateway_unavailable(e)
         except stripe.error.CardError as e:
             return Response(status=status.HTTP_400_BAD_REQUEST, data=e.error.message)
         except stripe.error.StripeError as e:
             # If we have user info, create a failed transaction and send signal
-            if 'user' in locals():
-                merchant = Merchant.objects.first()
-                payment_method = PaymentMethod.objects.filter(user=user).first()
-                if payment_method:
-                    transaction = Transaction.objects.create(
-                        user=user,
-                        merchant=merchant,
-                        payment_method=payment_method,
-                        amount=Decimal(amount),
-                        description=request.data.get('description', ''),
-                        status='failed'
-                    )
-                    
-                    payment_failed.send(
-                        sender=self.__class__,
-                        transaction=transaction,
-                        error_message=str(e)
-                    )
+            if 'context' in locals() and context.payment_method:
+                record_failed_payment(self.__class__, context, request.data, e)
                 
             return Response(status=status.HTTP_400_BAD_REQUEST, data=str(e))
         except Exception as e:
             logger.error(f"An error occurred: {str(e)}")
             return Response(status=status.HTTP_500_INTERNAL_SERVER_ERROR, data="An internal error occurred.")
             
+    @idempotent
+    def create_payment_intents(self, request):
+        """
+        Create payment intents for a batch of charges.
+
+        Every charge is validated before any is sent to Stripe. The response
+        lists each charge's outcome; it is 207 if any of them failed, and 503
+        with ``Retry-After`` if any was rejected before reaching a gateway.
+        A retry with the same key records only the charges not yet recorded.
+        """
+        serializer = BulkChargeSerializer(data=request.data)
+        if not serializer.is_valid():
+            return Response(status=status.HTTP_400_BAD_REQUEST, data=serializer.errors)
+        charges = serializer.validated_data['charges']
+        
+        try:
+            contexts = load_payment_contexts([charge['user_id'] for charge in charges],
+                                             serializer.validated_data.get('merchant_id'))
+            errors = bulk.missing_users(charges, contexts)
+            if errors:
+                return Response(status=status.HTTP_400_BAD_REQUEST, data={'charges': errors})
+            
+            outcomes = bulk.call_gateway(
+                charges, lambda index, charge: gateways.create_payment_intent(payment_intent_params(charge),
+                                                                            **stripe_options(index))
+            )
+            results = bulk.record_results(charges, contexts, outcomes, sender=self.__class__)
+        except Exception as e:
+            logger.error(f"An error occurred: {str(e)}")
+            return Response(status=status.HTTP_500_INTERNAL_SERVER_ERROR, data="An internal error occurred.")
+        
+        rejected = [outcome for outcome in outcomes if isinstance(outcome, gateways.GatewayRejected)]
+        if rejected:
+            # Not stored under the key, so the client can retry the batch
+            return Response(status=status.HTTP_503_SERVICE_UNAVAILABLE, data={'results': results},
+                            headers=gateways.retry_after_headers(
+                                max(rejected, key=lambda error: error.retry_after or 0)))
+        failed = any(result['status'] == 'failed' for result in results)
+        return Response(status=status.HTTP_207_MULTI_STATUS if failed else status.HTTP_200_OK,
+                        data={'results': results})
+            
+    @idempotent
     def create_payment_link(self, request):
         try:
             user_id = request.data.get('user_id')
             amount = request.data.get('amount', 0)
-            product_name = request.data.get('product_name', 'Product')
             description = request.data.get('description', '')
             
             if not user_id or not amount:
                 return Response(status=status.HTTP_400_BAD_REQUEST, data="User ID and amount are required.")
             
-            user = get_object_or_404(User, pk=user_id)
+            context = load_payment_context(user_id, request.data.get('merchant_id'))
+            if not context.merchant:
+                return Response(status=status.HTTP_400_BAD_REQUEST, data="No merchant available.")
             
-            payment_link = stripe.PaymentLink.create(
-                line_items=[{
-                    'price_data': {
-                        'currency': 'usd',
-                        'product_data': {
-                            'name': product_name,
-                            'description': description,
-                        },
-                        'unit_amount': int(Decimal(amount) * 100),
-                    },
-                    'quantity': 1,
-                }],
-                after_completion={
-                    'type': 'redirect',
-                    'redirect': {
-                        'url': request.build_absolute_uri(reverse('success')),
-                    },
-                },
-                metadata={
-                    'user_id': user_id,
-                    'description': description
-                }
-            )
+            payment_link = gateways.create_payment_link(payment_link_params(request, request.data), **stripe_options())
 
-            # Get merchant - either from request or default to first merchant
-            merchant_id = request.data.get('merchant_id')
-            if merchant_id:
-                merchant = get_object_or_404(Merchant, pk=merchant_id)
-            else:
-                merchant = Merchant.objects.first()
-                if not merchant:
-                    return Response(status=status.HTTP_400_BAD_REQUEST, data="No merchant available.")
-            
-            # Get payment method - either from request or default to first for user
-            payment_method = PaymentMethod.objects.filter(user=user).first()
-            if not payment_method:
-                # Create a default payment method if none exists
-                payment_method = PaymentMethod.objects.create(
-                    user=user,
-                    method_type='credit_card',
-                    gateway_payment_method_token='pm_default',
-                    last_four_digits='1234'  # Default value
-                )
-            
             transaction = Transaction.objects.create(
-                user=user,
-                merchant=merchant,
-                payment_method=payment_method,
+                user=context.user,
+                merchant=context.merchant,
+                payment_method=context.ensure_payment_method('pm_default'),
                 amount=Decimal(amount),
                 description=description,
-                status='pending'
+                status='pending',
+                gateway_payment_link_id=payment_link.id
             )
             
             # Log the transaction
@@ -181,7 +251,8 @@ class StripePaymentView(ViewSet):
                 transaction=transaction,
                 log_message=f"Payment link created: {payment_link.url}",
                 log_type='initiated',
-                user=user
+                user=context.user,
+                additional_info={'payment_link_id': payment_link.id}
             )
             
             return Response({
@@ -189,44 +260,48 @@ class StripePaymentView(ViewSet):
                 'transaction_id': transaction.id
             }, status=status.HTTP_201_CREATED)
             
+        except gateways.GatewayRejected as e:
+            return gateway_unavailable(e)
         except stripe.error.StripeError as e:
             return Response(status=status.HTTP_400_BAD_REQUEST, data=str(e))
         except Exception as e:
             logger.error(f"An error occurred: {str(e)}")
             return Response(status=status.HTTP_500_INTERNAL_SERVER_ERROR, data="An internal error occurred.")
         
+    @idempotent
     def checkout_session(self, request):
         try:
             user_id = request.data.get('user_id')
             if not user_id:
                 return Response(status=status.HTTP_400_BAD_REQUEST, data="User ID is required.")
                 
-            user = get_object_or_404(User, pk=user_id)
+            context = load_payment_context(user_id, request.data.get('merchant_id'))
+            user = context.user
             
-            session = stripe.checkout.Session.create(
-                payment_method_types=['card'],
-                line_items=[
-                    {
-                        'price_data': {
-                            'currency': 'usd',
-                            'product_data': {
-                                'name': request.data.get('product_name', 'Product'),
-                            },
-                            'unit_amount': int(Decimal(request.data.get('amount', 0)) * 100),
-                        },
-                        'quantity': 1,
-                    },
-                ],
-                mode='payment',
-                customer=user.stripe_customer_id if hasattr(user, 'stripe_customer_id') else None,\
-                success_url=request.build_absolute_uri(reverse('success')) + '?session_id={CHECKOUT_SESSION_ID}',
-                cancel_url=request.build_absolute_uri(reverse('cancel')) + '?cancel=true',
-                metadata={
-                    'user_id': user_id,
-                    'description': request.data.get('description', '')
-                }
+            session = gateways.create_checkout_session(checkout_session_params(request, request.data, user),
+                                                       **stripe_options())
+
+            transaction = Transaction.objects.create(
+                user=user,
+                merchant=context.merchant,
+                payment_method=context.ensure_payment_method('pm_default'),
+                amount=Decimal(request.data.get('amount', 0)),
+                description=request.data.get('description', ''),
+                status='pending',
+                gateway_checkout_session_id=session.id,
+                gateway_payment_intent_id=getattr(session, 'payment_intent', None) or ''
+            )
+
+            TransactionLog.objects.create(
+                transaction=transaction,
+                log_message=f"Checkout session created: {session.id}",
+                log_type='initiated',
+                user=user,
+                additional_info={'checkout_session_id': session.id}
             )
             return Response(status=status.HTTP_200_OK, data=session)
+        except gateways.GatewayRejected as e:
+            return gateway_unavailable(e)
         except Exception as e:
             logger.error(f"An error occurred: {str(e)}")
             return Response(status=status.HTTP_500_INTERNAL_SERVER_ERROR, data="An internal error occurred.")
@@ -237,18 +312,22 @@ class StripePaymentView(ViewSet):
             if session_id:
                 # Try to find transaction related to this session
                 transaction = Transaction.objects.filter(
-                    payment_method__gateway_payment_method_token=session_id
+                    gateway_checkout_session_id=session_id
                 ).first()
                 
                 if transaction:
-                    transaction.status = 'completed'
-                    transaction.save()
-                    
-                    # Send signal that payment was processed
-                    payment_processed.send(
-                        sender=self.__class__,
-                        transaction=transaction
-                    )
+                    with effects.batch():
+                        # Only the first completion (redirect or webhook) credits the balance
+                        if Transaction.objects.filter(pk=transaction.pk).exclude(status='completed').update(status='completed'):
+                            transaction.status = 'completed'
+                            # update() sends no post_save
+                            effects.add_rollup(transaction)
+                            
+                            # Send signal that payment was processed
+                            payment_processed.send(
+                                sender=self.__class__,
+                                transaction=transaction
+                            )
                     
             return Response(status=status.HTTP_200_OK, data="Payment was successful!")
     def log_transaction(self, request, user, intent, log_type):
@@ -277,7 +356,7 @@ class StripePaymentView(ViewSet):
             if session_id:
                 # Try to find transaction related to this session
                 transaction = Transaction.objects.filter(
-                    payment_method__gateway_payment_method_token=session_id
+                    gateway_checkout_session_id=session_id
                 ).first()
                 
                 if transaction:
@@ -322,32 +401,16 @@ class StripeWebhookView(APIView):
         event = None
         
         try:
-            event = stripe.Webhook.construct_event(
-                payload, sig_header, stripe.api_key  # Use your actual Stripe webhook secret here
-            )
-            # Handle Stripe webhook events
-            if event.type == 'payment_intent.succeeded':
-                payment_intent = event.data.object
-                logger.info(f"PaymentIntent was successful: {payment_intent.id}")
-                self.log_transaction_event(payment_intent.id, 'succeeded')
-            elif event.type == 'payment_intent.payment_failed':
-                payment_intent = event.data.object
-                logger.error(f"PaymentIntent failed: {payment_intent.id}")
-                self.log_transaction_event(payment_intent.id, 'failed')
-            elif event.type == 'checkout.session.completed':
-                session = event.data.object
-                logger.info(f"Checkout session completed: {session.id}")
-                self.log_transaction_event(session, 'completed')
-            elif event.type == 'checkout.session.async_payment_succeeded':
-                session = event.data.object
-                logger.info(f"Async payment succeeded for session: {session.id}")
-                self.log_transaction_event(session, 'completed')
-            elif event.type == 'checkout.session.async_payment_failed':
-                session = event.data.object
-                logger.error(f"Async payment failed for session: {session.id}")
-                self.log_transaction_event(session, 'failed')
-            else:
-                logger.info(f"Unhandled event type: {event.type}")
+            with timing.stage('parse'):
+                event = stripe.Webhook.construct_event(
+                    payload, sig_header, stripe.api_key  # Use your actual Stripe webhook secret here
+                )
+            if webhooks.inbox_enabled():
+                if processed_events.seen(event.id):
+                    return Response(status=status.HTTP_200_OK, data="Webhook already processed")
+                webhooks.enqueue_event(payload)
+                return Response(status=status.HTTP_200_OK, data="Webhook queued successfully")
+            self.handle_event(event)
             return Response(status=status.HTTP_200_OK, data="Webhook received successfully")
         except ValueError as e:
             return Response(status=status.HTTP_400_BAD_REQUEST, data=f"Invalid payload: {str(e)}")
@@ -357,28 +420,95 @@ class StripeWebhookView(APIView):
             logger.error(f"Error processing webhook: {str(e)}")
             return Response(status=status.HTTP_500_INTERNAL_SERVER_ERROR, data="An internal error occurred.")
 
-    def log_transaction_event(self, event_object, status):
-        payment_method_token = getattr(event_object, 'payment_method', None)
-        if payment_method_token:
-            transaction = Transaction.objects.filter(payment_method__gateway_payment_method_token=payment_method_token).first()
+    def handle_event(self, event):
+        # Claim the event id and apply its effects atomically so that a
+        # redelivered event is dropped before any Transaction query runs.
+        with effects.batch():
+            if not processed_events.claim(event.id, event.type):
+                logger.info("Ignoring duplicate webhook event %s", event.id)
+                return
+            self.dispatch_event(event)
+
+    def dispatch_event(self, event):
+        # Handle Stripe webhook events
+        if event.type == 'payment_intent.succeeded':
+            payment_intent = event.data.object
+            logger.info(f"PaymentIntent was successful: {payment_intent.id}")
+            self.log_transaction_event(payment_intent, 'completed')
+        elif event.type == 'payment_intent.payment_failed':
+            payment_intent = event.data.object
+            logger.error(f"PaymentIntent failed: {payment_intent.id}")
+            self.log_transaction_event(payment_intent, 'failed')
+        elif event.type == 'checkout.session.completed':
+            session = event.data.object
+            logger.info(f"Checkout session completed: {session.id}")
+            self.log_transaction_event(session, 'completed')
+        elif event.type == 'checkout.session.async_payment_succeeded':
+            session = event.data.object
+            logger.info(f"Async payment succeeded for session: {session.id}")
+            self.log_transaction_event(session, 'completed')
+        elif event.type == 'checkout.session.async_payment_failed':
+            session = event.data.object
+            logger.error(f"Async payment failed for session: {session.id}")
+            self.log_transaction_event(session, 'failed')
+        else:
+            logger.info(f"Unhandled event type: {event.type}")
+
+    def find_transaction(self, event_object):
+        """Look up the transaction for a PaymentIntent or Checkout Session by its gateway id."""
+        object_type = getattr(event_object, 'object', None)
+        if object_type == 'payment_intent':
+            return Transaction.objects.select_related('user').filter(gateway_payment_intent_id=event_object.id).first()
+        if object_type != 'checkout.session':
+            return None
+
+        transaction = Transaction.objects.select_related('user').filter(gateway_checkout_session_id=event_object.id).first()
+        if transaction is None and getattr(event_object, 'payment_link', None):
+            # Sessions started from a payment link are only known once Stripe
+            # reports them, so attach the session to the link's pending transaction.
+            transaction = Transaction.objects.select_related('user').filter(
+                gateway_payment_link_id=event_object.payment_link,
+                gateway_checkout_session_id='',
+                status='pending'
+            ).order_by('created_at').first()
             if transaction:
-                old_status = transaction.status
+                transaction.gateway_checkout_session_id = event_object.id
+        if transaction and not transaction.gateway_payment_intent_id and getattr(event_object, 'payment_intent', None):
+            transaction.gateway_payment_intent_id = event_object.payment_intent
+        return transaction
+
+    def log_transaction_event(self, event_object, status):
+        transaction = self.find_transaction(event_object)
+        if transaction:
+            with effects.batch():
+                # A conditional update rather than save(): of two deliveries for
+                # one payment handled at once (the success redirect and a webhook,
+                # or checkout.session.completed and payment_intent.succeeded) only
+                # the one that moves the row sends the signal and credits it
+                changed = Transaction.objects.filter(pk=transaction.pk).exclude(status=status).update(
+                    status=status,
+                    gateway_checkout_session_id=transaction.gateway_checkout_session_id,
+                    gateway_payment_intent_id=transaction.gateway_payment_intent_id,
+                )
                 transaction.status = status
-                transaction.save()
-                
+                if changed:
+                    # update() sends no post_save
+                    effects.add_rollup(transaction)
+
                 # Create transaction log
                 TransactionLog.objects.create(
                     transaction=transaction,
                     log_message="Webhook event processed",
-                    log_type=status,
-                    user=transaction.user,
-                    merchant=transaction.merchant,
-                    payment_method=transaction.payment_method,
+                    log_type='captured' if status == 'completed' else status,
+                    user_id=transaction.user_id,
+                    merchant_id=transaction.merchant_id,
+                    payment_method_id=transaction.payment_method_id,
                     additional_info=event_object.metadata if hasattr(event_object, 'metadata') else None
                 )
-                
-                # Send appropriate signal based on status
-                if status == 'completed' or status == 'succeeded':
+
+                if not changed:
+                    return
+                if status == 'completed':
                     payment_processed.send(
                         sender=self.__class__,
                         transaction=transaction
@@ -1,22 +1,41 @@
-from rest_framework import viewsets
-from .models import User, Transaction, Merchant, PaymentMethod, TransactionLog, PaymentGateway, Subscriptions
+from rest_framework import permissions, renderers, viewsets
+from rest_framework.decorators import action
+from rest_framework.exceptions import ValidationError
+from rest_framework.response import Response
+from rest_framework.views import APIView
+from django.db.models import Q, Sum
+from .models import (
+    User, Transaction, Merchant, PaymentMethod, TransactionLog, PaymentGateway, Subscriptions, TransactionRollup
+)
 from .serializers import (
     UserSerializer, TransactionSerializer, MerchantSerializer, 
     PaymentMethodSerializer, TransactionLogSerializer, 
-    PaymentGatewaySerializer, SubscriptionSerializer
+    PaymentGatewaySerializer, SubscriptionSerializer, TransactionRollupSerializer, RollupTotalsSerializer
+)
+from .pagination import KeysetPagination
+from .exports import filter_export_queryset, parse_boundary, parse_id, streaming_export
+from .fast_serializers import (
+    FastJSONRenderer, FastListMixin, TransactionValuesSerializer, TransactionLogValuesSerializer,
+    get_values_serializer
 )
+from . import archive, config_cache, gateways
+from .db_routing import ReplicaReadMixin, read_alias
+from .throttling import RATE_THROTTLES
 
-class UserViewSet(viewsets.ModelViewSet):
+class UserViewSet(ReplicaReadMixin, viewsets.ModelViewSet):
     queryset = User.objects.all()
     serializer_class = UserSerializer
+    throttle_classes = RATE_THROTTLES
 
-class MerchantViewSet(viewsets.ModelViewSet):
+class MerchantViewSet(ReplicaReadMixin, viewsets.ModelViewSet):
     queryset = Merchant.objects.all()
     serializer_class = MerchantSerializer
+    throttle_classes = RATE_THROTTLES
 
-class PaymentMethodViewSet(viewsets.ModelViewSet):
+class PaymentMethodViewSet(ReplicaReadMixin, viewsets.ModelViewSet):
     queryset = PaymentMethod.objects.all()
     serializer_class = PaymentMethodSerializer
+    throttle_classes = RATE_THROTTLES
     
     def get_queryset(self):
         queryset = PaymentMethod.objects.all()
@@ -25,9 +44,13 @@ class PaymentMethodViewSet(viewsets.ModelViewSet):
             queryset = queryset.filter(user_id=user_id)
         return queryset
 
-class TransactionViewSet(viewsets.ModelViewSet):
+class TransactionViewSet(ReplicaReadMixin, FastListMixin, viewsets.ModelViewSet):
     queryset = Transaction.objects.all()
     serializer_class = TransactionSerializer
+    throttle_classes = RATE_THROTTLES
+    fast_serializer_class = TransactionValuesSerializer
+    renderer_classes = [FastJSONRenderer, renderers.BrowsableAPIRenderer]
+    pagination_class = KeysetPagination
     
     def get_queryset(self):
         queryset = Transaction.objects.all()
@@ -36,9 +59,13 @@ class TransactionViewSet(viewsets.ModelViewSet):
             queryset = queryset.filter(user_id=user_id)
         return queryset
 
-class TransactionLogViewSet(viewsets.ModelViewSet):
+class TransactionLogViewSet(ReplicaReadMixin, FastListMixin, viewsets.ModelViewSet):
     queryset = TransactionLog.objects.all()
     serializer_class = TransactionLogSerializer
+    throttle_classes = RATE_THROTTLES
+    fast_serializer_class = TransactionLogValuesSerializer
+    renderer_classes = [FastJSONRenderer, renderers.BrowsableAPIRenderer]
+    pagination_class = KeysetPagination
     
     def get_queryset(self):
         queryset = TransactionLog.objects.all()
@@ -47,17 +74,123 @@ class TransactionLogViewSet(viewsets.ModelViewSet):
             queryset = queryset.filter(transaction_id=transaction_id)
         return queryset
 
-class PaymentGatewayViewSet(viewsets.ModelViewSet):
+    @action(detail=False)
+    def archived(self, request):
+        """Logs of ``?transaction_id=`` that have been moved to the log archive."""
+        try:
+            transaction_id = int(request.query_params['transaction_id'])
+        except (KeyError, ValueError):
+            raise ValidationError("transaction_id is required and must be an integer.")
+        fast = get_values_serializer(TransactionLogValuesSerializer)
+        return Response(fast.to_representation_many(archive.archived_logs(transaction_id)))
+
+class PaymentGatewayViewSet(ReplicaReadMixin, viewsets.ModelViewSet):
     queryset = PaymentGateway.objects.all()
     serializer_class = PaymentGatewaySerializer
+    throttle_classes = RATE_THROTTLES
 
-class SubscriptionViewSet(viewsets.ModelViewSet):
+class SubscriptionViewSet(ReplicaReadMixin, viewsets.ModelViewSet):
     queryset = Subscriptions.objects.all()
     serializer_class = SubscriptionSerializer
+    throttle_classes = RATE_THROTTLES
     
     def get_queryset(self):
         queryset = Subscriptions.objects.all()
         user_id = self.request.query_params.get('user_id', None)
         if user_id is not None:
             queryset = queryset.filter(user_id=user_id)
-        return queryset
\ No newline at end of file
+        return queryset
+
+class TransactionRollupViewSet(ReplicaReadMixin, viewsets.ReadOnlyModelViewSet):
+    """
+    Pre-aggregated transaction counts and amounts, for dashboards.
+
+    Query parameters: ``grain`` (``hour`` or ``day``, default ``day``),
+    ``scope`` (``merchant`` or ``user``, default ``merchant``), ``scope_id``,
+    ``status`` and ``start``/``end`` on the bucket.
+    """
+    queryset = TransactionRollup.objects.all()
+    serializer_class = TransactionRollupSerializer
+    throttle_classes = RATE_THROTTLES
+    replica_actions = ('list', 'retrieve', 'totals')
+
+    def get_queryset(self):
+        params = self.request.query_params
+        grain, scope = params.get('grain', 'day'), params.get('scope', 'merchant')
+        if grain not in dict(TransactionRollup.GRAINS) or scope not in dict(TransactionRollup.SCOPES):
+            raise ValidationError("grain must be hour or day, and scope merchant or user.")
+        queryset = TransactionRollup.objects.filter(grain=grain, scope=scope)
+        if params.get('scope_id') is not None:
+            queryset = queryset.filter(scope_id=parse_id('scope_id', params['scope_id']))
+        if params.get('status') is not None:
+            queryset = queryset.filter(status=params['status'])
+        if params.get('start'):
+            queryset = queryset.filter(bucket__gte=parse_boundary(params['start']))
+        if params.get('end'):
+            queryset = queryset.filter(bucket__lte=parse_boundary(params['end'], end=True))
+        return queryset.order_by('bucket', 'scope_id', 'status')
+
+    @action(detail=False)
+    def totals(self, request):
+        """Count and amount per bucket over all statuses, and of failed transactions."""
+        failed = Q(status='failed')
+        rows = (self.filter_queryset(self.get_queryset()).order_by('bucket').values('bucket')
+                .annotate(total_count=Sum('transaction_count'), total_amount=Sum('amount'),
+                          failed_count=Sum('transaction_count', filter=failed, default=0),
+                          failed_amount=Sum('amount', filter=failed, default=0)))
+        return Response(RollupTotalsSerializer(rows, many=True).data)
+
+class ExportView(APIView):
+    """
+    Stream a model's full history as NDJSON (default) or CSV.
+
+    Query parameters: ``start``/``end`` (ISO date or datetime), the view's
+    id filters, ``output=ndjson|csv`` and ``gzip=true``.
+    """
+    model = None
+    serializer_class = None
+    throttle_classes = RATE_THROTTLES
+    fast_serializer_class = None
+    filter_fields = ()
+    filename = None
+
+    def get(self, request, *args, **kwargs):
+        params = request.query_params
+        queryset = filter_export_queryset(self.model.objects.using(read_alias(request)), params, self.filter_fields)
+        return streaming_export(
+            queryset,
+            self.serializer_class(),
+            self.filename,
+            output=params.get('output', 'ndjson'),
+            compress=params.get('gzip', '').lower() in ('1', 'true'),
+            fast_serializer=get_values_serializer(self.fast_serializer_class) if self.fast_serializer_class else None,
+        )
+
+class TransactionExportView(ExportView):
+    model = Transaction
+    serializer_class = TransactionSerializer
+    fast_serializer_class = TransactionValuesSerializer
+    filter_fields = ('user_id', 'merchant_id', 'status')
+    filename = 'transactions'
+
+class TransactionLogExportView(ExportView):
+    model = TransactionLog
+    serializer_class = TransactionLogSerializer
+    fast_serializer_class = TransactionLogValuesSerializer
+    filter_fields = ('transaction_id', 'user_id', 'merchant_id', 'log_type')
+    filename = 'transaction-logs'
+
+class ConfigCacheStatsView(APIView):
+    """Hit, miss and invalidation counters of this worker's configuration caches."""
+    permission_classes = [permissions.IsAdminUser]
+
+    def get(self, request, *args, **kwargs):
+        return Response(config_cache.stats())
+
+class GatewayStatsView(APIView):
+    """Latency, error rate and circuit state of each payment gateway, as this worker's router sees them."""
+    permission_classes = [permissions.IsAdminUser]
+
+    def get(self, request, *args, **kwargs):
+        router = gateways.get_router()
+        return Response({'providers': router.snapshot(), **router.counters()})
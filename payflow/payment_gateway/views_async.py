@@ -0,0 +1,193 @@
+"""
+Async payment endpoints for running under ASGI (``payflow.asgi``).
+
+These mirror the ``StripePaymentView`` actions and ``StripeWebhookView`` but
+await the Stripe call (the SDK's ``*_async`` methods over the pooled httpx
+client from ``gateway_client``) instead of blocking a worker thread on it.
+Lookups and inserts use the async ORM. Recording a succeeded payment still
+runs in a thread, because it needs a database transaction around the insert
+and the synchronous signal receivers that credit the ledger.
+
+The payment endpoints honour ``Idempotency-Key`` like the synchronous ones
+(``idempotency.aidempotent``) and are rate limited by the same throttles
+(``throttling.athrottled``). Mounted under ``/api/v1/async/``.
+"""
+import logging
+from decimal import Decimal
+
+import stripe
+from asgiref.sync import sync_to_async
+from django.http import JsonResponse
+from django.views.decorators.csrf import csrf_exempt
+from django.views.decorators.http import require_POST
+
+from .context import aload_payment_context
+from .dedup import processed_events
+from .idempotency import aidempotent, request_data, stripe_options
+from .models import Transaction, TransactionLog
+from .throttling import athrottled
+from . import gateways, timing, webhooks
+from .views import (
+    StripePaymentView, StripeWebhookView, payment_intent_params, payment_link_params, checkout_session_params,
+    record_payment, record_failed_payment,
+)
+
+logger = logging.getLogger(__name__)
+
+
+def message(text, status):
+    return JsonResponse(text, status=status, safe=False)
+
+
+def gateway_unavailable(error):
+    return JsonResponse(str(error), status=503, safe=False, headers=gateways.retry_after_headers(error))
+
+
+@csrf_exempt
+@require_POST
+@athrottled
+@aidempotent
+async def create_payment_intent(request):
+    data = request_data(request)
+    try:
+        amount = data.get('amount', 0)
+        payment_method_id = data.get('payment_method_id', '')
+        user_id = data.get('user_id')
+
+        if amount is None or payment_method_id is None or user_id is None or float(amount) <= 0:
+            return message("Amount must be a positive number, and payment method ID, and user ID are required.", 400)
+
+        context = await aload_payment_context(user_id, data.get('merchant_id'))
+
+        intent = await gateways.acreate_payment_intent(payment_intent_params(data), **stripe_options())
+
+        if intent.status == 'succeeded':
+            await sync_to_async(record_payment)(StripePaymentView, context, data, intent)
+
+        return JsonResponse(intent)
+
+    except gateways.GatewayRejected as e:
+        return gateway_unavailable(e)
+    except stripe.error.CardError as e:
+        return message(e.error.message, 400)
+    except stripe.error.StripeError as e:
+        if 'context' in locals() and context.payment_method:
+            await sync_to_async(record_failed_payment)(StripePaymentView, context, data, e)
+        return message(str(e), 400)
+    except Exception as e:
+        logger.error(f"An error occurred: {str(e)}")
+        return message("An internal error occurred.", 500)
+
+
+@csrf_exempt
+@require_POST
+@athrottled
+@aidempotent
+async def create_payment_link(request):
+    data = request_data(request)
+    try:
+        user_id = data.get('user_id')
+        amount = data.get('amount', 0)
+        description = data.get('description', '')
+
+        if not user_id or not amount:
+            return message("User ID and amount are required.", 400)
+
+        context = await aload_payment_context(user_id, data.get('merchant_id'))
+        if not context.merchant:
+            return message("No merchant available.", 400)
+
+        payment_link = await gateways.acreate_payment_link(payment_link_params(request, data), **stripe_options())
+
+        transaction = await Transaction.objects.acreate(
+            user=context.user,
+            merchant=context.merchant,
+            payment_method=await context.aensure_payment_method('pm_default'),
+            amount=Decimal(amount),
+            description=description,
+            status='pending',
+            gateway_payment_link_id=payment_link.id
+        )
+        await TransactionLog.objects.acreate(
+            transaction=transaction,
+            log_message=f"Payment link created: {payment_link.url}",
+            log_type='initiated',
+            user=context.user,
+            additional_info={'payment_link_id': payment_link.id}
+        )
+        return JsonResponse({'payment_link': payment_link.url, 'transaction_id': transaction.id}, status=201)
+
+    except gateways.GatewayRejected as e:
+        return gateway_unavailable(e)
+    except stripe.error.StripeError as e:
+        return message(str(e), 400)
+    except Exception as e:
+        logger.error(f"An error occurred: {str(e)}")
+        return message("An internal error occurred.", 500)
+
+
+@csrf_exempt
+@require_POST
+@athrottled
+@aidempotent
+async def checkout_session(request):
+    data = request_data(request)
+    try:
+        user_id = data.get('user_id')
+        if not user_id:
+            return message("User ID is required.", 400)
+
+        context = await aload_payment_context(user_id, data.get('merchant_id'))
+
+        session = await gateways.acreate_checkout_session(checkout_session_params(request, data, context.user),
+                                                          **stripe_options())
+
+        transaction = await Transaction.objects.acreate(
+            user=context.user,
+            merchant=context.merchant,
+            payment_method=await context.aensure_payment_method('pm_default'),
+            amount=Decimal(data.get('amount', 0)),
+            description=data.get('description', ''),
+            status='pending',
+            gateway_checkout_session_id=session.id,
+            gateway_payment_intent_id=getattr(session, 'payment_intent', None) or ''
+        )
+        await TransactionLog.objects.acreate(
+            transaction=transaction,
+            log_message=f"Checkout session created: {session.id}",
+            log_type='initiated',
+            user=context.user,
+            additional_info={'checkout_session_id': session.id}
+        )
+        return JsonResponse(session)
+    except gateways.GatewayRejected as e:
+        return gateway_unavailable(e)
+    except Exception as e:
+        logger.error(f"An error occurred: {str(e)}")
+        return message("An internal error occurred.", 500)
+
+
+@csrf_exempt
+@require_POST
+async def webhook(request):
+    if 'HTTP_STRIPE_SIGNATURE' not in request.META:
+        return message("Missing Stripe signature header", 400)
+
+    payload = request.body
+    try:
+        with timing.stage('parse'):
+            event = stripe.Webhook.construct_event(payload, request.META['HTTP_STRIPE_SIGNATURE'], stripe.api_key)
+        if webhooks.inbox_enabled():
+            if await sync_to_async(processed_events.seen)(event.id):
+                return message("Webhook already processed", 200)
+            await sync_to_async(webhooks.enqueue_event)(payload)
+            return message("Webhook queued successfully", 200)
+        await sync_to_async(StripeWebhookView().handle_event)(event)
+        return message("Webhook received successfully", 200)
+    except ValueError as e:
+        return message(f"Invalid payload: {str(e)}", 400)
+    except stripe.error.SignatureVerificationError as e:
+        return message(f"Invalid signature: {str(e)}", 400)
+    except Exception as e:
+        logger.error(f"Error processing webhook: {str(e)}")
+        return message("An internal error occurred.", 500)
@@ -0,0 +1,118 @@
+"""
+Webhook inbox for Stripe events.
+
+When ``PAYFLOW_WEBHOOK_INBOX`` is enabled, ``StripeWebhookView`` only verifies
+the signature and stores the raw event here. The ``process_webhooks``
+management command drains the inbox in batches and runs the same event
+handling the view would have run inline.
+"""
+import json
+import logging
+import time
+from datetime import timedelta
+
+import stripe
+from django.conf import settings
+from django.db import transaction
+from django.db.models import F, Q
+from django.utils import timezone
+
+from .models import WebhookEvent
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_BATCH_SIZE = 100
+DEFAULT_MAX_ATTEMPTS = 5
+DEFAULT_VISIBILITY_TIMEOUT = 300
+
+
+def inbox_enabled() -> bool:
+    return getattr(settings, 'PAYFLOW_WEBHOOK_INBOX', False)
+
+
+def enqueue_event(payload) -> WebhookEvent:
+    """Persist a verified raw webhook payload for asynchronous processing."""
+    if hasattr(payload, 'decode'):
+        payload = payload.decode('utf-8')
+    data = json.loads(payload) if isinstance(payload, str) else payload
+    return WebhookEvent.objects.create(
+        event_id=data.get('id', ''),
+        event_type=data.get('type', ''),
+        payload=data,
+    )
+
+
+def claim_batch(batch_size=DEFAULT_BATCH_SIZE, visibility_timeout=DEFAULT_VISIBILITY_TIMEOUT):
+    """
+    Claim up to ``batch_size`` events for the calling worker.
+
+    Pending events are claimed oldest first. Events stuck in ``processing``
+    for longer than ``visibility_timeout`` seconds (a worker died mid-batch)
+    are claimed again.
+    """
+    now = timezone.now()
+    claimable = Q(status='pending') | Q(status='processing', claimed_at__lt=now - timedelta(seconds=visibility_timeout))
+    with transaction.atomic():
+        ids = list(
+            WebhookEvent.objects
+            .select_for_update(skip_locked=True)
+            .filter(claimable)
+            .order_by('received_at', 'id')
+            .values_list('id', flat=True)[:batch_size]
+        )
+        if not ids:
+            return []
+        # Re-check the claim condition in the UPDATE so that backends without
+        # row locks (SQLite) never hand the same event to two workers.
+        WebhookEvent.objects.filter(claimable, pk__in=ids).update(
+            status='processing',
+            claimed_at=now,
+            attempts=F('attempts') + 1,
+        )
+    return list(
+        WebhookEvent.objects
+        .filter(pk__in=ids, status='processing', claimed_at=now)
+        .order_by('received_at', 'id')
+    )
+
+
+def process_event(inbox_event: WebhookEvent, handler) -> bool:
+    """Run ``handler`` for a single inbox event and record the outcome."""
+    event = stripe.Event.construct_from(inbox_event.payload, stripe.api_key)
+    try:
+        with transaction.atomic():
+            handler(event)
+    except Exception as e:
+        max_attempts = getattr(settings, 'PAYFLOW_WEBHOOK_MAX_ATTEMPTS', DEFAULT_MAX_ATTEMPTS)
+        inbox_event.status = 'failed' if inbox_event.attempts >= max_attempts else 'pending'
+        inbox_event.last_error = str(e)
+        inbox_event.save(update_fields=['status', 'last_error'])
+        logger.error("Error processing webhook event %s: %s", inbox_event.event_id, e)
+        return False
+
+    inbox_event.status = 'processed'
+    inbox_event.processed_at = timezone.now()
+    inbox_event.save(update_fields=['status', 'processed_at'])
+    return True
+
+
+def drain(handler, batch_size=DEFAULT_BATCH_SIZE, visibility_timeout=DEFAULT_VISIBILITY_TIMEOUT):
+    """Claim and process one batch. Returns the number of events claimed."""
+    batch = claim_batch(batch_size, visibility_timeout)
+    for inbox_event in batch:
+        process_event(inbox_event, handler)
+    return len(batch)
+
+
+def run_worker(handler, batch_size=DEFAULT_BATCH_SIZE, poll_interval=1.0,
+               visibility_timeout=DEFAULT_VISIBILITY_TIMEOUT, once=False):
+    """Drain the inbox until it is empty (``once``) or forever, sleeping when idle."""
+    processed = 0
+    while True:
+        claimed = drain(handler, batch_size, visibility_timeout)
+        processed += claimed
+        if claimed:
+            continue
+        if once:
+            return processed
+        time.sleep(poll_interval)
@@ -0,0 +1,129 @@
+import gzip
+import os
+import shutil
+import tempfile
+from datetime import date, datetime, timezone as dt_timezone
+from io import StringIO
+from unittest.mock import patch
+from django.core.management import call_command
+from django.test import TestCase, override_settings
+from rest_framework.test import APIClient
+from payment_gateway import archive
+from payment_gateway.models import (
+    User, Merchant, PaymentMethod, Transaction, TransactionLog, LogArchive, ArchivedLog
+)
+
+
+def at(year, month, day):
+    return datetime(year, month, day, 12, 30, 15, 123456, tzinfo=dt_timezone.utc)
+
+
+class TestLogArchive(TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.directory)
+        override = override_settings(PAYFLOW_LOG_ARCHIVE={'DIR': self.directory, 'MAX_AGE_DAYS': 30,
+                                                          'BATCH_SIZE': 2})
+        override.enable()
+        self.addCleanup(override.disable)
+
+        self.user = User.objects.create(username='payer', email='payer@example.com', password='x')
+        self.merchant = Merchant.objects.create(name='Shop', email='shop@example.com', password='x')
+        self.method = PaymentMethod.objects.create(user=self.user, method_type='credit_card')
+        self.first = Transaction.objects.create(user=self.user, merchant=self.merchant,
+                                                payment_method=self.method, amount='10.00')
+        self.second = Transaction.objects.create(user=self.user, payment_method=self.method, amount='20.00')
+        self.old_logs = [
+            self.log(self.first, at(2024, 1, 5), 'initiated', {'attempt': 1}),
+            self.log(self.first, at(2024, 1, 20), 'captured', None),
+            self.log(self.second, at(2024, 1, 25), 'initiated', {'note': 'Café'}),
+            self.log(self.first, at(2024, 2, 2), 'refunded', [1, 'two']),
+        ]
+        self.recent = self.log(self.second, datetime.now(dt_timezone.utc), 'captured', None)
+
+    def log(self, record, created_at, log_type, info):
+        log = TransactionLog.objects.create(transaction=record, log_message=f'{log_type} {record.pk}',
+                                            log_type=log_type, user=self.user, merchant=self.merchant,
+                                            payment_method=self.method, additional_info=info)
+        TransactionLog.objects.filter(pk=log.pk).update(created_at=created_at)
+        log.refresh_from_db()
+        return log
+
+    def snapshot(self, logs):
+        return [(log.pk, log.transaction_id, log.log_message, log.log_type, log.user_id, log.merchant_id,
+                 log.payment_method_id, log.additional_info, log.created_at) for log in logs]
+
+    def test_moves_old_logs_into_monthly_files(self):
+        self.assertEqual(archive.archive_old_logs(), 4)
+
+        self.assertEqual(list(TransactionLog.objects.values_list('pk', flat=True)), [self.recent.pk])
+        months = {item.month: item for item in LogArchive.objects.all()}
+        self.assertEqual(set(months), {date(2024, 1, 1), date(2024, 2, 1)})
+        self.assertEqual(months[date(2024, 1, 1)].row_count, 3)
+        self.assertEqual(ArchivedLog.objects.count(), 4)
+        # Two batches for January: two gzip members in one file
+        self.assertEqual(ArchivedLog.objects.filter(archive=months[date(2024, 1, 1)])
+                         .values('offset').distinct().count(), 2)
+        with gzip.open(os.path.join(self.directory, 'transaction-logs-2024-01.ndjson.gz')) as f:
+            self.assertEqual(len(f.read().splitlines()), 3)
+
+    def test_lookup_reads_archived_rows(self):
+        archive.archive_old_logs()
+        rows = archive.archived_logs(self.first.pk)
+        self.assertEqual(self.snapshot(TransactionLog(**row) for row in rows),
+                         self.snapshot(log for log in self.old_logs if log.transaction_id == self.first.pk))
+
+    def test_archived_endpoint_matches_hot_serialization(self):
+        client = APIClient()
+        before = client.get(f'/api/v1/resources/transaction-logs/?transaction_id={self.first.pk}').json()
+        archive.archive_old_logs()
+
+        response = client.get(f'/api/v1/resources/transaction-logs/archived/?transaction_id={self.first.pk}')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json(), list(reversed(before['results'])))
+        self.assertEqual(client.get('/api/v1/resources/transaction-logs/archived/').status_code, 400)
+
+    def test_restore_transaction_puts_rows_back(self):
+        expected = self.snapshot(TransactionLog.objects.order_by('pk'))
+        archive.archive_old_logs()
+
+        self.assertEqual(archive.restore_transaction(self.first.pk), 3)
+        self.assertEqual(ArchivedLog.objects.count(), 1)
+        self.assertEqual(archive.restore_month(date(2024, 1, 1)), 1)
+        self.assertEqual(self.snapshot(TransactionLog.objects.order_by('pk')), expected)
+        self.assertFalse(ArchivedLog.objects.exists())
+        self.assertEqual(sum(LogArchive.objects.values_list('row_count', flat=True)), 0)
+
+    def test_restore_keeps_logs_of_deleted_transactions_archived(self):
+        archive.archive_old_logs()
+        self.second.delete()
+        self.assertEqual(archive.restore_month(date(2024, 1, 1)), 2)
+        self.assertEqual(ArchivedLog.objects.count(), 2)
+
+    def test_resumes_after_an_interrupted_batch(self):
+        archive.archive_old_logs(limit=2)
+        january = LogArchive.objects.get(month=date(2024, 1, 1))
+        committed = january.size
+
+        with patch.object(ArchivedLog.objects, 'bulk_create', side_effect=RuntimeError('crash')):
+            with self.assertRaises(RuntimeError):
+                archive.archive_batch(at(2024, 3, 1))
+        # The failed batch wrote bytes that were never committed
+        path = archive.archive_path(january)
+        self.assertGreater(os.path.getsize(path), committed)
+
+        self.assertEqual(archive.archive_old_logs(), 2)
+        self.assertEqual(ArchivedLog.objects.count(), 4)
+        with gzip.open(path) as f:
+            self.assertEqual(len(f.read().splitlines()), 3)
+        self.assertEqual(len(archive.archived_logs(self.first.pk)), 3)
+
+    def test_commands(self):
+        out = StringIO()
+        call_command('archive_transaction_logs', '--older-than-days', '30', stdout=out)
+        self.assertIn('Archived 4 transaction logs', out.getvalue())
+        call_command('restore_transaction_logs', '--month', '2024-02', stdout=out)
+        self.assertIn('Restored 1 transaction logs', out.getvalue())
+        call_command('restore_transaction_logs', '--transaction', str(self.second.pk), stdout=out)
+        self.assertIn('Restored 1 transaction logs', out.getvalue())
+        self.assertEqual(TransactionLog.objects.count(), 3)
@@ -0,0 +1,132 @@
+from decimal import Decimal
+from unittest.mock import patch
+import stripe
+from django.db import connection
+from django.test import TestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from rest_framework.test import APIRequestFactory
+from payment_gateway import gateways
+from payment_gateway.config_cache import clear_all as clear_config_caches, get_merchant
+from payment_gateway.models import User, PaymentMethod, Merchant, Transaction, TransactionLog, BalanceEntry
+from payment_gateway.views import StripePaymentView
+
+
+def fake_create(**params):
+    if params['amount'] == 9900:
+        raise stripe.error.CardError("Your card was declined.", None, 'card_declined')
+    return stripe.PaymentIntent.construct_from(
+        {'id': f"pi_{params['metadata']['user_id']}_{params['amount']}", 'status': 'succeeded'}, 'sk_test')
+
+
+@patch('stripe.PaymentIntent.create', side_effect=fake_create)
+class TestBulkPaymentIntents(TestCase):
+    def setUp(self):
+        clear_config_caches()
+        self.merchant = Merchant.objects.create(name='Shop', email='shop@example.com', password='x')
+        self.user = User.objects.create(username='payer', email='payer@example.com', password='x')
+        self.payment_method = PaymentMethod.objects.create(user=self.user, method_type='credit_card')
+        self.new_user = User.objects.create(username='new', email='new@example.com', password='x')
+
+    def post(self, charges):
+        view = StripePaymentView.as_view({'post': 'create_payment_intents'})
+        return view(APIRequestFactory().post('/create-payment-intents/', {'charges': charges}, format='json'))
+
+    def charge(self, user, amount='10.00'):
+        return {'amount': amount, 'payment_method_id': 'pm_123', 'user_id': user.pk}
+
+    def test_records_batch_and_credits_balances(self, mock_create):
+        response = self.post([self.charge(self.user), self.charge(self.user, '5.00'), self.charge(self.new_user)])
+
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual([result['status'] for result in response.data['results']], ['succeeded'] * 3)
+        self.assertEqual(Transaction.objects.filter(status='completed').count(), 3)
+        self.assertEqual(TransactionLog.objects.filter(log_type='captured').count(), 3)
+        self.assertEqual(BalanceEntry.objects.count(), 3)
+        self.assertEqual(User.objects.get(pk=self.user.pk).balance, Decimal('15.00'))
+        self.assertEqual(User.objects.get(pk=self.new_user.pk).balance, Decimal('10.00'))
+        self.assertTrue(PaymentMethod.objects.filter(user=self.new_user).exists())
+        transaction = Transaction.objects.get(pk=response.data['results'][1]['transaction_id'])
+        self.assertEqual(transaction.gateway_payment_intent_id, f'pi_{self.user.pk}_500')
+        self.assertEqual(transaction.merchant, self.merchant)
+
+    def test_single_and_bulk_charges_write_the_same_logs(self, mock_create):
+        view = StripePaymentView.as_view({'post': 'create_payment_intent'})
+        single = view(APIRequestFactory().post('/create-payment-intent/', self.charge(self.user), format='json'))
+        bulk = self.post([self.charge(self.user, '5.00')])
+
+        self.assertEqual(single.status_code, 200)
+        self.assertEqual(bulk.status_code, 200)
+        logs = [
+            TransactionLog.objects.filter(transaction__gateway_payment_intent_id=intent)
+            .values_list('log_type', 'log_message', 'user_id', 'merchant_id', 'payment_method_id').get()
+            for intent in (f'pi_{self.user.pk}_1000', f'pi_{self.user.pk}_500')
+        ]
+        self.assertEqual(logs[0][0], 'captured')
+        self.assertEqual(logs[0][2:], logs[1][2:])
+        self.assertEqual([log[1] for log in logs],
+                         ['Transaction captured for amount 10.00', 'Transaction captured for amount 5.00'])
+
+    def test_partial_failure(self, mock_create):
+        response = self.post([self.charge(self.user), self.charge(self.user, '99.00'), self.charge(self.new_user, '99.00')])
+
+        self.assertEqual(response.status_code, 207)
+        results = response.data['results']
+        self.assertEqual([result['status'] for result in results], ['succeeded', 'failed', 'failed'])
+        self.assertIn('declined', results[1]['error'])
+        self.assertEqual(Transaction.objects.get(pk=results[1]['transaction_id']).status, 'failed')
+        # Like the single endpoint, a failure is only recorded for users with a payment method
+        self.assertNotIn('transaction_id', results[2])
+        self.assertEqual(TransactionLog.objects.filter(log_type='failed').count(), 1)
+        self.assertEqual(User.objects.get(pk=self.user.pk).balance, Decimal('10.00'))
+
+    def test_rejected_charges_are_not_recorded(self, mock_create):
+        def busy_for_77(params, **options):
+            if params['amount'] == 7700:
+                raise gateways.GatewayBusy("Too many gateway calls in flight.", retry_after=2.5)
+            return fake_create(**params)
+
+        charges = [self.charge(self.user), self.charge(self.user, '77.00')]
+        with patch('payment_gateway.gateways.create_payment_intent', side_effect=busy_for_77):
+            response = self.post(charges)
+        self.assertEqual(response.status_code, 503)
+        self.assertEqual(response['Retry-After'], '3')
+        results = response.data['results']
+        self.assertEqual([result['status'] for result in results], ['succeeded', 'rejected'])
+        self.assertNotIn('transaction_id', results[1])
+        self.assertEqual(Transaction.objects.count(), 1)
+        self.assertFalse(TransactionLog.objects.filter(log_type='failed').exists())
+
+        # Retrying the batch records only the charge that was not recorded yet
+        response = self.post(charges)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.data['results'][0]['transaction_id'], results[0]['transaction_id'])
+        self.assertEqual(Transaction.objects.count(), 2)
+        self.assertEqual(User.objects.get(pk=self.user.pk).balance, Decimal('87.00'))
+
+    def test_validates_every_charge_before_calling_stripe(self, mock_create):
+        response = self.post([self.charge(self.user), {'amount': '-1', 'user_id': self.user.pk}])
+        self.assertEqual(response.status_code, 400)
+        self.assertIn('charges', response.data)
+
+        response = self.post([self.charge(self.user), {'amount': '1.00', 'payment_method_id': 'pm', 'user_id': 999}])
+        self.assertEqual(response.status_code, 400)
+        self.assertIn(1, response.data['charges'])
+
+        with override_settings(PAYFLOW_BULK_MAX_CHARGES=2):
+            response = self.post([self.charge(self.user)] * 3)
+        self.assertEqual(response.status_code, 400)
+
+        mock_create.assert_not_called()
+        self.assertFalse(Transaction.objects.exists())
+
+    def test_query_count_does_not_grow_with_batch_size(self, mock_create):
+        get_merchant()
+        counts = []
+        for size in (2, 20):
+            # Distinct amounts, so the fake gateway returns distinct intents
+            charges = [self.charge(self.user, f'{size}.{index:02}') for index in range(size)]
+            with CaptureQueriesContext(connection) as queries:
+                response = self.post(charges)
+            self.assertEqual(response.status_code, 200)
+            counts.append(len(queries))
+        self.assertEqual(counts[0], counts[1])
@@ -0,0 +1,106 @@
+from django.core.cache import caches
+from django.http import Http404
+from django.test import TestCase, override_settings
+from payment_gateway import config_cache
+from payment_gateway.config_cache import ConfigCache, get_merchant, get_payment_gateway
+from payment_gateway.models import PaymentGateway
+
+SHARED = {'SHARED_CACHE': 'default', 'VERSION_CHECK_INTERVAL': 0}
+
+
+class TestConfigCache(TestCase):
+    def setUp(self):
+        config_cache.clear_all()
+        caches['default'].clear()
+        self.loads = []
+
+    def make_cache(self, name='test'):
+        def loader(key):
+            self.loads.append(key)
+            return f"value-{key}-{len(self.loads)}"
+        cache = ConfigCache(name, loader)
+        self.addCleanup(config_cache._registry.pop, name, None)
+        return cache
+
+    def test_hits_and_misses_are_counted(self):
+        cache = self.make_cache()
+        self.assertEqual(cache.get('a'), 'value-a-1')
+        self.assertEqual(cache.get('a'), 'value-a-1')
+        self.assertEqual(cache.stats(), {'hits': 1, 'misses': 1, 'invalidations': 0, 'size': 1})
+        self.assertIn('test', config_cache.stats())
+
+    @override_settings(PAYFLOW_CONFIG_CACHE={'TTL': 0})
+    def test_entries_expire_after_ttl(self):
+        cache = self.make_cache()
+        cache.get('a')
+        cache.get('a')
+        self.assertEqual(self.loads, ['a', 'a'])
+
+    def test_invalidate_one_key(self):
+        cache = self.make_cache()
+        cache.get('a')
+        cache.get('b')
+        cache.invalidate('a')
+        self.assertEqual(cache.get('a'), 'value-a-3')
+        self.assertEqual(cache.get('b'), 'value-b-2')
+
+    def test_load_racing_an_invalidation_is_not_kept(self):
+        def loader(key):
+            cache.invalidate(key)
+            return 'stale'
+        cache = ConfigCache('racy', loader)
+        self.addCleanup(config_cache._registry.pop, 'racy', None)
+
+        self.assertEqual(cache.get('a'), 'stale')
+        self.assertEqual(cache.stats()['size'], 0)
+        # Nothing is left behind for the key once its load is over
+        self.assertEqual((cache._key_versions, cache._loading), ({}, {}))
+
+    @override_settings(PAYFLOW_CONFIG_CACHE={'MAX_ENTRIES': 2})
+    def test_least_recently_used_entry_is_dropped(self):
+        cache = self.make_cache()
+        cache.get('a')
+        cache.get('b')
+        cache.get('a')
+        cache.get('c')
+        self.assertEqual(cache.stats()['size'], 2)
+        cache.get('a')
+        cache.get('b')
+        self.assertEqual(self.loads, ['a', 'b', 'c', 'b'])
+
+    def test_invalidations_and_failed_loads_leave_nothing_behind(self):
+        def loader(key):
+            raise LookupError(key)
+        cache = ConfigCache('failing', loader)
+        self.addCleanup(config_cache._registry.pop, 'failing', None)
+        for key in range(100):
+            cache.invalidate(key)
+            with self.assertRaises(LookupError):
+                cache.get(key)
+        self.assertEqual((cache._entries, cache._key_versions, cache._loading), ({}, {}, {}))
+
+    def test_unknown_merchant_ids_are_not_cached(self):
+        for merchant_id in range(1000, 1100):
+            with self.assertRaises(Http404):
+                get_merchant(merchant_id)
+        self.assertEqual(config_cache.merchants.stats()['size'], 0)
+
+    @override_settings(PAYFLOW_CONFIG_CACHE=SHARED)
+    def test_invalidation_reaches_other_workers(self):
+        here, there = self.make_cache('shared'), ConfigCache('shared', lambda key: 'fresh')
+        there.get('a')
+        here.invalidate('a')
+        self.assertEqual(there.stats()['size'], 1)
+        there.get('a')
+        self.assertEqual(there.stats()['misses'], 2)
+
+    def test_gateway_cache_invalidated_by_signals(self):
+        gateway = PaymentGateway.objects.create(name='stripe', api_key='pk_1', api_secret='sk_1')
+        self.assertEqual(get_payment_gateway('stripe').api_key, 'pk_1')
+        with self.assertNumQueries(0):
+            get_payment_gateway('stripe')
+        gateway.api_key = 'pk_2'
+        gateway.save()
+        self.assertEqual(get_payment_gateway('stripe').api_key, 'pk_2')
+        gateway.delete()
+        self.assertIsNone(get_payment_gateway('stripe'))
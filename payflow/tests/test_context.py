@@ -0,0 +1,66 @@
+from decimal import Decimal
+from unittest.mock import patch, MagicMock
+from django.test import TestCase
+from rest_framework.test import APIRequestFactory
+from payment_gateway.config_cache import clear_all as clear_config_caches
+from payment_gateway.context import load_payment_context, get_merchant
+from payment_gateway.models import User, PaymentMethod, Merchant, Transaction
+from payment_gateway.views import StripePaymentView
+
+
+class TestPaymentContext(TestCase):
+    def setUp(self):
+        clear_config_caches()
+        self.user = User.objects.create(username='payer', email='payer@example.com', password='x')
+        self.payment_method = PaymentMethod.objects.create(user=self.user, method_type='credit_card')
+        self.merchant = Merchant.objects.create(name='Shop', email='shop@example.com', password='x')
+
+    def test_user_and_payment_method_load_in_one_query(self):
+        get_merchant()
+        with self.assertNumQueries(1):
+            context = load_payment_context(self.user.pk)
+            self.assertEqual(context.user, self.user)
+            self.assertEqual(context.payment_method, self.payment_method)
+            self.assertEqual(context.merchant, self.merchant)
+
+    def test_repeat_loads_are_served_from_cache(self):
+        load_payment_context(self.user.pk)
+        with self.assertNumQueries(0):
+            context = load_payment_context(self.user.pk)
+        self.assertEqual(context.payment_method, self.payment_method)
+
+    def test_new_payment_method_invalidates_cached_context(self):
+        other = User.objects.create(username='new', email='new@example.com', password='x')
+        self.assertIsNone(load_payment_context(other.pk).payment_method)
+        created = PaymentMethod.objects.create(user=other, method_type='credit_card')
+        self.assertEqual(load_payment_context(other.pk).payment_method, created)
+
+    def test_user_without_payment_method(self):
+        other = User.objects.create(username='new', email='new@example.com', password='x')
+        context = load_payment_context(other.pk)
+        self.assertEqual(context.user, other)
+        self.assertIsNone(context.payment_method)
+
+    def test_merchant_cache_invalidated_on_save_and_delete(self):
+        self.assertEqual(get_merchant(self.merchant.pk).name, 'Shop')
+        self.merchant.name = 'Renamed'
+        self.merchant.save()
+        self.assertEqual(get_merchant(self.merchant.pk).name, 'Renamed')
+        self.merchant.delete()
+        self.assertIsNone(get_merchant())
+
+    @patch('stripe.PaymentIntent.create')
+    def test_create_payment_intent_query_count(self, mock_payment_intent_create):
+        mock_payment_intent_create.return_value = MagicMock(id='pi_123', status='succeeded')
+        view = StripePaymentView.as_view({'post': 'create_payment_intent'})
+        data = {'amount': '10.00', 'payment_method_id': 'pm_123', 'user_id': self.user.pk}
+        load_payment_context(self.user.pk)
+
+        # The context is cached; the transaction and captured log inserts, the
+        # ledger entry and balance update and the rollup upsert, inside savepoints.
+        with self.assertNumQueries(9):
+            response = view(APIRequestFactory().post('/create-payment-intent/', data, format='json'))
+
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(Transaction.objects.get().merchant, self.merchant)
+        self.assertEqual(User.objects.get(pk=self.user.pk).balance, Decimal('10.00'))
@@ -0,0 +1,24 @@
+from django.test import TestCase
+from benchmarks import dataset
+from payment_gateway.models import User, Merchant, Transaction, TransactionLog
+
+
+class TestDatasetGenerator(TestCase):
+    def test_generates_requested_rows(self):
+        rows = dataset.generate(users=20, merchants=2, transactions=120, days=30, batch_size=50)
+        self.assertEqual(rows, dataset.counts())
+        self.assertEqual(rows['transactions'], 120)
+        self.assertEqual(TransactionLog.objects.count(), 120)
+        # Timestamps are spread over the window rather than all set to now
+        self.assertGreater(Transaction.objects.values('created_at').distinct().count(), 100)
+
+    def test_same_seed_gives_same_rows(self):
+        def snapshot():
+            return list(Transaction.objects.order_by('pk').values_list('amount', 'status', 'gateway_payment_intent_id'))
+
+        dataset.generate(users=5, merchants=1, transactions=30, seed=7)
+        first = snapshot()
+        User.objects.all().delete()
+        Merchant.objects.all().delete()
+        dataset.generate(users=5, merchants=1, transactions=30, seed=7)
+        self.assertEqual(snapshot(), first)
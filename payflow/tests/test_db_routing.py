@@ -0,0 +1,76 @@
+from django.contrib import admin
+from django.db import transaction
+from django.test import RequestFactory, SimpleTestCase, TestCase, override_settings
+from rest_framework.request import Request
+from payment_gateway.db_routing import PrimaryReplicaRouter, read_alias
+from payment_gateway.models import Transaction
+from payment_gateway.views_api import TransactionRollupViewSet, TransactionViewSet
+
+# Aliases are only named, never connected to: routing decisions are tested
+# without queries, so no second database is needed.
+REPLICAS = {'REPLICAS': ['replica_0', 'replica_1'], 'PIN_SECONDS': 5}
+
+
+@override_settings(PAYFLOW_DATABASE_ROUTING=REPLICAS)
+class TestReadAlias(SimpleTestCase):
+    def setUp(self):
+        self.factory = RequestFactory()
+
+    def test_safe_requests_read_from_a_replica(self):
+        self.assertIn(read_alias(self.factory.get('/')), REPLICAS['REPLICAS'])
+        self.assertIn(read_alias(), REPLICAS['REPLICAS'])
+
+    def test_primary_for_writes_pinned_clients_and_transactions(self):
+        self.assertEqual(read_alias(self.factory.post('/')), 'default')
+        request = self.factory.get('/')
+        request.COOKIES['payflow_primary'] = '1'
+        self.assertEqual(read_alias(request), 'default')
+
+    @override_settings(PAYFLOW_DATABASE_ROUTING={'REPLICAS': []})
+    def test_primary_without_replicas(self):
+        self.assertEqual(read_alias(self.factory.get('/')), 'default')
+
+    def test_viewsets_read_only_actions_use_a_replica(self):
+        def queryset_db(viewset, action, method='get'):
+            view = viewset(action=action, request=Request(getattr(self.factory, method)('/?grain=day')))
+            return view.filter_queryset(view.get_queryset()).db
+
+        self.assertIn(queryset_db(TransactionViewSet, 'list'), REPLICAS['REPLICAS'])
+        self.assertIn(queryset_db(TransactionViewSet, 'retrieve'), REPLICAS['REPLICAS'])
+        self.assertIn(queryset_db(TransactionRollupViewSet, 'totals'), REPLICAS['REPLICAS'])
+        self.assertEqual(queryset_db(TransactionViewSet, 'partial_update', 'patch'), 'default')
+        self.assertEqual(queryset_db(TransactionViewSet, 'destroy', 'delete'), 'default')
+
+    def test_admin_changelists_use_a_replica(self):
+        model_admin = admin.site._registry[Transaction]
+        request = self.factory.get('/admin/payment_gateway/transaction/')
+        self.assertEqual(model_admin.get_queryset(request).db, 'default')
+        request.read_alias = read_alias(request)
+        self.assertIn(model_admin.get_queryset(request).db, REPLICAS['REPLICAS'])
+
+    def test_router_keeps_writes_and_migrations_on_the_primary(self):
+        router = PrimaryReplicaRouter()
+        replica_copy = Transaction()
+        replica_copy._state.db = 'replica_1'
+        self.assertEqual(router.db_for_write(Transaction, instance=replica_copy), 'default')
+        primary_copy = Transaction()
+        primary_copy._state.db = 'default'
+        self.assertTrue(router.allow_relation(replica_copy, primary_copy))
+        self.assertTrue(router.allow_migrate('default', 'payment_gateway'))
+        self.assertFalse(router.allow_migrate('replica_0', 'payment_gateway'))
+
+
+@override_settings(PAYFLOW_DATABASE_ROUTING=REPLICAS)
+class TestPrimaryPinning(TestCase):
+    def test_writes_pin_the_client_to_the_primary(self):
+        response = self.client.post('/api/v1/resources/users/',
+                                    {'username': 'pinned', 'email': 'pinned@example.com', 'password': 'x'})
+        self.assertEqual(response.status_code, 201)
+        self.assertEqual(response.cookies['payflow_primary']['max-age'], 5)
+        # Reads in the same client now go to the primary, which has the new user
+        self.assertEqual(self.client.get('/api/v1/resources/users/').json()[0]['username'], 'pinned')
+        self.assertNotIn('payflow_primary', self.client.get('/api/v1/resources/users/').cookies)
+
+    def test_reads_in_a_transaction_stay_on_the_primary(self):
+        with transaction.atomic():
+            self.assertEqual(read_alias(RequestFactory().get('/')), 'default')
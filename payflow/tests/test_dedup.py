@@ -0,0 +1,63 @@
+from datetime import timedelta
+from unittest.mock import patch
+import stripe
+from django.db import transaction
+from django.test import TestCase
+from django.utils import timezone
+from payment_gateway.dedup import ProcessedEventStore
+from payment_gateway.models import ProcessedEvent
+from payment_gateway.views import StripeWebhookView
+
+
+class TestProcessedEventStore(TestCase):
+    def setUp(self):
+        self.store = ProcessedEventStore(max_size=2)
+
+    def test_claim_only_succeeds_once(self):
+        self.assertTrue(self.store.claim('evt_1'))
+        self.assertFalse(self.store.claim('evt_1'))
+        self.assertEqual(ProcessedEvent.objects.count(), 1)
+
+    def test_recent_duplicates_skip_the_database(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            self.store.claim('evt_1')
+        with self.assertNumQueries(0):
+            self.assertFalse(self.store.claim('evt_1'))
+            self.assertTrue(self.store.seen('evt_1'))
+
+    def test_lru_evicts_oldest_entries(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            for event_id in ('evt_1', 'evt_2', 'evt_3'):
+                self.store.claim(event_id)
+        self.assertEqual(list(self.store._recent), ['evt_2', 'evt_3'])
+        # Evicted ids are still rejected through the unique index.
+        self.assertFalse(self.store.claim('evt_1'))
+
+    def test_rolled_back_claim_can_be_retried(self):
+        with self.assertRaises(RuntimeError):
+            with transaction.atomic():
+                self.store.claim('evt_1')
+                raise RuntimeError("processing failed")
+        self.assertFalse(self.store.seen('evt_1'))
+        self.assertTrue(self.store.claim('evt_1'))
+
+    def test_prune_removes_expired_events(self):
+        self.store.claim('evt_old')
+        self.store.claim('evt_new')
+        ProcessedEvent.objects.filter(event_id='evt_old').update(processed_at=timezone.now() - timedelta(days=2))
+        self.assertEqual(self.store.prune(ttl=24 * 60 * 60), 1)
+        self.assertEqual(list(ProcessedEvent.objects.values_list('event_id', flat=True)), ['evt_new'])
+
+
+class TestWebhookDeduplication(TestCase):
+    def test_redelivered_event_is_dispatched_once(self):
+        event = stripe.Event.construct_from({
+            'id': 'evt_dup',
+            'type': 'payment_intent.succeeded',
+            'data': {'object': {'id': 'pi_123'}},
+        }, None)
+        view = StripeWebhookView()
+        with patch.object(StripeWebhookView, 'dispatch_event') as mock_dispatch:
+            view.handle_event(event)
+            view.handle_event(event)
+        mock_dispatch.assert_called_once_with(event)
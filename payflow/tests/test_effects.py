@@ -0,0 +1,91 @@
+from decimal import Decimal
+from unittest.mock import MagicMock
+from django.db import connection
+from django.test import TestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from payment_gateway import effects
+from payment_gateway.models import User, PaymentMethod, Transaction, TransactionLog, BalanceEntry
+from payment_gateway.signals import payment_processed, payment_failed, user_balance_updated
+
+
+class TestEffectBatch(TestCase):
+    def setUp(self):
+        self.user = User.objects.create(username='payer', email='payer@example.com', password='x')
+        self.payment_method = PaymentMethod.objects.create(user=self.user, method_type='credit_card')
+
+    def create_transaction(self, status='completed'):
+        return Transaction.objects.create(user=self.user, payment_method=self.payment_method, amount='10.00',
+                                          status=status)
+
+    def balance(self):
+        return User.objects.get(pk=self.user.pk).balance
+
+    def test_credits_for_same_user_are_coalesced(self):
+        records = [self.create_transaction() for _ in range(3)]
+        with CaptureQueriesContext(connection) as queries:
+            with effects.batch():
+                for record in records:
+                    payment_processed.send(sender=self.__class__, transaction=record)
+                self.assertEqual(self.balance(), Decimal('0.00'))
+
+        balance_updates = [q for q in queries if q['sql'].startswith('UPDATE "payment_gateway_user"')]
+        self.assertEqual(len(balance_updates), 1)
+        self.assertEqual(self.balance(), Decimal('30.00'))
+        self.assertEqual(BalanceEntry.objects.count(), 3)
+
+    def test_failure_logs_are_bulk_inserted(self):
+        records = [self.create_transaction('failed') for _ in range(3)]
+        with CaptureQueriesContext(connection) as queries:
+            with effects.batch():
+                for record in records:
+                    payment_failed.send(sender=self.__class__, transaction=record, error_message='declined')
+
+        inserts = [q for q in queries if q['sql'].startswith('INSERT INTO "payment_gateway_transactionlog"')]
+        self.assertEqual(len(inserts), 1)
+        self.assertEqual(TransactionLog.objects.filter(log_type='failed').count(), 3)
+
+    def test_notifications_wait_for_commit(self):
+        receiver = MagicMock()
+        user_balance_updated.connect(receiver)
+        self.addCleanup(user_balance_updated.disconnect, receiver)
+        record = self.create_transaction()
+
+        with self.captureOnCommitCallbacks(execute=True) as callbacks:
+            with effects.batch():
+                payment_processed.send(sender=self.__class__, transaction=record)
+            receiver.assert_not_called()
+
+        self.assertEqual(len(callbacks), 1)
+        receiver.assert_called_once()
+        self.assertEqual(receiver.call_args.kwargs['amount'], record.amount)
+
+    def test_rolled_back_batch_discards_effects(self):
+        record = self.create_transaction()
+        with self.captureOnCommitCallbacks() as callbacks:
+            with self.assertRaises(RuntimeError):
+                with effects.batch():
+                    payment_processed.send(sender=self.__class__, transaction=record)
+                    raise RuntimeError("insert failed")
+        self.assertEqual(callbacks, [])
+        self.assertEqual(self.balance(), Decimal('0.00'))
+        self.assertFalse(BalanceEntry.objects.exists())
+
+    def test_failed_nested_batch_keeps_outer_effects(self):
+        first, second = self.create_transaction(), self.create_transaction()
+        with effects.batch():
+            payment_processed.send(sender=self.__class__, transaction=first)
+            try:
+                with effects.batch():
+                    payment_processed.send(sender=self.__class__, transaction=second)
+                    raise RuntimeError("inner failed")
+            except RuntimeError:
+                pass
+        self.assertEqual(self.balance(), Decimal('10.00'))
+        self.assertEqual(list(BalanceEntry.objects.values_list('transaction_id', flat=True)), [first.pk])
+
+    @override_settings(PAYFLOW_SYNC_SIDE_EFFECTS=True)
+    def test_sync_mode_applies_effects_immediately(self):
+        record = self.create_transaction()
+        with effects.batch():
+            payment_processed.send(sender=self.__class__, transaction=record)
+            self.assertEqual(self.balance(), Decimal('10.00'))
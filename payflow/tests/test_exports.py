@@ -0,0 +1,74 @@
+import csv
+import gzip
+import io
+import json
+from datetime import timedelta
+from django.test import TestCase
+from django.utils import timezone
+from rest_framework import status
+from rest_framework.test import APIClient
+from payment_gateway.models import User, Merchant, PaymentMethod, Transaction, TransactionLog
+from payment_gateway.serializers import TransactionSerializer
+
+
+class TestStreamingExports(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create(username='payer', email='payer@example.com', password='x')
+        other = User.objects.create(username='other', email='other@example.com', password='x')
+        cls.merchant = Merchant.objects.create(name='Shop', email='shop@example.com', password='x')
+        method = PaymentMethod.objects.create(user=cls.user, method_type='credit_card')
+        other_method = PaymentMethod.objects.create(user=other, method_type='credit_card')
+        cls.transactions = [
+            Transaction.objects.create(user=cls.user, merchant=cls.merchant, payment_method=method,
+                                       amount=f'{i}.00', status='completed')
+            for i in range(1, 4)
+        ]
+        Transaction.objects.create(user=other, payment_method=other_method, amount='9.00', status='failed')
+        old = cls.transactions[0]
+        Transaction.objects.filter(pk=old.pk).update(created_at=timezone.now() - timedelta(days=10))
+        TransactionLog.objects.create(transaction=old, log_message='seed', log_type='initiated',
+                                      additional_info={'source': 'test'})
+
+    def setUp(self):
+        self.client = APIClient()
+
+    def read(self, response):
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        return b''.join(response.streaming_content)
+
+    def test_ndjson_export_matches_serializer_output(self):
+        response = self.client.get('/api/v1/resources/transactions/export/')
+        self.assertEqual(response['Content-Type'], 'application/x-ndjson')
+        rows = [json.loads(line) for line in self.read(response).decode().splitlines()]
+        expected = [json.loads(json.dumps(TransactionSerializer(t).data))
+                    for t in Transaction.objects.order_by('created_at', 'id')]
+        self.assertEqual(rows, expected)
+
+    def test_filters_by_user_merchant_and_date_range(self):
+        start = (timezone.now() - timedelta(days=1)).date().isoformat()
+        response = self.client.get('/api/v1/resources/transactions/export/',
+                                   {'user_id': self.user.pk, 'merchant_id': self.merchant.pk, 'start': start})
+        ids = [json.loads(line)['id'] for line in self.read(response).decode().splitlines()]
+        self.assertEqual(ids, [t.pk for t in self.transactions[1:]])
+
+    def test_csv_export_with_gzip(self):
+        response = self.client.get('/api/v1/resources/transaction-logs/export/', {'output': 'csv', 'gzip': 'true'})
+        self.assertEqual(response['Content-Type'], 'application/gzip')
+        self.assertIn('transaction-logs.csv.gz', response['Content-Disposition'])
+        rows = list(csv.DictReader(io.StringIO(gzip.decompress(self.read(response)).decode())))
+        self.assertEqual(len(rows), 1)
+        self.assertEqual(rows[0]['log_type_display'], 'Initiated')
+        self.assertEqual(json.loads(rows[0]['additional_info']), {'source': 'test'})
+
+    def test_invalid_parameters_are_rejected(self):
+        response = self.client.get('/api/v1/resources/transactions/export/', {'output': 'xml'})
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        response = self.client.get('/api/v1/resources/transactions/export/', {'start': 'yesterday'})
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        for params in ({'start': '2024-02-30'}, {'end': '2024-13-01T00:00:00'}, {'user_id': 'abc'},
+                       {'merchant_id': '1.5'}):
+            response = self.client.get('/api/v1/resources/transactions/export/', params)
+            self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST, params)
+        response = self.client.get('/api/v1/resources/transaction-logs/export/', {'transaction_id': 'abc'})
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
@@ -0,0 +1,84 @@
+from datetime import timedelta
+from unittest.mock import patch
+from django.test import TestCase
+from django.utils import timezone
+from rest_framework.test import APIClient
+from payment_gateway.fast_serializers import TransactionValuesSerializer, TransactionLogValuesSerializer
+from payment_gateway.models import User, Merchant, PaymentMethod, Transaction, TransactionLog
+from payment_gateway.views_api import (
+    TransactionViewSet, TransactionLogViewSet, TransactionExportView, TransactionLogExportView
+)
+
+
+class TestFastSerializers(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        user = User.objects.create(username='payer', email='payer@example.com', password='x')
+        merchant = Merchant.objects.create(name='Shop', email='shop@example.com', password='x')
+        method = PaymentMethod.objects.create(user=user, method_type='credit_card')
+        descriptions = ['', 'Café ☕', 'line\nbreak "quoted" \\ tab\t', 'separators   ', 'ctrl \x01\x1f']
+        amounts = ['0.10', '12.00', '99999999.99', '5', '1.5']
+        statuses = ['completed', 'failed', 'pending', 'unknown', 'completed']
+        for i, (description, amount, status) in enumerate(zip(descriptions, amounts, statuses)):
+            record = Transaction.objects.create(user=user, merchant=merchant if i % 2 else None,
+                                                payment_method=method, amount=amount, description=description,
+                                                status=status)
+            Transaction.objects.filter(pk=record.pk).update(
+                created_at=timezone.now() - timedelta(days=i, microseconds=i * 7))
+            TransactionLog.objects.create(transaction=record, log_message=description, log_type='captured',
+                                          user=user, additional_info=[None, {'n': i, 'ok': True, 'text': description},
+                                                                      {'nested': ['a', 1]}][i % 3])
+        TransactionLog.objects.create(transaction=record, log_message='float', log_type='refunded',
+                                      additional_info={'rate': 1e16, 'ratio': 0.1})
+
+    def setUp(self):
+        self.client = APIClient()
+
+    def fetch(self, url, view, fast=True):
+        if fast:
+            return self.client.get(url)
+        with patch.object(view, 'fast_serializer_class', None):
+            return self.client.get(url)
+
+    def assertSameOutput(self, url, view, streaming=False):
+        fast, regular = self.fetch(url, view), self.fetch(url, view, fast=False)
+        self.assertEqual(fast.status_code, 200)
+        if streaming:
+            self.assertEqual(b''.join(fast.streaming_content), b''.join(regular.streaming_content))
+        else:
+            self.assertEqual(fast.content, regular.content)
+
+    def test_transaction_list_is_byte_identical(self):
+        self.assertSameOutput('/api/v1/resources/transactions/?page_size=3', TransactionViewSet)
+        self.assertSameOutput('/api/v1/resources/transactions/?page_size=100', TransactionViewSet)
+
+    def test_transaction_log_list_is_byte_identical(self):
+        self.assertSameOutput('/api/v1/resources/transaction-logs/', TransactionLogViewSet)
+
+    def test_identical_in_another_timezone(self):
+        with timezone.override('America/New_York'):
+            self.assertSameOutput('/api/v1/resources/transactions/', TransactionViewSet)
+
+    def test_exports_are_byte_identical(self):
+        for output in ('ndjson', 'csv'):
+            self.assertSameOutput(f'/api/v1/resources/transactions/export/?output={output}',
+                                  TransactionExportView, streaming=True)
+            self.assertSameOutput(f'/api/v1/resources/transaction-logs/export/?output={output}',
+                                  TransactionLogExportView, streaming=True)
+
+    def test_cursor_pages_follow_on(self):
+        first = self.client.get('/api/v1/resources/transactions/?page_size=2').json()
+        second = self.client.get(first['next']).json()
+        ids = [row['id'] for row in first['results'] + second['results']]
+        expected = list(Transaction.objects.order_by('-created_at', '-id').values_list('id', flat=True)[:4])
+        self.assertEqual(ids, expected)
+
+    def test_list_uses_one_query(self):
+        with self.assertNumQueries(1):
+            self.client.get('/api/v1/resources/transactions/')
+
+    def test_plans_read_only_columns(self):
+        self.assertEqual(TransactionValuesSerializer().columns,
+                         ['id', 'user_id', 'merchant_id', 'payment_method_id', 'amount', 'description', 'status',
+                          'created_at'])
+        self.assertIn('additional_info', TransactionLogValuesSerializer().columns)
@@ -0,0 +1,47 @@
+import stripe
+from django.test import SimpleTestCase
+from benchmarks.fake_stripe import start_server
+from payment_gateway import gateway_client
+
+
+class TestGatewayClient(SimpleTestCase):
+    def setUp(self):
+        self.server, _ = start_server()
+        self.addCleanup(self.server.shutdown)
+        self.client = gateway_client.build_http_client()
+        self.addCleanup(self.client.close)
+
+    def create_intent(self):
+        stripe_client = stripe.StripeClient('sk_test_123', http_client=self.client,
+                                            base_addresses={'api': self.server.url})
+        return stripe_client.payment_intents.create(params={'amount': 1000, 'currency': 'usd'})
+
+    def test_app_uses_shared_pooled_client(self):
+        self.assertIsInstance(stripe.default_http_client, gateway_client.PooledRequestsClient)
+
+    def test_calls_reuse_one_connection(self):
+        for _ in range(3):
+            self.assertEqual(self.create_intent().status, 'succeeded')
+        self.assertEqual(self.server.connections, 1)
+
+    def test_call_timeout_overrides_default(self):
+        self.server.latency = 0.5
+        with gateway_client.call_timeout(0.05):
+            with self.assertRaises(stripe.error.APIConnectionError):
+                self.create_intent()
+
+    def test_session_rebuilt_after_fork(self):
+        self.create_intent()
+        session = self.client._session
+        self.client._pid = -1
+        self.create_intent()
+        self.assertIsNot(self.client._session, session)
+        self.assertEqual(self.server.connections, 2)
+
+    def test_fake_server_failure_rates(self):
+        self.server.failure_rate = 1.0
+        with self.assertRaises(stripe.error.CardError):
+            self.create_intent()
+        self.server.failure_rate, self.server.error_rate = 0.0, 1.0
+        with self.assertRaises(stripe.error.APIError):
+            self.create_intent()
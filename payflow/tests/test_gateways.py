@@ -0,0 +1,219 @@
+from decimal import Decimal
+import stripe
+from django.contrib.auth.models import User as StaffUser
+from django.test import TestCase, override_settings
+from rest_framework.test import APIClient
+from payment_gateway import gateway_client, gateways
+from payment_gateway.config_cache import clear_all as clear_config_caches
+from payment_gateway.gateways import GatewayBusy, NoGatewayAvailable, Provider, Router
+from payment_gateway.models import User, PaymentMethod, Merchant, Transaction
+from payment_gateway.resilience import Bulkhead, CircuitBreaker
+
+
+class Clock:
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self):
+        return self.now
+
+
+class FakeProvider(Provider):
+    """Answers payment intents after ``latency`` seconds of the shared fake clock, or fails."""
+
+    clock = None
+
+    def __init__(self, name, latency=0.1, error=None, failing_calls=None):
+        super().__init__(name)
+        self.latency = latency
+        self.error = error
+        self.failing_calls = failing_calls
+        self.calls = 0
+        self.timeouts = []
+
+    def create_payment_intent(self, params, **options):
+        self.calls += 1
+        self.timeouts.append(gateway_client._call_timeout.get())
+        if self.clock is not None:
+            self.clock.now += self.latency
+        if self.error and (self.failing_calls is None or self.calls <= self.failing_calls):
+            raise self.error
+        return stripe.PaymentIntent.construct_from(
+            {'id': f'pi_{self.name}_{self.calls}', 'status': 'succeeded', 'amount': params['amount']}, None)
+
+    async def acreate_payment_intent(self, params, **options):
+        return self.create_payment_intent(params, **options)
+
+
+class TestCircuitBreaker(TestCase):
+    def test_opens_after_consecutive_failures_and_probes_once(self):
+        clock = Clock()
+        breaker = CircuitBreaker(failure_threshold=2, reset_timeout=10, clock=clock)
+        breaker.record_failure()
+        breaker.record_success()
+        breaker.record_failure()
+        self.assertEqual(breaker.state, 'closed')
+        breaker.record_failure()
+        self.assertEqual(breaker.state, 'open')
+        self.assertFalse(breaker.allow())
+
+        clock.now = 10
+        self.assertEqual(breaker.state, 'half_open')
+        self.assertTrue(breaker.allow())
+        self.assertFalse(breaker.allow())
+        breaker.record_failure()
+        self.assertEqual(breaker.state, 'open')
+
+        clock.now = 20
+        self.assertTrue(breaker.allow())
+        breaker.record_success()
+        self.assertEqual(breaker.state, 'closed')
+
+
+class TestRouter(TestCase):
+    def setUp(self):
+        self.clock = Clock()
+        FakeProvider.clock = self.clock
+        self.addCleanup(setattr, FakeProvider, 'clock', None)
+
+    def router(self, *providers, **options):
+        return Router(providers, explore_rate=0, clock=self.clock, failure_threshold=3, reset_timeout=30, **options)
+
+    def charge(self, router, count=1):
+        return [router.call('create_payment_intent', {'amount': 100}).id for _ in range(count)]
+
+    def test_prefers_the_faster_gateway(self):
+        slow, fast = FakeProvider('slow', latency=0.5), FakeProvider('fast', latency=0.1)
+        router = self.router(slow, fast)
+        self.charge(router, 10)
+        # Each is tried once before the averages decide
+        self.assertEqual((slow.calls, fast.calls), (1, 9))
+
+        fast.latency = 2.0
+        self.charge(router, 10)
+        self.assertGreater(slow.calls, 5)
+
+    def test_steers_away_from_errors_and_open_circuits(self):
+        flaky, backup = FakeProvider('flaky', latency=0.1), FakeProvider('backup', latency=0.25)
+        router = self.router(flaky, backup)
+        self.charge(router, 3)
+        self.assertEqual((flaky.calls, backup.calls), (2, 1))
+        flaky.error = stripe.error.APIConnectionError("timeout")
+        with self.assertRaises(stripe.error.APIConnectionError):
+            self.charge(router)
+        # One error outweighs the latency advantage
+        self.charge(router, 5)
+        self.assertEqual((flaky.calls, backup.calls), (3, 6))
+
+        backup.error = stripe.error.APIError("500")
+        for _ in range(5):
+            with self.assertRaises(stripe.error.StripeError):
+                self.charge(router)
+        self.assertEqual({name: stats['state'] for name, stats in router.snapshot().items()},
+                         {'flaky': 'open', 'backup': 'open'})
+        with self.assertRaises(NoGatewayAvailable):
+            self.charge(router)
+
+        # After the timeout a recovered gateway gets its probe and then traffic again
+        self.clock.now += 30
+        flaky.error = None
+        self.assertTrue(self.charge(router)[0].startswith('pi_flaky'))
+        self.assertEqual(router.snapshot()['flaky']['state'], 'closed')
+        self.assertTrue(self.charge(router)[0].startswith('pi_flaky'))
+
+    def test_declines_do_not_count_against_the_gateway(self):
+        provider = FakeProvider('only', error=stripe.error.CardError("declined", 'card', 'card_declined'))
+        router = self.router(provider)
+        for _ in range(5):
+            with self.assertRaises(stripe.error.CardError):
+                self.charge(router)
+        self.assertEqual(router.snapshot()['only']['error_rate'], 0)
+        self.assertEqual(router.snapshot()['only']['state'], 'closed')
+
+    def test_only_keyed_calls_are_retried(self):
+        provider = FakeProvider('only', error=stripe.error.APIConnectionError("reset"), failing_calls=2)
+        router = self.router(provider, retries=2, retry_base_delay=0, timeouts={'create_payment_intent': (1, 5)})
+        with self.assertRaises(stripe.error.APIConnectionError):
+            router.call('create_payment_intent', {'amount': 100})
+        self.assertEqual(provider.calls, 1)
+
+        intent = router.call('create_payment_intent', {'amount': 100}, idempotency_key='key-1')
+        self.assertEqual((intent.id, provider.calls), ('pi_only_3', 3))
+        self.assertEqual(router.snapshot()['only']['retries'], 1)
+        self.assertEqual(provider.timeouts, [(1, 5)] * 3)
+
+        provider.error, provider.failing_calls = stripe.error.CardError("declined", 'card', 'card_declined'), None
+        with self.assertRaises(stripe.error.CardError):
+            router.call('create_payment_intent', {'amount': 100}, idempotency_key='key-2')
+        self.assertEqual(provider.calls, 4)
+
+    def test_full_bulkhead_fails_fast(self):
+        router = self.router(FakeProvider('only'), bulkhead_size=1)
+        self.assertTrue(router.bulkhead.acquire())
+        with self.assertRaises(GatewayBusy):
+            self.charge(router)
+        router.bulkhead.release()
+        self.charge(router)
+        self.assertEqual(router.counters()['rejections'], {'circuit_open': 0, 'bulkhead_full': 1})
+
+    async def test_async_bulkhead_waits_without_blocking(self):
+        bulkhead = Bulkhead(1, max_wait=0.02)
+        self.assertTrue(await bulkhead.aacquire())
+        self.assertFalse(await bulkhead.aacquire())
+        bulkhead.release()
+        self.assertTrue(await bulkhead.aacquire())
+        self.assertEqual(bulkhead.in_use, 1)
+
+    def test_unsupported_operations_are_never_routed(self):
+        router = self.router(FakeProvider('intents_only'))
+        with self.assertRaises(NoGatewayAvailable):
+            router.call('create_payment_link', {})
+
+
+@override_settings(PAYFLOW_GATEWAYS={'PROVIDERS': {'fake': FakeProvider}, 'EXPLORE_RATE': 0})
+class TestGatewayViews(TestCase):
+    def setUp(self):
+        clear_config_caches()
+        gateways.reset_router('PAYFLOW_GATEWAYS')
+        self.user = User.objects.create(username='payer', email='payer@example.com', password='x')
+        PaymentMethod.objects.create(user=self.user, method_type='credit_card')
+        Merchant.objects.create(name='Shop', email='shop@example.com', password='x')
+
+    def test_payments_go_through_the_configured_provider(self):
+        response = APIClient().post('/api/v1/create-payment-intent/', {
+            'amount': '12.50', 'payment_method_id': 'pm_123', 'user_id': self.user.pk}, format='json')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(Transaction.objects.get().gateway_payment_intent_id, 'pi_fake_1')
+        self.assertEqual(User.objects.get(pk=self.user.pk).balance, Decimal('12.50'))
+        self.assertEqual(gateways.get_router().snapshot()['fake']['calls'], 1)
+
+    async def test_async_payments_go_through_the_configured_provider(self):
+        response = await self.async_client.post('/api/v1/async/create-payment-intent/', {
+            'amount': '3.00', 'payment_method_id': 'pm_123', 'user_id': self.user.pk},
+            content_type='application/json')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json()['id'], 'pi_fake_1')
+
+    @override_settings(PAYFLOW_GATEWAYS={'PROVIDERS': {'fake': FakeProvider}, 'FAILURE_THRESHOLD': 1},
+                       PAYFLOW_METRICS={'TOKEN': 'scrape-token'})
+    def test_open_circuit_answers_503(self):
+        gateways.get_router().providers[0].error = stripe.error.APIError("500")
+        client = APIClient()
+        data = {'amount': '12.50', 'payment_method_id': 'pm_123', 'user_id': self.user.pk}
+        self.assertEqual(client.post('/api/v1/create-payment-intent/', data, format='json').status_code, 400)
+        response = client.post('/api/v1/create-payment-intent/', data, format='json')
+        self.assertEqual(response.status_code, 503)
+        self.assertEqual(response['Retry-After'], '30')
+        # Only the call that reached the gateway is recorded
+        self.assertEqual(Transaction.objects.filter(status='failed').count(), 1)
+        self.assertIn('payflow_gateway_rejections_total{reason="circuit_open"} 1', client.get('/metrics', HTTP_AUTHORIZATION='Bearer scrape-token').content.decode())
+
+    def test_stats_are_for_staff(self):
+        client = APIClient()
+        self.assertEqual(client.get('/api/v1/internal/gateways/').status_code, 403)
+        staff = StaffUser.objects.create_user('staff', is_staff=True)
+        client.force_authenticate(staff)
+        response = client.get('/api/v1/internal/gateways/')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json()['providers']['fake']['state'], 'closed')
+        self.assertEqual(response.json()['rejections'], {'circuit_open': 0, 'bulkhead_full': 0})
@@ -0,0 +1,109 @@
+import time
+from unittest.mock import patch
+import stripe
+from django.test import TestCase, override_settings
+from rest_framework.test import APIRequestFactory
+from payment_gateway.config_cache import clear_all as clear_config_caches
+from payment_gateway.idempotency import get_cache
+from payment_gateway.models import User, PaymentMethod, Merchant, Transaction
+from payment_gateway.views import StripePaymentView
+
+
+def fake_create(**params):
+    return stripe.PaymentIntent.construct_from({'id': 'pi_123', 'status': 'succeeded'}, 'sk_test')
+
+
+@patch('stripe.PaymentIntent.create', side_effect=fake_create)
+class TestIdempotencyKey(TestCase):
+    def setUp(self):
+        clear_config_caches()
+        get_cache().clear()
+        Merchant.objects.create(name='Shop', email='shop@example.com', password='x')
+        self.user = User.objects.create(username='payer', email='payer@example.com', password='x')
+        PaymentMethod.objects.create(user=self.user, method_type='credit_card')
+        self.data = {'amount': '10.00', 'payment_method_id': 'pm_123', 'user_id': self.user.pk}
+
+    def post(self, data, key='key-1', action='create_payment_intent', **headers):
+        view = StripePaymentView.as_view({'post': action})
+        if key:
+            headers['HTTP_IDEMPOTENCY_KEY'] = key
+        return view(APIRequestFactory().post('/create-payment-intent/', data, format='json', **headers))
+
+    def test_retry_replays_stored_response(self, mock_create):
+        first = self.post(self.data)
+        second = self.post(self.data)
+
+        self.assertEqual(first.status_code, 200)
+        self.assertEqual(second.status_code, 200)
+        self.assertEqual(second.data['id'], 'pi_123')
+        self.assertEqual(second['Idempotent-Replayed'], 'true')
+        mock_create.assert_called_once()
+        self.assertEqual(len(mock_create.call_args.kwargs['idempotency_key']), 32)
+        self.assertEqual(Transaction.objects.count(), 1)
+
+    def test_replay_does_not_touch_the_database(self, mock_create):
+        self.post(self.data)
+        with self.assertNumQueries(0):
+            self.post(self.data)
+
+    def test_key_reused_for_different_request(self, mock_create):
+        self.post(self.data)
+        response = self.post({**self.data, 'amount': '20.00'})
+        self.assertEqual(response.status_code, 422)
+        mock_create.assert_called_once()
+
+    def test_concurrent_retry_gets_conflict(self, mock_create):
+        def retry_while_running(**params):
+            self.assertEqual(self.post(self.data).status_code, 409)
+            return fake_create(**params)
+
+        mock_create.side_effect = retry_while_running
+        self.assertEqual(self.post(self.data).status_code, 200)
+
+    @override_settings(PAYFLOW_IDEMPOTENCY={'CACHE': 'default', 'TTL': 3600, 'LOCK_TTL': 0.3})
+    def test_lock_outlives_a_slow_request(self, mock_create):
+        def slow(**params):
+            time.sleep(0.5)
+            # Past LOCK_TTL, a retry still finds the request in progress
+            self.assertEqual(self.post(self.data).status_code, 409)
+            return fake_create(**params)
+
+        get_cache().clear()
+        mock_create.side_effect = slow
+        self.assertEqual(self.post(self.data).status_code, 200)
+        time.sleep(0.3)
+        # The stored response was not cut short to the lock's TTL
+        self.assertEqual(self.post(self.data)['Idempotent-Replayed'], 'true')
+        mock_create.assert_called_once()
+
+    def test_server_errors_are_not_stored(self, mock_create):
+        with patch('payment_gateway.views.record_payment', side_effect=RuntimeError("db down")):
+            self.assertEqual(self.post(self.data).status_code, 500)
+        self.assertEqual(self.post(self.data).status_code, 200)
+        self.assertEqual(Transaction.objects.count(), 1)
+
+    def test_requests_without_key_are_not_deduplicated(self, mock_create):
+        self.post(self.data, key=None)
+        self.post(self.data, key=None)
+        self.assertEqual(mock_create.call_count, 2)
+        self.assertNotIn('idempotency_key', mock_create.call_args.kwargs)
+
+    def test_bulk_forwards_a_key_per_charge(self, mock_create):
+        response = self.post({'charges': [self.data, self.data]}, action='create_payment_intents')
+        self.assertEqual(response.status_code, 200)
+        keys = sorted(call.kwargs['idempotency_key'] for call in mock_create.call_args_list)
+        self.assertEqual([key.split(':') for key in keys], [[keys[0][:-2], '0'], [keys[0][:-2], '1']])
+
+    def test_keys_are_scoped_to_the_caller(self, mock_create):
+        first = self.post(self.data, HTTP_X_API_KEY='client-a')
+        # Another client reusing the key, even for a different body, is a new request
+        other = self.post({**self.data, 'amount': '20.00'}, HTTP_X_API_KEY='client-b')
+        self.assertEqual((first.status_code, other.status_code), (200, 200))
+        self.assertNotIn('Idempotent-Replayed', other)
+        forwarded = [call.kwargs['idempotency_key'] for call in mock_create.call_args_list]
+        self.assertNotEqual(forwarded[0], forwarded[1])
+        # And so is the same client acting for another merchant
+        merchant = Merchant.objects.create(name='Other', email='other@example.com', password='x')
+        response = self.post({**self.data, 'merchant_id': merchant.pk}, HTTP_X_API_KEY='client-a')
+        self.assertNotIn('Idempotent-Replayed', response)
+        self.assertEqual(self.post(self.data, HTTP_X_API_KEY='client-a')['Idempotent-Replayed'], 'true')
@@ -0,0 +1,56 @@
+from decimal import Decimal
+from django.db import transaction
+from django.test import TestCase, override_settings
+from rest_framework.test import APIRequestFactory
+from payment_gateway import ledger
+from payment_gateway.models import User, PaymentMethod, Transaction, BalanceEntry, BalanceShard
+from payment_gateway.signals import payment_processed
+from payment_gateway.views import StripePaymentView
+
+
+class TestBalanceLedger(TestCase):
+    def setUp(self):
+        self.user = User.objects.create(username='payer', email='payer@example.com', password='x')
+        self.payment_method = PaymentMethod.objects.create(user=self.user, method_type='credit_card')
+
+    def balance(self):
+        return User.objects.get(pk=self.user.pk).balance
+
+    def test_credit_appends_entry_and_updates_balance_column(self):
+        ledger.credit(self.user.pk, Decimal('10.50'))
+        ledger.credit(self.user.pk, Decimal('4.50'))
+        self.assertEqual(self.balance(), Decimal('15.00'))
+        self.assertEqual(BalanceEntry.objects.filter(user=self.user).count(), 2)
+
+    @override_settings(PAYFLOW_BALANCE_SHARDS=4)
+    def test_hot_account_credits_are_sharded_until_rolled_up(self):
+        with override_settings(PAYFLOW_HOT_ACCOUNTS={self.user.pk}):
+            for _ in range(20):
+                ledger.credit(self.user.pk, Decimal('1.00'))
+        self.assertEqual(self.balance(), Decimal('0.00'))
+        self.assertLessEqual(BalanceShard.objects.filter(user=self.user).count(), 4)
+        self.assertEqual(ledger.get_balance(self.user.pk), Decimal('20.00'))
+
+        self.assertEqual(ledger.rollup(), 1)
+        self.assertEqual(self.balance(), Decimal('20.00'))
+        self.assertEqual(ledger.get_balance(self.user.pk), Decimal('20.00'))
+        self.assertEqual(ledger.rollup(), 0)
+
+    def test_ledger_write_rolls_back_with_payment(self):
+        with self.assertRaises(RuntimeError):
+            with transaction.atomic():
+                record = Transaction.objects.create(user=self.user, payment_method=self.payment_method,
+                                                    amount='25.00', status='completed')
+                payment_processed.send(sender=self.__class__, transaction=record)
+                raise RuntimeError("payment insert failed")
+        self.assertEqual(self.balance(), Decimal('0.00'))
+        self.assertFalse(BalanceEntry.objects.exists())
+
+    def test_success_redirect_credits_only_once(self):
+        Transaction.objects.create(user=self.user, payment_method=self.payment_method, amount='25.00',
+                                   status='pending', gateway_checkout_session_id='cs_123')
+        view = StripePaymentView.as_view({'get': 'payment_success'})
+        for _ in range(2):
+            view(APIRequestFactory().get('/success/', {'session_id': 'cs_123'}))
+        self.assertEqual(self.balance(), Decimal('25.00'))
+        self.assertEqual(BalanceEntry.objects.count(), 1)
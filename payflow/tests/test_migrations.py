@@ -0,0 +1,54 @@
+from decimal import Decimal
+from importlib import import_module
+from unittest.mock import patch
+from django.db import connection
+from django.db.migrations.executor import MigrationExecutor
+from django.test import TransactionTestCase
+from payment_gateway.models import Transaction
+
+
+class TestBackfillGatewayReferences(TransactionTestCase):
+    before = [('payment_gateway', '0004_transaction_gateway_references')]
+    after = [('payment_gateway', '0005_backfill_gateway_references')]
+
+    def tearDown(self):
+        executor = MigrationExecutor(connection)
+        executor.migrate(executor.loader.graph.leaf_nodes())
+
+    def test_backfills_from_logs_and_single_use_tokens(self):
+        executor = MigrationExecutor(connection)
+        executor.migrate(self.before)
+        apps = executor.loader.project_state(self.before).apps
+        models = {name: apps.get_model('payment_gateway', name)
+                  for name in ('User', 'PaymentMethod', 'Transaction', 'TransactionLog')}
+        user = models['User'].objects.create(username='payer', email='payer@example.com', password='x')
+
+        def transaction(token):
+            method = models['PaymentMethod'].objects.create(
+                user=user, method_type='credit_card', gateway_payment_method_token=token)
+            return models['Transaction'].objects.create(user=user, payment_method=method, amount=Decimal('1.00'),
+                                                        status='completed')
+
+        single_use = transaction('pi_legacy')
+        logged = transaction('pi_from_token')
+        models['TransactionLog'].objects.create(transaction=logged, log_message='x', log_type='initiated',
+                                                additional_info={'payment_intent_id': 'pi_from_log'})
+        models['TransactionLog'].objects.create(transaction=logged, log_message='x', log_type='initiated',
+                                                additional_info={'session_id': 'cs_from_log'})
+        shared = transaction('cs_shared')
+        models['Transaction'].objects.create(user=user, payment_method=shared.payment_method,
+                                             amount=Decimal('2.00'), status='completed')
+
+        # One transaction per batch, so the batching is exercised too
+        with patch.object(import_module('payment_gateway.migrations.0005_backfill_gateway_references'),
+                          'BATCH_SIZE', 1):
+            MigrationExecutor(connection).migrate(self.after)
+
+        references = dict(Transaction.objects.values_list('pk', 'gateway_payment_intent_id'))
+        self.assertEqual(references[single_use.pk], 'pi_legacy')
+        # The logs win over the payment method token
+        self.assertEqual(references[logged.pk], 'pi_from_log')
+        self.assertEqual(Transaction.objects.get(pk=logged.pk).gateway_checkout_session_id, 'cs_from_log')
+        # A token shared by several transactions is not trusted
+        self.assertFalse(Transaction.objects.exclude(gateway_checkout_session_id='')
+                         .exclude(pk=logged.pk).exists())
@@ -0,0 +1,65 @@
+from django.test import TestCase, override_settings
+from django.utils import timezone
+from rest_framework import status
+from rest_framework.test import APIClient
+from payment_gateway.models import User, Merchant, PaymentMethod, Transaction, TransactionLog
+
+
+class TestKeysetPagination(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        user = User.objects.create(username='payer', email='payer@example.com', password='x')
+        merchant = Merchant.objects.create(name='Shop', email='shop@example.com', password='x')
+        payment_method = PaymentMethod.objects.create(user=user, method_type='credit_card')
+        cls.transactions = [
+            Transaction.objects.create(user=user, merchant=merchant, payment_method=payment_method,
+                                       amount=f'{i}.00', status='completed')
+            for i in range(1, 8)
+        ]
+        # Give several rows the same timestamp to exercise the id tie-breaker.
+        same_time = timezone.now()
+        Transaction.objects.filter(pk__in=[t.pk for t in cls.transactions[2:5]]).update(created_at=same_time)
+        for transaction in cls.transactions:
+            TransactionLog.objects.create(transaction=transaction, log_message='seed', log_type='initiated')
+        cls.expected = list(Transaction.objects.order_by('-created_at', '-id').values_list('id', flat=True))
+
+    def setUp(self):
+        self.client = APIClient()
+
+    def collect(self, url):
+        ids, pages = [], 0
+        while url:
+            response = self.client.get(url)
+            self.assertEqual(response.status_code, status.HTTP_200_OK)
+            ids.extend(row['id'] for row in response.data['results'])
+            url = response.data['next']
+            pages += 1
+        return ids, pages
+
+    def test_walks_all_pages_newest_first_without_duplicates(self):
+        ids, pages = self.collect('/api/v1/resources/transactions/?page_size=3')
+        self.assertEqual(ids, self.expected)
+        self.assertEqual(pages, 3)
+
+    def test_previous_link_returns_preceding_page(self):
+        first = self.client.get('/api/v1/resources/transactions/?page_size=3').data
+        self.assertIsNone(first['previous'])
+        second = self.client.get(first['next']).data
+        back = self.client.get(second['previous']).data
+        self.assertEqual([row['id'] for row in back['results']], [row['id'] for row in first['results']])
+        self.assertIsNone(back['previous'])
+
+    def test_filters_apply_before_pagination(self):
+        transaction_id = self.transactions[0].pk
+        response = self.client.get(f'/api/v1/resources/transaction-logs/?transaction_id={transaction_id}')
+        self.assertEqual([row['transaction'] for row in response.data['results']], [transaction_id])
+        self.assertIsNone(response.data['next'])
+
+    @override_settings(PAYFLOW_PAGINATION={'PAGE_SIZE': 2, 'MAX_PAGE_SIZE': 4})
+    def test_page_size_is_capped(self):
+        self.assertEqual(len(self.client.get('/api/v1/resources/transactions/').data['results']), 2)
+        self.assertEqual(len(self.client.get('/api/v1/resources/transactions/?page_size=100').data['results']), 4)
+
+    def test_invalid_cursor_is_rejected(self):
+        response = self.client.get('/api/v1/resources/transactions/?cursor=not-a-cursor')
+        self.assertEqual(response.status_code, status.HTTP_404_NOT_FOUND)
@@ -0,0 +1,142 @@
+"""
+Query plan regression tests.
+
+Seeds a dataset, refreshes planner statistics and checks that the EXPLAIN
+output of every viewset and admin changelist query uses an index rather than
+a full table scan. The default dataset is small enough for CI. Set
+PAYFLOW_QUERY_PLAN_ROWS (e.g. 2000000) to check plans against a production-sized
+table before shipping index changes.
+"""
+import os
+import re
+from datetime import timedelta
+from django.contrib import admin
+from django.db import connection
+from django.test import TestCase
+from django.utils import timezone
+from rest_framework.request import Request
+from rest_framework.test import APIRequestFactory
+from payment_gateway import renewals
+from payment_gateway.pagination import KeysetPagination
+from payment_gateway.models import User, Merchant, PaymentMethod, Transaction, TransactionLog, Subscriptions
+from payment_gateway.views_api import (
+    PaymentMethodViewSet, TransactionViewSet, TransactionLogViewSet, SubscriptionViewSet
+)
+
+SEED_ROWS = int(os.environ.get('PAYFLOW_QUERY_PLAN_ROWS', 2000))
+CHUNK_SIZE = 5000
+
+SQLITE_INDEXED = re.compile(r'USING (COVERING )?INDEX|USING INTEGER PRIMARY KEY|USING ROWID')
+
+
+def full_table_scans(queryset):
+    """Return the plan lines of ``queryset`` that read a whole table."""
+    plan = queryset.explain()
+    if connection.vendor == 'sqlite':
+        return [line for line in plan.splitlines() if ' SCAN ' in f' {line} ' and not SQLITE_INDEXED.search(line)]
+    if connection.vendor == 'postgresql':
+        return [line for line in plan.splitlines() if 'Seq Scan' in line]
+    return []
+
+
+def seed(rows):
+    users = User.objects.bulk_create(
+        User(username=f'user{i}', email=f'user{i}@example.com', password='x') for i in range(max(rows // 20, 1))
+    )
+    merchants = Merchant.objects.bulk_create(
+        Merchant(name=f'merchant{i}', email=f'merchant{i}@example.com', password='x') for i in range(max(rows // 200, 1))
+    )
+    methods = PaymentMethod.objects.bulk_create(
+        PaymentMethod(user=user, method_type='credit_card', card_brand='visa') for user in users
+    )
+    statuses = [choice for choice, _ in Transaction.STATUS_CHOICES]
+    log_types = [choice for choice, _ in TransactionLog.LOG_TYPES]
+    for start in range(0, rows, CHUNK_SIZE):
+        transactions = Transaction.objects.bulk_create(
+            Transaction(
+                user=methods[i % len(methods)].user,
+                merchant=merchants[i % len(merchants)],
+                payment_method=methods[i % len(methods)],
+                amount='10.00',
+                status=statuses[i % len(statuses)],
+            )
+            for i in range(start, min(start + CHUNK_SIZE, rows))
+        )
+        TransactionLog.objects.bulk_create(
+            TransactionLog(transaction=transaction, log_message='seed', log_type=log_types[i % len(log_types)],
+                           user_id=transaction.user_id)
+            for i, transaction in enumerate(transactions)
+        )
+    end_date = timezone.now() + timedelta(days=30)
+    Subscriptions.objects.bulk_create(
+        Subscriptions(user=user, plan_name='basic', end_date=end_date) for user in users
+    )
+    with connection.cursor() as cursor:
+        cursor.execute('ANALYZE')
+    return users[0], Transaction.objects.order_by('id').first()
+
+
+class TestQueryPlans(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.user, cls.transaction = seed(SEED_ROWS)
+
+    def viewset_queryset(self, viewset_class, **params):
+        request = Request(APIRequestFactory().get('/', params))
+        viewset = viewset_class(request=request, format_kwarg=None)
+        return viewset.get_queryset()
+
+    def changelist_queryset(self, model, **filters):
+        model_admin = admin.site._registry[model]
+        return model.objects.filter(**filters).order_by(*model_admin.ordering, '-pk')[:100]
+
+    def keyset_page_queryset(self, queryset):
+        # The query KeysetPagination issues for a page in the middle of the table.
+        position = Transaction.objects.order_by('created_at', 'id').values_list('created_at', 'id')[SEED_ROWS // 2]
+        return KeysetPagination().get_page_queryset(queryset, position, reverse=False, page_size=50)
+
+    def assertUsesIndex(self, queryset):
+        scans = full_table_scans(queryset)
+        self.assertEqual(scans, [], f"Full table scan in plan for:\n{queryset.query}")
+
+    def test_viewset_filters_use_indexes(self):
+        self.assertUsesIndex(self.viewset_queryset(TransactionViewSet, user_id=self.user.pk))
+        self.assertUsesIndex(self.viewset_queryset(TransactionLogViewSet, transaction_id=self.transaction.pk))
+        self.assertUsesIndex(self.viewset_queryset(PaymentMethodViewSet, user_id=self.user.pk))
+        self.assertUsesIndex(self.viewset_queryset(SubscriptionViewSet, user_id=self.user.pk))
+
+    def test_viewset_retrieve_uses_primary_key(self):
+        for viewset_class in (TransactionViewSet, TransactionLogViewSet, PaymentMethodViewSet, SubscriptionViewSet):
+            with self.subTest(viewset=viewset_class.__name__):
+                self.assertUsesIndex(self.viewset_queryset(viewset_class).filter(pk=1))
+
+    def test_keyset_pages_seek_through_indexes(self):
+        self.assertUsesIndex(self.keyset_page_queryset(self.viewset_queryset(TransactionViewSet)))
+        self.assertUsesIndex(self.keyset_page_queryset(self.viewset_queryset(TransactionViewSet, user_id=self.user.pk)))
+        self.assertUsesIndex(self.keyset_page_queryset(self.viewset_queryset(TransactionLogViewSet)))
+        self.assertUsesIndex(self.keyset_page_queryset(
+            self.viewset_queryset(TransactionLogViewSet, transaction_id=self.transaction.pk)))
+
+    def test_transaction_user_history_is_index_ordered(self):
+        queryset = Transaction.objects.filter(user=self.user).order_by('-created_at')[:50]
+        self.assertUsesIndex(queryset)
+
+    def test_renewal_claims_use_the_due_index(self):
+        queryset = (Subscriptions.objects.filter(renewals.due(timezone.now()), auto_renew=True)
+                    .order_by('end_date', 'id').values_list('id', flat=True)[:500])
+        self.assertUsesIndex(queryset)
+
+    def test_admin_changelists_use_indexes(self):
+        cases = [
+            (Transaction, {}),
+            (Transaction, {'status': 'failed'}),
+            (TransactionLog, {}),
+            (TransactionLog, {'log_type': 'captured'}),
+            (PaymentMethod, {}),
+            (PaymentMethod, {'method_type': 'credit_card'}),
+            (Subscriptions, {}),
+            (Subscriptions, {'status': 'active'}),
+        ]
+        for model, filters in cases:
+            with self.subTest(model=model.__name__, filters=filters):
+                self.assertUsesIndex(self.changelist_queryset(model, **filters))
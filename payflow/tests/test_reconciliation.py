@@ -0,0 +1,138 @@
+import csv
+import gzip
+import os
+import tempfile
+from datetime import datetime, timezone as dt_timezone
+from decimal import Decimal
+from io import StringIO
+from django.core.management import call_command
+from django.core.management.base import CommandError
+from django.test import TestCase
+from payment_gateway.models import User, Merchant, PaymentMethod, Transaction, TransactionLog
+from payment_gateway.reconciliation import read_chunks, reconcile, to_cents
+
+HEADER = ['balance_transaction_id', 'created_utc', 'currency', 'gross', 'fee', 'net', 'reporting_category',
+          'payment_intent_id']
+
+
+def export(*rows):
+    out = StringIO()
+    writer = csv.writer(out)
+    writer.writerow(HEADER)
+    for txn_id, created, gross, category, intent in rows:
+        writer.writerow([txn_id, created, 'usd', gross, '0.30', '', category, intent])
+    return out.getvalue().splitlines(keepends=True)
+
+
+class TestReconciliation(TestCase):
+    def setUp(self):
+        self.user = User.objects.create(username='payer', email='payer@example.com', password='x')
+        self.merchant = Merchant.objects.create(name='Shop', email='shop@example.com', password='x')
+        self.method = PaymentMethod.objects.create(user=self.user, method_type='credit_card')
+        self.ok = self.pay('pi_ok', '10.00', 'completed')
+        self.short = self.pay('pi_short', '5.00', 'completed')
+        self.pending = self.pay('pi_pending', '7.50', 'pending')
+        self.unexported = self.pay('pi_unexported', '3.00', 'completed')
+        self.outside = self.pay('pi_outside', '1.00', 'completed', created_at=datetime(2024, 12, 1, tzinfo=dt_timezone.utc))
+        self.rows = [
+            ('txn_1', '2025-03-01 10:00:00', '10.00', 'charge', 'pi_ok'),
+            ('txn_2', '2025-03-01 11:00:00', '5.01', 'charge', 'pi_short'),
+            ('txn_3', '2025-03-01 12:00:00', '7.50', 'charge', 'pi_pending'),
+            ('txn_4', '2025-03-01 13:00:00', '2.00', 'charge', 'pi_unknown'),
+            ('txn_5', '2025-03-01 14:00:00', '-10.00', 'payout', ''),
+            ('txn_6', '2025-03-02 09:00:00', '10.00', 'charge', ''),
+        ]
+
+    def pay(self, intent, amount, status, created_at=None):
+        record = Transaction.objects.create(user=self.user, merchant=self.merchant, payment_method=self.method,
+                                            amount=Decimal(amount), status=status, gateway_payment_intent_id=intent)
+        Transaction.objects.filter(pk=record.pk).update(
+            created_at=created_at or datetime(2025, 3, 1, 12, tzinfo=dt_timezone.utc))
+        return record
+
+    def corrections(self):
+        return {log.transaction_id: log for log in TransactionLog.objects.filter(log_type='reconciliation')}
+
+    def test_reports_every_kind_of_discrepancy(self):
+        for chunk_size in (2, 100):
+            TransactionLog.objects.all().delete()
+            result = reconcile(export(*self.rows), chunk_size=chunk_size)
+            self.assertEqual(result.as_dict(), {
+                'rows': 6, 'skipped': 1, 'malformed': 0, 'matched': 1, 'missing_in_db': 2, 'missing_in_export': 1,
+                'amount_mismatch': 1, 'status_mismatch': 1, 'corrections': 3,
+            })
+
+            logs = self.corrections()
+            self.assertEqual(set(logs), {self.short.pk, self.pending.pk, self.unexported.pk})
+            self.assertEqual(logs[self.short.pk].additional_info['issues'], ['amount_mismatch'])
+            self.assertEqual(logs[self.short.pk].additional_info['stripe_amount_cents'], 501)
+            self.assertEqual(logs[self.short.pk].additional_info['recorded_amount_cents'], 500)
+            self.assertEqual(logs[self.pending.pk].additional_info['issues'], ['status_mismatch'])
+            self.assertEqual(logs[self.pending.pk].merchant_id, self.merchant.pk)
+            self.assertEqual(logs[self.unexported.pk].additional_info['issues'], ['missing_in_export'])
+
+    def test_reconciling_again_adds_no_corrections(self):
+        reconcile(export(*self.rows))
+        result = reconcile(export(*self.rows))
+        self.assertEqual((result.amount_mismatch, result.missing_in_export, result.corrections), (1, 1, 0))
+        self.assertEqual(TransactionLog.objects.filter(log_type='reconciliation').count(), 3)
+        # A new balance transaction for the same payment is still logged
+        result = reconcile(export(('txn_7', '2025-03-01 11:30:00', '5.02', 'charge', 'pi_short')))
+        self.assertEqual(result.corrections, 1)
+
+    def test_large_amounts_are_exact(self):
+        self.assertEqual(to_cents(['92233720368547.75', '0.29', '1.005']).tolist(), [9223372036854775, 29, 100])
+        self.assertEqual(to_cents(['12345678901234567'], unit='cents').tolist(), [12345678901234567])
+
+    def test_dry_run_and_report(self):
+        report = StringIO()
+        result = reconcile(export(*self.rows), dry_run=True, report=report)
+        self.assertEqual(result.corrections, 3)
+        self.assertFalse(TransactionLog.objects.exists())
+
+        issues = sorted((row['issue'], row['reference']) for row in csv.DictReader(StringIO(report.getvalue())))
+        self.assertEqual(issues, [
+            ('amount_mismatch', 'pi_short'), ('missing_in_db', ''), ('missing_in_db', 'pi_unknown'),
+            ('missing_in_export', 'pi_unexported'), ('status_mismatch', 'pi_pending'),
+        ])
+
+    def test_amounts_in_cents_and_renamed_columns(self):
+        lines = [line.replace('payment_intent_id', 'intent') for line in export(
+            ('txn_1', '2025-03-01 10:00:00', '1000', 'charge', 'pi_ok'))]
+        result = reconcile(lines, amount_unit='cents', columns={'reference': 'intent'},
+                           start=datetime(2025, 3, 1, tzinfo=dt_timezone.utc),
+                           end=datetime(2025, 3, 1, 10, tzinfo=dt_timezone.utc))
+        self.assertEqual((result.matched, result.missing_in_export), (1, 0))
+
+    def test_missing_columns(self):
+        with self.assertRaisesRegex(ValueError, 'payment_intent_id'):
+            reconcile(['balance_transaction_id,gross\n', 'txn_1,1.00\n'])
+
+    def test_short_rows_are_skipped_with_their_line_number(self):
+        lines = export(*self.rows)
+        # A truncated row in the middle, and a cut-off last line
+        lines[3:3] = ['txn_7,2025-03-01 15:00:00,usd\n']
+        lines.append('txn_8,2025-03-01')
+        with self.assertLogs('payment_gateway.reconciliation', 'WARNING') as logs:
+            result = reconcile(lines, start=datetime(2025, 3, 1, tzinfo=dt_timezone.utc),
+                               end=datetime(2025, 3, 2, 23, tzinfo=dt_timezone.utc))
+        self.assertEqual((result.rows, result.malformed, result.corrections), (6, 2, 3))
+        self.assertIn('line 4', logs.output[0])
+        self.assertIn('line 9', logs.output[1])
+        with self.assertRaisesRegex(ValueError, 'line 4 has 3 columns'):
+            list(read_chunks(lines, {'reference': 'payment_intent_id'}, 100))
+
+    def test_command_reads_gzipped_exports(self):
+        directory = tempfile.mkdtemp()
+        path = os.path.join(directory, 'export.csv.gz')
+        with gzip.open(path, 'wt') as f:
+            f.writelines(export(*self.rows))
+        out = StringIO()
+        call_command('reconcile_stripe_export', path, '--chunk-size', '3', stdout=out)
+        self.assertIn('Wrote 3 reconciliation logs', out.getvalue())
+        self.assertEqual(len(self.corrections()), 3)
+
+        with self.assertRaises(CommandError):
+            call_command('reconcile_stripe_export', path, '--reference-column', 'nope', stdout=out)
+        os.remove(path)
+        os.rmdir(directory)
@@ -0,0 +1,142 @@
+from datetime import timedelta
+from decimal import Decimal
+from io import StringIO
+from unittest.mock import patch, MagicMock
+from django.core.management import call_command
+from django.db import connection
+from django.db.migrations.executor import MigrationExecutor
+from django.test import TestCase, TransactionTestCase, override_settings
+from django.utils import timezone
+from payment_gateway import gateways, renewals
+from payment_gateway.models import User, PaymentMethod, Subscriptions, Transaction
+
+
+def intent(status='succeeded', intent_id='pi_renewal'):
+    return MagicMock(id=intent_id, status=status)
+
+
+class TestRenewals(TestCase):
+    def setUp(self):
+        self.now = timezone.now()
+        self.user = User.objects.create(username='payer', email='payer@example.com', password='x')
+        PaymentMethod.objects.create(user=self.user, method_type='credit_card', gateway_payment_method_token='pm_1')
+        self.subscription = self.subscribe(self.user)
+
+    def subscribe(self, user, days_ago=1, **fields):
+        return Subscriptions.objects.create(user=user, plan_name='pro', amount=Decimal('9.99'),
+                                            end_date=self.now - timedelta(days=days_ago), **fields)
+
+    def test_claims_due_subscriptions_once(self):
+        self.subscribe(self.user, days_ago=-5)  # not due yet
+        self.subscribe(self.user, auto_renew=False)
+        claimed = renewals.claim_batch(10, now=self.now)
+        self.assertEqual([subscription.pk for subscription in claimed], [self.subscription.pk])
+        self.assertEqual(renewals.claim_batch(10, now=self.now), [])
+        # An abandoned claim is handed out again once it expires
+        later = self.now + timedelta(seconds=renewals.renewal_settings()['VISIBILITY_TIMEOUT'] + 1)
+        self.assertEqual(len(renewals.claim_batch(10, now=later)), 1)
+
+    def test_successful_renewal_extends_the_period(self):
+        create_intent = MagicMock(return_value=intent())
+        renewed, failed = renewals.renew_batch(renewals.claim_batch(now=self.now), now=self.now,
+                                               create_intent=create_intent)
+        self.assertEqual((renewed, failed), (1, 0))
+        self.subscription.refresh_from_db()
+        self.assertEqual(self.subscription.end_date, self.now + timedelta(days=29))
+        self.assertIsNone(self.subscription.claimed_until)
+        record = Transaction.objects.get()
+        self.assertEqual((record.status, record.amount, record.gateway_payment_intent_id),
+                         ('completed', Decimal('9.99'), 'pi_renewal'))
+        self.assertEqual(create_intent.call_args.args[1]['payment_method_id'], 'pm_1')
+
+    def test_idempotency_key_is_per_period_and_attempt(self):
+        def charge():
+            with patch('stripe.PaymentIntent.create', return_value=intent()) as create:
+                renewals.create_renewal_intent(self.subscription, renewals.renewal_charge(
+                    self.subscription, MagicMock(payment_method=None)))
+            return create.call_args.kwargs
+
+        kwargs = charge()
+        self.assertEqual(kwargs['idempotency_key'],
+                         f"renewal:{self.subscription.pk}:{self.subscription.end_date:%Y%m%dT%H%M%S}:0")
+        # A retry after a decline is charged again instead of replaying the decline
+        self.subscription.renewal_attempts = 1
+        self.assertEqual(charge()['idempotency_key'][-2:], ':1')
+        self.assertEqual(kwargs['metadata']['subscription_id'], self.subscription.pk)
+        self.assertEqual(kwargs['amount'], 999)
+
+    @override_settings(PAYFLOW_RENEWALS={'MAX_ATTEMPTS': 2})
+    def test_failures_are_retried_then_deactivate(self):
+        create_intent = MagicMock(return_value=intent(status='requires_payment_method'))
+        self.assertEqual(renewals.renew_batch(renewals.claim_batch(now=self.now), now=self.now,
+                                              create_intent=create_intent), (0, 1))
+        self.subscription.refresh_from_db()
+        self.assertEqual((self.subscription.status, self.subscription.renewal_attempts), ('active', 1))
+        self.assertEqual(self.subscription.claimed_until, self.now + timedelta(days=1))
+        self.assertEqual(renewals.claim_batch(now=self.now), [])
+
+        retry_at = self.now + timedelta(days=1, seconds=1)
+        renewals.renew_batch(renewals.claim_batch(now=retry_at), now=retry_at, create_intent=create_intent)
+        self.subscription.refresh_from_db()
+        self.assertEqual((self.subscription.status, self.subscription.renewal_attempts), ('inactive', 2))
+
+    def test_charges_refused_by_the_router_are_not_attempts(self):
+        create_intent = MagicMock(side_effect=gateways.NoGatewayAvailable("No gateway available.", retry_after=30))
+        self.assertEqual(renewals.renew_batch(renewals.claim_batch(now=self.now), now=self.now,
+                                              create_intent=create_intent), (0, 0))
+        self.subscription.refresh_from_db()
+        self.assertEqual((self.subscription.status, self.subscription.renewal_attempts), ('active', 0))
+        self.assertEqual(self.subscription.claimed_until, self.now + timedelta(seconds=30))
+        self.assertFalse(Transaction.objects.exists())
+
+    def test_users_without_payment_method_fail(self):
+        other = User.objects.create(username='other', email='other@example.com', password='x')
+        Subscriptions.objects.all().delete()
+        self.subscribe(other)
+        create_intent = MagicMock(return_value=intent())
+        self.assertEqual(renewals.renew_batch(renewals.claim_batch(now=self.now), now=self.now,
+                                              create_intent=create_intent), (0, 1))
+        create_intent.assert_not_called()
+        self.assertFalse(Transaction.objects.exists())
+
+    def test_lost_claims_are_not_recorded(self):
+        batch = renewals.claim_batch(now=self.now)
+        Subscriptions.objects.update(claimed_until=self.now + timedelta(hours=1))
+        self.assertEqual(renewals.renew_batch(batch, now=self.now, create_intent=MagicMock(return_value=intent())),
+                         (0, 0))
+        self.assertFalse(Transaction.objects.exists())
+
+    def test_command_renews_and_expires(self):
+        self.subscribe(self.user, auto_renew=False)
+        out = StringIO()
+        with patch('stripe.PaymentIntent.create', return_value=intent()):
+            call_command('renew_subscriptions', '--once', '--batch-size', '1', stdout=out)
+        self.assertIn('Renewed 1 subscriptions, 0 failed, 1 expired', out.getvalue())
+        self.assertEqual(Subscriptions.objects.filter(status='inactive').count(), 1)
+
+
+class TestRenewalsMigration(TransactionTestCase):
+    before = [('payment_gateway', '0011_reconciliation_log_type')]
+    after = [('payment_gateway', '0012_subscription_renewals')]
+
+    def tearDown(self):
+        executor = MigrationExecutor(connection)
+        executor.migrate(executor.loader.graph.leaf_nodes())
+
+    def test_existing_subscriptions_are_not_charged(self):
+        executor = MigrationExecutor(connection)
+        executor.migrate(self.before)
+        apps = executor.loader.project_state(self.before).apps
+        user = apps.get_model('payment_gateway', 'User').objects.create(
+            username='legacy', email='legacy@example.com', password='x')
+        legacy = apps.get_model('payment_gateway', 'Subscriptions').objects.create(
+            user=user, plan_name='pro', end_date=timezone.now() - timedelta(days=1))
+
+        executor = MigrationExecutor(connection)
+        executor.migrate(self.after)
+        subscription = Subscriptions.objects.get(pk=legacy.pk)
+        self.assertEqual((subscription.auto_renew, subscription.amount), (False, 0))
+        self.assertEqual(renewals.claim_batch(10), [])
+        self.assertEqual(renewals.expire_due(), 1)
+        # New subscriptions still renew by default
+        self.assertTrue(Subscriptions(user_id=user.pk, plan_name='pro').auto_renew)
@@ -0,0 +1,151 @@
+from datetime import datetime, timezone as dt_timezone
+from decimal import Decimal
+from io import StringIO
+from unittest.mock import patch
+from django.core.management import call_command
+from django.core.management.base import CommandError
+from django.test import TestCase, override_settings
+from rest_framework.test import APIClient
+from payment_gateway import effects, rollups
+from payment_gateway.models import User, Merchant, PaymentMethod, Transaction, TransactionRollup
+
+
+def at(day, hour, minute=0):
+    return datetime(2025, 3, day, hour, minute, tzinfo=dt_timezone.utc)
+
+
+class TestRollups(TestCase):
+    def setUp(self):
+        self.user = User.objects.create(username='payer', email='payer@example.com', password='x')
+        self.other = User.objects.create(username='other', email='other@example.com', password='x')
+        self.merchant = Merchant.objects.create(name='Shop', email='shop@example.com', password='x')
+        self.method = PaymentMethod.objects.create(user=self.user, method_type='credit_card')
+
+    def pay(self, amount, status, created_at, user=None, merchant=True):
+        record = Transaction.objects.create(user=user or self.user, merchant=self.merchant if merchant else None,
+                                            payment_method=self.method, amount=Decimal(amount), status=status)
+        # Move it to a known bucket the way a rebuild would see it
+        Transaction.objects.filter(pk=record.pk).update(created_at=created_at)
+        TransactionRollup.objects.all().delete()
+        rollups.rebuild()
+        return Transaction.objects.get(pk=record.pk)
+
+    def snapshot(self):
+        return sorted(TransactionRollup.objects.exclude(transaction_count=0, amount=0).values_list(
+            'grain', 'scope', 'scope_id', 'bucket', 'status', 'transaction_count', 'amount'))
+
+    def rollup(self, grain='day', scope='merchant', scope_id=None, status='completed'):
+        row = TransactionRollup.objects.filter(grain=grain, scope=scope, status=status,
+                                               scope_id=self.merchant.pk if scope_id is None else scope_id).first()
+        return (row.transaction_count, row.amount) if row else (0, Decimal('0'))
+
+    def test_new_transactions_are_rolled_up(self):
+        Transaction.objects.create(user=self.user, merchant=self.merchant, payment_method=self.method,
+                                   amount=Decimal('10.50'), status='completed')
+        Transaction.objects.create(user=self.other, merchant=self.merchant, payment_method=self.method,
+                                   amount=Decimal('4.25'), status='completed')
+        Transaction.objects.create(user=self.user, payment_method=self.method, amount=Decimal('3'), status='failed')
+
+        self.assertEqual(self.rollup(), (2, Decimal('14.75')))
+        self.assertEqual(self.rollup(grain='hour'), (2, Decimal('14.75')))
+        self.assertEqual(self.rollup(scope='user', scope_id=self.user.pk), (1, Decimal('10.50')))
+        self.assertEqual(self.rollup(scope_id=0, status='failed'), (1, Decimal('3.00')))
+
+    def test_status_transitions_move_totals(self):
+        record = self.pay('20.00', 'pending', at(1, 10))
+        record.status = 'completed'
+        record.save()
+        self.assertEqual(self.rollup(status='pending'), (0, Decimal('0')))
+        self.assertEqual(self.rollup(status='completed'), (1, Decimal('20.00')))
+        # Saving again without changes adds nothing
+        record.save()
+        self.assertEqual(self.rollup(status='completed'), (1, Decimal('20.00')))
+
+        record.delete()
+        self.assertEqual(self.rollup(status='completed'), (0, Decimal('0')))
+
+    def test_update_path_rolls_up_explicitly(self):
+        record = self.pay('5.00', 'pending', at(1, 10))
+        with effects.batch():
+            Transaction.objects.filter(pk=record.pk).update(status='completed')
+            record.status = 'completed'
+            effects.add_rollup(record)
+        self.assertEqual(self.rollup(status='completed'), (1, Decimal('5.00')))
+        self.assertEqual(self.rollup(status='pending'), (0, Decimal('0')))
+
+    def test_live_updates_match_a_rebuild(self):
+        first = self.pay('10.00', 'pending', at(1, 9, 30))
+        self.pay('7.10', 'failed', at(1, 23, 59), user=self.other)
+        self.pay('2.00', 'completed', at(2, 0, 1), merchant=False)
+        first.status = 'completed'
+        first.save()
+        Transaction.objects.create(user=self.user, merchant=self.merchant, payment_method=self.method,
+                                   amount=Decimal('1.99'), status='failed')
+        live = self.snapshot()
+
+        TransactionRollup.objects.all().delete()
+        self.assertGreater(rollups.rebuild(), 0)
+        self.assertEqual(self.snapshot(), live)
+
+    def test_row_by_row_fallback_matches_upsert(self):
+        record = self.pay('10.00', 'pending', at(1, 9))
+        with patch.object(rollups, 'UPSERT_VENDORS', ()):
+            record.status = 'failed'
+            record.save()
+            Transaction.objects.create(user=self.user, merchant=self.merchant, payment_method=self.method,
+                                       amount=Decimal('3.00'), status='failed')
+        live = self.snapshot()
+        rollups.rebuild()
+        self.assertEqual(self.snapshot(), live)
+
+    def test_large_change_sets_are_upserted_in_batches(self):
+        key = ('day', 'merchant', self.merchant.pk)
+        deltas = [((*key, at(day, 0), 'completed'), 1, Decimal('1.00')) for day in range(1, 29)]
+        with patch.object(rollups, 'UPSERT_BATCH_SIZE', 10), \
+                self.assertNumQueries(3):
+            rollups.apply(deltas)
+        self.assertEqual(TransactionRollup.objects.filter(grain='day', scope='merchant').count(), 28)
+        rollups.apply(deltas)
+        self.assertEqual({row.transaction_count for row in TransactionRollup.objects.filter(grain='day')}, {2})
+
+    def test_rebuild_from_watermark_keeps_older_buckets(self):
+        self.pay('10.00', 'completed', at(1, 9))
+        self.pay('5.00', 'completed', at(3, 9))
+        TransactionRollup.objects.filter(bucket__lt=at(2, 0)).update(transaction_count=99)
+
+        rollups.rebuild(at(2, 12))
+        self.assertEqual(TransactionRollup.objects.get(grain='day', scope='merchant', bucket=at(1, 0)).transaction_count, 99)
+        self.assertEqual(TransactionRollup.objects.get(grain='day', scope='merchant', bucket=at(3, 0)).transaction_count, 1)
+
+    @override_settings(PAYFLOW_ROLLUPS={'LIVE': False})
+    def test_live_updates_can_be_turned_off(self):
+        Transaction.objects.create(user=self.user, merchant=self.merchant, payment_method=self.method,
+                                   amount=Decimal('10.00'), status='completed')
+        self.assertFalse(TransactionRollup.objects.exists())
+        out = StringIO()
+        call_command('rebuild_rollups', '--full', stdout=out)
+        self.assertIn('Rebuilt 4 rollup rows', out.getvalue())
+
+    def test_api(self):
+        self.pay('10.00', 'completed', at(1, 9))
+        self.pay('4.00', 'failed', at(1, 10))
+        self.pay('6.00', 'completed', at(2, 9))
+        client = APIClient()
+
+        response = client.get(f'/api/v1/resources/rollups/?scope_id={self.merchant.pk}&start=2025-03-01&end=2025-03-01')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual([(row['status'], row['transaction_count'], row['amount']) for row in response.json()],
+                         [('completed', 1, '10.00'), ('failed', 1, '4.00')])
+
+        response = client.get(f'/api/v1/resources/rollups/totals/?scope_id={self.merchant.pk}')
+        self.assertEqual(response.json(), [
+            {'bucket': '2025-03-01T00:00:00Z', 'transaction_count': 2, 'amount': '14.00',
+             'failed_count': 1, 'failed_amount': '4.00'},
+            {'bucket': '2025-03-02T00:00:00Z', 'transaction_count': 1, 'amount': '6.00',
+             'failed_count': 0, 'failed_amount': '0.00'},
+        ])
+        self.assertEqual(client.get('/api/v1/resources/rollups/?grain=week').status_code, 400)
+        for query in ('start=2024-02-30', 'end=2024-13-01T00:00:00', 'scope_id=abc'):
+            self.assertEqual(client.get(f'/api/v1/resources/rollups/?{query}').status_code, 400, query)
+        with self.assertRaises(CommandError):
+            call_command('rebuild_rollups', '--since', '2024-02-30', stdout=StringIO())
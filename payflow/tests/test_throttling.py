@@ -0,0 +1,157 @@
+import threading
+from django.contrib.auth.models import User as StaffUser
+from django.core.cache import caches
+from django.conf import settings
+from django.test import TestCase, override_settings
+from rest_framework.test import APIClient
+from payment_gateway.models import User
+from payment_gateway.throttling import CacheBucketStore, Limit, LocalBucketStore, get_limiter, parse_rate, reset_limiter
+
+
+class Clock:
+    def __init__(self, now=1000.0):
+        self.now = now
+
+    def __call__(self):
+        return self.now
+
+
+class TestBucketStores(TestCase):
+    def setUp(self):
+        caches['default'].clear()
+
+    def test_parse_rate(self):
+        self.assertEqual(parse_rate('100/s'), 100)
+        self.assertEqual(parse_rate('600/min'), 10)
+        self.assertEqual(parse_rate('36/hour'), 0.01)
+
+    def test_local_bucket_bursts_then_refills(self):
+        clock = Clock()
+        store = LocalBucketStore(clock=clock)
+        limit = Limit(rate=2, burst=3)
+        self.assertEqual([store.consume('k', limit)[0] for _ in range(4)], [True, True, True, False])
+        self.assertAlmostEqual(store.consume('k', limit)[1], 0.5)
+        clock.now += 0.5
+        self.assertTrue(store.consume('k', limit)[0])
+        self.assertFalse(store.consume('k', limit)[0])
+        # Other keys have their own bucket
+        self.assertTrue(store.consume('other', limit)[0])
+
+    def test_local_store_drops_least_recently_used_keys(self):
+        store = LocalBucketStore(max_keys=2, clock=Clock())
+        limit = Limit(rate=1, burst=1)
+        store.consume('a', limit)
+        store.consume('b', limit)
+        store.consume('a', limit)
+        store.consume('c', limit)
+        self.assertEqual(list(store._buckets), ['a', 'c'])
+
+    def test_cache_store_limits_and_refills(self):
+        clock = Clock(now=1000.0)
+        store = CacheBucketStore(caches['default'], clock=clock)
+        limit = Limit(rate=1, burst=4)  # 4 second windows
+        self.assertEqual([store.consume('k', limit)[0] for _ in range(5)], [True] * 4 + [False])
+        # Refusals take no tokens, so the count is back to the burst
+        self.assertEqual(caches['default'].get('payflow:ratelimit:k:250'), 4)
+        # Half a window later half of the previous window still counts
+        clock.now = 1006.0
+        self.assertEqual([store.consume('k', limit)[0] for _ in range(3)], [True, True, False])
+
+    def test_cache_store_is_atomic_across_threads(self):
+        store = CacheBucketStore(caches['default'], clock=Clock())
+        limit = Limit(rate=1, burst=50)
+        allowed = []
+
+        def hammer():
+            for _ in range(25):
+                allowed.append(store.consume('shared', limit)[0])
+
+        threads = [threading.Thread(target=hammer) for _ in range(8)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(allowed.count(True), 50)
+
+
+RATE_LIMITS = {
+    'RATES': {
+        'merchant': {'RATE': '1/min', 'BURST': 3},
+        'user': {'RATE': '1/min', 'BURST': 2},
+        'principal': {'RATE': '1/min', 'BURST': 5},
+    },
+}
+
+
+@override_settings(PAYFLOW_RATE_LIMITS=RATE_LIMITS)
+class TestThrottledViews(TestCase):
+    def setUp(self):
+        caches['default'].clear()
+        reset_limiter('PAYFLOW_RATE_LIMITS')
+        self.client = APIClient()
+        self.user = User.objects.create(username='payer', email='payer@example.com', password='x')
+
+    def get(self, url, **headers):
+        return self.client.get(url, headers=headers).status_code
+
+    def test_limits_per_user(self):
+        url = f'/api/v1/resources/payment-methods/?user_id={self.user.pk}'
+        self.assertEqual([self.get(url) for _ in range(3)], [200, 200, 429])
+        response = self.client.get(url)
+        self.assertEqual(int(response['Retry-After']), 60)
+        self.assertEqual(self.get(f'/api/v1/resources/payment-methods/?user_id={self.user.pk + 1}'), 200)
+
+    def test_limits_per_merchant_within_the_caller(self):
+        url = '/api/v1/resources/transactions/?merchant_id=7'
+        self.assertEqual([self.get(url) for _ in range(4)], [200, 200, 200, 429])
+        # Another caller has its own bucket for the same merchant
+        self.client.force_authenticate(StaffUser.objects.create_user('staff'))
+        self.assertEqual(self.get(url), 200)
+
+    def test_changing_ids_does_not_escape_the_caller_limit(self):
+        statuses = [self.get(f'/api/v1/resources/payment-methods/?user_id={user_id}&merchant_id={user_id}')
+                    for user_id in range(6)]
+        self.assertEqual(statuses, [200] * 5 + [429])
+        self.assertEqual(self.get('/api/v1/resources/users/'), 429)
+
+    def test_limits_per_authenticated_user(self):
+        self.assertEqual({self.get('/api/v1/resources/users/') for _ in range(5)}, {200})
+        self.assertEqual(self.get('/api/v1/resources/users/'), 429)
+        self.client.force_authenticate(StaffUser.objects.create_user('staff'))
+        self.assertEqual([self.get('/api/v1/resources/users/') for _ in range(6)], [200] * 5 + [429])
+
+    def test_unchecked_headers_do_not_make_a_new_caller(self):
+        statuses = [self.get('/api/v1/resources/users/', X_Api_Key=f'key-{n}', Authorization=f'Token {n}',
+                             X_Forwarded_For=f'203.0.113.{n}') for n in range(6)]
+        self.assertEqual(statuses, [200] * 5 + [429])
+
+    @override_settings(REST_FRAMEWORK={**settings.REST_FRAMEWORK, 'NUM_PROXIES': 1})
+    def test_trusted_proxy_address(self):
+        # Only the entry the proxy appended counts; what the client sent before it does not
+        statuses = [self.get('/api/v1/resources/users/', X_Forwarded_For=f'203.0.113.{n}, 198.51.100.1')
+                    for n in range(6)]
+        self.assertEqual(statuses, [200] * 5 + [429])
+        self.assertEqual(self.get('/api/v1/resources/users/', X_Forwarded_For='198.51.100.2'), 200)
+
+    def test_payment_endpoints_are_limited(self):
+        data = {'amount': '0', 'payment_method_id': 'pm_123', 'user_id': self.user.pk}
+        statuses = [self.client.post('/api/v1/create-payment-intent/', data, format='json').status_code
+                    for _ in range(3)]
+        self.assertEqual(statuses, [400, 400, 429])
+
+    async def test_async_payment_endpoints_are_limited(self):
+        data = {'amount': '0', 'payment_method_id': 'pm_123', 'user_id': self.user.pk}
+        responses = [await self.async_client.post('/api/v1/async/create-payment-intent/', data,
+                                                  content_type='application/json') for _ in range(3)]
+        self.assertEqual([response.status_code for response in responses], [400, 400, 429])
+        self.assertEqual(int(responses[2]['Retry-After']), 60)
+        # The synchronous endpoint draws on the same buckets
+        response = await self.async_client.post('/api/v1/create-payment-intent/', data,
+                                                content_type='application/json')
+        self.assertEqual(response.status_code, 429)
+
+    @override_settings(PAYFLOW_RATE_LIMITS={**RATE_LIMITS, 'BACKEND': 'cache', 'CACHE': 'default'})
+    def test_shared_store_backend(self):
+        self.assertIsInstance(get_limiter().store, CacheBucketStore)
+        url = f'/api/v1/resources/subscriptions/?user_id={self.user.pk}'
+        self.assertEqual([self.get(url) for _ in range(3)], [200, 200, 429])
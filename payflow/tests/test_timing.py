@@ -0,0 +1,101 @@
+import re
+from unittest.mock import patch
+import stripe
+from django.contrib.auth.models import User as StaffUser
+from django.test import TestCase, override_settings
+from benchmarks.fake_stripe import start_server
+from payment_gateway import metrics, timing
+from payment_gateway.config_cache import clear_all as clear_config_caches
+from payment_gateway.models import User, PaymentMethod, Merchant
+
+SAMPLED = {'SAMPLE_RATE': 1.0, 'SERVER_TIMING': True}
+SCRAPER = {'HTTP_AUTHORIZATION': 'Bearer scrape-token'}
+
+
+def parse_server_timing(header):
+    entries = {}
+    for entry in header.split(', '):
+        name, _, rest = entry.partition(';')
+        entries[name] = float(re.search(r'dur=([\d.]+)', rest).group(1))
+    return entries
+
+
+@override_settings(PAYFLOW_TIMING=SAMPLED, PAYFLOW_METRICS={'TOKEN': 'scrape-token'})
+class TestTimingMiddleware(TestCase):
+    def setUp(self):
+        clear_config_caches()
+        metrics.clear()
+        self.user = User.objects.create(username='payer', email='payer@example.com', password='x')
+        PaymentMethod.objects.create(user=self.user, method_type='credit_card')
+        Merchant.objects.create(name='Shop', email='shop@example.com', password='x')
+
+    def test_viewset_request_reports_stages(self):
+        response = self.client.get('/api/v1/resources/users/')
+
+        stages = parse_server_timing(response['Server-Timing'])
+        self.assertIn('db', stages)
+        self.assertIn('serialize', stages)
+        self.assertIn('total', stages)
+        self.assertIn('desc="1 queries"', response['Server-Timing'])
+        self.assertIn('payflow_request_db_queries_count{view="user-list"} 1', metrics.render())
+
+    def test_payment_request_times_stripe_and_signals(self):
+        server, _ = start_server()
+        self.addCleanup(server.shutdown)
+        with patch('stripe.api_base', server.url), patch('stripe.api_key', 'sk_test_123'):
+            response = self.client.post('/api/v1/create-payment-intent/',
+                                        {'amount': '10.00', 'payment_method_id': 'pm_123', 'user_id': self.user.pk},
+                                        content_type='application/json')
+
+        self.assertEqual(response.status_code, 200)
+        stages = parse_server_timing(response['Server-Timing'])
+        for name in ('parse', 'db', 'stripe', 'serialize', 'signals'):
+            self.assertGreater(stages[name], 0, name)
+        self.assertGreaterEqual(stages['total'], stages['stripe'])
+
+    @override_settings(PAYFLOW_TIMING={'SAMPLE_RATE': 0})
+    def test_unsampled_requests_are_not_timed(self):
+        response = self.client.get('/api/v1/resources/users/')
+        self.assertNotIn('Server-Timing', response)
+        self.assertNotIn('view="user-list"', metrics.render())
+
+    def test_metrics_endpoint(self):
+        self.client.get('/api/v1/resources/users/')
+        response = self.client.get('/metrics', **SCRAPER)
+
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response['Content-Type'], metrics.CONTENT_TYPE)
+        body = response.content.decode()
+        self.assertIn('# TYPE payflow_request_stage_seconds histogram', body)
+        self.assertIn('payflow_request_stage_seconds_bucket{view="user-list",stage="db",le="+Inf"} 1', body)
+        self.assertIn('payflow_request_duration_seconds_count{view="user-list",method="GET"} 1', body)
+        self.assertIn('payflow_config_cache_hits_total{cache="merchants"}', body)
+        self.assertNotIn('view="metrics"', body)
+
+    def test_metrics_are_for_the_scraper_and_staff(self):
+        self.assertEqual(self.client.get('/metrics').status_code, 403)
+        self.assertEqual(self.client.get('/metrics', HTTP_AUTHORIZATION='Bearer wrong').status_code, 403)
+        self.client.force_login(StaffUser.objects.create_user('viewer'))
+        self.assertEqual(self.client.get('/metrics').status_code, 403)
+        self.client.force_login(StaffUser.objects.create_user('staff', is_staff=True))
+        self.assertEqual(self.client.get('/metrics').status_code, 200)
+
+    @override_settings(PAYFLOW_METRICS={'TOKEN': ''})
+    def test_an_empty_token_admits_no_scraper(self):
+        self.assertEqual(self.client.get('/metrics', HTTP_AUTHORIZATION='Bearer ').status_code, 403)
+
+
+class TestStageTimers(TestCase):
+    def test_stage_is_a_no_op_outside_a_sampled_request(self):
+        self.assertIsNone(timing.current())
+        self.assertIs(timing.stage('db'), timing.stage('stripe'))
+
+    def test_histogram_buckets_are_cumulative(self):
+        histogram = metrics.Histogram('test_seconds', 'Test.', ('view',), (0.1, 1.0))
+        for value in (0.05, 0.1, 0.5, 2.0):
+            histogram.observe(value, 'x')
+        lines = histogram.render()
+        self.assertIn('test_seconds_bucket{view="x",le="0.1"} 2', lines)
+        self.assertIn('test_seconds_bucket{view="x",le="1.0"} 3', lines)
+        self.assertIn('test_seconds_bucket{view="x",le="+Inf"} 4', lines)
+        self.assertIn('test_seconds_count{view="x"} 4', lines)
@@ -1,10 +1,12 @@
 import unittest
 import json
 from unittest.mock import patch, MagicMock
+import stripe
 from django.test import RequestFactory
 from rest_framework import status
 from payment_gateway.views import StripePaymentView
 from payment_gateway.models import User
+from payment_gateway.context import PaymentContext
 
 class TestStripePaymentView(unittest.TestCase):
     def setUp(self):
@@ -12,15 +14,16 @@ class TestStripePaymentView(unittest.TestCase):
         self.view = StripePaymentView.as_view({'post': 'create_payment_intent'})
 
     @patch('stripe.PaymentIntent.create')
-    @patch('payment_gateway.views.get_object_or_404')
+    @patch('payment_gateway.views.load_payment_context')
+    @patch('payment_gateway.views.log_captured')
     @patch('payment_gateway.models.Transaction.objects.create')
     @patch('payment_gateway.models.PaymentMethod.objects.filter')
     @patch('payment_gateway.models.Merchant.objects.first')
     def test_create_payment_intent_success(self, mock_merchant_first, mock_payment_method_filter, 
-                                          mock_transaction_create, mock_get_object_or_404, mock_payment_intent_create):
+                                          mock_transaction_create, mock_log_captured, mock_load_payment_context,
+                                          mock_payment_intent_create):
         # Setup mocks
         mock_user = MagicMock(spec=User)
-        mock_get_object_or_404.return_value = mock_user
         
         # Mock payment method filter
         mock_payment_method = MagicMock()
@@ -29,6 +32,8 @@ class TestStripePaymentView(unittest.TestCase):
         # Mock merchant
         mock_merchant = MagicMock()
         mock_merchant_first.return_value = mock_merchant
+        mock_load_payment_context.return_value = PaymentContext(
+            user=mock_user, payment_method=mock_payment_method, merchant=mock_merchant)
         
         # Mock transaction
         mock_transaction = MagicMock()
@@ -52,18 +57,18 @@ class TestStripePaymentView(unittest.TestCase):
         response = self.view(request)
         self.assertEqual(response.status_code, status.HTTP_200_OK)
         mock_transaction_create.assert_called_once()
+        mock_log_captured.assert_called_once_with(mock_transaction)
 
     @patch('stripe.PaymentLink.create')
-    @patch('payment_gateway.views.get_object_or_404')
+    @patch('payment_gateway.views.load_payment_context')
     @patch('payment_gateway.models.Transaction.objects.create')
     @patch('payment_gateway.models.PaymentMethod.objects.filter')
     @patch('payment_gateway.models.Merchant.objects.first')
     @patch('payment_gateway.models.TransactionLog.objects.create')
     def test_create_payment_link_success(self, mock_log_create, mock_merchant_first, mock_payment_method_filter, 
-                                        mock_transaction_create, mock_get_object_or_404, mock_payment_link_create):
+                                        mock_transaction_create, mock_load_payment_context, mock_payment_link_create):
         # Setup mocks
         mock_user = MagicMock(spec=User)
-        mock_get_object_or_404.return_value = mock_user
         
         # Mock payment method
         mock_payment_method = MagicMock()
@@ -72,6 +77,8 @@ class TestStripePaymentView(unittest.TestCase):
         # Mock merchant
         mock_merchant = MagicMock()
         mock_merchant_first.return_value = mock_merchant
+        mock_load_payment_context.return_value = PaymentContext(
+            user=mock_user, payment_method=mock_payment_method, merchant=mock_merchant)
         
         # Mock transaction
         mock_transaction = MagicMock()
@@ -95,11 +102,18 @@ class TestStripePaymentView(unittest.TestCase):
         mock_transaction_create.assert_called_once()
 
     @patch('stripe.checkout.Session.create')
-    @patch('payment_gateway.views.get_object_or_404')
-    def test_checkout_session_success(self, mock_get_object_or_404, mock_session_create):
+    @patch('payment_gateway.views.load_payment_context')
+    @patch('payment_gateway.models.Transaction.objects.create')
+    @patch('payment_gateway.models.PaymentMethod.objects.filter')
+    @patch('payment_gateway.models.Merchant.objects.first')
+    @patch('payment_gateway.models.TransactionLog.objects.create')
+    def test_checkout_session_success(self, mock_log_create, mock_merchant_first, mock_payment_method_filter,
+                                      mock_transaction_create, mock_load_payment_context, mock_session_create):
         mock_user = MagicMock(spec=User)
-        mock_get_object_or_404.return_value = mock_user
-        mock_session_create.return_value = MagicMock(id='cs_test_123')
+        mock_payment_method_filter.return_value.first.return_value = MagicMock()
+        mock_load_payment_context.return_value = PaymentContext(
+            user=mock_user, payment_method=MagicMock(), merchant=None)
+        mock_session_create.return_value = MagicMock(id='cs_test_123', payment_intent=None)
         
         request = self.factory.post('/checkout-session', data={
             'user_id': 1,
@@ -109,8 +123,18 @@ class TestStripePaymentView(unittest.TestCase):
         
         response = StripePaymentView.as_view({'post': 'checkout_session'})(request)
         self.assertEqual(response.status_code, status.HTTP_200_OK)
+        mock_transaction_create.assert_called_once()
+        self.assertEqual(mock_transaction_create.call_args.kwargs['gateway_checkout_session_id'], 'cs_test_123')
 
-    def test_create_payment_intent_missing_amount(self):
+    @patch('stripe.PaymentIntent.create', side_effect=stripe.error.AuthenticationError("No API key provided."))
+    @patch('payment_gateway.views.load_payment_context')
+    @patch('payment_gateway.models.PaymentMethod.objects.filter')
+    @patch('payment_gateway.models.Merchant.objects.first')
+    def test_create_payment_intent_missing_amount(self, mock_merchant_first, mock_payment_method_filter,
+                                                  mock_load_payment_context, mock_payment_intent_create):
+        mock_load_payment_context.return_value = PaymentContext(
+            user=MagicMock(spec=User), payment_method=None, merchant=None)
+        mock_payment_method_filter.return_value.first.return_value = None
         request = self.factory.post('/payment-intent', data=json.dumps({
             'amount': '100.00',
             'payment_method_id': 'pm_123',
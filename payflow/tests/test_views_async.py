@@ -0,0 +1,91 @@
+from decimal import Decimal
+from unittest.mock import patch, AsyncMock
+import stripe
+from django.test import TestCase
+from benchmarks.fake_stripe import start_server
+from payment_gateway.config_cache import clear_all as clear_config_caches
+from payment_gateway.idempotency import get_cache
+from payment_gateway.models import User, PaymentMethod, Merchant, Transaction, TransactionLog
+
+
+class TestAsyncPaymentViews(TestCase):
+    def setUp(self):
+        clear_config_caches()
+        get_cache().clear()
+        self.user = User.objects.create(username='payer', email='payer@example.com', password='x')
+        self.payment_method = PaymentMethod.objects.create(user=self.user, method_type='credit_card')
+        self.merchant = Merchant.objects.create(name='Shop', email='shop@example.com', password='x')
+
+    async def post(self, name, data, **headers):
+        return await self.async_client.post(f'/api/v1/async/{name}/', data, content_type='application/json',
+                                            headers=headers)
+
+    async def test_create_payment_intent_through_async_http_client(self):
+        server, _ = start_server()
+        self.addCleanup(server.shutdown)
+        with patch.object(stripe, 'api_base', server.url), patch.object(stripe, 'api_key', 'sk_test_123'):
+            response = await self.post('create-payment-intent', {
+                'amount': '12.50', 'payment_method_id': 'pm_123', 'user_id': self.user.pk})
+
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json()['status'], 'succeeded')
+        transaction = await Transaction.objects.aget()
+        self.assertEqual(transaction.gateway_payment_intent_id, response.json()['id'])
+        self.assertEqual((await User.objects.aget(pk=self.user.pk)).balance, Decimal('12.50'))
+
+    async def test_create_payment_intent_requires_positive_amount(self):
+        response = await self.post('create-payment-intent', {'amount': '0', 'payment_method_id': 'pm_123',
+                                                             'user_id': self.user.pk})
+        self.assertEqual(response.status_code, 400)
+
+    @patch('stripe.PaymentIntent.create_async', new_callable=AsyncMock)
+    async def test_create_payment_intent_stripe_error_records_failure(self, mock_create):
+        mock_create.side_effect = stripe.error.APIConnectionError("down")
+        response = await self.post('create-payment-intent', {'amount': '5.00', 'payment_method_id': 'pm_123',
+                                                             'user_id': self.user.pk})
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual((await Transaction.objects.aget()).status, 'failed')
+
+    @patch('stripe.PaymentIntent.create_async', new_callable=AsyncMock)
+    async def test_idempotency_key_replays_the_payment(self, mock_create):
+        mock_create.return_value = stripe.PaymentIntent.construct_from(
+            {'id': 'pi_async', 'status': 'succeeded'}, 'sk_test')
+        data = {'amount': '5.00', 'payment_method_id': 'pm_123', 'user_id': self.user.pk}
+        first = await self.post('create-payment-intent', data, **{'Idempotency-Key': 'async-1'})
+        second = await self.post('create-payment-intent', data, **{'Idempotency-Key': 'async-1'})
+
+        self.assertEqual((first.status_code, second.status_code), (200, 200))
+        self.assertEqual(second.json()['id'], 'pi_async')
+        self.assertEqual(second['Idempotent-Replayed'], 'true')
+        mock_create.assert_awaited_once()
+        self.assertIn('idempotency_key', mock_create.call_args.kwargs)
+        self.assertEqual(await Transaction.objects.acount(), 1)
+        response = await self.post('create-payment-intent', {**data, 'amount': '6.00'},
+                                   **{'Idempotency-Key': 'async-1'})
+        self.assertEqual(response.status_code, 422)
+
+    @patch('stripe.PaymentLink.create_async', new_callable=AsyncMock)
+    async def test_create_payment_link(self, mock_create):
+        mock_create.return_value = stripe.PaymentLink.construct_from(
+            {'id': 'plink_123', 'url': 'https://buy.stripe.com/test'}, 'sk_test')
+        response = await self.post('create-payment-link', {'amount': '20.00', 'user_id': self.user.pk})
+
+        self.assertEqual(response.status_code, 201)
+        self.assertEqual(response.json()['payment_link'], 'https://buy.stripe.com/test')
+        transaction = await Transaction.objects.aget(pk=response.json()['transaction_id'])
+        self.assertEqual(transaction.gateway_payment_link_id, 'plink_123')
+        self.assertTrue(await TransactionLog.objects.filter(transaction=transaction, log_type='initiated').aexists())
+
+    @patch('stripe.checkout.Session.create_async', new_callable=AsyncMock)
+    async def test_checkout_session(self, mock_create):
+        mock_create.return_value = stripe.checkout.Session.construct_from(
+            {'id': 'cs_123', 'url': 'https://checkout.stripe.com/test'}, 'sk_test')
+        response = await self.post('checkout-session', {'amount': '20.00', 'user_id': self.user.pk})
+
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json()['id'], 'cs_123')
+        self.assertTrue(await Transaction.objects.filter(gateway_checkout_session_id='cs_123').aexists())
+
+    async def test_webhook_requires_signature(self):
+        response = await self.post('webhook', {})
+        self.assertEqual(response.status_code, 400)
@@ -0,0 +1,139 @@
+from decimal import Decimal
+import json
+from unittest.mock import patch, MagicMock
+import stripe
+from django.test import TestCase, RequestFactory, override_settings
+from rest_framework import status
+from payment_gateway import webhooks
+from payment_gateway.models import (WebhookEvent, User, Merchant, PaymentMethod, Transaction, TransactionLog,
+                                    BalanceEntry)
+from payment_gateway.views import StripeWebhookView
+
+
+def make_event_payload(event_id='evt_123', event_type='payment_intent.succeeded', object_id='pi_123'):
+    return {
+        'id': event_id,
+        'object': 'event',
+        'type': event_type,
+        'data': {'object': {'id': object_id, 'object': 'payment_intent', 'metadata': {}}},
+    }
+
+
+class TestWebhookInbox(TestCase):
+    def setUp(self):
+        self.factory = RequestFactory()
+
+    def post_event(self, payload):
+        body = json.dumps(payload)
+        request = self.factory.post('/webhook', data=body, content_type='application/json',
+                                    HTTP_STRIPE_SIGNATURE='t=1,v1=sig')
+        with patch('stripe.Webhook.construct_event',
+                   return_value=stripe.Event.construct_from(payload, None)):
+            return StripeWebhookView.as_view()(request)
+
+    @override_settings(PAYFLOW_WEBHOOK_INBOX=True)
+    def test_inbox_mode_stores_event_without_processing(self):
+        with patch.object(StripeWebhookView, 'handle_event') as mock_handle:
+            response = self.post_event(make_event_payload())
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        mock_handle.assert_not_called()
+        event = WebhookEvent.objects.get()
+        self.assertEqual(event.event_id, 'evt_123')
+        self.assertEqual(event.status, 'pending')
+
+    @override_settings(PAYFLOW_WEBHOOK_INBOX=False)
+    def test_inline_mode_handles_event(self):
+        with patch.object(StripeWebhookView, 'handle_event') as mock_handle:
+            response = self.post_event(make_event_payload())
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        mock_handle.assert_called_once()
+        self.assertFalse(WebhookEvent.objects.exists())
+
+    def test_drain_processes_pending_events_in_order(self):
+        webhooks.enqueue_event(json.dumps(make_event_payload('evt_1')))
+        webhooks.enqueue_event(json.dumps(make_event_payload('evt_2')))
+        handler = MagicMock()
+
+        self.assertEqual(webhooks.drain(handler, batch_size=10), 2)
+        self.assertEqual([call.args[0].id for call in handler.call_args_list], ['evt_1', 'evt_2'])
+        self.assertEqual(WebhookEvent.objects.filter(status='processed').count(), 2)
+        self.assertEqual(webhooks.drain(handler, batch_size=10), 0)
+
+    @override_settings(PAYFLOW_WEBHOOK_MAX_ATTEMPTS=2)
+    def test_failed_event_is_retried_then_marked_failed(self):
+        webhooks.enqueue_event(json.dumps(make_event_payload()))
+        handler = MagicMock(side_effect=RuntimeError("boom"))
+
+        webhooks.drain(handler)
+        event = WebhookEvent.objects.get()
+        self.assertEqual(event.status, 'pending')
+        self.assertEqual(event.last_error, 'boom')
+
+        webhooks.drain(handler)
+        event.refresh_from_db()
+        self.assertEqual(event.status, 'failed')
+        self.assertEqual(event.attempts, 2)
+
+
+class TestWebhookTransactionLookup(TestCase):
+    def setUp(self):
+        self.user = User.objects.create(username='payer', email='payer@example.com', password='x')
+        self.merchant = Merchant.objects.create(name='Shop', email='shop@example.com', password='x')
+        self.payment_method = PaymentMethod.objects.create(user=self.user, method_type='credit_card')
+
+    def create_transaction(self, **kwargs):
+        return Transaction.objects.create(user=self.user, merchant=self.merchant, payment_method=self.payment_method,
+                                          amount='25.00', status='pending', **kwargs)
+
+    def dispatch(self, event_type, obj):
+        event = stripe.Event.construct_from({'id': 'evt_1', 'type': event_type, 'data': {'object': obj}}, None)
+        StripeWebhookView().dispatch_event(event)
+
+    def test_payment_intent_event_updates_matching_transaction(self):
+        other = self.create_transaction(gateway_payment_intent_id='pi_other')
+        transaction = self.create_transaction(gateway_payment_intent_id='pi_123')
+
+        self.dispatch('payment_intent.succeeded', {'id': 'pi_123', 'object': 'payment_intent', 'metadata': {}})
+
+        transaction.refresh_from_db()
+        other.refresh_from_db()
+        self.assertEqual(transaction.status, 'completed')
+        self.assertEqual(other.status, 'pending')
+        self.assertEqual(TransactionLog.objects.get(transaction=transaction).log_type, 'captured')
+
+    def test_checkout_session_from_payment_link_is_attached(self):
+        transaction = self.create_transaction(gateway_payment_link_id='plink_123')
+
+        self.dispatch('checkout.session.completed', {
+            'id': 'cs_123', 'object': 'checkout.session', 'payment_link': 'plink_123',
+            'payment_intent': 'pi_456', 'metadata': {},
+        })
+
+        transaction.refresh_from_db()
+        self.assertEqual(transaction.status, 'completed')
+        self.assertEqual(transaction.gateway_checkout_session_id, 'cs_123')
+        self.assertEqual(transaction.gateway_payment_intent_id, 'pi_456')
+
+    def test_failed_payment_intent_marks_transaction_failed(self):
+        transaction = self.create_transaction(gateway_payment_intent_id='pi_123')
+
+        self.dispatch('payment_intent.payment_failed', {'id': 'pi_123', 'object': 'payment_intent'})
+
+        transaction.refresh_from_db()
+        self.assertEqual(transaction.status, 'failed')
+
+    def test_session_and_intent_events_for_one_payment_credit_once(self):
+        transaction = self.create_transaction(gateway_checkout_session_id='cs_123', gateway_payment_intent_id='pi_123')
+        session = {'id': 'cs_123', 'object': 'checkout.session', 'payment_intent': 'pi_123', 'metadata': {}}
+        intent = {'id': 'pi_123', 'object': 'payment_intent', 'metadata': {}}
+        # Both deliveries read the row while it is still pending
+        stale = Transaction.objects.get(pk=transaction.pk)
+
+        self.dispatch('checkout.session.completed', session)
+        with patch.object(StripeWebhookView, 'find_transaction', return_value=stale):
+            self.dispatch('payment_intent.succeeded', intent)
+
+        self.assertEqual(BalanceEntry.objects.filter(transaction=transaction).count(), 1)
+        self.assertEqual(User.objects.get(pk=self.user.pk).balance, Decimal('25.00'))
+        self.assertEqual(Transaction.objects.get(pk=transaction.pk).status, 'completed')
+        self.assertEqual(TransactionLog.objects.filter(transaction=transaction, log_type='captured').count(), 2)